@@ -0,0 +1,69 @@
+"""
+分析队列工作进程 - 独立于 uvicorn Web 进程消费 analysis_jobs 表中的分析任务
+
+可在多台机器上同时运行，任务通过 SELECT ... FOR UPDATE SKIP LOCKED 领取，互不重复。
+Web 进程内置的工作协程可通过 ANALYSIS_WORKER_EMBEDDED=false 关闭。
+分析结果写入的标签通过 catalog_changes 变更日志同步到各 Web 进程的内存索引，
+本进程负责刷新自己写入的图片的相似图片行。
+"""
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.database import create_tables, test_connection, SessionLocal
+from app.services.analysis_queue_service import analysis_queue
+from app.services.batch_analysis_service import batch_analysis
+from app.services.ai_client_service import ai_client
+from app.services.image_preprocess_service import image_preprocessor
+from app.services.similar_image_service import similar_images
+from app.services.catalog_sync_service import catalog_sync
+
+
+async def run(concurrency: int = None):
+    """在共享的OpenAI客户端生命周期内运行队列、离线批次轮询、相似图片增量刷新和图库变更同步"""
+    await ai_client.open()
+    background = [
+        asyncio.create_task(batch_analysis.run_poller()),
+        asyncio.create_task(similar_images.run_refresher()),
+        asyncio.create_task(catalog_sync.run_watcher())
+    ]
+    try:
+        await analysis_queue.run_worker(concurrency)
+    finally:
+        for task in background:
+            task.cancel()
+        await ai_client.close()
+        await image_preprocessor.shutdown()
+
+
+def main(concurrency: int = None):
+    """运行分析队列工作进程，Ctrl+C 退出时执行中的任务放回队列"""
+    if not test_connection():
+        print("❌ 数据库连接失败，请检查配置")
+        sys.exit(1)
+    create_tables()
+    
+    # 相似图片表已建好时才增量刷新；其他进程修改的标签由变更同步登记，刷新时重新读取
+    db = SessionLocal()
+    try:
+        catalog_sync.start(db)
+        similar_images.load(db)
+    finally:
+        db.close()
+    
+    try:
+        asyncio.run(run(concurrency))
+    except KeyboardInterrupt:
+        pass
+    print(f"👋 分析队列工作进程退出 - 完成: {analysis_queue.completed}, 失败: {analysis_queue.failed}")
+
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='图片分析队列工作进程')
+    parser.add_argument('--concurrency', type=int, default=None, help='同时执行的分析任务数（默认 ANALYSIS_CONCURRENCY）')
+    args = parser.parse_args()
+    
+    main(args.concurrency)
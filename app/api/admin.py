@@ -15,12 +15,23 @@ from pathlib import Path
 from app.database import get_db
 from app.auth.dependencies import require_admin, require_user
 from app.models.user import User, UserRole
-from app.models.image import Image, Tag, ImageTag
+from app.models.image import Image, Tag
 from app.services.database_service import DatabaseService
+from app.services.fulltext_service import FullTextSearchService
+from app.services.vector_index_service import vector_index
+from app.services.response_cache_service import response_cache
+from app.services.catalog_sync_service import catalog_sync
 from app.services.gpt4o_service import gpt4o_analyzer
 from app.services.storage_service import storage_manager
+from app.services.perceptual_hash_service import phash_bytes
+from app.services.color_palette_service import palette_bytes
+from app.services.analysis_queue_service import analysis_queue
+from app.services.rate_limit_service import openai_limiter
+from app.services.ai_client_service import ai_client
+from app.services.image_preprocess_service import image_preprocessor
+from app.services.analysis_cache_service import analysis_cache
+from app.services.batch_analysis_service import batch_analysis
 from app.config import get_settings
-from app.api.upload import process_image_with_gpt4o
 
 router = APIRouter()
 settings = get_settings()
@@ -173,12 +184,14 @@ async def get_admin_images(
         if uploader:
             query = query.filter(Image.uploader.contains(uploader))
         
-        # 搜索
+        # 搜索 - 描述使用全文索引，文件名和上传者仍为模糊匹配
         if search:
+            # 短于 ngram 分词长度的查询词由 search_condition 改走 LIKE；列表保持按所选字段排序
+            description_condition, _ = FullTextSearchService(db).search_condition("ft_images_description", [search])
             query = query.filter(
                 or_(
                     Image.filename.contains(search),
-                    Image.ai_description.contains(search),
+                    description_condition,
                     Image.uploader.contains(search)
                 )
             )
@@ -191,10 +204,11 @@ async def get_admin_images(
         
         # 处理结果
         db_service = DatabaseService(db)
+        tags_map = db_service.get_tags_for_images([image.id for image in images])
         result_images = []
         
         for image in images:
-            tags = db_service.get_image_tags(image.id)
+            tags = tags_map.get(image.id, [])
             
             # 解析搜索关键词
             searchable_keywords = []
@@ -273,13 +287,21 @@ async def update_image(
         # 更新自定义标签
         if custom_tags is not None:
             # 删除现有标签
-            db.query(ImageTag).filter(ImageTag.image_id == image_id).delete()
+            db_service.clear_image_tags(image_id)
             
             # 添加新标签
             if custom_tags:
                 db_service.add_tags_to_image(image_id, custom_tags, 'admin', [0.9] * len(custom_tags))
         
+        # 登记变更，其他进程据此使响应缓存失效
+        catalog_sync.record(db, image_id)
         db.commit()
+        # 同步向量索引: 停用的图片移除向量，其余按最新描述重新编码
+        if image.is_active:
+            await vector_index.index_image_async(image)
+        else:
+            await vector_index.remove_async([image_id])
+        await response_cache.invalidate_async()
         
         return {
             "success": True,
@@ -294,7 +316,6 @@ async def update_image(
 @router.post("/images/{image_id}/reanalyze")
 async def reanalyze_image(
     image_id: int,
-    background_tasks: BackgroundTasks,
     custom_prompt: Optional[str] = None,
     current_user: User = Depends(require_admin),
     db: Session = Depends(get_db)
@@ -309,144 +330,18 @@ async def reanalyze_image(
         
         print(f"🔄 收到重新分析请求 - 图片ID: {image_id}, 文件路径: {image.file_path}")
         
-        # 更新状态为重新分析中
-        image.ai_analysis_status = 'pending'
-        db.commit()
-        
-        # 启动重新分析任务 - 直接传递file_path，让任务函数内部转换为URL
-        background_tasks.add_task(
-            reanalyze_image_task, 
-            image_id, 
-            image.file_path,  # 传递OSS key，在任务内部转换为完整URL
-            custom_prompt
-        )
+        # 登记重新分析任务（图片状态置为 pending），由分析队列工作进程执行
+        analysis_queue.enqueue(db, [image_id], "reanalyze", custom_prompt)
         
         return {
             "success": True,
-            "message": "已启动重新分析任务"
+            "message": "已登记重新分析任务"
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"启动重新分析失败: {str(e)}")
 
 
-async def reanalyze_image_task(image_id: int, file_path: str, custom_prompt: Optional[str] = None):
-    """重新分析图片的后台任务"""
-    try:
-        print(f"🔄 开始重新分析图片 ID: {image_id}")
-        print(f"📁 原始文件路径: {file_path}")
-        
-        # 关键修复：获取完整的公网URL
-        from app.services.storage_service import StorageManager
-        storage_manager = StorageManager()
-        
-        # 如果file_path是OSS key，转换为完整URL
-        if not file_path.startswith('http'):
-            image_url = storage_manager.get_oss_url(file_path)
-            print(f"🔧 转换为OSS URL: {image_url}")
-        else:
-            image_url = file_path
-            print(f"🌐 使用现有URL: {image_url}")
-        
-        # 验证URL格式
-        if not image_url.startswith('http'):
-            raise ValueError(f"无效的图片URL: {image_url}")
-        
-        # 使用自定义提示词或默认分析
-        if custom_prompt:
-            print(f"🤖 使用自定义提示词分析: {custom_prompt}")
-            analysis_result = await gpt4o_analyzer.analyze_with_custom_prompt(image_url, custom_prompt)
-        else:
-            print(f"🤖 使用默认分析")
-            analysis_result = await gpt4o_analyzer.analyze_for_search(image_url)
-        
-        print(f"📋 GPT分析结果: {analysis_result}")
-        
-        # 更新数据库
-        from app.database import SessionLocal
-        db = SessionLocal()
-        try:
-            db_service = DatabaseService(db)
-            image = db_service.get_image_by_id(image_id)
-            
-            if image:
-                if analysis_result.get("success"):
-                    analysis = analysis_result["analysis"]
-                    
-                    # 更新AI分析结果
-                    image.ai_description = analysis.get('description', '')
-                    image.ai_confidence = analysis.get('confidence', 0.0)
-                    image.ai_analysis_status = 'completed'
-                    image.ai_model = 'gpt-4o-reanalyzed'
-                    
-                    # 存储完整分析结果
-                    image.ai_analysis_raw = json.dumps(analysis, ensure_ascii=False)
-                    image.ai_mood = analysis.get('mood', '')
-                    image.ai_style = analysis.get('style', '')
-                    image.ai_searchable_keywords = json.dumps(
-                        analysis.get('searchable_keywords', []), 
-                        ensure_ascii=False
-                    )
-                    
-                    # 重新处理标签
-                    db.query(ImageTag).filter(ImageTag.image_id == image_id).delete()
-                    await _process_reanalyzed_tags(db_service, image_id, analysis)
-                    
-                    db.commit()
-                    print(f"✅ 重新分析完成 ID: {image_id}")
-                else:
-                    image.ai_analysis_status = 'failed'
-                    db.commit()
-                    error_msg = analysis_result.get('error', '未知错误')
-                    print(f"❌ 重新分析失败 ID: {image_id}, 错误: {error_msg}")
-            
-        except Exception as e:
-            print(f"❌ 更新重新分析结果失败: {e}")
-            db.rollback()
-        finally:
-            db.close()
-            
-    except Exception as e:
-        print(f"❌ 重新分析任务失败: {e}")
-        # 标记为失败状态
-        try:
-            from app.database import SessionLocal
-            db = SessionLocal()
-            image = db.query(Image).filter(Image.id == image_id).first()
-            if image:
-                image.ai_analysis_status = 'failed'
-                db.commit()
-            db.close()
-        except:
-            pass
-
-
-async def _process_reanalyzed_tags(db_service: DatabaseService, image_id: int, analysis: dict):
-    """处理重新分析的标签"""
-    tags = analysis.get('tags', {})
-    all_tags = []
-    confidences = []
-    
-    # 处理分类标签
-    for category, tag_list in tags.items():
-        if isinstance(tag_list, list):
-            for tag in tag_list:
-                if tag and tag.strip() and tag not in all_tags:
-                    all_tags.append(tag.strip())
-                    confidences.append(analysis.get('confidence', 0.8))
-    
-    # 添加搜索关键词作为标签
-    searchable_keywords = analysis.get('searchable_keywords', [])
-    for keyword in searchable_keywords:
-        if keyword and keyword.strip() and keyword not in all_tags:
-            all_tags.append(keyword.strip())
-            confidences.append(analysis.get('confidence', 0.8))
-    
-    # 添加到数据库
-    if all_tags:
-        db_service.add_tags_to_image(image_id, all_tags, 'gpt4o-reanalyzed', confidences)
-
-
 @router.delete("/images/{image_id}")
 async def delete_image_admin(
     image_id: int,
@@ -470,7 +365,7 @@ async def delete_image_admin(
                 pass  # 文件可能已经不存在
             
             # 删除相关标签关联
-            db.query(ImageTag).filter(ImageTag.image_id == image_id).delete()
+            db_service.clear_image_tags(image_id, keep_palette=False)
             
             # 删除数据库记录
             db.delete(image)
@@ -478,7 +373,10 @@ async def delete_image_admin(
             # 软删除
             image.is_active = False
         
+        catalog_sync.record(db, image_id)
         db.commit()
+        await vector_index.remove_async([image_id])
+        await response_cache.invalidate_async()
         
         return {
             "success": True,
@@ -505,7 +403,10 @@ async def restore_image(
             raise HTTPException(status_code=404, detail="图片不存在")
         
         image.is_active = True
+        catalog_sync.record(db, image_id)
         db.commit()
+        await vector_index.index_image_async(image)
+        await response_cache.invalidate_async()
         
         return {
             "success": True,
@@ -519,10 +420,10 @@ async def restore_image(
 
 @router.post("/batch/analyze")
 async def batch_analyze_images(
-    background_tasks: BackgroundTasks,
     status_filter: str = Query("pending", description="分析状态筛选"),
     limit: int = Query(50, description="批量处理数量限制"),
     custom_prompt: Optional[str] = None,
+    offline: bool = Query(False, description="使用离线批量API（大批量回填，不占用在线分析配额）"),
     current_user: User = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
@@ -547,16 +448,22 @@ async def batch_analyze_images(
                 "count": 0
             }
         
-        # 启动批量分析任务
-        background_tasks.add_task(
-            batch_analyze_task,
-            [img.id for img in images],
-            custom_prompt
-        )
+        if offline:
+            # 写入离线批次，由批量分析轮询任务提交到批量API
+            batch_ids = batch_analysis.create(db, [img.id for img in images], custom_prompt)
+            return {
+                "success": True,
+                "message": f"已登记离线批量分析，{len(images)} 张图片分为 {len(batch_ids)} 个批次",
+                "count": len(images),
+                "batch_ids": batch_ids
+            }
+        
+        # 登记批量分析任务，由分析队列工作进程执行
+        analysis_queue.enqueue(db, [img.id for img in images], "batch", custom_prompt)
         
         return {
             "success": True,
-            "message": f"已启动批量分析任务，将处理 {len(images)} 张图片",
+            "message": f"已登记批量分析任务，将处理 {len(images)} 张图片",
             "count": len(images)
         }
         
@@ -564,32 +471,6 @@ async def batch_analyze_images(
         raise HTTPException(status_code=500, detail=f"启动批量分析失败: {str(e)}")
 
 
-async def batch_analyze_task(image_ids: List[int], custom_prompt: Optional[str] = None):
-    """批量分析任务"""
-    print(f"🚀 开始批量分析 {len(image_ids)} 张图片")
-    
-    for i, image_id in enumerate(image_ids):
-        try:
-            from app.database import SessionLocal
-            db = SessionLocal()
-            
-            image = db.query(Image).filter(Image.id == image_id).first()
-            if image:
-                print(f"📊 分析进度: {i+1}/{len(image_ids)} - 图片ID: {image_id}")
-                await reanalyze_image_task(image_id, image.file_path, custom_prompt)
-                
-                # 添加延迟避免API限制
-                await asyncio.sleep(2)
-            
-            db.close()
-            
-        except Exception as e:
-            print(f"❌ 批量分析图片 {image_id} 失败: {e}")
-            continue
-    
-    print(f"✅ 批量分析完成")
-
-
 @router.post("/scan-directory")
 async def scan_and_import_directory(
     background_tasks: BackgroundTasks,
@@ -666,6 +547,8 @@ async def scan_directory_task(directory_path: str, uploader: str, auto_analyze:
                     upload_result = await storage_manager.upload_image(file_content, file)
                     
                     if upload_result.get("success"):
+                        palette = await asyncio.to_thread(palette_bytes, file_content)
+                        
                         # 创建数据库记录
                         db_service = DatabaseService(db)
                         image = db_service.create_image(
@@ -674,16 +557,19 @@ async def scan_directory_task(directory_path: str, uploader: str, auto_analyze:
                             file_size=upload_result["file_size"],
                             width=upload_result["width"],
                             height=upload_result["height"],
+                            phash=await asyncio.to_thread(phash_bytes, file_content),
+                            color_palette=palette,
                             uploader=uploader,
                             ai_analysis_status="pending" if auto_analyze else "skipped",
                             ai_model="gpt-4o"
                         )
                         
+                        db_service.apply_color_palette(image.id, palette)
                         imported_count += 1
                         
                         # 自动分析
                         if auto_analyze:
-                            await reanalyze_image_task(image.id, upload_result["file_path"])
+                            analysis_queue.enqueue(db, [image.id], "reanalyze")
                         
                         print(f"✅ 导入图片: {file}")
                     else:
@@ -734,7 +620,6 @@ async def scan_oss_task(oss_prefix: str, uploader: str, auto_analyze: bool = Tru
     """扫描OSS存储桶任务"""
     try:
         from app.services.storage_service import StorageManager
-        from app.api.upload import process_image_with_gpt4o  # 导入正确的分析函数
         from app.models.image import Image
         from app.database import get_db
         
@@ -765,9 +650,13 @@ async def scan_oss_task(oss_prefix: str, uploader: str, auto_analyze: bool = Tru
                     response = requests.get(oss_url, timeout=10)
                     img = PILImage.open(io.BytesIO(response.content))
                     width, height = img.size
+                    phash = await asyncio.to_thread(phash_bytes, response.content)
+                    palette = await asyncio.to_thread(palette_bytes, response.content)
                 except Exception as e:
                     print(f"⚠️ 获取图片尺寸失败: {obj['key']}, {e}")
                     width, height = 0, 0
+                    phash = None
+                    palette = None
                 
                 # 创建图片记录
                 image = Image(
@@ -779,6 +668,8 @@ async def scan_oss_task(oss_prefix: str, uploader: str, auto_analyze: bool = Tru
                     file_size=obj['size'],
                     width=width,
                     height=height,
+                    phash=phash,
+                    color_palette=palette,
                     uploader=uploader,
                     ai_analysis_status="pending" if auto_analyze else "skipped",
                     ai_model="gpt-4o"
@@ -787,13 +678,14 @@ async def scan_oss_task(oss_prefix: str, uploader: str, auto_analyze: bool = Tru
                 db.add(image)
                 db.commit()
                 db.refresh(image)
+                DatabaseService(db).apply_color_palette(image.id, palette)
+                await response_cache.invalidate_async()
                 
                 imported_count += 1
                 
-                # 使用正确的AI分析函数，传入OSS URL而不是key
+                # 登记AI分析任务
                 if auto_analyze:
-                    # 使用BackgroundTasks或直接调用
-                    await process_image_with_gpt4o(image.id, storage.get_oss_url(obj['key']), is_cloud_storage=True)
+                    analysis_queue.enqueue(db, [image.id], "analyze")
                 
                 print(f"✅ 导入OSS图片: {obj['key']}")
                 db.close()
@@ -1020,6 +912,11 @@ async def clear_system_cache(
         # 强制垃圾回收
         gc.collect()
         
+        # 清理查询扩展和接口响应的进程内缓存
+        from app.services.query_expansion_service import query_expansion_cache
+        query_expansion_cache.cache.local.clear()
+        response_cache.cache.local.clear()
+        
         # 这里可以添加其他缓存清理逻辑
         # 比如Redis缓存、文件缓存等
         
@@ -1030,15 +927,54 @@ async def clear_system_cache(
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"清理缓存失败: {str(e)}")
+
+
+@router.get("/analysis-jobs")
+async def get_analysis_jobs_status(
+    current_user: User = Depends(require_admin),
+    db: Session = Depends(get_db)
+):
+    """分析队列状态: 各状态任务数、本进程工作协程、API限流、连接池、图片预处理和结果缓存统计"""
+    try:
+        return {
+            "success": True,
+            "data": {
+                "jobs": analysis_queue.counts(db),
+                "worker": analysis_queue.stats(),
+                "rate_limit": openai_limiter.stats(),
+                "ai_client": ai_client.stats(),
+                "preprocess": image_preprocessor.stats(),
+                "cache": analysis_cache.stats(),
+                "batch_api": batch_analysis.stats()
+            }
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取分析队列状态失败: {str(e)}")
+
+
+@router.get("/analysis-batches")
+async def get_analysis_batches(
+    limit: int = Query(20, ge=1, le=100, description="返回数量"),
+    current_user: User = Depends(require_admin),
+    db: Session = Depends(get_db)
+):
+    """离线批量分析批次列表: 状态、请求数、缓存命中数和导入结果"""
+    try:
+        return {
+            "success": True,
+            "data": batch_analysis.list_batches(db, limit)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取离线批次失败: {str(e)}")
     
 # 在现有代码中添加/修改以下部分
 
 @router.post("/batch/analyze")
 async def batch_analyze_images(
-    background_tasks: BackgroundTasks,
     status_filter: str = Query("failed", description="分析状态筛选: pending, failed, all"),
     limit: int = Query(50, description="批量处理数量限制"),
     custom_prompt: Optional[str] = None,
+    offline: bool = Query(False, description="使用离线批量API（大批量回填，不占用在线分析配额）"),
     current_user: User = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
@@ -1067,24 +1003,23 @@ async def batch_analyze_images(
         
         print(f"📊 找到 {len(images)} 张需要分析的图片")
         
-        # 更新状态为处理中
-        image_ids = [img.id for img in images]
-        db.query(Image).filter(Image.id.in_(image_ids)).update(
-            {"ai_analysis_status": "pending"},
-            synchronize_session=False
-        )
-        db.commit()
+        if offline:
+            # 写入离线批次，由批量分析轮询任务提交到批量API
+            batch_ids = batch_analysis.create(db, [img.id for img in images], custom_prompt)
+            return {
+                "success": True,
+                "message": f"已登记离线批量分析，{len(images)} 张图片分为 {len(batch_ids)} 个批次",
+                "count": len(images),
+                "batch_ids": batch_ids,
+                "status_filter": status_filter
+            }
         
-        # 启动批量分析任务
-        background_tasks.add_task(
-            batch_analyze_task,
-            image_ids,
-            custom_prompt
-        )
+        # 登记批量分析任务（图片状态置为 pending），由分析队列工作进程执行
+        analysis_queue.enqueue(db, [img.id for img in images], "batch", custom_prompt)
         
         return {
             "success": True,
-            "message": f"已启动批量分析任务，将处理 {len(images)} 张图片",
+            "message": f"已登记批量分析任务，将处理 {len(images)} 张图片",
             "count": len(images),
             "status_filter": status_filter
         }
@@ -1094,88 +1029,80 @@ async def batch_analyze_images(
         raise HTTPException(status_code=500, detail=f"启动批量分析失败: {str(e)}")
 
 
-async def batch_analyze_task(image_ids: List[int], custom_prompt: Optional[str] = None):
-    """批量分析任务 - 改进版"""
-    print(f"🚀 开始批量分析 {len(image_ids)} 张图片")
+async def _analyze_batch_image(image_id: int, custom_prompt: Optional[str] = None,
+                               analysis_result: Optional[dict] = None) -> bool:
+    """批量分析任务：分析单张图片并保存结果，返回是否成功（由分析队列工作进程执行）
     
-    success_count = 0
-    failed_count = 0
+    传入 analysis_result 时不再调用API，直接保存已有的分析结果（离线批量API的结果导入）。
+    """
+    from app.database import SessionLocal
+    db = SessionLocal()
     
-    for i, image_id in enumerate(image_ids):
-        try:
-            from app.database import SessionLocal
-            db = SessionLocal()
-            
-            image = db.query(Image).filter(Image.id == image_id).first()
-            if image:
-                print(f"📊 分析进度: {i+1}/{len(image_ids)} - 图片ID: {image_id}")
-                
-                # 获取图片URL
-                image_url = storage_manager.get_image_url(image.file_path)
-                print(f"🖼️ 分析图片URL: {image_url}")
-                
-                # 执行AI分析
-                if custom_prompt:
-                    analysis_result = await gpt4o_analyzer.analyze_with_custom_prompt(image_url, custom_prompt)
-                else:
-                    analysis_result = await gpt4o_analyzer.analyze_for_search(image_url)
-                
-                # 更新结果
-                if analysis_result.get("success"):
-                    analysis = analysis_result["analysis"]
-                    
-                    # 更新AI分析结果
-                    image.ai_description = analysis.get('description', '')
-                    image.ai_confidence = analysis.get('confidence', 0.0)
-                    image.ai_analysis_status = 'completed'
-                    image.ai_model = 'gpt-4o-batch' if not custom_prompt else 'gpt-4o-custom-batch'
-                    
-                    # 存储完整分析结果
-                    image.ai_analysis_raw = json.dumps(analysis, ensure_ascii=False)
-                    image.ai_mood = analysis.get('mood', '')
-                    image.ai_style = analysis.get('style', '')
-                    image.ai_searchable_keywords = json.dumps(
-                        analysis.get('searchable_keywords', []), 
-                        ensure_ascii=False
-                    )
-                    
-                    # 处理标签
-                    db.query(ImageTag).filter(ImageTag.image_id == image_id).delete()
-                    await _process_batch_tags(db, image_id, analysis)
-                    
-                    success_count += 1
-                    print(f"✅ 分析成功 ID: {image_id}")
-                else:
-                    image.ai_analysis_status = 'failed'
-                    failed_count += 1
-                    print(f"❌ 分析失败 ID: {image_id}, 错误: {analysis_result.get('error', '未知错误')}")
-                
-                db.commit()
-                
-                # 添加延迟避免API限制
-                await asyncio.sleep(2)
+    try:
+        image = db.query(Image).filter(Image.id == image_id).first()
+        if not image:
+            return False
+        
+        if analysis_result is None:
+            # 获取图片URL
+            image_url = storage_manager.get_image_url(image.file_path)
+            print(f"🖼️ 分析图片URL: {image_url}")
             
-            db.close()
+            # 执行AI分析
+            if custom_prompt:
+                analysis_result = await gpt4o_analyzer.analyze_with_custom_prompt(image_url, custom_prompt)
+            else:
+                analysis_result = await gpt4o_analyzer.analyze_for_search(image_url)
+        
+        # 更新结果
+        if analysis_result.get("success"):
+            analysis = analysis_result["analysis"]
             
-        except Exception as e:
-            print(f"❌ 批量分析图片 {image_id} 失败: {e}")
-            failed_count += 1
+            # 更新AI分析结果
+            image.ai_description = analysis.get('description', '')
+            image.ai_confidence = analysis.get('confidence', 0.0)
+            image.ai_analysis_status = 'completed'
+            image.ai_model = 'gpt-4o-batch' if not custom_prompt else 'gpt-4o-custom-batch'
+            image.ai_image_tokens = analysis_result.get("image_tokens")
             
-            # 更新为失败状态
-            try:
-                from app.database import SessionLocal
-                db = SessionLocal()
-                image = db.query(Image).filter(Image.id == image_id).first()
-                if image:
-                    image.ai_analysis_status = 'failed'
-                    db.commit()
-                db.close()
-            except:
-                pass
+            # 存储完整分析结果
+            image.ai_analysis_raw = json.dumps(analysis, ensure_ascii=False)
+            image.ai_mood = analysis.get('mood', '')
+            image.ai_style = analysis.get('style', '')
+            image.ai_searchable_keywords = json.dumps(
+                analysis.get('searchable_keywords', []), 
+                ensure_ascii=False
+            )
             
-            continue
-    
-    print(f"✅ 批量分析完成 - 成功: {success_count}, 失败: {failed_count}")
+            # 处理标签
+            DatabaseService(db).clear_image_tags(image_id)
+            await _process_batch_tags(db, image_id, analysis)
+            print(f"✅ 分析成功 ID: {image_id}")
+        else:
+            image.ai_analysis_status = 'failed'
+            print(f"❌ 分析失败 ID: {image_id}, 错误: {analysis_result.get('error', '未知错误')}")
+        
+        db.commit()
+        if image.ai_analysis_status != 'completed':
+            return False
+        
+        await vector_index.index_image_async(image)
+        await response_cache.invalidate_async()
+        return True
+        
+    except Exception as e:
+        print(f"❌ 批量分析图片 {image_id} 失败: {e}")
+        db.rollback()
+        
+        # 更新为失败状态
+        try:
+            db.query(Image).filter(Image.id == image_id).update({"ai_analysis_status": "failed"})
+            db.commit()
+        except Exception:
+            db.rollback()
+        return False
+    finally:
+        db.close()
 
 
 async def _process_batch_tags(db: Session, image_id: int, analysis: dict):
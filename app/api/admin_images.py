@@ -2,7 +2,7 @@
 管理员图片管理API - 独立模块
 """
 from app.services.storage_service import storage_manager
-from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, or_, func, text, desc
@@ -19,16 +19,25 @@ from app.auth.dependencies import require_admin
 from app.models.user import User
 from app.models.image import Image, Tag, ImageTag
 from app.services.database_service import DatabaseService
+from app.services.fulltext_service import FullTextSearchService
+from app.services.vector_index_service import vector_index
+from app.services.response_cache_service import response_cache
+from app.services.catalog_sync_service import catalog_sync
+from app.services.pagination_service import paginate_by_cursor, count_cache
 from app.services.gpt4o_service import gpt4o_analyzer
 from app.services.storage_service import storage_manager
+from app.services.perceptual_hash_service import load_active_hashes, find_duplicate_clusters
+from app.services.analysis_queue_service import analysis_queue
+from app.services.batch_analysis_service import batch_analysis
 
 router = APIRouter()
 
 
 @router.get("/list")
 async def get_images_list(
-    page: int = Query(1, ge=1, description="页码"),
+    page: int = Query(1, ge=1, description="页码，提供 cursor 时忽略"),
     per_page: int = Query(15, ge=1, le=100, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="分页游标，取自上一页的 next_cursor（仅按上传时间排序时可用，否则返回400）"),
     status: Optional[str] = Query("active", description="状态筛选: active, deleted, all"),
     ai_status: Optional[str] = Query(None, description="AI分析状态: pending, completed, failed"),
     uploader: Optional[str] = Query(None, description="上传者筛选"),
@@ -39,61 +48,71 @@ async def get_images_list(
     db: Session = Depends(get_db)
 ):
     """获取图片管理列表"""
+    # 游标只记录 (上传时间, ID)，其他排序字段无法续接，需按页码分页
+    if cursor and sort_by != "upload_time":
+        raise HTTPException(status_code=400, detail="cursor 仅支持按上传时间排序，其他排序请使用 page 分页")
+    
     try:
-        offset = (page - 1) * per_page
-        
-        # 构建查询
-        query = db.query(Image)
-        
-        # 状态筛选
-        if status == "active":
-            query = query.filter(Image.is_active == True)
-        elif status == "deleted":
-            query = query.filter(Image.is_active == False)
-        # "all" 不添加过滤条件
-        
-        # AI分析状态筛选
-        if ai_status:
-            if ai_status == "failed":
-                query = query.filter(Image.ai_analysis_status == 'failed')
-            elif ai_status == "pending":
-                query = query.filter(Image.ai_analysis_status == 'pending')
-            elif ai_status == "completed":
-                query = query.filter(Image.ai_analysis_status == 'completed')
-        
-        # 上传者筛选
-        if uploader:
-            query = query.filter(Image.uploader.contains(uploader))
-        
-        # 搜索
-        if search:
-            query = query.filter(
-                or_(
-                    Image.filename.contains(search),
-                    Image.ai_description.contains(search),
-                    Image.uploader.contains(search)
+        def build_query(session: Session):
+            """构建带筛选条件的查询"""
+            query = session.query(Image)
+            
+            # 状态筛选
+            if status == "active":
+                query = query.filter(Image.is_active == True)
+            elif status == "deleted":
+                query = query.filter(Image.is_active == False)
+            # "all" 不添加过滤条件
+            
+            # AI分析状态筛选
+            if ai_status:
+                if ai_status == "failed":
+                    query = query.filter(Image.ai_analysis_status == 'failed')
+                elif ai_status == "pending":
+                    query = query.filter(Image.ai_analysis_status == 'pending')
+                elif ai_status == "completed":
+                    query = query.filter(Image.ai_analysis_status == 'completed')
+            
+            # 上传者筛选
+            if uploader:
+                query = query.filter(Image.uploader.contains(uploader))
+            
+            # 搜索 - 描述使用全文索引，文件名和上传者仍为模糊匹配
+            if search:
+                # 短于 ngram 分词长度的查询词由 search_condition 改走 LIKE；列表保持按所选字段排序
+                description_condition, _ = FullTextSearchService(session).search_condition("ft_images_description", [search])
+                query = query.filter(
+                    or_(
+                        Image.filename.contains(search),
+                        description_condition,
+                        Image.uploader.contains(search)
+                    )
                 )
-            )
+            
+            return query
         
-        # 排序
-        sort_column = getattr(Image, sort_by, Image.upload_time)
-        if sort_order == "desc":
-            query = query.order_by(desc(sort_column))
+        # 按上传时间排序时使用游标分页，其他排序字段或按页码跳转时使用偏移分页
+        next_cursor = None
+        descending = sort_order == "desc"
+        if sort_by == "upload_time" and (cursor or page == 1):
+            images, next_cursor = paginate_by_cursor(build_query(db), per_page, cursor, descending)
         else:
-            query = query.order_by(sort_column)
+            sort_column = getattr(Image, sort_by, Image.upload_time)
+            query = build_query(db).order_by(desc(sort_column) if descending else sort_column,
+                                             desc(Image.id) if descending else Image.id)
+            images = query.offset((page - 1) * per_page).limit(per_page).all()
         
-        # 总数
-        total = query.count()
-        
-        # 分页查询
-        images = query.offset(offset).limit(per_page).all()
+        # 总数（缓存，过期后后台刷新）
+        count_key = json.dumps(["admin_images", status, ai_status, uploader, search], ensure_ascii=False)
+        total = count_cache.get(count_key, db, build_query)
         
         # 处理结果
         db_service = DatabaseService(db)
+        tags_map = db_service.get_tags_for_images([image.id for image in images])
         result_images = []
         
         for image in images:
-            tags = db_service.get_image_tags(image.id)
+            tags = tags_map.get(image.id, [])
             
             # 解析搜索关键词
             searchable_keywords = []
@@ -136,11 +155,14 @@ async def get_images_list(
                     "page": page,
                     "per_page": per_page,
                     "total": total,
-                    "pages": (total + per_page - 1) // per_page
+                    "pages": (total + per_page - 1) // per_page,
+                    "next_cursor": next_cursor
                 }
             }
         }
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"❌ 获取图片列表失败: {e}")
         raise HTTPException(status_code=500, detail=f"获取图片列表失败: {str(e)}")
@@ -242,13 +264,21 @@ async def update_image(
         # 更新自定义标签
         if custom_tags is not None:
             # 删除现有标签
-            db.query(ImageTag).filter(ImageTag.image_id == image_id).delete()
+            db_service.clear_image_tags(image_id)
             
             # 添加新标签
             if custom_tags:
                 db_service.add_tags_to_image(image_id, custom_tags, 'admin', [0.9] * len(custom_tags))
         
+        # 登记变更，其他进程据此使响应缓存失效
+        catalog_sync.record(db, image_id)
         db.commit()
+        # 同步向量索引: 停用的图片移除向量，其余按最新描述重新编码
+        if image.is_active:
+            await vector_index.index_image_async(image)
+        else:
+            await vector_index.remove_async([image_id])
+        await response_cache.invalidate_async()
         
         return {
             "success": True,
@@ -265,7 +295,6 @@ async def update_image(
 @router.post("/{image_id}/reanalyze")
 async def reanalyze_image(
     image_id: int,
-    background_tasks: BackgroundTasks,
     custom_prompt: Optional[str] = None,
     current_user: User = Depends(require_admin),
     db: Session = Depends(get_db)
@@ -283,31 +312,20 @@ async def reanalyze_image(
         
         print(f"📄 图片信息 - 文件名: {image.filename}, 路径: {image.file_path}, 当前状态: {image.ai_analysis_status}")
         
-        # 更新状态为重新分析中
+        # 登记重新分析任务（图片状态置为 pending），由分析队列工作进程执行
         try:
-            image.ai_analysis_status = 'pending'
             if custom_prompt:
                 image.ai_model = 'gpt-4o-custom'
-            db.commit()
-            print(f"✅ 状态更新为pending")
+            analysis_queue.enqueue(db, [image_id], "reanalyze", custom_prompt)
+            print(f"✅ 已登记重新分析任务")
         except Exception as status_error:
-            print(f"❌ 更新状态失败: {status_error}")
+            print(f"❌ 登记分析任务失败: {status_error}")
             db.rollback()
-            raise HTTPException(status_code=500, detail=f"更新状态失败: {str(status_error)}")
-        
-        print(f"🚀 启动后台分析任务")
-        
-        # 启动重新分析任务
-        background_tasks.add_task(
-            reanalyze_image_task, 
-            image_id, 
-            image.file_path,
-            custom_prompt
-        )
+            raise HTTPException(status_code=500, detail=f"登记分析任务失败: {str(status_error)}")
         
         return {
             "success": True,
-            "message": "已启动重新分析任务"
+            "message": "已登记重新分析任务"
         }
         
     except HTTPException:
@@ -316,56 +334,13 @@ async def reanalyze_image(
         print(f"❌ 启动重新分析失败: {e}")
         raise HTTPException(status_code=500, detail=f"启动重新分析失败: {str(e)}")
     
-async def batch_reanalyze_task(image_ids: List[int], custom_prompt: Optional[str] = None):
-    """批量重新分析任务"""
-    print(f"🚀 开始批量重新分析 {len(image_ids)} 张图片")
-    
-    success_count = 0
-    failed_count = 0
-    
-    for i, image_id in enumerate(image_ids):
-        try:
-            from app.database import SessionLocal
-            db = SessionLocal()
-            
-            image = db.query(Image).filter(Image.id == image_id).first()
-            if image:
-                print(f"📊 分析进度: {i+1}/{len(image_ids)} - 图片ID: {image_id}")
-                
-                # 修复：获取完整的OSS URL
-                from app.services.storage_service import StorageManager
-                storage_manager = StorageManager()
-                image_url = storage_manager.get_oss_url(image.file_path)
-                
-                # 调用重新分析任务 - 传递完整URL
-                await reanalyze_image_task(image_id, image.file_path, None)
-                
-                # 检查结果
-                db.refresh(image)
-                if image.ai_analysis_status == 'completed':
-                    success_count += 1
-                else:
-                    failed_count += 1
-                
-                # 添加延迟避免API限制
-                await asyncio.sleep(2)
-            
-            db.close()
-            
-        except Exception as e:
-            print(f"❌ 批量分析图片 {image_id} 失败: {e}")
-            failed_count += 1
-            continue
-    
-    print(f"✅ 批量重新分析完成 - 成功: {success_count}, 失败: {failed_count}")
-
 
 @router.post("/batch-reanalyze")
 async def batch_reanalyze_images(
-    background_tasks: BackgroundTasks,
     image_ids: List[int],
     status_filter: str = Query("failed", description="分析状态筛选: pending, failed, all"),
     custom_prompt: Optional[str] = None,
+    offline: bool = Query(False, description="使用离线批量API（大批量回填，不占用在线分析配额）"),
     current_user: User = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
@@ -403,25 +378,24 @@ async def batch_reanalyze_images(
                 "count": 0
             }
         
-        # 更新状态为处理中
-        db.query(Image).filter(Image.id.in_(image_ids)).update(
-            {"ai_analysis_status": "pending"},
-            synchronize_session=False
-        )
-        db.commit()
-        
         print(f"📊 将重新分析 {len(image_ids)} 张图片")
         
-        # 启动批量分析任务
-        background_tasks.add_task(
-            batch_reanalyze_task,
-            image_ids,
-            custom_prompt
-        )
+        if offline:
+            # 写入离线批次，由批量分析轮询任务提交到批量API
+            batch_ids = batch_analysis.create(db, image_ids, custom_prompt)
+            return {
+                "success": True,
+                "message": f"已登记离线批量重新分析，{len(image_ids)} 张图片分为 {len(batch_ids)} 个批次",
+                "count": len(image_ids),
+                "batch_ids": batch_ids
+            }
+        
+        # 登记批量重新分析任务（图片状态置为 pending），由分析队列工作进程执行
+        analysis_queue.enqueue(db, image_ids, "reanalyze", custom_prompt)
         
         return {
             "success": True,
-            "message": f"已启动批量重新分析任务，将处理 {len(image_ids)} 张图片",
+            "message": f"已登记批量重新分析任务，将处理 {len(image_ids)} 张图片",
             "count": len(image_ids)
         }
         
@@ -452,7 +426,7 @@ async def delete_image(
                 pass  # 文件可能已经不存在
             
             # 删除相关标签关联
-            db.query(ImageTag).filter(ImageTag.image_id == image_id).delete()
+            db_service.clear_image_tags(image_id, keep_palette=False)
             
             # 删除数据库记录
             db.delete(image)
@@ -460,7 +434,10 @@ async def delete_image(
             # 软删除
             image.is_active = False
         
+        catalog_sync.record(db, image_id)
         db.commit()
+        await vector_index.remove_async([image_id])
+        await response_cache.invalidate_async()
         
         return {
             "success": True,
@@ -486,6 +463,9 @@ async def batch_update_images(
     try:
         updated_count = 0
         db_service = DatabaseService(db)
+        # 提交后同步向量索引: 停用或删除的图片移除向量，重新启用的图片重新编码
+        removed_ids = []
+        activated = []
         
         for image_id in image_ids:
             image = db.query(Image).filter(Image.id == image_id).first()
@@ -494,9 +474,11 @@ async def batch_update_images(
                 
             if action == "activate":
                 image.is_active = True
+                activated.append(image)
                 updated_count += 1
             elif action == "deactivate":
                 image.is_active = False
+                removed_ids.append(image_id)
                 updated_count += 1
             elif action == "add_tag" and value:
                 # 添加标签
@@ -504,14 +486,7 @@ async def batch_update_images(
                 updated_count += 1
             elif action == "remove_tag" and value:
                 # 删除标签
-                db.query(ImageTag).filter(
-                    and_(
-                        ImageTag.image_id == image_id,
-                        ImageTag.tag_id.in_(
-                            db.query(Tag.id).filter(Tag.name == value)
-                        )
-                    )
-                ).delete(synchronize_session=False)
+                db_service.remove_tag_name_from_image(image_id, value)
                 updated_count += 1
             elif action == "delete":
                 permanent = value == "permanent"
@@ -520,13 +495,20 @@ async def batch_update_images(
                         await storage_manager.delete_image(image.file_path)
                     except:
                         pass
-                    db.query(ImageTag).filter(ImageTag.image_id == image_id).delete()
+                    db_service.clear_image_tags(image_id, keep_palette=False)
                     db.delete(image)
                 else:
                     image.is_active = False
+                removed_ids.append(image_id)
                 updated_count += 1
+            catalog_sync.record(db, image_id)
         
         db.commit()
+        await vector_index.remove_async(removed_ids)
+        for image in activated:
+            await vector_index.index_image_async(image)
+        if updated_count:
+            await response_cache.invalidate_async()
         
         return {
             "success": True,
@@ -663,10 +645,11 @@ async def get_images_analytics(
 
 @router.post("/duplicate-check")
 async def check_duplicate_images(
+    radius: int = Query(6, ge=0, le=16, description="感知哈希汉明距离阈值，0 表示内容完全一致"),
     current_user: User = Depends(require_admin),
     db: Session = Depends(get_db)
 ):
-    """检查重复图片"""
+    """检查重复图片 - 按感知哈希聚类近似重复（重新编码、缩放的副本），并列出同名文件"""
     try:
         # 按文件名查找重复
         filename_duplicates = db.query(
@@ -675,24 +658,9 @@ async def check_duplicate_images(
             func.group_concat(Image.id).label('ids')
         ).filter(Image.is_active == True).group_by(Image.filename).having(func.count(Image.id) > 1).all()
         
-        # 按文件大小查找可能重复
-        size_duplicates = db.query(
-            Image.file_size,
-            func.count(Image.id).label('count'),
-            func.group_concat(Image.id).label('ids')
-        ).filter(
-            and_(Image.is_active == True, Image.file_size > 0)
-        ).group_by(Image.file_size).having(func.count(Image.id) > 1).all()
-        
-        # 按尺寸查找可能重复
-        dimension_duplicates = db.query(
-            Image.width,
-            Image.height,
-            func.count(Image.id).label('count'),
-            func.group_concat(Image.id).label('ids')
-        ).filter(
-            and_(Image.is_active == True, Image.width > 0, Image.height > 0)
-        ).group_by(Image.width, Image.height).having(func.count(Image.id) > 1).all()
+        # 感知哈希近似重复: BK树按汉明距离检索，避免两两比较
+        hashes, unhashed_count = load_active_hashes(db)
+        near_duplicates = await asyncio.to_thread(find_duplicate_clusters, hashes, radius)
         
         duplicate_data = {
             "filename_duplicates": [
@@ -703,23 +671,10 @@ async def check_duplicate_images(
                 }
                 for dup in filename_duplicates
             ],
-            "size_duplicates": [
-                {
-                    "file_size": dup.file_size,
-                    "count": dup.count,
-                    "image_ids": [int(id) for id in dup.ids.split(',')]
-                }
-                for dup in size_duplicates
-            ],
-            "dimension_duplicates": [
-                {
-                    "width": dup.width,
-                    "height": dup.height,
-                    "count": dup.count,
-                    "image_ids": [int(id) for id in dup.ids.split(',')]
-                }
-                for dup in dimension_duplicates
-            ]
+            "near_duplicates": near_duplicates,
+            "radius": radius,
+            "hashed_count": len(hashes),
+            "unhashed_count": unhashed_count
         }
         
         return {
@@ -752,10 +707,11 @@ async def export_images_data(
         
         # 获取每张图片的标签
         db_service = DatabaseService(db)
+        tags_map = db_service.get_tags_for_images([image.id for image in images])
         export_data = []
         
         for image in images:
-            tags = db_service.get_image_tags(image.id)
+            tags = tags_map.get(image.id, [])
             tag_names = [tag.name for tag in tags]
             
             # 解析搜索关键词
@@ -820,7 +776,7 @@ async def export_images_data(
 
 # 后台任务函数 - 修复后的版本
 async def reanalyze_image_task(image_id: int, file_path: str, custom_prompt: Optional[str] = None):
-    """重新分析图片的后台任务 - 修复版本"""
+    """重新分析图片 - 由分析队列工作进程执行"""
     db = None
     try:
         print(f"🔄 开始重新分析图片 ID: {image_id}, 文件路径: {file_path}")
@@ -859,13 +815,13 @@ async def reanalyze_image_task(image_id: int, file_path: str, custom_prompt: Opt
         if not image_url.startswith('http'):
             raise ValueError(f"无法构建有效的图片URL: {image_url}")
         
-        # 使用自定义提示词或默认分析
+        # 使用自定义提示词或默认分析；管理员重新分析时不复用分析缓存，并以新结果覆盖
         if custom_prompt:
             print(f"🤖 使用自定义提示词: {custom_prompt}")
-            analysis_result = await gpt4o_analyzer.analyze_with_custom_prompt(image_url, custom_prompt)
+            analysis_result = await gpt4o_analyzer.analyze_with_custom_prompt(image_url, custom_prompt, use_cache=False)
         else:
             print(f"🤖 使用默认分析")
-            analysis_result = await gpt4o_analyzer.analyze_for_search(image_url)
+            analysis_result = await gpt4o_analyzer.analyze_for_search(image_url, use_cache=False)
         
         print(f"📋 分析结果: {analysis_result}")
         
@@ -889,6 +845,7 @@ async def reanalyze_image_task(image_id: int, file_path: str, custom_prompt: Opt
                 image.ai_confidence = analysis.get('confidence', 0.0)
                 image.ai_analysis_status = 'completed'
                 image.ai_model = 'gpt-4o-reanalyzed' if not custom_prompt else 'gpt-4o-custom'
+                image.ai_image_tokens = analysis_result.get("image_tokens")
                 
                 # 存储完整分析结果
                 import json
@@ -903,8 +860,7 @@ async def reanalyze_image_task(image_id: int, file_path: str, custom_prompt: Opt
                 # 分步处理标签操作
                 try:
                     # 1. 先删除旧标签
-                    from app.models.image import ImageTag
-                    deleted_count = db.query(ImageTag).filter(ImageTag.image_id == image_id).delete()
+                    deleted_count = db_service.clear_image_tags(image_id)
                     print(f"🗑️ 删除了 {deleted_count} 个旧标签")
                     
                     # 2. 提交删除操作
@@ -915,6 +871,8 @@ async def reanalyze_image_task(image_id: int, file_path: str, custom_prompt: Opt
                     
                     # 4. 提交所有更改
                     db.commit()
+                    await vector_index.index_image_async(image)
+                    await response_cache.invalidate_async()
                     print(f"✅ 重新分析完成 ID: {image_id}")
                     
                 except Exception as tag_error:
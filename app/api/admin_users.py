@@ -17,6 +17,9 @@ from app.database import get_db
 from app.auth.dependencies import require_admin
 from app.models.user import User, UserRole
 from app.models.image import ImageTag, Image
+from app.services.response_cache_service import response_cache
+from app.services.catalog_sync_service import catalog_sync
+from app.services.vector_index_service import vector_index
 
 router = APIRouter()
 
@@ -326,9 +329,17 @@ async def delete_user(
             for image in user_images:
                 image.is_active = False
         
+        image_ids = [image.id for image in user_images]
+        for image_id in image_ids:
+            catalog_sync.record(db, image_id)
+        
         # 删除用户
         db.delete(user)
         db.commit()
+        if not transfer_images:
+            await vector_index.remove_async(image_ids)
+        if user_images:
+            await response_cache.invalidate_async()
         
         action = "转移" if transfer_images else "禁用"
         return {
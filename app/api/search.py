@@ -1,13 +1,24 @@
 """
 搜索API - 添加相似图片推荐功能
 """
+import asyncio
+import json
+
 from fastapi import APIRouter, Depends, Query, HTTPException, Path
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import Optional
 
 from app.database import get_db
 from app.services.smart_search_service import SmartSearchService
+from app.services.search_service import SearchService
 from app.services.database_service import DatabaseService
+from app.services.response_cache_service import response_cache
+from app.services.autocomplete_service import autocomplete_index
+from app.services.pagination_service import paginate_by_cursor, order_by_upload_time, count_cache
+from app.services.view_counter_service import view_counter
+from app.services.popular_search_service import popular_searches
+from app.services.facet_service import FacetService
 
 router = APIRouter()
 
@@ -21,14 +32,23 @@ async def get_similar_images(
 ):
     """获取相似图片推荐"""
     try:
+        cache_key = await response_cache.key("similar", {
+            "image_id": image_id, "similarity_type": similarity_type, "limit": limit
+        })
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         search_service = SmartSearchService(db)
         result = await search_service.find_similar_images(image_id, similarity_type, limit)
         
         if result["success"]:
-            return {
+            response = {
                 "success": True,
                 "data": result
             }
+            await response_cache.set(cache_key, response)
+            return response
         else:
             raise HTTPException(status_code=404, detail=result["error"])
         
@@ -44,6 +64,9 @@ async def search_images(
     q: str = Query(..., description="搜索查询，支持自然语言"),
     limit: int = Query(20, ge=1, le=100, description="返回结果数量"),
     use_ai: bool = Query(True, description="使用GPT-4o进行智能搜索"),
+    rerank: Optional[bool] = Query(None, description="使用GPT-4o对结果二次排序，默认按配置"),
+    budget_ms: Optional[int] = Query(None, ge=100, le=60000, description="AI搜索的延迟预算(毫秒)，默认按配置"),
+    facets: bool = Query(False, description="返回结果集的分类标签统计"),
     db: Session = Depends(get_db)
 ):
     """
@@ -56,19 +79,33 @@ async def search_images(
     - "户外 自然光"
     """
     try:
-        if use_ai:
-            # 使用GPT-4o智能搜索
-            search_service = SmartSearchService(db)
-            result = await search_service.search_with_gpt4o(q, limit)
-        else:
-            # 使用传统搜索
-            search_service = SmartSearchService(db)
-            result = await search_service._fallback_search(q, limit)
+        popular_searches.record(q)
         
-        # 更新查看次数
-        db_service = DatabaseService(db)
-        for image_data in result["images"]:
-            db_service.update_image_view_count(image_data["id"])
+        cache_key = await response_cache.key("search", {
+            "q": " ".join(q.split()), "limit": limit, "use_ai": use_ai, "rerank": rerank
+        })
+        result = await response_cache.get(cache_key)
+        
+        if result is None:
+            if use_ai:
+                # 使用GPT-4o智能搜索
+                search_service = SmartSearchService(db)
+                result = await search_service.search_with_gpt4o(q, limit, rerank, budget_ms)
+            else:
+                # 使用传统搜索
+                search_service = SmartSearchService(db)
+                result = await search_service._fallback_search(q, limit)
+            
+            # AI搜索失败降级或有阶段超时的结果不缓存，下次请求重新尝试
+            if not use_ai or (result.get("search_method") != "fallback_keyword" and not result.get("degraded")):
+                await response_cache.set(cache_key, result)
+        
+        # 更新查看次数（内存累计，定时批量写库）
+        view_counter.increment_many(image_data["id"] for image_data in result["images"])
+        
+        # 分面统计不进入缓存，按需基于结果集计算
+        if facets:
+            result = {**result, "facets": FacetService(db).compute([image["id"] for image in result["images"]])}
         
         return {
             "success": True,
@@ -80,15 +117,107 @@ async def search_images(
         raise HTTPException(status_code=500, detail=f"搜索失败: {str(e)}")
 
 
+@router.get("/search/stream")
+async def search_images_stream(
+    q: str = Query(..., description="搜索查询，支持自然语言"),
+    limit: int = Query(20, ge=1, le=100, description="返回结果数量"),
+    rerank: Optional[bool] = Query(None, description="使用GPT-4o对结果二次排序，默认按配置"),
+    budget_ms: Optional[int] = Query(None, ge=100, le=60000, description="AI阶段的延迟预算(毫秒)，默认按配置"),
+    db: Session = Depends(get_db)
+):
+    """
+    渐进式智能搜索 - 以NDJSON逐行返回
+    
+    先返回标签索引/关键词检索的结果，GPT-4o查询扩展和排序完成后再返回优化后的结果。
+    每行一个JSON对象: {"stage": "fast" | "ai" | "done" | "error", ...}
+    """
+    popular_searches.record(q)
+    
+    # 与 /api/search?use_ai=true 共用缓存
+    cache_key = await response_cache.key("search", {
+        "q": " ".join(q.split()), "limit": limit, "use_ai": True, "rerank": rerank
+    })
+    
+    async def generate():
+        try:
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                view_counter.increment_many(image_data["id"] for image_data in cached["images"])
+                yield _ndjson({"stage": "ai", "cached": True, "data": cached})
+                yield _ndjson({"stage": "done"})
+                return
+            
+            # 1. 快速结果: 标签索引 + 本地相关性排序，无法解析时走全文检索
+            fast = await asyncio.to_thread(SearchService(db).search_images, q, limit)
+            fast["search_method"] = "keyword" if fast["parsed"].get("fallback") else "tag_index"
+            yield _ndjson({"stage": "fast", "data": fast})
+            
+            # 2. GPT-4o扩展查询后的结果，前端用它替换快速结果
+            result = await SmartSearchService(db).search_with_gpt4o(q, limit, rerank, budget_ms)
+            if result.get("search_method") != "fallback_keyword" and not result.get("degraded"):
+                await response_cache.set(cache_key, result)
+            
+            view_counter.increment_many(image_data["id"] for image_data in result["images"])
+            yield _ndjson({"stage": "ai", "data": result})
+            yield _ndjson({"stage": "done"})
+        
+        except Exception as e:
+            # 响应头已发出，错误只能作为最后一行返回
+            print(f"❌ 渐进式搜索失败: {e}")
+            yield _ndjson({"stage": "error", "detail": f"搜索失败: {str(e)}"})
+    
+    return StreamingResponse(
+        generate(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/search/color")
+async def search_images_by_color(
+    colors: str = Query(..., description="颜色，逗号分隔，支持 #RRGGBB 或颜色名（如 红色）"),
+    limit: int = Query(20, ge=1, le=100, description="返回结果数量"),
+    db: Session = Depends(get_db)
+):
+    """按主色调搜索图片 - 与查询颜色最接近的调色板排在前面"""
+    color_list = [color.strip() for color in colors.split(",") if color.strip()][:5]
+    if not color_list:
+        raise HTTPException(status_code=400, detail="请至少提供一个颜色")
+    
+    try:
+        cache_key = await response_cache.key("search_color", {"colors": color_list, "limit": limit})
+        result = await response_cache.get(cache_key)
+        if result is None:
+            result = SearchService(db).search_by_color(color_list, limit)
+            await response_cache.set(cache_key, result)
+        
+        return {
+            "success": True,
+            "data": result
+        }
+    
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"❌ 颜色搜索失败: {e}")
+        raise HTTPException(status_code=500, detail=f"颜色搜索失败: {str(e)}")
+
+
 @router.get("/search/suggestions")
 async def get_search_suggestions(
     q: str = Query(..., description="部分查询词"),
+    limit: int = Query(8, ge=1, le=10, description="返回数量"),
+    use_ai: bool = Query(False, description="追加GPT-4o生成的相关搜索建议"),
     db: Session = Depends(get_db)
 ):
-    """获取AI驱动的搜索建议"""
+    """获取搜索建议 - 默认使用内存前缀索引，可选追加AI建议"""
     try:
-        search_service = SmartSearchService(db)
-        suggestions = await search_service.get_search_suggestions(q)
+        suggestions = autocomplete_index.suggest(q, limit)
+        
+        if use_ai:
+            search_service = SmartSearchService(db)
+            ai_suggestions = await search_service.get_search_suggestions(q)
+            suggestions = list(dict.fromkeys(suggestions + ai_suggestions))[:limit]
         
         return {
             "success": True,
@@ -103,25 +232,14 @@ async def get_search_suggestions(
 
 
 @router.get("/search/popular")
-async def get_popular_searches(db: Session = Depends(get_db)):
-    """获取热门搜索词"""
-    popular_searches = [
-        "女性坐姿",
-        "男性站立",
-        "室内场景",
-        "户外自然光",
-        "思考表情",
-        "阅读动作",
-        "办公室环境",
-        "休闲服装",
-        "专业风格",
-        "轻松氛围"
-    ]
-    
+async def get_popular_searches(
+    limit: int = Query(10, ge=1, le=50, description="返回数量")
+):
+    """获取热门搜索词 - 按时间衰减后的搜索次数排序"""
     return {
         "success": True,
         "data": {
-            "popular_searches": popular_searches
+            "popular_searches": popular_searches.popular_queries(limit)
         }
     }
 
@@ -204,8 +322,8 @@ async def get_image_detail(
         # 获取标签
         tags = db_service.get_image_tags(image_id)
         
-        # 更新查看次数
-        db_service.update_image_view_count(image_id)
+        # 更新查看次数（内存累计，定时批量写库）
+        view_counter.increment(image_id)
         
         # 解析搜索关键词
         searchable_keywords = []
@@ -234,7 +352,7 @@ async def get_image_detail(
                 "mood": getattr(image, 'ai_mood', ''),
                 "style": getattr(image, 'ai_style', ''),
                 "upload_time": image.upload_time.isoformat(),
-                "view_count": image.view_count,
+                "view_count": (image.view_count or 0) + view_counter.pending(image_id),
                 "uploader": image.uploader,
                 "tags": [
                     {
@@ -256,32 +374,42 @@ async def get_image_detail(
 
 @router.get("/images")
 async def get_images(
-    page: int = Query(1, ge=1, description="页码"),
+    page: int = Query(1, ge=1, description="页码，提供 cursor 时忽略"),
     per_page: int = Query(20, ge=1, le=100, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="分页游标，取自上一页的 next_cursor"),
+    facets: bool = Query(False, description="返回本页图片的分类标签统计"),
     db: Session = Depends(get_db)
 ):
-    """获取图片列表"""
+    """获取图片列表 - 支持游标分页（无限滚动）"""
     try:
         from app.models.image import Image
         
-        offset = (page - 1) * per_page
+        cache_key = await response_cache.key("images", {"page": page, "per_page": per_page, "cursor": cursor})
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            return _attach_facets(db, cached, facets)
         
-        # 查询图片
-        images = db.query(Image).filter(
-            Image.is_active == True
-        ).order_by(
-            Image.upload_time.desc()
-        ).offset(offset).limit(per_page).all()
+        def build_query(session: Session):
+            return session.query(Image).filter(Image.is_active == True)
         
-        # 总数
-        total = db.query(Image).filter(Image.is_active == True).count()
+        # 查询图片: 首页和带游标的请求走游标分页，按页码跳转时兼容偏移分页
+        next_cursor = None
+        if cursor or page == 1:
+            images, next_cursor = paginate_by_cursor(build_query(db), per_page, cursor)
+        else:
+            offset = (page - 1) * per_page
+            images = order_by_upload_time(build_query(db)).offset(offset).limit(per_page).all()
+        
+        # 总数（缓存，过期后后台刷新）
+        total = count_cache.get("images:active", db, build_query)
         
         # 处理结果
         db_service = DatabaseService(db)
+        tags_map = db_service.get_tags_for_images([image.id for image in images])
         result_images = []
         
         for image in images:
-            tags = db_service.get_image_tags(image.id)
+            tags = tags_map.get(image.id, [])
             result_images.append({
                 "id": image.id,
                 "filename": image.filename,
@@ -296,7 +424,7 @@ async def get_images(
                 "tags": [{"name": tag.name, "category": tag.category} for tag in tags]
             })
         
-        return {
+        response = {
             "success": True,
             "data": {
                 "images": result_images,
@@ -304,10 +432,28 @@ async def get_images(
                     "page": page,
                     "per_page": per_page,
                     "total": total,
-                    "pages": (total + per_page - 1) // per_page
+                    "pages": (total + per_page - 1) // per_page,
+                    "next_cursor": next_cursor
                 }
             }
         }
+        await response_cache.set(cache_key, response)
+        return _attach_facets(db, response, facets)
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"获取图片列表失败: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"获取图片列表失败: {str(e)}")
+
+
+def _attach_facets(db: Session, response: dict, facets: bool) -> dict:
+    """按需附加本页图片的分面统计（不修改缓存中的响应）"""
+    if not facets:
+        return response
+    image_ids = [image["id"] for image in response["data"]["images"]]
+    return {**response, "data": {**response["data"], "facets": FacetService(db).compute(image_ids)}}
+
+
+def _ndjson(payload: dict) -> bytes:
+    """序列化为一行NDJSON"""
+    return (json.dumps(payload, ensure_ascii=False, default=str) + "\n").encode("utf-8")
\ No newline at end of file
@@ -1,10 +1,11 @@
 """
 图片上传API - 需要用户登录
 """
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, BackgroundTasks
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from typing import Optional
+import asyncio
 import json
 import logging
 
@@ -12,6 +13,12 @@ from app.database import get_db
 from app.services.storage_service import storage_manager
 from app.services.gpt4o_service import gpt4o_analyzer
 from app.services.database_service import DatabaseService
+from app.services.vector_index_service import vector_index
+from app.services.response_cache_service import response_cache
+from app.services.catalog_sync_service import catalog_sync
+from app.services.perceptual_hash_service import phash_file
+from app.services.color_palette_service import palette_file
+from app.services.analysis_queue_service import analysis_queue
 from app.models.image import Image
 from app.models.user import User
 from app.auth.dependencies import require_user
@@ -24,7 +31,7 @@ router = APIRouter()
 
 
 async def process_image_with_gpt4o(image_id: int, file_path: str, is_cloud_storage: bool = False):
-    """后台任务：使用GPT-4o分析图片"""
+    """分析任务：使用GPT-4o分析图片（由分析队列工作进程执行）"""
     try:
         print(f"🤖 开始GPT-4o分析图片 ID: {image_id}")
         
@@ -44,26 +51,26 @@ async def process_image_with_gpt4o(image_id: int, file_path: str, is_cloud_stora
         else:
             print(f"📁 分析本地图片: {file_path}")
         
-        # 使用GPT-4o进行分析
-        from app.services.ai_service import GPT4OAnalyzer
-        gpt4o_analyzer = GPT4OAnalyzer()
+        # 使用共享的GPT-4o分析器（复用全局HTTP连接池）
         analysis_result = await gpt4o_analyzer.analyze_for_search(analysis_file_path)
         
         if not analysis_result.get("success"):
             error_msg = analysis_result.get("error", "Unknown error")
             print(f"❌ GPT-4o分析失败: {error_msg}")
             
-            # 使用fallback分析
-            if "fallback_analysis" in analysis_result:
-                analysis = analysis_result["fallback_analysis"]
-            else:
-                analysis = {
-                    "description": "图片分析待处理",
-                    "tags": {"general": ["图片", "参考"]},
-                    "confidence": 0.5
-                }
-        else:
-            analysis = analysis_result["analysis"]
+            # 不保存 fallback 分析: 标记失败，由分析队列按退避重试
+            from app.database import SessionLocal
+            db = SessionLocal()
+            try:
+                db.query(Image).filter(Image.id == image_id).update(
+                    {"ai_analysis_status": "failed"}, synchronize_session=False
+                )
+                db.commit()
+            finally:
+                db.close()
+            return
+        
+        analysis = analysis_result["analysis"]
         
         # 更新数据库
         from app.database import SessionLocal
@@ -79,6 +86,7 @@ async def process_image_with_gpt4o(image_id: int, file_path: str, is_cloud_stora
                 image.ai_confidence = analysis.get('confidence', 0.0)
                 image.ai_analysis_status = 'completed'
                 image.ai_model = 'gpt-4o'
+                image.ai_image_tokens = analysis_result.get("image_tokens")
                 
                 # 存储完整的GPT-4o分析结果
                 import json
@@ -94,6 +102,8 @@ async def process_image_with_gpt4o(image_id: int, file_path: str, is_cloud_stora
                 await _process_gpt4o_tags(db_service, image_id, analysis)
                 
                 db.commit()
+                await vector_index.index_image_async(image)
+                await response_cache.invalidate_async()
                 print(f"✅ GPT-4o分析完成 ID: {image_id}")
             
         except Exception as e:
@@ -177,7 +187,6 @@ async def _process_gpt4o_tags(db_service: DatabaseService, image_id: int, analys
 
 @router.post("/upload")
 async def upload_image(
-    background_tasks: BackgroundTasks,
     current_user: User = Depends(require_user),
     file: UploadFile = File(...),
     db: Session = Depends(get_db)
@@ -198,6 +207,10 @@ async def upload_image(
         # 确保URL使用正确的OSS路径
         oss_url = storage_manager.get_oss_url(file_path)
         
+        # 计算感知哈希（近似重复检测）和主色调调色板（颜色搜索）
+        phash = await asyncio.to_thread(phash_file, file_path)
+        palette = await asyncio.to_thread(palette_file, file_path)
+        
         upload_result = {
             "filename": file_info.get("filename", original_filename),
             "original_filename": original_filename,
@@ -219,22 +232,22 @@ async def upload_image(
             url=upload_result["url"],  # 使用OSS URL
             width=upload_result["width"],
             height=upload_result["height"],
+            phash=phash,
+            color_palette=palette,
             uploader=current_user.username,
             ai_analysis_status="pending",
             ai_model="gpt-4o"
         )
         
+        # 颜色索引和颜色标签
+        db_service.apply_color_palette(image.id, palette)
+        
         # 更新用户上传统计
         current_user.upload_count += 1
         db.commit()
         
-        # 启动GPT-4o分析任务
-        background_tasks.add_task(
-            process_image_with_gpt4o, 
-            image.id, 
-            upload_result["file_path"],
-            True  # 使用云存储
-        )
+        # 登记GPT-4o分析任务，由分析队列工作进程执行
+        analysis_queue.enqueue(db, [image.id], "analyze")
         
         return JSONResponse({
             "success": True,
@@ -340,7 +353,10 @@ async def delete_image(
         
         # 软删除数据库记录
         image.is_active = False
+        catalog_sync.record(db, image_id)
         db.commit()
+        await vector_index.remove_async([image_id])
+        await response_cache.invalidate_async()
         
         # 更新用户上传统计
         if current_user.username == image.uploader:
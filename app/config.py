@@ -31,6 +31,27 @@ class Settings(BaseSettings):
     openai_model: str = "gpt-4o"
     openai_max_tokens: int = 1000
     openai_temperature: float = 0.1
+    openai_requests_per_minute: int = 500  # 每分钟请求数配额
+    openai_tokens_per_minute: int = 30000  # 每分钟token配额
+    openai_max_retries: int = 5  # 429/5xx/网络错误的最大重试次数
+    openai_backoff_base: float = 1.0  # 指数退避的初始间隔(秒)
+    openai_backoff_max: float = 60.0  # 指数退避的最大间隔(秒)
+    openai_http2: bool = True  # OpenAI 客户端是否启用HTTP/2（需要 h2 包）
+    openai_max_connections: int = 20  # OpenAI 客户端连接池最大连接数
+    openai_max_keepalive_connections: int = 10  # 连接池保留的空闲长连接数
+    openai_keepalive_expiry: float = 60.0  # 空闲长连接保留时间(秒)
+    openai_connect_timeout: float = 10.0  # 建立连接超时(秒)
+    openai_text_timeout: int = 30  # 文本调用（查询扩展、重排序）的读取超时(秒)，图片分析使用 image_analysis_timeout
+    analysis_concurrency: int = 8  # 每个工作进程同时执行的分析任务数
+    analysis_worker_embedded: bool = True  # Web进程内是否运行分析队列工作协程（独立部署 analysis_worker.py 时可关闭）
+    analysis_job_lease_seconds: int = 300  # 分析任务租约时长(秒)，执行中定期续租
+    analysis_job_max_attempts: int = 3  # 分析任务最大执行次数
+    analysis_job_poll_interval: float = 2.0  # 队列为空时的轮询间隔(秒)
+    analysis_cache_enabled: bool = True  # 按图片内容和提示词哈希复用已有的分析结果
+    analysis_batch_max_requests: int = 150  # 每个离线批次的最大请求数（批量API单个文件上限200MB）
+    analysis_batch_poll_interval: float = 60.0  # 离线批次状态轮询间隔(秒)
+    openai_batch_base_url: str = ""  # 批量API地址，留空时使用 openai_base_url（测试时可指向本地替身服务）
+    openai_batch_completion_window: str = "24h"  # 批量API完成时限
     
     # 图片存储配置
     storage_type: str = "local"  # local, oss, s3
@@ -38,6 +59,11 @@ class Settings(BaseSettings):
     max_file_size: int = 10 * 1024 * 1024
     allowed_extensions: set = {".jpg", ".jpeg", ".png", ".webp"}
     image_analysis_timeout: int = 60
+    preprocess_workers: int = 2  # 图片预处理进程数（解码、缩放、编码），0 表示在线程中执行
+    preprocess_max_pixels: int = 50_000_000  # 预处理解码后允许的最大像素数
+    preprocess_max_bytes: int = 30 * 1024 * 1024  # 预处理下载远程图片的最大字节数
+    vision_sizing_policy: str = "fixed"  # 视觉分析图片尺寸策略: fixed(长边2048, detail=high), budget(按切片预算自适应), low(512, detail=low)；用 benchmark_vision_sizing.py 确认标签质量后再切换
+    vision_max_tiles: int = 4  # budget 策略每张图片最多的512px切片数（每个切片170 token，另加85基础token）
     
     # 阿里云OSS配置
     oss_enabled: bool = False
@@ -70,11 +96,38 @@ class Settings(BaseSettings):
     search_results_per_page: int = 20
     search_max_results: int = 100
     enable_semantic_search: bool = True
+    vector_index_dir: str = "./cache/vector_index"  # 本地向量索引目录
+    vector_dim: int = 512  # 哈希编码向量维度
+    search_gpt_rerank: bool = False  # 是否默认使用GPT-4o二次排序
+    ranking_max_candidates: int = 2000  # 相关性排序最多参与完整打分的候选数量（超出时按标签命中和全文相关度预筛）
+    search_latency_budget_ms: int = 3000  # AI搜索单次请求的延迟预算(毫秒)
+    search_stage_reserve_ms: int = 300  # 等待查询扩展时为后续检索预留的时间(毫秒)
+    search_rerank_min_ms: int = 1500  # 剩余预算低于该值时跳过GPT-4o二次排序(毫秒)
+    similar_top_k: int = 30  # 每张图片预计算的相似图片数量
+    similar_block_size: int = 512  # 计算相似图片时每批处理的图片数量
+    similar_refresh_interval: int = 30  # 标签变化后增量刷新相似图片的间隔(秒)
+    similar_matrix_reload_interval: int = 3600  # 增量刷新时全量重读 image_tags 的间隔(秒)，其余刷新只读取变化图片
+    catalog_sync_interval: float = 2.0  # 轮询其他进程（分析工作进程、其他Web进程）图库变更的间隔(秒)
+    catalog_sync_gap_seconds: int = 60  # 变更ID出现空洞（事务尚未提交）时继续等待的时长(秒)
+    catalog_change_retention: int = 86400  # 图库变更日志保留时长(秒)
     
     # 缓存配置
     enable_redis_cache: bool = False
     redis_url: str = "redis://localhost:6379"
     cache_ttl: int = 3600
+    query_cache_size: int = 2000  # 查询扩展内存缓存条数
+    query_cache_warm_interval: int = 600  # 热门查询预热间隔(秒)
+    query_cache_warm_top_n: int = 50  # 每次预热的热门查询数量
+    enable_response_cache: bool = True  # 缓存搜索/列表/相似图片接口响应
+    response_cache_size: int = 5000  # 响应缓存条数
+    response_cache_ttl: int = 600  # 响应缓存过期时间(秒)
+    count_cache_ttl: int = 60  # 列表总数缓存时间(秒)，过期后后台刷新
+    view_count_flush_interval: int = 5  # 查看次数批量写库间隔(秒)
+    view_count_flush_lock_ttl: int = 300  # 查看次数写库锁的过期时间(秒)，需长于最慢的一次写库，写完即释放
+    popular_search_state_path: str = "./cache/popular_searches.json"  # 热门搜索统计持久化文件
+    popular_search_capacity: int = 1000  # 热门搜索统计跟踪的查询数量
+    popular_search_half_life: int = 86400 * 3  # 热门度半衰期(秒)
+    popular_search_persist_interval: int = 300  # 热门搜索统计持久化间隔(秒)
     
     # 管理员配置
     admin_password: str = "admin123"
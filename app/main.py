@@ -1,6 +1,7 @@
 """
 FastAPI主应用 - 添加用户认证支持
 """
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Depends
 from fastapi.staticfiles import StaticFiles
@@ -8,10 +9,46 @@ from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse, RedirectResponse
 
 from app.config import get_settings, create_directories
-from app.database import create_tables, test_connection
+from app.database import create_tables, test_connection, SessionLocal
 from app.api import upload, search, admin, auth
 from app.auth.dependencies import optional_user
 from app.models.user import User
+from app.services.tag_index_service import tag_index
+from app.services.vector_index_service import vector_index
+from app.services.query_expansion_service import query_expansion_cache
+from app.services.query_parser_service import query_parser
+from app.services.autocomplete_service import autocomplete_index
+from app.services.view_counter_service import view_counter
+from app.services.popular_search_service import popular_searches
+from app.services.similar_image_service import similar_images
+from app.services.color_palette_service import color_index
+from app.services.analysis_queue_service import analysis_queue
+from app.services.batch_analysis_service import batch_analysis
+from app.services.ai_client_service import ai_client
+from app.services.image_preprocess_service import image_preprocessor
+from app.services.catalog_sync_service import catalog_sync
+
+def _rebuild_vector_index():
+    """从数据库重建向量索引"""
+    db = SessionLocal()
+    try:
+        vector_index.rebuild(db)
+    except Exception as e:
+        print(f"❌ 重建向量索引失败: {e}")
+    finally:
+        db.close()
+
+
+def _rebuild_similar_images():
+    """从数据库重建相似图片表"""
+    db = SessionLocal()
+    try:
+        similar_images.rebuild(db)
+    except Exception as e:
+        print(f"❌ 重建相似图片表失败: {e}")
+    finally:
+        db.close()
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -20,15 +57,79 @@ async def lifespan(app: FastAPI):
     print("🚀 启动AI姿势参考图库...")
     create_directories()
     
+    # 持有后台重建任务的引用，避免任务在完成前被回收
+    rebuild_tasks = set()
+    
     if test_connection():
         create_tables()
+        
+        # 构建标签倒排索引，编译查询解析词典和自动补全索引，加载颜色索引
+        # 先记录变更日志游标，加载期间其他进程提交的变更由同步任务补上
+        db = SessionLocal()
+        try:
+            catalog_sync.start(db)
+            tag_index.build(db)
+            query_parser.load_tags(db)
+            autocomplete_index.load(db)
+            has_similar_images = similar_images.load(db)
+            color_index.load(db)
+        finally:
+            db.close()
+        
+        # 加载本地向量索引，不存在时在后台线程中重建
+        if not vector_index.load():
+            rebuild_tasks.add(asyncio.create_task(asyncio.to_thread(_rebuild_vector_index)))
+        
+        # 相似图片表为空时在后台线程中全量计算
+        if not has_similar_images:
+            rebuild_tasks.add(asyncio.create_task(asyncio.to_thread(_rebuild_similar_images)))
+        for task in rebuild_tasks:
+            task.add_done_callback(rebuild_tasks.discard)
+        
         print("✅ 应用启动完成")
     else:
         print("❌ 数据库连接失败，请检查配置")
     
+    # 打开共享的OpenAI客户端（HTTP/2 + 连接池）
+    await ai_client.open()
+    
+    # 恢复热门搜索统计
+    popular_searches.load()
+    
+    # 启动热门查询扩展预热、查看次数写回、热门搜索持久化、相似图片增量刷新、图库变更同步任务
+    warmer_task = asyncio.create_task(query_expansion_cache.run_warmer())
+    view_flush_task = asyncio.create_task(view_counter.run_flusher())
+    popular_persist_task = asyncio.create_task(popular_searches.run_persister())
+    similar_refresh_task = asyncio.create_task(similar_images.run_refresher())
+    catalog_sync_task = asyncio.create_task(catalog_sync.run_watcher())
+    
+    # 分析队列工作协程和离线批次轮询（独立运行 analysis_worker.py 时可通过 ANALYSIS_WORKER_EMBEDDED=false 关闭）
+    analysis_worker_task = None
+    batch_poller_task = None
+    if get_settings().analysis_worker_embedded:
+        analysis_worker_task = asyncio.create_task(analysis_queue.run_worker())
+        batch_poller_task = asyncio.create_task(batch_analysis.run_poller())
+    
     yield
     
     # 关闭时执行
+    warmer_task.cancel()
+    view_flush_task.cancel()
+    popular_persist_task.cancel()
+    similar_refresh_task.cancel()
+    catalog_sync_task.cancel()
+    if batch_poller_task:
+        batch_poller_task.cancel()
+    if analysis_worker_task:
+        analysis_worker_task.cancel()
+        try:
+            await analysis_worker_task
+        except asyncio.CancelledError:
+            pass
+    await ai_client.close()
+    await image_preprocessor.shutdown()
+    await view_counter.flush()
+    popular_searches.save()
     print("👋 应用关闭")
 
 
@@ -1,7 +1,7 @@
 """
 图片相关数据模型 - 修复重复标签
 """
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Float, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean, Float, JSON, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -27,6 +27,9 @@ class Image(Base):
     ai_searchable_keywords = Column(JSON, comment="AI提取的搜索关键词")
     ai_mood = Column(String(200), comment="AI分析的整体氛围")
     ai_style = Column(String(200), comment="AI分析的视觉风格")
+    phash = Column(String(16), index=True, comment="感知哈希(pHash)，用于近似重复检测")
+    color_palette = Column(LargeBinary(32), comment="主色调调色板，每色4字节打包的Lab值和占比")
+    ai_image_tokens = Column(Integer, comment="最近一次视觉分析的图片token预估（按尺寸策略和切片规则计算）")
     
     # 用户信息
     uploader = Column(String(100), comment="上传者")
@@ -39,6 +42,11 @@ class Image(Base):
     # 关联关系
     image_tags = relationship("ImageTag", back_populates="image", cascade="all, delete-orphan")
     
+    # 游标分页索引: (is_active, upload_time, id)
+    __table_args__ = (
+        Index("idx_images_active_upload", "is_active", "upload_time", "id"),
+    )
+    
     def __repr__(self):
         return f"<Image(id={self.id}, filename='{self.filename}')>"
 
@@ -89,6 +97,116 @@ class ImageTag(Base):
         return f"<ImageTag(image_id={self.image_id}, tag_id={self.tag_id})>"
 
 
+class ImageNeighbor(Base):
+    """相似图片表 - 预计算的标签余弦相似度 top-K"""
+    __tablename__ = "image_neighbors"
+    
+    # 不设外键: 删除图片时无需级联，读取时与 images 关联过滤
+    image_id = Column(Integer, primary_key=True, comment="图片ID")
+    rank = Column(Integer, primary_key=True, comment="相似度排名，从0开始")
+    neighbor_id = Column(Integer, nullable=False, comment="相似图片ID")
+    score = Column(Float, nullable=False, comment="标签余弦相似度")
+    
+    # 增量刷新时按相似图片反查受影响的行
+    __table_args__ = (
+        Index("idx_image_neighbors_neighbor", "neighbor_id"),
+    )
+    
+    def __repr__(self):
+        return f"<ImageNeighbor(image_id={self.image_id}, neighbor_id={self.neighbor_id}, score={self.score})>"
+
+
+class CatalogChange(Base):
+    """图库变更日志 - 记录标签、调色板或状态发生变化的图片，其他进程轮询后同步内存索引和响应缓存"""
+    __tablename__ = "catalog_changes"
+    
+    id = Column(Integer, primary_key=True, comment="变更ID（自增，作为轮询游标）")
+    image_id = Column(Integer, nullable=False, comment="发生变化的图片ID")
+    origin = Column(String(100), nullable=False, comment="写入变更的进程，本进程的变更已在提交时生效")
+    created_time = Column(DateTime(timezone=True), server_default=func.now(), index=True, comment="创建时间，按保留时长清理")
+    
+    def __repr__(self):
+        return f"<CatalogChange(id={self.id}, image_id={self.image_id}, origin='{self.origin}')>"
+
+
+class AnalysisJob(Base):
+    """图片分析任务队列 - 持久化分析任务，进程重启或崩溃后由工作进程继续处理"""
+    __tablename__ = "analysis_jobs"
+    
+    id = Column(Integer, primary_key=True, comment="任务ID")
+    image_id = Column(Integer, nullable=False, index=True, comment="图片ID")
+    kind = Column(String(20), nullable=False, default="analyze", comment="任务类型: analyze, reanalyze, batch")
+    custom_prompt = Column(Text, comment="自定义提示词")
+    state = Column(String(20), nullable=False, default="queued", comment="状态: queued, running, batched, completed, failed")
+    attempts = Column(Integer, nullable=False, default=0, comment="已执行次数")
+    available_at = Column(DateTime, nullable=False, comment="最早可领取时间(UTC)，失败重试时按退避推迟")
+    lease_expires_at = Column(DateTime, comment="租约到期时间(UTC)，到期仍未完成的任务重新排队")
+    worker_id = Column(String(100), comment="领取任务的工作进程")
+    last_error = Column(Text, comment="最近一次失败原因")
+    created_time = Column(DateTime(timezone=True), server_default=func.now(), comment="创建时间")
+    updated_time = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), comment="更新时间")
+    
+    # 领取任务和回收过期租约的查询都按 (状态, 时间) 走索引
+    __table_args__ = (
+        Index("idx_analysis_jobs_claim", "state", "available_at"),
+        Index("idx_analysis_jobs_lease", "state", "lease_expires_at"),
+    )
+    
+    def __repr__(self):
+        return f"<AnalysisJob(id={self.id}, image_id={self.image_id}, state='{self.state}')>"
+
+
+class AnalysisBatch(Base):
+    """离线批量分析 - 一个提交到 OpenAI 批量API的请求文件，对应的分析任务处于 batched 状态"""
+    __tablename__ = "analysis_batches"
+    
+    id = Column(Integer, primary_key=True, comment="批次ID")
+    state = Column(String(20), nullable=False, default="building", index=True,
+                   comment="状态: building, uploading, submitted, ingesting, completed, failed")
+    remote_batch_id = Column(String(100), comment="批量API返回的批次ID")
+    remote_status = Column(String(30), comment="批量API最近一次返回的状态")
+    input_file_id = Column(String(100), comment="上传的请求文件ID")
+    output_file_id = Column(String(100), comment="结果文件ID")
+    error_file_id = Column(String(100), comment="错误文件ID")
+    custom_prompt = Column(Text, comment="自定义提示词")
+    image_ids = Column(JSON, nullable=False, comment="批次包含的图片ID")
+    items = Column(JSON, comment="请求ID到归一化图片哈希、detail和预估token的映射，导入结果时写入分析缓存")
+    request_count = Column(Integer, nullable=False, default=0, comment="提交的请求数")
+    cached_count = Column(Integer, nullable=False, default=0, comment="命中分析缓存、未提交的图片数")
+    succeeded_count = Column(Integer, nullable=False, default=0, comment="导入成功的图片数")
+    failed_count = Column(Integer, nullable=False, default=0, comment="失败并退回在线队列的图片数")
+    lease_expires_at = Column(DateTime, comment="构建或导入的租约到期时间(UTC)，到期仍未完成的由其他进程接手")
+    last_error = Column(Text, comment="最近一次错误")
+    submitted_at = Column(DateTime, comment="提交时间(UTC)")
+    completed_at = Column(DateTime, comment="完成时间(UTC)")
+    created_time = Column(DateTime(timezone=True), server_default=func.now(), comment="创建时间")
+    updated_time = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), comment="更新时间")
+    
+    def __repr__(self):
+        return f"<AnalysisBatch(id={self.id}, state='{self.state}', requests={self.request_count})>"
+
+
+class AnalysisCache(Base):
+    """图片分析结果缓存 - 按归一化图片内容哈希和提示词哈希复用已有的分析结果"""
+    __tablename__ = "analysis_cache"
+    
+    id = Column(Integer, primary_key=True, comment="缓存ID")
+    image_hash = Column(String(64), nullable=False, comment="归一化图片内容的SHA-256")
+    prompt_hash = Column(String(64), nullable=False, comment="模型和提示词的SHA-256")
+    model = Column(String(50), nullable=False, comment="分析模型")
+    result = Column(JSON, nullable=False, comment="解析后的分析结果")
+    hit_count = Column(Integer, nullable=False, default=0, comment="命中次数")
+    created_time = Column(DateTime(timezone=True), server_default=func.now(), comment="创建时间")
+    last_hit_time = Column(DateTime(timezone=True), comment="最近命中时间")
+    
+    __table_args__ = (
+        Index("uq_analysis_cache_key", "image_hash", "prompt_hash", unique=True),
+    )
+    
+    def __repr__(self):
+        return f"<AnalysisCache(image_hash='{self.image_hash[:12]}', model='{self.model}', hits={self.hit_count})>"
+
+
 # 标签分类常量
 class TagCategory:
     """标签分类枚举"""
@@ -201,4 +319,18 @@ PREDEFINED_TAGS = [
     {"name": "活跃氛围", "category": TagCategory.MOOD, "description": "活跃氛围"},  # 改名避免重复
     {"name": "商务氛围", "category": TagCategory.MOOD, "description": "商务氛围"},  # 改名避免重复
     {"name": "轻松氛围", "category": TagCategory.MOOD, "description": "轻松氛围"},  # 改名避免重复
+    
+    # 颜色（由主色调提取自动标注）
+    {"name": "红色", "category": TagCategory.COLOR, "description": "红色为主色调"},
+    {"name": "橙色", "category": TagCategory.COLOR, "description": "橙色为主色调"},
+    {"name": "黄色", "category": TagCategory.COLOR, "description": "黄色为主色调"},
+    {"name": "绿色", "category": TagCategory.COLOR, "description": "绿色为主色调"},
+    {"name": "青色", "category": TagCategory.COLOR, "description": "青色为主色调"},
+    {"name": "蓝色", "category": TagCategory.COLOR, "description": "蓝色为主色调"},
+    {"name": "紫色", "category": TagCategory.COLOR, "description": "紫色为主色调"},
+    {"name": "粉色", "category": TagCategory.COLOR, "description": "粉色为主色调"},
+    {"name": "棕色", "category": TagCategory.COLOR, "description": "棕色为主色调"},
+    {"name": "黑色", "category": TagCategory.COLOR, "description": "黑色为主色调"},
+    {"name": "白色", "category": TagCategory.COLOR, "description": "白色为主色调"},
+    {"name": "灰色", "category": TagCategory.COLOR, "description": "灰色为主色调"},
 ]
\ No newline at end of file
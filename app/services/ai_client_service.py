@@ -0,0 +1,121 @@
+"""
+AI客户端管理 - 全部 OpenAI 调用共享一个 httpx.AsyncClient
+
+在应用生命周期内打开和关闭，启用 HTTP/2 和 keep-alive，连接池上限显式配置，
+批量分析时复用已建立的 TLS 连接而不是每张图片重新握手；每次调用单独指定超时，
+并统计调用延迟和连接池占用情况。
+"""
+import importlib.util
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+from app.config import get_settings
+from app.services.rate_limit_service import openai_limiter
+
+settings = get_settings()
+
+
+def _http2_available() -> bool:
+    """HTTP/2 依赖 h2 包（httpx[http2]）"""
+    return importlib.util.find_spec("h2") is not None
+
+
+class AIClientManager:
+    """共享的 OpenAI HTTP 客户端"""
+    
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self.http2 = False
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_latency = 0.0
+    
+    def _create_client(self) -> httpx.AsyncClient:
+        self.http2 = settings.openai_http2 and _http2_available()
+        if settings.openai_http2 and not self.http2:
+            print("⚠️ 未安装 h2，OpenAI 客户端使用 HTTP/1.1（pip install 'httpx[http2]'）")
+        
+        return httpx.AsyncClient(
+            base_url=settings.openai_base_url.rstrip("/"),
+            http2=self.http2,
+            headers={"Authorization": f"Bearer {settings.openai_api_key}"},
+            limits=httpx.Limits(
+                max_connections=settings.openai_max_connections,
+                max_keepalive_connections=settings.openai_max_keepalive_connections,
+                keepalive_expiry=settings.openai_keepalive_expiry
+            ),
+            timeout=httpx.Timeout(settings.image_analysis_timeout, connect=settings.openai_connect_timeout)
+        )
+    
+    async def open(self):
+        """打开共享客户端（应用启动时调用）"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._create_client()
+            print(f"✅ OpenAI 客户端已打开: {'HTTP/2' if self.http2 else 'HTTP/1.1'}, "
+                  f"最大连接数 {settings.openai_max_connections}")
+    
+    async def close(self):
+        """关闭共享客户端，释放连接池（应用关闭时调用）"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """未经生命周期打开时（脚本、测试）按需创建"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._create_client()
+        return self._client
+    
+    async def chat_completion(self, payload: Dict[str, Any], timeout: float,
+                              estimated_tokens: int) -> httpx.Response:
+        """经限流器发送 chat/completions 请求，timeout 为本次调用的读取超时(秒)"""
+        client = self.client
+        call_timeout = httpx.Timeout(timeout, connect=settings.openai_connect_timeout)
+        
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.perf_counter()
+        try:
+            response = await openai_limiter.call(
+                lambda: client.post("/chat/completions", json=payload, timeout=call_timeout),
+                estimated_tokens
+            )
+            if response.status_code != 200:
+                self.errors += 1
+            return response
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.total_latency += time.perf_counter() - started
+    
+    def pool_stats(self) -> Dict[str, int]:
+        """连接池中的连接数量（读取 httpcore 连接池，内部结构不可用时返回0）"""
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []) or [])
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {"connections": len(connections), "idle": idle, "active": len(connections) - idle}
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "open": self._client is not None and not self._client.is_closed,
+            "http2": self.http2,
+            "requests": self.requests,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "avg_latency_ms": round(self.total_latency * 1000 / self.requests, 1) if self.requests else 0.0,
+            "pool": self.pool_stats(),
+            "max_connections": settings.openai_max_connections
+        }
+
+
+# 创建全局AI客户端实例
+ai_client = AIClientManager()
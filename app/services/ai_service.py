@@ -1,17 +1,15 @@
 """
 AI服务 - 图片分析和标签生成 - 修复文件路径问题
 """
-import base64
-import httpx
 import os
 from typing import List, Dict, Any
-from PIL import Image
-import io
 import json
 from pathlib import Path
 
 from app.config import get_settings
 from app.models.image import TagCategory
+from app.services.ai_client_service import ai_client
+from app.services.image_preprocess_service import image_preprocessor
 
 settings = get_settings()
 
@@ -19,9 +17,6 @@ settings = get_settings()
 class AIService:
     """AI服务类"""
     
-    def __init__(self):
-        self.client = httpx.AsyncClient()
-        
     async def analyze_image(self, image_path: str) -> Dict[str, Any]:
         """分析图片并生成标签和描述"""
         try:
@@ -36,7 +31,7 @@ class AIService:
                 return self._get_fallback_analysis()
             
             # 加载和处理图片
-            image_data = self._prepare_image(fixed_path)
+            image_data = await self._prepare_image(fixed_path)
             
             # 如果没有配置OpenAI API Key，使用模拟分析
             if not settings.openai_api_key or settings.openai_api_key == "your_openai_api_key_here":
@@ -87,38 +82,18 @@ class AIService:
         print(f"⚠️ 使用回退路径: {fallback_path}")
         return fallback_path
     
-    def _prepare_image(self, image_path: str) -> str:
-        """准备图片数据用于AI分析"""
+    async def _prepare_image(self, image_path: str) -> str:
+        """准备图片数据用于AI分析（在预处理进程池中解码、缩放和编码）"""
         try:
-            # 打开图片
-            with Image.open(image_path) as img:
-                # 转换为RGB
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # 调整大小以节省API费用
-                max_size = 1024
-                if img.width > max_size or img.height > max_size:
-                    img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-                
-                # 转换为base64
-                buffer = io.BytesIO()
-                img.save(buffer, format='JPEG', quality=85)
-                image_bytes = buffer.getvalue()
-                
-                return base64.b64encode(image_bytes).decode('utf-8')
-                
+            # 调整大小以节省API费用
+            image = await image_preprocessor.prepare(image_path, max_size=1024, quality=85)
+            return image.data
         except Exception as e:
             print(f"❌ 图片预处理失败: {e}")
             raise
     
     async def _call_openai_vision(self, image_data: str) -> Dict[str, Any]:
         """调用OpenAI Vision API"""
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {settings.openai_api_key}"
-        }
-        
         prompt = """请分析这张图片中的人物姿势和场景，并提供以下信息：
 
 1. 详细描述图片内容（100字以内）
@@ -161,12 +136,8 @@ class AIService:
         }
         
         try:
-            response = await self.client.post(
-                f"{settings.openai_base_url}/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=30.0
-            )
+            # 1024px图片按4个切片预估: 4*170+85 = 765 token
+            response = await ai_client.chat_completion(payload, 30.0, len(prompt) + payload["max_tokens"] + 765)
             
             if response.status_code == 200:
                 result = response.json()
@@ -192,7 +163,6 @@ class AIService:
         print("🤖 使用模拟AI分析（未配置OpenAI API Key）")
         
         import random
-        from pathlib import Path
         
         filename = Path(image_path).name.lower()
         
@@ -259,10 +229,6 @@ class AIService:
             "tags": ["人物", "姿势", "参考"],
             "confidence": 0.5
         }
-    
-    async def close(self):
-        """关闭HTTP客户端"""
-        await self.client.aclose()
 
 
 # 创建全局AI服务实例
@@ -0,0 +1,106 @@
+"""
+分析结果缓存 - 按 (归一化图片内容SHA-256, 模型+detail+提示词SHA-256) 持久化 GPT-4o 分析结果
+
+重复上传同一张照片、或用相同提示词重新分析时，只需一次唯一索引查询即可复用结果，不再调用视觉API。
+"""
+import asyncio
+import hashlib
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from app.config import get_settings
+from app.models.image import AnalysisCache
+
+settings = get_settings()
+
+
+def prompt_hash(model: str, prompt: str, detail: str = "high") -> str:
+    """模型、图片 detail 和提示词共同决定分析结果"""
+    return hashlib.sha256(f"{model}\n{detail}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+class AnalysisResultCache:
+    """GPT-4o 分析结果的数据库缓存"""
+    
+    def __init__(self, session_factory: Optional[Callable] = None):
+        self._session_factory = session_factory
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+    
+    def _session(self):
+        if self._session_factory is None:
+            from app.database import SessionLocal
+            self._session_factory = SessionLocal
+        return self._session_factory()
+    
+    def get(self, image_hash: str, key: str) -> Optional[Dict[str, Any]]:
+        """查询缓存，命中时更新命中次数"""
+        db = self._session()
+        try:
+            entry = db.query(AnalysisCache).filter(
+                AnalysisCache.image_hash == image_hash,
+                AnalysisCache.prompt_hash == key
+            ).first()
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            entry.hit_count = (entry.hit_count or 0) + 1
+            entry.last_hit_time = datetime.utcnow()
+            db.commit()
+            self.hits += 1
+            return entry.result
+        finally:
+            db.close()
+    
+    def set(self, image_hash: str, key: str, model: str, result: Dict[str, Any], replace: bool = False):
+        """写入缓存，并发写入同一键时保留已有记录；replace 为真时先删除旧记录（重新分析）"""
+        db = self._session()
+        try:
+            if replace:
+                db.query(AnalysisCache).filter(
+                    AnalysisCache.image_hash == image_hash,
+                    AnalysisCache.prompt_hash == key
+                ).delete(synchronize_session=False)
+            db.add(AnalysisCache(image_hash=image_hash, prompt_hash=key, model=model, result=result, hit_count=0))
+            db.commit()
+            self.stores += 1
+        except IntegrityError:
+            db.rollback()
+        finally:
+            db.close()
+    
+    async def lookup(self, image_hash: str, model: str, prompt: str, detail: str = "high") -> Optional[Dict[str, Any]]:
+        if not settings.analysis_cache_enabled:
+            return None
+        try:
+            return await asyncio.to_thread(self.get, image_hash, prompt_hash(model, prompt, detail))
+        except Exception as e:
+            print(f"⚠️ 查询分析缓存失败: {e}")
+            return None
+    
+    async def store(self, image_hash: str, model: str, prompt: str, result: Dict[str, Any], detail: str = "high",
+                    replace: bool = False):
+        if not settings.analysis_cache_enabled:
+            return
+        try:
+            await asyncio.to_thread(self.set, image_hash, prompt_hash(model, prompt, detail), model, result, replace)
+        except Exception as e:
+            print(f"⚠️ 写入分析缓存失败: {e}")
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": settings.analysis_cache_enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
+
+# 创建全局分析结果缓存实例
+analysis_cache = AnalysisResultCache()
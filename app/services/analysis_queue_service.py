@@ -0,0 +1,347 @@
+"""
+分析任务队列服务 - analysis_jobs 表持久化分析任务，进程重启或崩溃后任务不会丢失
+
+工作协程用 SELECT ... FOR UPDATE SKIP LOCKED 领取任务并写入租约到期时间，
+多个进程/节点可以同时消费同一队列；执行中定期续租，进程崩溃后租约过期的任务重新排队。
+失败的任务按指数退避重试，超过最大次数后任务和图片都标记为失败。
+"""
+import asyncio
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.models.image import Image, AnalysisJob
+from app.services.rate_limit_service import backoff_delay
+
+settings = get_settings()
+
+JOB_KINDS = ("analyze", "reanalyze", "batch")
+# batched: 已提交到离线批量API，等待结果导入
+ACTIVE_STATES = ("queued", "running", "batched")
+# 失败重试的初始退避和上限(秒)
+RETRY_BASE_SECONDS = 30.0
+RETRY_MAX_SECONDS = 900.0
+
+
+def _now() -> datetime:
+    return datetime.utcnow()
+
+
+async def run_analysis_job(kind: str, image_id: int, custom_prompt: Optional[str] = None) -> bool:
+    """执行一个分析任务，返回图片是否分析完成；图片已删除时视为完成"""
+    from app.database import SessionLocal
+    
+    db = SessionLocal()
+    try:
+        image = db.query(Image).filter(Image.id == image_id, Image.is_active == True).first()
+        file_path = image.file_path if image else None
+    finally:
+        db.close()
+    
+    if not file_path:
+        print(f"⏭️ 图片不存在或已删除，跳过分析任务 ID: {image_id}")
+        return True
+    
+    if kind == "batch":
+        from app.api.admin import _analyze_batch_image
+        await _analyze_batch_image(image_id, custom_prompt)
+    elif kind == "reanalyze":
+        from app.api.admin_images import reanalyze_image_task
+        await reanalyze_image_task(image_id, file_path, custom_prompt)
+    else:
+        from app.api.upload import process_image_with_gpt4o
+        await process_image_with_gpt4o(image_id, file_path, True)
+    
+    db = SessionLocal()
+    try:
+        status = db.query(Image.ai_analysis_status).filter(Image.id == image_id).scalar()
+        return status == 'completed'
+    finally:
+        db.close()
+
+
+class AnalysisQueue:
+    """分析任务队列 - 登记、领取、续租、完成/重试"""
+    
+    # 单条 IN 查询包含的最大图片数量
+    batch_size = 500
+    
+    def __init__(self, lease_seconds: int, max_attempts: int, poll_interval: float):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self._inflight: Dict[int, Dict[str, Any]] = {}
+        self.completed = 0
+        self.failed = 0
+        self.running = False
+    
+    def enqueue(self, db: Session, image_ids: Iterable[int], kind: str = "analyze",
+                custom_prompt: Optional[str] = None) -> int:
+        """登记分析任务并把图片状态置为 pending，返回新增的任务数量
+        
+        同一图片已有排队中的任务时只更新其类型和提示词；已有执行中或已提交离线批次的任务时跳过，
+        同一图片始终只有一个活动任务。
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"未知的分析任务类型: {kind}")
+        
+        image_ids = list(dict.fromkeys(image_ids))
+        now = _now()
+        active_ids = set()
+        for start in range(0, len(image_ids), self.batch_size):
+            chunk = image_ids[start:start + self.batch_size]
+            active = db.query(AnalysisJob).filter(
+                AnalysisJob.image_id.in_(chunk),
+                AnalysisJob.state.in_(ACTIVE_STATES)
+            ).all()
+            for job in active:
+                active_ids.add(job.image_id)
+                if job.state == "queued":
+                    job.kind = kind
+                    job.custom_prompt = custom_prompt
+            db.query(Image).filter(Image.id.in_(chunk)).update(
+                {"ai_analysis_status": "pending"},
+                synchronize_session=False
+            )
+        
+        new_ids = [image_id for image_id in image_ids if image_id not in active_ids]
+        db.add_all([
+            AnalysisJob(image_id=image_id, kind=kind, custom_prompt=custom_prompt,
+                        state="queued", attempts=0, available_at=now)
+            for image_id in new_ids
+        ])
+        db.commit()
+        return len(new_ids)
+    
+    def recover_pending(self, db: Session) -> int:
+        """为没有活动任务的 pending 图片补登任务（队列上线前或 BackgroundTasks 时代遗留的图片）"""
+        active = db.query(AnalysisJob.image_id).filter(AnalysisJob.state.in_(ACTIVE_STATES))
+        image_ids = [image_id for (image_id,) in db.query(Image.id).filter(
+            Image.is_active == True,
+            Image.ai_analysis_status == 'pending',
+            ~Image.id.in_(active)
+        )]
+        if image_ids:
+            self.enqueue(db, image_ids, "analyze")
+            print(f"🔁 为 {len(image_ids)} 张待分析图片补登分析任务")
+        return len(image_ids)
+    
+    def claim(self, db: Session, limit: int = 1) -> List[Dict[str, Any]]:
+        """领取可执行的任务: 行锁跳过其他进程已锁定的行，写入租约后提交"""
+        now = _now()
+        jobs = db.query(AnalysisJob).filter(
+            AnalysisJob.state == "queued",
+            AnalysisJob.available_at <= now
+        ).order_by(AnalysisJob.available_at, AnalysisJob.id).limit(limit).with_for_update(skip_locked=True).all()
+        
+        claimed = []
+        for job in jobs:
+            job.state = "running"
+            job.attempts += 1
+            job.worker_id = self.worker_id
+            job.lease_expires_at = now + timedelta(seconds=self.lease_seconds)
+            claimed.append({
+                "id": job.id,
+                "image_id": job.image_id,
+                "kind": job.kind,
+                "custom_prompt": job.custom_prompt,
+                "attempts": job.attempts
+            })
+        db.commit()
+        return claimed
+    
+    def renew(self, db: Session, job_ids: List[int]) -> int:
+        """为执行中的任务续租"""
+        if not job_ids:
+            return 0
+        count = db.query(AnalysisJob).filter(
+            AnalysisJob.id.in_(job_ids),
+            AnalysisJob.worker_id == self.worker_id,
+            AnalysisJob.state == "running"
+        ).update(
+            {"lease_expires_at": _now() + timedelta(seconds=self.lease_seconds)},
+            synchronize_session=False
+        )
+        db.commit()
+        return count
+    
+    def _retry_or_fail(self, db: Session, job: AnalysisJob, error: str, backoff: bool = True):
+        """未超过最大次数时重新排队（backoff 为真时按退避推迟），否则标记任务和图片为失败"""
+        job.last_error = error[:2000]
+        job.lease_expires_at = None
+        if job.attempts < self.max_attempts:
+            delay = backoff_delay(job.attempts - 1, base=RETRY_BASE_SECONDS, cap=RETRY_MAX_SECONDS) if backoff else 0.0
+            job.state = "queued"
+            job.available_at = _now() + timedelta(seconds=delay)
+            db.query(Image).filter(Image.id == job.image_id).update(
+                {"ai_analysis_status": "pending"}, synchronize_session=False
+            )
+        else:
+            job.state = "failed"
+            db.query(Image).filter(Image.id == job.image_id).update(
+                {"ai_analysis_status": "failed"}, synchronize_session=False
+            )
+    
+    def requeue_expired(self, db: Session) -> int:
+        """回收租约过期的任务（执行进程已崩溃或失联）"""
+        expired = db.query(AnalysisJob).filter(
+            AnalysisJob.state == "running",
+            AnalysisJob.lease_expires_at < _now()
+        ).with_for_update(skip_locked=True).all()
+        for job in expired:
+            print(f"⚠️ 分析任务租约过期 ID: {job.id}, 工作进程: {job.worker_id}")
+            # 进程崩溃不是任务本身的问题，立即重新排队，但仍计入执行次数
+            self._retry_or_fail(db, job, f"租约过期（工作进程 {job.worker_id}）", backoff=False)
+        db.commit()
+        return len(expired)
+    
+    def finish(self, db: Session, job_id: int, success: bool, error: Optional[str] = None) -> bool:
+        """记录任务结果；租约已被回收（其他进程接手）时忽略，返回是否写入"""
+        job = db.query(AnalysisJob).filter(
+            AnalysisJob.id == job_id,
+            AnalysisJob.worker_id == self.worker_id,
+            AnalysisJob.state == "running"
+        ).with_for_update().first()
+        if not job:
+            db.rollback()
+            return False
+        
+        if success:
+            job.state = "completed"
+            job.lease_expires_at = None
+            job.last_error = None
+        else:
+            self._retry_or_fail(db, job, error or "分析失败")
+        db.commit()
+        return True
+    
+    def release(self, db: Session, job_ids: List[int]) -> int:
+        """进程退出时把执行中的任务放回队列，不计入执行次数"""
+        if not job_ids:
+            return 0
+        count = db.query(AnalysisJob).filter(
+            AnalysisJob.id.in_(job_ids),
+            AnalysisJob.worker_id == self.worker_id,
+            AnalysisJob.state == "running"
+        ).update({
+            "state": "queued",
+            "attempts": AnalysisJob.attempts - 1,
+            "available_at": _now(),
+            "lease_expires_at": None
+        }, synchronize_session=False)
+        db.commit()
+        return count
+    
+    def counts(self, db: Session) -> Dict[str, int]:
+        """各状态的任务数量"""
+        rows = db.query(AnalysisJob.state, func.count(AnalysisJob.id)).group_by(AnalysisJob.state).all()
+        return {state: count for state, count in rows}
+    
+    @staticmethod
+    def _with_session(operation: Callable, *args):
+        """在独立会话中执行队列操作（在线程中调用）"""
+        from app.database import SessionLocal
+        
+        db = SessionLocal()
+        try:
+            return operation(db, *args)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    
+    async def _execute(self, job: Dict[str, Any]):
+        """执行一个已领取的任务并记录结果"""
+        self._inflight[job["id"]] = job
+        error = None
+        try:
+            success = await run_analysis_job(job["kind"], job["image_id"], job["custom_prompt"])
+            if not success:
+                error = "分析未完成"
+        except Exception as e:
+            success = False
+            error = str(e)
+        # 被取消时保留在执行中列表，由 run_worker 放回队列
+        self._inflight.pop(job["id"], None)
+        
+        await asyncio.to_thread(self._with_session, self.finish, job["id"], success, error)
+        if success:
+            self.completed += 1
+        else:
+            self.failed += 1
+            print(f"❌ 分析任务失败 ID: {job['id']}, 图片: {job['image_id']}, 第{job['attempts']}次: {error}")
+    
+    async def _worker_loop(self):
+        """单个工作协程: 逐个领取并执行任务，队列为空时轮询"""
+        while True:
+            try:
+                jobs = await asyncio.to_thread(self._with_session, self.claim, 1)
+            except Exception as e:
+                print(f"❌ 领取分析任务失败: {e}")
+                jobs = []
+            if not jobs:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            await self._execute(jobs[0])
+    
+    async def _maintain(self):
+        """定期为执行中的任务续租，并回收其他进程遗留的过期任务"""
+        while True:
+            await asyncio.sleep(max(1.0, self.lease_seconds / 3))
+            try:
+                await asyncio.to_thread(self._with_session, self.renew, list(self._inflight))
+                await asyncio.to_thread(self._with_session, self.requeue_expired)
+            except Exception as e:
+                print(f"❌ 维护分析任务租约失败: {e}")
+    
+    async def run_worker(self, concurrency: Optional[int] = None):
+        """运行工作进程: concurrency 个工作协程 + 租约维护，取消时把执行中的任务放回队列"""
+        concurrency = concurrency or settings.analysis_concurrency
+        try:
+            await asyncio.to_thread(self._with_session, self.requeue_expired)
+            await asyncio.to_thread(self._with_session, self.recover_pending)
+        except Exception as e:
+            print(f"❌ 恢复分析任务失败: {e}")
+        
+        print(f"🚀 分析队列工作进程启动: {self.worker_id}, 并发 {concurrency}")
+        self.running = True
+        tasks = [asyncio.create_task(self._worker_loop()) for _ in range(concurrency)]
+        tasks.append(asyncio.create_task(self._maintain()))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            self.running = False
+            for task in tasks:
+                task.cancel()
+            inflight = list(self._inflight)
+            if inflight:
+                try:
+                    self._with_session(self.release, inflight)
+                    print(f"↩️ 已将 {len(inflight)} 个执行中的分析任务放回队列")
+                except Exception as e:
+                    print(f"❌ 释放分析任务失败: {e}")
+                self._inflight.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "running": self.running,
+            "inflight": len(self._inflight),
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+
+# 创建全局分析任务队列实例
+analysis_queue = AnalysisQueue(
+    settings.analysis_job_lease_seconds,
+    settings.analysis_job_max_attempts,
+    settings.analysis_job_poll_interval
+)
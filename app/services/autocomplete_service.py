@@ -0,0 +1,119 @@
+"""
+搜索自动补全服务 - 内存前缀树，每个节点预存权重最高的补全词
+"""
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.models.image import Tag
+from app.services.query_parser_service import KEYWORD_MAPPINGS
+from app.services.query_expansion_service import normalize_query
+from app.services.popular_search_service import popular_searches
+
+
+class _TrieNode:
+    __slots__ = ("children", "top")
+    
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.top: List[str] = []
+
+
+class AutocompleteIndex:
+    """前缀补全索引: 标签名（按使用次数加权）、关键词映射、热门历史查询"""
+    
+    # 每个前缀保留的候选数量
+    top_k = 10
+    # 历史查询的最低热度（衰减后的搜索次数），避免偶然输入进入补全
+    min_query_count = 2
+    # 有新数据时最短的重建间隔(秒)
+    rebuild_interval = 30
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tag_weights: Dict[str, int] = {}
+        self._popular_version = -1
+        self._root: Optional[_TrieNode] = None
+        self._built_at = 0.0
+        self._dirty = True
+        self._rebuilding = False
+    
+    def load(self, db: Session) -> int:
+        """从标签表加载标签及使用次数并重建索引"""
+        try:
+            rows = db.query(Tag.name, Tag.usage_count).filter(Tag.is_active == True).all()
+        except SQLAlchemyError as e:
+            print(f"❌ 加载自动补全词典失败: {e}")
+            return 0
+        
+        with self._lock:
+            self._tag_weights = {name: usage_count or 0 for name, usage_count in rows}
+            self._dirty = True
+        self._rebuild()
+        print(f"✅ 自动补全索引构建完成: {len(self._tag_weights)} 个标签")
+        return len(rows)
+    
+    def add_tag(self, name: str):
+        """登记新建的标签"""
+        with self._lock:
+            if name not in self._tag_weights:
+                self._tag_weights[name] = 0
+                self._dirty = True
+    
+    def _weights(self) -> Dict[str, int]:
+        """合并各来源的补全词，同一个词取最大权重"""
+        weights: Dict[str, int] = dict(self._tag_weights)
+        for keyword, tags in KEYWORD_MAPPINGS.items():
+            weight = max((self._tag_weights.get(tag, 0) for tag in tags), default=0)
+            weights[keyword] = max(weights.get(keyword, 0), weight)
+        for query, count in popular_searches.top(popular_searches.snapshot_size):
+            if count >= self.min_query_count:
+                weights[query] = max(weights.get(query, 0), count)
+        return weights
+    
+    def _rebuild(self):
+        """按权重从高到低插入，每个节点的 top 列表天然有序"""
+        with self._lock:
+            self._popular_version = popular_searches.version
+            weights = self._weights()
+            self._dirty = False
+        
+        root = _TrieNode()
+        for term in sorted(weights, key=lambda t: (-weights[t], len(t), t)):
+            node = root
+            for char in normalize_query(term):
+                node = node.children.setdefault(char, _TrieNode())
+                if len(node.top) < self.top_k:
+                    node.top.append(term)
+        
+        self._root = root
+        self._built_at = time.monotonic()
+        self._rebuilding = False
+    
+    def _needs_rebuild(self) -> bool:
+        """标签或热门查询有变化，且距上次重建超过最短间隔"""
+        changed = self._dirty or self._popular_version != popular_searches.version
+        return changed and not self._rebuilding and time.monotonic() - self._built_at >= self.rebuild_interval
+    
+    def suggest(self, prefix: str, limit: int = 8) -> List[str]:
+        """返回以 prefix 开头、权重最高的补全词"""
+        if self._root is None:
+            self._rebuild()
+        elif self._needs_rebuild():
+            # 在后台线程重建，重建完成前继续使用旧索引
+            self._rebuilding = True
+            threading.Thread(target=self._rebuild, daemon=True).start()
+        
+        node = self._root
+        for char in normalize_query(prefix):
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return node.top[:limit] if node is not self._root else []
+
+
+# 创建全局自动补全索引实例
+autocomplete_index = AutocompleteIndex()
@@ -0,0 +1,501 @@
+"""
+离线批量分析 - 大批量重新分析时把视觉请求写成 JSONL 文件提交到 OpenAI 兼容的批量API
+
+流程: 登记批次(building) -> 预处理图片并写入请求文件、上传、创建批次(submitted)
+     -> 轮询批次状态 -> 下载结果文件并经过与在线分析相同的保存和标签处理路径导入(completed)
+
+批量API有独立的配额，回填大量图片时不占用在线分析的请求和token配额；命中分析缓存的图片直接导入，
+不写入请求文件。请求失败或批次过期的图片退回在线分析队列重试。
+"""
+import asyncio
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.models.image import Image, AnalysisJob, AnalysisBatch
+from app.services.ai_client_service import ai_client
+from app.services.analysis_cache_service import analysis_cache
+from app.services.gpt4o_service import gpt4o_analyzer, is_structured_analysis, SEARCH_PROMPT
+from app.services.storage_service import storage_manager
+
+settings = get_settings()
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# 批量API中表示批次已结束但未全部完成的状态
+REMOTE_FAILED_STATES = ("failed", "expired", "cancelled")
+
+
+def _now() -> datetime:
+    return datetime.utcnow()
+
+
+def custom_id_for(image_id: int) -> str:
+    return f"image-{image_id}"
+
+
+def parse_output_line(line: str) -> Tuple[str, Optional[str], Optional[str]]:
+    """解析结果文件或错误文件的一行，返回 (请求ID, 模型输出内容, 错误信息)"""
+    record = json.loads(line)
+    response = record.get("response") or {}
+    body = response.get("body") or {}
+    if response.get("status_code") == 200 and body.get("choices"):
+        return record["custom_id"], body["choices"][0]["message"]["content"], None
+    
+    error = record.get("error") or body.get("error") or f"HTTP {response.get('status_code')}"
+    return record["custom_id"], None, json.dumps(error, ensure_ascii=False) if isinstance(error, dict) else str(error)
+
+
+class BatchAnalysisService:
+    """离线批量分析的登记、提交、轮询和结果导入"""
+    
+    def __init__(self, max_requests: int, poll_interval: float, lease_seconds: int,
+                 session_factory: Optional[Callable] = None):
+        self.max_requests = max_requests
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._session_factory = session_factory
+        self.running = False
+        self.submitted = 0
+        self.ingested = 0
+        self.fallback = 0
+    
+    def _url(self, path: str) -> str:
+        base_url = settings.openai_batch_base_url or settings.openai_base_url
+        return f"{base_url.rstrip('/')}{path}"
+    
+    def _with_session(self, operation: Callable, *args):
+        """在独立会话中执行数据库操作（在线程中调用）"""
+        if self._session_factory is None:
+            from app.database import SessionLocal
+            self._session_factory = SessionLocal
+        
+        db = self._session_factory()
+        try:
+            return operation(db, *args)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    
+    def create(self, db: Session, image_ids: Iterable[int], custom_prompt: Optional[str] = None) -> List[int]:
+        """登记离线批次，按 max_requests 拆分，返回批次ID列表
+        
+        图片已排队的任务转入批次，执行中或已在其他批次中的图片跳过；图片状态置为 pending。
+        """
+        image_ids = list(dict.fromkeys(image_ids))
+        now = _now()
+        batch_ids = []
+        for start in range(0, len(image_ids), self.max_requests):
+            chunk = image_ids[start:start + self.max_requests]
+            jobs = db.query(AnalysisJob).filter(
+                AnalysisJob.image_id.in_(chunk),
+                AnalysisJob.state.in_(("queued", "running", "batched"))
+            ).all()
+            busy = {job.image_id for job in jobs if job.state != "queued"}
+            queued = {job.image_id: job for job in jobs if job.state == "queued"}
+            chunk = [image_id for image_id in chunk if image_id not in busy]
+            if not chunk:
+                continue
+            
+            for image_id in chunk:
+                job = queued.get(image_id)
+                if job is None:
+                    job = AnalysisJob(image_id=image_id, attempts=0, available_at=now)
+                    db.add(job)
+                job.kind = "batch"
+                job.custom_prompt = custom_prompt
+                job.state = "batched"
+            db.query(Image).filter(Image.id.in_(chunk)).update(
+                {"ai_analysis_status": "pending"},
+                synchronize_session=False
+            )
+            
+            batch = AnalysisBatch(state="building", custom_prompt=custom_prompt, image_ids=chunk,
+                                  request_count=0, cached_count=0, succeeded_count=0, failed_count=0)
+            db.add(batch)
+            db.flush()
+            batch_ids.append(batch.id)
+        db.commit()
+        return batch_ids
+    
+    def _claim(self, db: Session, from_state: str, to_state: str, batch_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """用条件更新领取批次并写入租约，多个进程同时轮询时只有一个能领取成功"""
+        query = db.query(AnalysisBatch).filter(AnalysisBatch.state == from_state)
+        if batch_id is not None:
+            query = query.filter(AnalysisBatch.id == batch_id)
+        batch = query.order_by(AnalysisBatch.id).first()
+        if batch is None:
+            return None
+        
+        claimed = db.query(AnalysisBatch).filter(
+            AnalysisBatch.id == batch.id,
+            AnalysisBatch.state == from_state
+        ).update({
+            "state": to_state,
+            "lease_expires_at": _now() + timedelta(seconds=self.lease_seconds)
+        }, synchronize_session=False)
+        db.commit()
+        if not claimed:
+            return None
+        
+        db.refresh(batch)
+        return {
+            "id": batch.id,
+            "image_ids": list(batch.image_ids or []),
+            "custom_prompt": batch.custom_prompt,
+            "remote_batch_id": batch.remote_batch_id,
+            "items": dict(batch.items or {})
+        }
+    
+    def claim_building(self, db: Session) -> Optional[Dict[str, Any]]:
+        return self._claim(db, "building", "uploading")
+    
+    def claim_ingesting(self, db: Session, batch_id: int) -> Optional[Dict[str, Any]]:
+        return self._claim(db, "submitted", "ingesting", batch_id)
+    
+    def renew(self, db: Session, batch_id: int, state: str) -> bool:
+        """为构建或导入中的批次续租，返回批次是否仍由本进程持有"""
+        count = db.query(AnalysisBatch).filter(
+            AnalysisBatch.id == batch_id,
+            AnalysisBatch.state == state
+        ).update(
+            {"lease_expires_at": _now() + timedelta(seconds=self.lease_seconds)},
+            synchronize_session=False
+        )
+        db.commit()
+        return bool(count)
+    
+    async def _keep_lease(self, batch_id: int, state: str):
+        """预处理上百张图片、上传或导入结果期间定期续租，避免租约到期后被其他进程重复领取"""
+        while True:
+            await asyncio.sleep(max(1.0, self.lease_seconds / 3))
+            try:
+                if not await asyncio.to_thread(self._with_session, self.renew, batch_id, state):
+                    print(f"⚠️ 离线批次 {batch_id} 已不在 {state} 状态，停止续租")
+                    return
+            except Exception as e:
+                print(f"⚠️ 离线批次 {batch_id} 续租失败: {e}")
+    
+    def recover_expired(self, db: Session) -> int:
+        """构建或导入过程中进程退出的批次，租约到期后放回上一状态"""
+        now = _now()
+        recovered = 0
+        for from_state, to_state in (("uploading", "building"), ("ingesting", "submitted")):
+            recovered += db.query(AnalysisBatch).filter(
+                AnalysisBatch.state == from_state,
+                AnalysisBatch.lease_expires_at < now
+            ).update({"state": to_state, "lease_expires_at": None}, synchronize_session=False)
+        db.commit()
+        return recovered
+    
+    def submitted_batches(self, db: Session) -> List[Dict[str, Any]]:
+        rows = db.query(AnalysisBatch.id, AnalysisBatch.remote_batch_id).filter(
+            AnalysisBatch.state == "submitted"
+        ).order_by(AnalysisBatch.id).all()
+        return [{"id": batch_id, "remote_batch_id": remote_id} for batch_id, remote_id in rows]
+    
+    def load_images(self, db: Session, image_ids: List[int]) -> List[Tuple[int, str]]:
+        return db.query(Image.id, Image.file_path).filter(
+            Image.id.in_(image_ids),
+            Image.is_active == True
+        ).all()
+    
+    def update_batch(self, db: Session, batch_id: int, values: Dict[str, Any]):
+        db.query(AnalysisBatch).filter(AnalysisBatch.id == batch_id).update(values, synchronize_session=False)
+        db.commit()
+    
+    def finish_jobs(self, db: Session, image_ids: List[int], success: bool, error: Optional[str] = None) -> int:
+        """结束批次中仍处于 batched 状态的任务；失败的任务退回在线队列"""
+        if not image_ids:
+            return 0
+        if success:
+            values = {"state": "completed", "last_error": None}
+        else:
+            values = {"state": "queued", "available_at": _now(), "last_error": error}
+        updated = db.query(AnalysisJob).filter(
+            AnalysisJob.image_id.in_(image_ids),
+            AnalysisJob.state == "batched"
+        ).update(values, synchronize_session=False)
+        db.commit()
+        return updated
+    
+    def pending_image_ids(self, db: Session, image_ids: List[int]) -> List[int]:
+        """批次中仍在等待结果的图片"""
+        return [image_id for (image_id,) in db.query(AnalysisJob.image_id).filter(
+            AnalysisJob.image_id.in_(image_ids),
+            AnalysisJob.state == "batched"
+        )]
+    
+    async def _ingest_one(self, image_id: int, analysis: Dict[str, Any], custom_prompt: Optional[str],
+                          image_tokens: Optional[int] = None) -> bool:
+        """经过与在线批量分析相同的保存和标签处理路径写入结果"""
+        from app.api.admin import _analyze_batch_image
+        
+        success = await _analyze_batch_image(image_id, custom_prompt, {
+            "success": True,
+            "analysis": analysis,
+            "image_tokens": image_tokens
+        })
+        await asyncio.to_thread(self._with_session, self.finish_jobs, [image_id], success,
+                                None if success else "保存批量分析结果失败")
+        return success
+    
+    async def build_and_submit(self, batch: Dict[str, Any]):
+        """预处理图片并写入 JSONL 请求文件，上传后创建批次"""
+        batch_id = batch["id"]
+        prompt = batch["custom_prompt"] or SEARCH_PROMPT
+        images = await asyncio.to_thread(self._with_session, self.load_images, batch["image_ids"])
+        
+        # 图片已删除的任务直接结束
+        missing = set(batch["image_ids"]) - {image_id for image_id, _ in images}
+        await asyncio.to_thread(self._with_session, self.finish_jobs, list(missing), True)
+        
+        # 请求ID -> 归一化图片哈希、detail 和预估图片token
+        items: Dict[str, Dict[str, Any]] = {}
+        cached = 0
+        renewer = asyncio.create_task(self._keep_lease(batch_id, "uploading"))
+        fd, path = tempfile.mkstemp(prefix=f"analysis_batch_{batch_id}_", suffix=".jsonl")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for image_id, file_path in images:
+                    try:
+                        image = await gpt4o_analyzer._prepare_image_for_gpt4o(
+                            storage_manager.get_image_url(file_path)
+                        )
+                    except Exception as e:
+                        await asyncio.to_thread(self._with_session, self.finish_jobs, [image_id], False,
+                                                f"图片预处理失败: {e}")
+                        self.fallback += 1
+                        continue
+                    
+                    hit = await analysis_cache.lookup(image.sha256, gpt4o_analyzer.model, prompt, image.detail)
+                    if hit is not None:
+                        await self._ingest_one(image_id, hit, batch["custom_prompt"], image.tokens)
+                        cached += 1
+                        continue
+                    
+                    custom_id = custom_id_for(image_id)
+                    request = {
+                        "custom_id": custom_id,
+                        "method": "POST",
+                        "url": BATCH_ENDPOINT,
+                        "body": gpt4o_analyzer._build_vision_payload(image.data, prompt, image.detail)
+                    }
+                    f.write(json.dumps(request, ensure_ascii=False).encode("utf-8") + b"\n")
+                    items[custom_id] = {"sha256": image.sha256, "detail": image.detail, "tokens": image.tokens}
+            
+            values: Dict[str, Any] = {"items": items, "request_count": len(items), "cached_count": cached}
+            if not items:
+                values.update({"state": "completed", "completed_at": _now(), "lease_expires_at": None})
+                await asyncio.to_thread(self._with_session, self.update_batch, batch_id, values)
+                print(f"✅ 离线批次 {batch_id} 全部命中缓存，无需提交")
+                return
+            
+            client = ai_client.client
+            with open(path, "rb") as f:
+                response = await client.post(
+                    self._url("/files"),
+                    data={"purpose": "batch"},
+                    files={"file": (os.path.basename(path), f, "application/jsonl")},
+                    timeout=httpx.Timeout(300.0, connect=settings.openai_connect_timeout)
+                )
+            if response.status_code != 200:
+                raise Exception(f"上传批量请求文件失败: {response.status_code} - {response.text}")
+            input_file_id = response.json()["id"]
+            
+            response = await client.post(self._url("/batches"), json={
+                "input_file_id": input_file_id,
+                "endpoint": BATCH_ENDPOINT,
+                "completion_window": settings.openai_batch_completion_window,
+                "metadata": {"analysis_batch_id": str(batch_id)}
+            })
+            if response.status_code != 200:
+                raise Exception(f"创建批次失败: {response.status_code} - {response.text}")
+            remote = response.json()
+            
+            values.update({
+                "state": "submitted",
+                "input_file_id": input_file_id,
+                "remote_batch_id": remote["id"],
+                "remote_status": remote.get("status"),
+                "submitted_at": _now(),
+                "lease_expires_at": None
+            })
+            await asyncio.to_thread(self._with_session, self.update_batch, batch_id, values)
+            self.submitted += 1
+            print(f"📦 离线批次 {batch_id} 已提交: {remote['id']}，{len(items)} 个请求，{cached} 张命中缓存")
+        except Exception as e:
+            print(f"❌ 离线批次 {batch_id} 提交失败，退回在线队列: {e}")
+            await self._fail_batch(batch_id, batch["image_ids"], str(e))
+        finally:
+            renewer.cancel()
+            os.unlink(path)
+    
+    async def _fail_batch(self, batch_id: int, image_ids: List[int], error: str):
+        """批次失败: 仍在等待的图片退回在线分析队列"""
+        fallback = await asyncio.to_thread(self._with_session, self.finish_jobs, image_ids, False, error)
+        self.fallback += fallback
+        await asyncio.to_thread(self._with_session, self.update_batch, batch_id, {
+            "state": "failed",
+            "last_error": error,
+            "failed_count": fallback,
+            "completed_at": _now(),
+            "lease_expires_at": None
+        })
+    
+    async def _ingest_file(self, file_id: str, items: Dict[str, Dict[str, Any]], prompt: str,
+                           custom_prompt: Optional[str]) -> Tuple[int, int]:
+        """流式读取结果文件逐行导入，返回 (成功数, 失败数)"""
+        succeeded = failed = 0
+        async with ai_client.client.stream("GET", self._url(f"/files/{file_id}/content"),
+                                           timeout=httpx.Timeout(300.0, connect=settings.openai_connect_timeout)) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise Exception(f"下载结果文件失败: {response.status_code} - {response.text}")
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                custom_id, content, error = parse_output_line(line)
+                image_id = int(custom_id.rsplit("-", 1)[1])
+                if content is None:
+                    await asyncio.to_thread(self._with_session, self.finish_jobs, [image_id], False,
+                                            f"批量请求失败: {error}")
+                    failed += 1
+                    continue
+                
+                analysis = await gpt4o_analyzer._parse_and_validate_result(content)
+                item = items.get(custom_id) or {}
+                if item and is_structured_analysis(analysis):
+                    await analysis_cache.store(item["sha256"], gpt4o_analyzer.model, prompt, analysis, item["detail"])
+                if await self._ingest_one(image_id, analysis, custom_prompt, item.get("tokens")):
+                    succeeded += 1
+                else:
+                    failed += 1
+        return succeeded, failed
+    
+    async def poll(self, batch_id: int, remote_batch_id: str):
+        """查询批次状态，结束后导入结果"""
+        response = await ai_client.client.get(self._url(f"/batches/{remote_batch_id}"))
+        if response.status_code != 200:
+            raise Exception(f"查询批次失败: {response.status_code} - {response.text}")
+        remote = response.json()
+        status = remote.get("status")
+        
+        if status != "completed" and status not in REMOTE_FAILED_STATES:
+            await asyncio.to_thread(self._with_session, self.update_batch, batch_id, {"remote_status": status})
+            return
+        
+        batch = await asyncio.to_thread(self._with_session, self.claim_ingesting, batch_id)
+        if batch is None:
+            return
+        
+        prompt = batch["custom_prompt"] or SEARCH_PROMPT
+        succeeded = failed = 0
+        error = None
+        renewer = asyncio.create_task(self._keep_lease(batch_id, "ingesting"))
+        try:
+            for file_id in (remote.get("output_file_id"), remote.get("error_file_id")):
+                if file_id:
+                    ok, bad = await self._ingest_file(file_id, batch["items"], prompt, batch["custom_prompt"])
+                    succeeded += ok
+                    failed += bad
+        except Exception as e:
+            error = str(e)
+            print(f"❌ 导入离线批次 {batch_id} 结果失败: {e}")
+        finally:
+            renewer.cancel()
+        
+        # 结果文件中缺失的请求退回在线队列
+        remaining = await asyncio.to_thread(self._with_session, self.pending_image_ids, batch["image_ids"])
+        if remaining:
+            error = error or f"批次状态 {status}，{len(remaining)} 个请求没有结果"
+            await asyncio.to_thread(self._with_session, self.finish_jobs, remaining, False, error)
+        failed += len(remaining)
+        
+        self.ingested += succeeded
+        self.fallback += failed
+        await asyncio.to_thread(self._with_session, self.update_batch, batch_id, {
+            "state": "completed" if status == "completed" else "failed",
+            "remote_status": status,
+            "output_file_id": remote.get("output_file_id"),
+            "error_file_id": remote.get("error_file_id"),
+            "succeeded_count": succeeded,
+            "failed_count": failed,
+            "last_error": error,
+            "completed_at": _now(),
+            "lease_expires_at": None
+        })
+        print(f"✅ 离线批次 {batch_id} 导入完成: 成功 {succeeded}，退回在线队列 {failed}")
+    
+    async def run_once(self) -> bool:
+        """处理一个待构建批次并轮询所有已提交批次，返回是否有待处理的批次"""
+        await asyncio.to_thread(self._with_session, self.recover_expired)
+        
+        batch = await asyncio.to_thread(self._with_session, self.claim_building)
+        if batch is not None:
+            await self.build_and_submit(batch)
+        
+        submitted = await asyncio.to_thread(self._with_session, self.submitted_batches)
+        for item in submitted:
+            try:
+                await self.poll(item["id"], item["remote_batch_id"])
+            except Exception as e:
+                print(f"⚠️ 轮询离线批次 {item['id']} 失败: {e}")
+        return batch is not None
+    
+    async def run_poller(self):
+        """后台循环: 构建并提交新批次，轮询已提交批次（应用或分析工作进程中运行）"""
+        self.running = True
+        try:
+            while True:
+                try:
+                    # 刚提交过批次时立即检查是否还有待构建的批次
+                    if await self.run_once():
+                        continue
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"❌ 离线批量分析轮询失败: {e}")
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            self.running = False
+    
+    def list_batches(self, db: Session, limit: int = 20) -> List[Dict[str, Any]]:
+        batches = db.query(AnalysisBatch).order_by(AnalysisBatch.id.desc()).limit(limit).all()
+        return [{
+            "id": batch.id,
+            "state": batch.state,
+            "remote_batch_id": batch.remote_batch_id,
+            "remote_status": batch.remote_status,
+            "images": len(batch.image_ids or []),
+            "requests": batch.request_count,
+            "cached": batch.cached_count,
+            "succeeded": batch.succeeded_count,
+            "failed": batch.failed_count,
+            "last_error": batch.last_error,
+            "submitted_at": batch.submitted_at.isoformat() if batch.submitted_at else None,
+            "completed_at": batch.completed_at.isoformat() if batch.completed_at else None
+        } for batch in batches]
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "submitted": self.submitted,
+            "ingested": self.ingested,
+            "fallback": self.fallback
+        }
+
+
+# 创建全局离线批量分析实例
+batch_analysis = BatchAnalysisService(
+    max_requests=settings.analysis_batch_max_requests,
+    poll_interval=settings.analysis_batch_poll_interval,
+    lease_seconds=settings.analysis_job_lease_seconds
+)
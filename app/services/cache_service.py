@@ -0,0 +1,183 @@
+"""
+缓存服务 - 进程内LRU缓存 + 可选Redis二级缓存
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import get_settings
+
+settings = get_settings()
+
+_redis_client = None
+_redis_checked = False
+_sync_redis_client = None
+_sync_redis_checked = False
+
+
+def get_redis():
+    """获取共享的Redis异步客户端，未启用或不可用时返回 None"""
+    global _redis_client, _redis_checked
+    
+    if _redis_checked:
+        return _redis_client
+    _redis_checked = True
+    
+    if not settings.enable_redis_cache:
+        return None
+    
+    try:
+        import redis.asyncio as redis_asyncio
+        _redis_client = redis_asyncio.from_url(settings.redis_url, decode_responses=True)
+        print(f"✅ 已启用Redis缓存: {settings.redis_url}")
+    except Exception as e:
+        print(f"⚠️ Redis缓存初始化失败，仅使用内存缓存: {e}")
+        _redis_client = None
+    return _redis_client
+
+
+def get_sync_redis():
+    """获取同步Redis客户端（短超时），用于必须在返回前完成的少量写入，未启用或不可用时返回 None"""
+    global _sync_redis_client, _sync_redis_checked
+    
+    if _sync_redis_checked:
+        return _sync_redis_client
+    _sync_redis_checked = True
+    
+    if not settings.enable_redis_cache:
+        return None
+    
+    try:
+        import redis
+        _sync_redis_client = redis.from_url(settings.redis_url, decode_responses=True,
+                                            socket_timeout=1, socket_connect_timeout=1)
+    except Exception as e:
+        print(f"⚠️ 同步Redis客户端初始化失败: {e}")
+        _sync_redis_client = None
+    return _sync_redis_client
+
+
+class LRUCache:
+    """带过期时间的线程安全LRU缓存"""
+    
+    def __init__(self, max_size: int = 1000, ttl: int = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        with self._lock:
+            self._data[key] = (time.time() + (ttl or self.ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+    
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def ttl_remaining(self, key: str) -> float:
+        """剩余有效时间（秒），不存在时为 0"""
+        with self._lock:
+            item = self._data.get(key)
+            return max(0.0, item[0] - time.time()) if item else 0.0
+    
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+class CacheService:
+    """两级缓存: 先查进程内LRU，再查Redis（启用时），值以JSON存储"""
+    
+    def __init__(self, namespace: str, max_size: int = 1000, ttl: Optional[int] = None):
+        self.namespace = namespace
+        self.ttl = ttl or settings.cache_ttl
+        self.local = LRUCache(max_size=max_size, ttl=self.ttl)
+    
+    def _redis_key(self, key: str) -> str:
+        return f"ai-pose-gallery:{self.namespace}:{key}"
+    
+    async def get(self, key: str) -> Optional[Any]:
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        
+        redis_client = get_redis()
+        if redis_client is None:
+            return None
+        
+        try:
+            raw = await redis_client.get(self._redis_key(key))
+            if raw is None:
+                return None
+            value = json.loads(raw)
+            remaining = await redis_client.ttl(self._redis_key(key))
+            self.local.set(key, value, remaining if remaining and remaining > 0 else None)
+            return value
+        except Exception as e:
+            print(f"⚠️ 读取Redis缓存失败 {self.namespace}: {e}")
+            return None
+    
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        ttl = ttl or self.ttl
+        self.local.set(key, value, ttl)
+        
+        redis_client = get_redis()
+        if redis_client is None:
+            return
+        
+        try:
+            await redis_client.set(self._redis_key(key), json.dumps(value, ensure_ascii=False), ex=ttl)
+        except Exception as e:
+            print(f"⚠️ 写入Redis缓存失败 {self.namespace}: {e}")
+    
+    async def delete(self, key: str):
+        self.local.delete(key)
+        
+        redis_client = get_redis()
+        if redis_client is None:
+            return
+        
+        try:
+            await redis_client.delete(self._redis_key(key))
+        except Exception as e:
+            print(f"⚠️ 删除Redis缓存失败 {self.namespace}: {e}")
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "namespace": self.namespace,
+            "ttl": self.ttl,
+            "redis_enabled": get_redis() is not None,
+            "local": self.local.stats()
+        }
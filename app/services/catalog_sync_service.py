@@ -0,0 +1,216 @@
+"""
+图库变更同步服务 - 多进程部署时同步各进程的内存索引
+
+标签倒排索引、查询解析词典、自动补全、颜色索引和相似图片的标签数组都保存在进程内存中。
+本进程的写入在事务提交后直接更新这些索引；独立的分析工作进程和 uvicorn 其他 worker 的写入
+通过 catalog_changes 表传递: 写入方在同一事务中登记变化的图片ID，各进程轮询新增的变更，
+从数据库重新读取这些图片的标签和调色板。
+"""
+import asyncio
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.models.image import Image, Tag, ImageTag, CatalogChange
+from app.services.tag_index_service import tag_index
+from app.services.query_parser_service import query_parser
+from app.services.autocomplete_service import autocomplete_index
+from app.services.color_palette_service import color_index
+from app.services.similar_image_service import similar_images
+from app.services.vector_index_service import vector_index
+from app.services.response_cache_service import response_cache
+
+settings = get_settings()
+
+# 会话 info 中暂存本事务内发生变化的图片ID
+PENDING_KEY = "catalog_changes_pending"
+# 清理过期变更日志的间隔(秒)
+PRUNE_INTERVAL = 600.0
+
+
+class CatalogSync:
+    """图库变更日志: 登记变化的图片，轮询其他进程的变更并应用到本进程的内存索引"""
+    
+    # 单条 IN 查询包含的最大图片数量
+    batch_size = 500
+    
+    def __init__(self, poll_interval: float, gap_seconds: int, retention: int):
+        self.poll_interval = poll_interval
+        self.gap_seconds = gap_seconds
+        self.retention = retention
+        # 已应用的最大变更ID；None 表示尚未初始化
+        self._cursor: Optional[int] = None
+        # 小于游标但尚未出现的变更ID（事务未提交）-> 放弃等待的时间
+        self._gaps: Dict[int, float] = {}
+        self._pruned_at = 0.0
+        self.applied_images = 0
+        self.running = False
+    
+    @property
+    def origin(self) -> str:
+        """当前进程标识，uvicorn 多 worker 时每个进程不同"""
+        return f"{socket.gethostname()}-{os.getpid()}"
+    
+    def record(self, db: Session, image_id: int):
+        """登记图片的标签或调色板发生变化，提交时与改动一起写入变更日志"""
+        db.info.setdefault(PENDING_KEY, set()).add(image_id)
+    
+    def write_pending(self, db: Session):
+        """提交前写入变更日志"""
+        image_ids = db.info.pop(PENDING_KEY, None)
+        if image_ids:
+            origin = self.origin
+            db.add_all([CatalogChange(image_id=image_id, origin=origin) for image_id in sorted(image_ids)])
+    
+    def start(self, db: Session) -> int:
+        """加载内存索引之前调用: 记录当前游标，之后只需应用新的变更"""
+        self._cursor = db.query(func.max(CatalogChange.id)).scalar() or 0
+        self._gaps.clear()
+        return self._cursor
+    
+    def _fetch(self, db: Session) -> List[Tuple[int, int, str]]:
+        """读取游标之后的变更，以及之前空洞中已经提交的变更"""
+        columns = (CatalogChange.id, CatalogChange.image_id, CatalogChange.origin)
+        rows = db.query(*columns).filter(CatalogChange.id > self._cursor).order_by(CatalogChange.id).all()
+        gap_ids = sorted(self._gaps)
+        for start in range(0, len(gap_ids), self.batch_size):
+            rows.extend(db.query(*columns).filter(
+                CatalogChange.id.in_(gap_ids[start:start + self.batch_size])
+            ).all())
+        return rows
+    
+    def apply(self, db: Session, image_ids: Set[int], foreign: bool = True) -> int:
+        """从数据库重新读取图片的标签和调色板，更新本进程的内存索引"""
+        ids = sorted(image_ids)
+        tags: Dict[int, Set[str]] = {image_id: set() for image_id in ids}
+        categories: Dict[str, str] = {}
+        palettes: Dict[int, bytes] = {}
+        for start in range(0, len(ids), self.batch_size):
+            chunk = ids[start:start + self.batch_size]
+            rows = db.query(ImageTag.image_id, Tag.name, Tag.category).join(
+                Tag, ImageTag.tag_id == Tag.id
+            ).filter(ImageTag.image_id.in_(chunk)).all()
+            for image_id, tag_name, category in rows:
+                tags[image_id].add(tag_name)
+                categories[tag_name] = category
+            palettes.update(db.query(Image.id, Image.color_palette).filter(
+                Image.id.in_(chunk),
+                Image.is_active == True,
+                Image.color_palette != None
+            ).all())
+        
+        for image_id, tag_names in tags.items():
+            tag_index.replace(image_id, tag_names)
+        tag_index.set_categories(categories)
+        query_parser.add_tags(categories)
+        for tag_name in categories:
+            autocomplete_index.add_tag(tag_name)
+        for image_id, packed in palettes.items():
+            color_index.add(image_id, packed)
+        similar_images.mark_stale(ids)
+        vector_index.refresh()
+        # 本进程的写入在提交时已使响应缓存失效
+        if foreign:
+            response_cache.version.bump_local()
+        
+        self.applied_images += len(ids)
+        return len(ids)
+    
+    def sync(self, db: Session) -> int:
+        """应用新提交的变更，返回重新加载的图片数量"""
+        if self._cursor is None:
+            self.start(db)
+            return 0
+        
+        rows = self._fetch(db)
+        now = time.monotonic()
+        # 本进程的变更也重新读取: 与轮询并发提交的写入可能被较早读到的数据覆盖
+        image_ids = {image_id for _, image_id, _ in rows}
+        foreign = any(origin != self.origin for _, _, origin in rows)
+        if image_ids:
+            self.apply(db, image_ids, foreign)
+        
+        # 应用成功后再推进游标；自增ID跳过的部分可能属于尚未提交的事务，等待 gap_seconds
+        seen = {change_id for change_id, _, _ in rows}
+        newest = max((change_id for change_id in seen if change_id > self._cursor), default=self._cursor)
+        for change_id in range(self._cursor + 1, newest):
+            if change_id not in seen:
+                self._gaps[change_id] = now + self.gap_seconds
+        self._cursor = newest
+        self._gaps = {change_id: deadline for change_id, deadline in self._gaps.items()
+                      if change_id not in seen and deadline > now}
+        
+        if now - self._pruned_at > PRUNE_INTERVAL:
+            self._pruned_at = now
+            self.prune(db)
+        return len(image_ids)
+    
+    def prune(self, db: Session) -> int:
+        """删除超过保留时长的变更日志"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.retention)
+        count = db.query(CatalogChange).filter(
+            CatalogChange.created_time < cutoff
+        ).delete(synchronize_session=False)
+        db.commit()
+        return count
+    
+    @staticmethod
+    def _with_session(operation):
+        """在独立会话中执行同步（在线程中调用）"""
+        from app.database import SessionLocal
+        
+        db = SessionLocal()
+        try:
+            return operation(db)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    
+    async def run_watcher(self):
+        """定时同步其他进程的图库变更，在应用生命周期内运行"""
+        self.running = True
+        try:
+            while True:
+                await asyncio.sleep(self.poll_interval)
+                try:
+                    await asyncio.to_thread(self._with_session, self.sync)
+                except Exception as e:
+                    print(f"❌ 同步图库变更失败: {e}")
+        finally:
+            self.running = False
+    
+    def stats(self) -> Dict[str, object]:
+        return {
+            "running": self.running,
+            "cursor": self._cursor,
+            "pending_gaps": len(self._gaps),
+            "applied_images": self.applied_images
+        }
+
+
+# 创建全局图库变更同步实例
+catalog_sync = CatalogSync(
+    settings.catalog_sync_interval,
+    settings.catalog_sync_gap_seconds,
+    settings.catalog_change_retention
+)
+
+
+@event.listens_for(Session, "before_commit")
+def _write_pending_changes(session: Session):
+    catalog_sync.write_pending(session)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_pending_changes(session: Session, transaction):
+    # 回滚或未提交就关闭的事务丢弃暂存的变更
+    if transaction.parent is None:
+        session.info.pop(PENDING_KEY, None)
@@ -0,0 +1,262 @@
+"""
+主色调服务 - 缩略图上用 k-means 提取 Lab 调色板，打包保存，内存矩阵一次计算全库颜色距离
+
+每个颜色打包为4字节 (L, a+128, b+128, 占比)，5色调色板共20字节，保存在 images.color_palette。
+"""
+import io
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image as PILImage
+from sqlalchemy.orm import Session
+
+from app.models.image import Image
+from app.services.ranking_service import top_k_indices
+
+# 调色板颜色数量和提取时的缩略图边长
+PALETTE_SIZE = 5
+THUMBNAIL_SIZE = 64
+# 占比低于该值的颜色不生成颜色标签
+COLOR_TAG_MIN_WEIGHT = 0.2
+# 颜色占比不足时的距离惩罚（Lab ΔE），占满画面的颜色不受惩罚
+COVERAGE_PENALTY = 25.0
+
+# 颜色标签及其代表色（按颜色名搜索时使用），与 PREDEFINED_TAGS 中的颜色分类一致
+COLOR_NAMES = {
+    "红色": "#d32f2f",
+    "橙色": "#f57c00",
+    "黄色": "#fbc02d",
+    "绿色": "#388e3c",
+    "青色": "#0097a7",
+    "蓝色": "#2a5bd7",
+    "紫色": "#7b1fa2",
+    "粉色": "#f48fb1",
+    "棕色": "#795548",
+    "黑色": "#121212",
+    "白色": "#f5f5f5",
+    "灰色": "#9e9e9e",
+}
+
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """sRGB (0-255, 形状 (..., 3)) 转 CIE Lab (D65)"""
+    srgb = np.asarray(rgb, dtype=np.float64) / 255.0
+    linear = np.where(srgb > 0.04045, ((srgb + 0.055) / 1.055) ** 2.4, srgb / 12.92)
+    xyz = linear @ np.array([
+        [0.4124564, 0.2126729, 0.0193339],
+        [0.3575761, 0.7151522, 0.1191920],
+        [0.1804375, 0.0721750, 0.9503041],
+    ])
+    xyz /= np.array([0.95047, 1.0, 1.08883])
+    
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([
+        116 * f[..., 1] - 16,
+        500 * (f[..., 0] - f[..., 1]),
+        200 * (f[..., 1] - f[..., 2]),
+    ], axis=-1)
+
+
+def parse_color(value: str) -> np.ndarray:
+    """解析颜色名称或 #RRGGBB，返回 Lab"""
+    value = value.strip()
+    hex_value = COLOR_NAMES.get(value, value).lstrip("#")
+    if len(hex_value) != 6:
+        raise ValueError(f"无法识别的颜色: {value}")
+    try:
+        rgb = [int(hex_value[i:i + 2], 16) for i in (0, 2, 4)]
+    except ValueError:
+        raise ValueError(f"无法识别的颜色: {value}")
+    return rgb_to_lab(np.array(rgb))
+
+
+def _kmeans(pixels: np.ndarray, k: int, iterations: int = 12) -> Tuple[np.ndarray, np.ndarray]:
+    """k-means++ 初始化的 k-means，固定随机种子保证同一图片结果一致"""
+    rng = np.random.default_rng(0)
+    centers = [pixels[rng.integers(len(pixels))]]
+    for _ in range(1, k):
+        distances = np.min(((pixels[:, None, :] - np.array(centers)[None]) ** 2).sum(axis=2), axis=1)
+        if distances.sum() == 0:
+            break
+        centers.append(pixels[rng.choice(len(pixels), p=distances / distances.sum())])
+    centers = np.array(centers)
+    
+    for _ in range(iterations):
+        labels = ((pixels[:, None, :] - centers[None]) ** 2).sum(axis=2).argmin(axis=1)
+        updated = np.array([pixels[labels == i].mean(axis=0) if np.any(labels == i) else centers[i]
+                            for i in range(len(centers))])
+        if np.allclose(updated, centers, atol=0.5):
+            centers = updated
+            break
+        centers = updated
+    
+    labels = ((pixels[:, None, :] - centers[None]) ** 2).sum(axis=2).argmin(axis=1)
+    weights = np.bincount(labels, minlength=len(centers)) / len(pixels)
+    return centers, weights
+
+
+def extract_palette(img: PILImage.Image, k: int = PALETTE_SIZE) -> List[Tuple[Tuple[float, float, float], float]]:
+    """提取主色调，返回按占比降序的 [((L, a, b), 占比)]"""
+    thumbnail = img.copy()
+    thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    thumbnail = thumbnail.convert("RGB")
+    pixels = rgb_to_lab(np.asarray(thumbnail).reshape(-1, 3))
+    
+    centers, weights = _kmeans(pixels, min(k, len(pixels)))
+    order = np.argsort(-weights)
+    return [(tuple(float(v) for v in centers[i]), float(weights[i])) for i in order if weights[i] > 0]
+
+
+def pack_palette(palette: Sequence[Tuple[Tuple[float, float, float], float]]) -> bytes:
+    """打包为每色4字节: L*2.55, a+128, b+128, 占比*255"""
+    packed = bytearray()
+    for (l_value, a_value, b_value), weight in palette[:PALETTE_SIZE]:
+        packed += bytes([
+            int(np.clip(round(l_value * 2.55), 0, 255)),
+            int(np.clip(round(a_value + 128), 0, 255)),
+            int(np.clip(round(b_value + 128), 0, 255)),
+            int(np.clip(round(weight * 255), 0, 255)),
+        ])
+    return bytes(packed)
+
+
+def unpack_palette(packed: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """解包为 (Lab 数组 (n, 3), 占比数组 (n,))"""
+    values = np.frombuffer(packed, dtype=np.uint8).reshape(-1, 4).astype(np.float32)
+    labs = np.stack([values[:, 0] / 2.55, values[:, 1] - 128, values[:, 2] - 128], axis=1)
+    return labs, values[:, 3] / 255.0
+
+
+def palette_file(file_path: str) -> Optional[bytes]:
+    """由本地文件提取并打包调色板"""
+    try:
+        with PILImage.open(file_path) as img:
+            # JPEG 解码时直接按比例降采样，避免解码整张大图
+            img.draft("RGB", (THUMBNAIL_SIZE * 4, THUMBNAIL_SIZE * 4))
+            return pack_palette(extract_palette(img))
+    except Exception as e:
+        print(f"⚠️ 提取主色调失败 {file_path}: {e}")
+        return None
+
+
+def palette_bytes(content: bytes) -> Optional[bytes]:
+    """由图片内容提取并打包调色板"""
+    try:
+        with PILImage.open(io.BytesIO(content)) as img:
+            img.draft("RGB", (THUMBNAIL_SIZE * 4, THUMBNAIL_SIZE * 4))
+            return pack_palette(extract_palette(img))
+    except Exception as e:
+        print(f"⚠️ 提取主色调失败: {e}")
+        return None
+
+
+def color_name(lab: Sequence[float]) -> str:
+    """按 LCh 色相和明度把 Lab 颜色归入颜色标签（欧氏距离在蓝紫、橙黄之间容易误判）"""
+    lightness, a_value, b_value = (float(v) for v in lab)
+    chroma = np.hypot(a_value, b_value)
+    if chroma < 12:
+        if lightness < 25:
+            return "黑色"
+        return "白色" if lightness > 85 else "灰色"
+    
+    hue = np.degrees(np.arctan2(b_value, a_value)) % 360
+    if hue < 55 or hue >= 345:
+        return "粉色" if lightness >= 70 else "红色"
+    if hue < 85:
+        return "棕色" if lightness < 50 else "橙色"
+    if hue < 115:
+        return "棕色" if lightness < 40 else "黄色"
+    if hue < 170:
+        return "绿色"
+    if hue < 240:
+        return "青色"
+    if hue < 312:
+        return "蓝色"
+    return "粉色" if lightness >= 70 else "紫色"
+
+
+def color_tag_names(packed: bytes) -> List[Tuple[str, float]]:
+    """占比足够的主色调归入颜色标签，同名颜色占比累加，返回 [(标签名, 占比)]"""
+    labs, weights = unpack_palette(packed)
+    
+    tags: Dict[str, float] = {}
+    for lab, weight in zip(labs, weights):
+        if weight < COLOR_TAG_MIN_WEIGHT:
+            continue
+        name = color_name(lab)
+        tags[name] = tags.get(name, 0.0) + float(weight)
+    return sorted(tags.items(), key=lambda item: -item[1])
+
+
+class ColorIndex:
+    """颜色检索索引 - 全库调色板保存在 (N, K, 3) 矩阵中，一次广播计算全部距离"""
+    
+    def __init__(self):
+        self._palettes: Dict[int, bytes] = {}
+        self._lock = threading.Lock()
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._labs = np.zeros((0, PALETTE_SIZE, 3), dtype=np.float32)
+        self._weights = np.zeros((0, PALETTE_SIZE), dtype=np.float32)
+        self._stale = False
+        self.loaded = False
+    
+    @property
+    def size(self) -> int:
+        return len(self._palettes)
+    
+    def load(self, db: Session) -> int:
+        """从数据库加载全部有效图片的调色板"""
+        rows = db.query(Image.id, Image.color_palette).filter(
+            Image.is_active == True,
+            Image.color_palette != None
+        ).all()
+        with self._lock:
+            self._palettes = {image_id: bytes(packed) for image_id, packed in rows if packed}
+            self._stale = True
+            self.loaded = True
+        print(f"✅ 颜色索引加载完成: {len(self._palettes)} 张图片")
+        return len(self._palettes)
+    
+    def add(self, image_id: int, packed: Optional[bytes]):
+        """写入或更新单张图片的调色板"""
+        if not packed:
+            return
+        with self._lock:
+            self._palettes[image_id] = bytes(packed)
+            self._stale = True
+    
+    def _matrices(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """索引变化后重新拼装矩阵，短调色板用占比0补齐"""
+        with self._lock:
+            if self._stale:
+                ids = np.fromiter(self._palettes.keys(), dtype=np.int64, count=len(self._palettes))
+                labs = np.zeros((len(ids), PALETTE_SIZE, 3), dtype=np.float32)
+                weights = np.zeros((len(ids), PALETTE_SIZE), dtype=np.float32)
+                for row, packed in enumerate(self._palettes.values()):
+                    palette_labs, palette_weights = unpack_palette(packed)
+                    labs[row, :len(palette_labs)] = palette_labs
+                    weights[row, :len(palette_weights)] = palette_weights
+                self._ids, self._labs, self._weights = ids, labs, weights
+                self._stale = False
+            return self._ids, self._labs, self._weights
+    
+    def search(self, colors: Sequence[str], k: int) -> List[Tuple[int, float]]:
+        """按颜色检索: 每个查询色取调色板中 ΔE + 占比惩罚 最小的颜色，多个查询色取平均，距离升序"""
+        queries = np.array([parse_color(color) for color in colors], dtype=np.float32)
+        ids, labs, weights = self._matrices()
+        if len(ids) == 0 or k <= 0:
+            return []
+        
+        # (N, K, Q): 每张图片每个主色与每个查询色的距离
+        distances = np.linalg.norm(labs[:, :, None, :] - queries[None, None, :, :], axis=3)
+        distances += COVERAGE_PENALTY * (1.0 - weights)[:, :, None]
+        distances[weights == 0] = np.inf
+        scores = distances.min(axis=1).mean(axis=1)
+        
+        top = top_k_indices(-scores, k)
+        return [(int(ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+
+# 创建全局颜色索引实例
+color_index = ColorIndex()
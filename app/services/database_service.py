@@ -1,11 +1,18 @@
 """
 数据库服务工具类 - 修复版本
 """
-from typing import List, Optional
+from typing import Dict, List, Optional
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy import and_, or_
-from app.models.image import Image, Tag, ImageTag
+from app.models.image import Image, Tag, ImageTag, TagCategory
+from app.services.tag_index_service import tag_index
+from app.services.response_cache_service import response_cache
+from app.services.query_parser_service import query_parser
+from app.services.autocomplete_service import autocomplete_index
+from app.services.similar_image_service import similar_images
+from app.services.color_palette_service import color_index, color_tag_names
+from app.services.catalog_sync_service import catalog_sync
 import traceback
 
 
@@ -22,6 +29,7 @@ class DatabaseService:
         self.db.add(image)
         self.db.commit()
         self.db.refresh(image)
+        response_cache.invalidate()
         return image
     
     def get_image_by_id(self, image_id: int, include_deleted: bool = False) -> Optional[Image]:
@@ -75,6 +83,9 @@ class DatabaseService:
                 self.db.add(tag)
                 self.db.commit()
                 self.db.refresh(tag)
+                query_parser.add_tags([tag.name])
+                autocomplete_index.add_tag(tag.name)
+                tag_index.set_categories({tag.name: tag.category})
             return tag
         except SQLAlchemyError as e:
             print(f"❌ 获取或创建标签失败 {name}: {e}")
@@ -118,8 +129,9 @@ class DatabaseService:
             return []
     
     # 图片标签关联操作
-    def add_tags_to_image(self, image_id: int, tag_names: List[str], source: str = "ai", confidences: List[float] = None):
-        """为图片添加标签 - 原版本"""
+    def add_tags_to_image(self, image_id: int, tag_names: List[str], source: str = "ai", confidences: List[float] = None,
+                          category: str = "auto"):
+        """为图片添加标签 - 原版本，新建标签归入 category 分类"""
         try:
             if confidences is None:
                 confidences = [1.0] * len(tag_names)
@@ -128,9 +140,10 @@ class DatabaseService:
             if len(confidences) != len(tag_names):
                 confidences = [1.0] * len(tag_names)
             
+            added_names = []
             for i, tag_name in enumerate(tag_names):
                 # 获取或创建标签（这里需要指定分类，实际使用时需要AI分析）
-                tag = self.get_or_create_tag(tag_name, "auto", f"AI生成的标签: {tag_name}")
+                tag = self.get_or_create_tag(tag_name, category, f"AI生成的标签: {tag_name}")
                 
                 # 检查是否已存在关联
                 existing = self.db.query(ImageTag).filter(
@@ -148,8 +161,15 @@ class DatabaseService:
                     
                     # 更新标签使用次数
                     tag.usage_count += 1
+                    added_names.append(tag.name)
             
+            tag_index.stage(self.db, "add", image_id, added_names)
+            if added_names:
+                catalog_sync.record(self.db, image_id)
             self.db.commit()
+            if added_names:
+                similar_images.mark_dirty(image_id)
+                response_cache.invalidate()
         except SQLAlchemyError as e:
             print(f"❌ 添加标签到图片失败 ID {image_id}: {e}")
             self.db.rollback()
@@ -185,6 +205,9 @@ class DatabaseService:
                     
                     # 更新标签使用次数
                     tag.usage_count += 1
+                    tag_index.stage(self.db, "add", image_id, [tag.name])
+                    catalog_sync.record(self.db, image_id)
+                    similar_images.mark_dirty(image_id)
                     
                     print(f"✅ 添加标签: {tag_name}")
                 else:
@@ -197,6 +220,22 @@ class DatabaseService:
         
         # 在调用方处理 commit，这里不自动提交
     
+    def apply_color_palette(self, image_id: int, palette: Optional[bytes]):
+        """登记图片调色板: 写入颜色索引并添加颜色分类标签"""
+        if not palette:
+            return
+        color_index.add(image_id, palette)
+        catalog_sync.record(self.db, image_id)
+        color_tags = color_tag_names(palette)
+        if color_tags:
+            self.add_tags_to_image(
+                image_id,
+                [name for name, _ in color_tags],
+                "palette",
+                [round(weight, 2) for _, weight in color_tags],
+                category=TagCategory.COLOR
+            )
+    
     def get_image_tags(self, image_id: int) -> List[Tag]:
         """获取图片的标签 - 增强错误处理"""
         try:
@@ -230,6 +269,28 @@ class DatabaseService:
             print(f"详细错误: {traceback.format_exc()}")
             return []
     
+    def get_tags_for_images(self, image_ids: List[int]) -> Dict[int, List[Tag]]:
+        """批量获取多张图片的标签 - 单次查询，避免列表页逐行查询"""
+        tags_map: Dict[int, List[Tag]] = {image_id: [] for image_id in image_ids}
+        if not tags_map:
+            return tags_map
+
+        try:
+            rows = self.db.query(ImageTag.image_id, Tag).join(
+                Tag, ImageTag.tag_id == Tag.id
+            ).filter(
+                ImageTag.image_id.in_(list(tags_map.keys()))
+            ).order_by(ImageTag.image_id, ImageTag.id).all()
+
+            for image_id, tag in rows:
+                tags_map[image_id].append(tag)
+
+            return tags_map
+
+        except SQLAlchemyError as e:
+            print(f"❌ 批量获取图片标签失败 ({len(tags_map)} 张图片): {e}")
+            return tags_map
+
     def remove_tag_from_image(self, image_id: int, tag_id: int):
         """从图片移除标签"""
         try:
@@ -245,7 +306,48 @@ class DatabaseService:
                 if tag and tag.usage_count > 0:
                     tag.usage_count -= 1
                 
+                if tag:
+                    tag_index.stage(self.db, "discard", image_id, [tag.name])
+                catalog_sync.record(self.db, image_id)
                 self.db.commit()
+                similar_images.mark_dirty(image_id)
+                response_cache.invalidate()
         except SQLAlchemyError as e:
             print(f"❌ 移除图片标签失败 Image ID {image_id}, Tag ID {tag_id}: {e}")
-            self.db.rollback()
\ No newline at end of file
+            self.db.rollback()
+    
+    def clear_image_tags(self, image_id: int, keep_palette: bool = True) -> int:
+        """
+        删除图片的标签关联（由调用方提交事务，提交后同步标签索引）
+        默认保留调色板生成的颜色标签: 颜色来自像素而非AI分析，重新分析后不会再写入
+        """
+        query = self.db.query(ImageTag.id, Tag.name).join(Tag, ImageTag.tag_id == Tag.id).filter(
+            ImageTag.image_id == image_id
+        )
+        if keep_palette:
+            query = query.filter(or_(ImageTag.source.is_(None), ImageTag.source != "palette"))
+        rows = query.all()
+        
+        if rows:
+            self.db.query(ImageTag).filter(
+                ImageTag.id.in_([image_tag_id for image_tag_id, _ in rows])
+            ).delete(synchronize_session=False)
+        tag_index.stage(self.db, "discard", image_id, [tag_name for _, tag_name in rows])
+        catalog_sync.record(self.db, image_id)
+        similar_images.mark_dirty(image_id)
+        return len(rows)
+    
+    def remove_tag_name_from_image(self, image_id: int, tag_name: str) -> int:
+        """按标签名删除图片的标签关联（由调用方提交事务）"""
+        deleted_count = self.db.query(ImageTag).filter(
+            and_(
+                ImageTag.image_id == image_id,
+                ImageTag.tag_id.in_(
+                    self.db.query(Tag.id).filter(Tag.name == tag_name)
+                )
+            )
+        ).delete(synchronize_session=False)
+        tag_index.stage(self.db, "discard", image_id, [tag_name])
+        catalog_sync.record(self.db, image_id)
+        similar_images.mark_dirty(image_id)
+        return deleted_count
@@ -0,0 +1,80 @@
+"""
+分面统计服务 - 统计结果集中每个分类下各标签的图片数量
+"""
+from collections import defaultdict
+from typing import Dict, List
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.models.image import Tag, ImageTag
+from app.services.tag_index_service import tag_index
+
+
+class FacetService:
+    """分面统计: 优先使用内存标签索引，开销与结果集大小成正比"""
+    
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def compute(self, image_ids: List[int]) -> Dict[str, Dict[str, int]]:
+        """返回 分类 -> 标签 -> 图片数，标签按数量从高到低排列"""
+        if not image_ids:
+            return {}
+        
+        if tag_index.loaded:
+            counts = self._count_from_index(image_ids)
+        else:
+            counts = self._count_from_database(image_ids)
+        
+        return {
+            category: dict(sorted(tags.items(), key=lambda item: (-item[1], item[0])))
+            for category, tags in sorted(counts.items())
+        }
+    
+    def _count_from_index(self, image_ids: List[int]) -> Dict[str, Dict[str, int]]:
+        """遍历结果集中每张图片的标签计数"""
+        tag_counts: Dict[str, int] = defaultdict(int)
+        for image_id in set(image_ids):
+            for tag_name in tag_index.tags_of(image_id):
+                tag_counts[tag_name] += 1
+        
+        categories = tag_index.categories_of(tag_counts)
+        missing = [name for name in tag_counts if name not in categories]
+        if missing:
+            categories.update(self._load_categories(missing))
+        
+        counts: Dict[str, Dict[str, int]] = defaultdict(dict)
+        for tag_name, count in tag_counts.items():
+            counts[categories.get(tag_name, "auto")][tag_name] = count
+        return counts
+    
+    def _load_categories(self, tag_names: List[str]) -> Dict[str, str]:
+        """从数据库补齐索引中缺失的标签分类"""
+        try:
+            categories = dict(self.db.query(Tag.name, Tag.category).filter(Tag.name.in_(tag_names)).all())
+        except SQLAlchemyError as e:
+            print(f"⚠️ 获取标签分类失败: {e}")
+            return {}
+        tag_index.set_categories(categories)
+        return categories
+    
+    def _count_from_database(self, image_ids: List[int]) -> Dict[str, Dict[str, int]]:
+        """索引未加载时用一条分组查询统计"""
+        counts: Dict[str, Dict[str, int]] = defaultdict(dict)
+        try:
+            rows = self.db.query(
+                Tag.category, Tag.name, func.count(func.distinct(ImageTag.image_id))
+            ).join(
+                ImageTag, ImageTag.tag_id == Tag.id
+            ).filter(
+                ImageTag.image_id.in_(set(image_ids))
+            ).group_by(Tag.category, Tag.name).all()
+        except SQLAlchemyError as e:
+            print(f"❌ 分面统计失败: {e}")
+            return counts
+        
+        for category, tag_name, count in rows:
+            counts[category][tag_name] = count
+        return counts
@@ -0,0 +1,131 @@
+"""
+全文检索服务 - MySQL FULLTEXT (ngram) 检索，未建索引或单字查询时回退到 LIKE
+"""
+import re
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import or_, true, text, literal_column
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.models.image import Image
+
+
+# 全文索引定义: 名称 -> 列（由 migrations/add_fulltext_indexes.py 创建）
+FULLTEXT_INDEXES: Dict[str, Tuple[str, ...]] = {
+    "ft_images_description": ("ai_description", "ai_keywords_text"),
+    "ft_images_style": ("ai_style",),
+    "ft_images_mood": ("ai_mood",),
+}
+
+# ngram 分词长度（MySQL ngram_token_size 默认值）
+# 全文索引只收录该长度的词元，单个汉字等更短的查询词无法命中，改走 LIKE 条件
+NGRAM_TOKEN_SIZE = 2
+
+# BOOLEAN MODE 中的特殊字符
+_BOOLEAN_OPERATORS = re.compile(r'[+\-<>()~*"@]+')
+
+# 已存在的全文索引缓存
+_available_indexes: Optional[Set[str]] = None
+_checked_at: float = 0.0
+_CHECK_INTERVAL = 300
+
+
+class FullTextSearchService:
+    """全文检索服务类"""
+    
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def available_indexes(self) -> Set[str]:
+        """查询已创建的全文索引（带缓存）"""
+        global _available_indexes, _checked_at
+        
+        if _available_indexes is not None and time.time() - _checked_at < _CHECK_INTERVAL:
+            return _available_indexes
+        
+        indexes: Set[str] = set()
+        if self.db.get_bind().dialect.name == "mysql":
+            try:
+                rows = self.db.execute(text("""
+                    SELECT DISTINCT INDEX_NAME
+                    FROM INFORMATION_SCHEMA.STATISTICS
+                    WHERE TABLE_SCHEMA = DATABASE()
+                    AND TABLE_NAME = 'images'
+                    AND INDEX_TYPE = 'FULLTEXT'
+                """)).fetchall()
+                indexes = {row[0] for row in rows}
+            except SQLAlchemyError as e:
+                print(f"⚠️ 检查全文索引失败，使用LIKE检索: {e}")
+        
+        _available_indexes = indexes
+        _checked_at = time.time()
+        return indexes
+    
+    def is_available(self, index_name: str) -> bool:
+        """指定全文索引是否可用"""
+        return index_name in self.available_indexes()
+    
+    @staticmethod
+    def build_boolean_query(terms: List[str]) -> str:
+        """将关键词构造成 BOOLEAN MODE 查询，每个词按短语匹配"""
+        phrases = []
+        for term in terms:
+            cleaned = _BOOLEAN_OPERATORS.sub(" ", term or "").strip()
+            if cleaned:
+                phrases.append(f'"{cleaned}"')
+        return " ".join(dict.fromkeys(phrases))
+    
+    @staticmethod
+    def build_natural_query(query: str) -> str:
+        """清理自然语言查询中的操作符"""
+        return _BOOLEAN_OPERATORS.sub(" ", query or "").strip()
+    
+    def relevance(self, index_name: str, terms: List[str], natural: bool = False):
+        """返回 MATCH ... AGAINST 相关度表达式，索引不可用或无有效关键词时返回 None"""
+        if not self.is_available(index_name):
+            return None
+        
+        against = self.build_natural_query(" ".join(terms)) if natural else self.build_boolean_query(terms)
+        if not against:
+            return None
+        
+        columns = [literal_column(f"images.{column}") for column in FULLTEXT_INDEXES[index_name]]
+        expression = match(*columns, against=against)
+        return expression.in_natural_language_mode() if natural else expression.in_boolean_mode()
+    
+    def search_condition(self, index_name: str, terms: List[str], natural: bool = False):
+        """
+        返回 (过滤条件, 相关度表达式)
+        全文索引可用时使用 MATCH，否则回退到原有的 LIKE 条件，相关度为 None；
+        短于 NGRAM_TOKEN_SIZE 的查询词始终使用 LIKE 条件
+        """
+        terms = [term for term in terms if term]
+        if not terms:
+            return true(), None
+        
+        short_terms = [term for term in terms if len(self.build_natural_query(term)) < NGRAM_TOKEN_SIZE]
+        ngram_terms = [term for term in terms if term not in short_terms]
+        relevance = self.relevance(index_name, ngram_terms, natural) if ngram_terms else None
+        if relevance is None:
+            return self.like_condition(index_name, terms), None
+        if short_terms:
+            return or_(relevance, self.like_condition(index_name, short_terms)), relevance
+        return relevance, relevance
+    
+    @staticmethod
+    def like_condition(index_name: str, terms: List[str]):
+        """全文索引对应列上的 LIKE 条件"""
+        if index_name == "ft_images_style":
+            conditions = [Image.ai_style.contains(term) for term in terms]
+        elif index_name == "ft_images_mood":
+            conditions = [Image.ai_mood.contains(term) for term in terms]
+        else:
+            conditions = []
+            for term in terms:
+                conditions.append(Image.ai_description.contains(term))
+                conditions.append(Image.ai_searchable_keywords.contains(f'"{term}"'))
+        
+        return or_(*conditions)
@@ -1,63 +1,38 @@
 """
 GPT-4o 图像分析服务
 """
-import base64
-import httpx
 import json
 import asyncio
 from typing import List, Dict, Any, Optional
-from PIL import Image
-import io
 from pathlib import Path
 
 from app.config import get_settings
+from app.services.ai_client_service import ai_client
+from app.services.analysis_cache_service import analysis_cache
+from app.services.image_preprocess_service import image_preprocessor, PreparedImage
 
 settings = get_settings()
 
 
-class GPT4oImageAnalyzer:
-    """GPT-4o 图像分析器"""
-    
-    def __init__(self):
-        self.client = httpx.AsyncClient(timeout=settings.image_analysis_timeout)
-        self.model = settings.openai_model
-        
-    async def analyze_image_comprehensive(self, image_path: str, user_query: str = None) -> Dict[str, Any]:
-        """
-        使用GPT-4o进行全面的图像分析
-        支持自定义查询需求
-        """
-        try:
-            # 准备图像数据
-            image_data = await self._prepare_image_for_gpt4o(image_path)
-            
-            # 构建分析提示词
-            prompt = self._build_analysis_prompt(user_query)
-            
-            # 调用GPT-4o API
-            result = await self._call_gpt4o_vision_api(image_data, prompt)
-            
-            # 解析和验证结果
-            parsed_result = await self._parse_and_validate_result(result)
-            
-            return {
-                "success": True,
-                "analysis": parsed_result,
-                "model": self.model,
-                "image_path": image_path
-            }
-            
-        except Exception as e:
-            print(f"❌ GPT-4o分析失败: {e}")
-            return {
-                "success": False,
-                "error": str(e),
-                "fallback_analysis": await self._get_fallback_analysis(image_path)
-            }
-    
-    async def analyze_for_search(self, image_path: str) -> Dict[str, Any]:
-        """专门为搜索优化的图像分析"""
-        search_prompt = """请作为专业的图像标注专家，详细分析这张图片，重点关注以下方面：
+def estimate_tokens(prompt: str, image_tokens: int = 0) -> int:
+    """预估一次调用的token用量（中文按每字一个token保守估计），用于令牌桶预留
+
+    image_tokens 为尺寸策略按切片规则预估的图片token。
+    """
+    return len(prompt) + settings.openai_max_tokens + image_tokens
+
+
+def is_structured_analysis(result: Optional[Dict[str, Any]]) -> bool:
+    """模型输出是否为含描述和分类标签的JSON；只有这样的结果才写入分析缓存，文本兜底结果不缓存"""
+    return (
+        isinstance(result, dict)
+        and isinstance(result.get("description"), str)
+        and isinstance(result.get("tags"), dict)
+    )
+
+
+# 搜索标注使用的默认提示词（在线分析和离线批量分析共用）
+SEARCH_PROMPT = """请作为专业的图像标注专家，详细分析这张图片，重点关注以下方面：
 
 1. **人物特征**：
    - 性别、年龄段
@@ -107,7 +82,75 @@ class GPT4oImageAnalyzer:
 
 确保标签准确、具体，便于后续搜索匹配。"""
 
-        return await self.analyze_image_comprehensive(image_path, search_prompt)
+
+class GPT4oImageAnalyzer:
+    """GPT-4o 图像分析器"""
+    
+    def __init__(self):
+        self.model = settings.openai_model
+        
+    async def analyze_image_comprehensive(self, image_path: str, user_query: str = None,
+                                          use_cache: bool = True) -> Dict[str, Any]:
+        """
+        使用GPT-4o进行全面的图像分析
+        支持自定义查询需求；use_cache 为假时不复用分析缓存，并用新结果覆盖缓存
+        """
+        try:
+            # 准备图像数据（按尺寸策略决定分辨率和 detail）
+            image = await self._prepare_image_for_gpt4o(image_path)
+            
+            # 构建分析提示词
+            prompt = self._build_analysis_prompt(user_query)
+            
+            # 相同图片内容和提示词已分析过时直接复用结果（管理员重新分析时跳过）
+            cached = await analysis_cache.lookup(image.sha256, self.model, prompt, image.detail) if use_cache else None
+            if cached is not None:
+                print(f"♻️ 命中分析缓存: {image.sha256[:12]}")
+                return {
+                    "success": True,
+                    "analysis": cached,
+                    "model": self.model,
+                    "image_path": image_path,
+                    "image_tokens": image.tokens,
+                    "cached": True
+                }
+            
+            # 调用GPT-4o API
+            result = await self._call_gpt4o_vision_api(image, prompt)
+            
+            # 解析和验证结果，只缓存按要求返回的JSON，重新分析时覆盖已有缓存
+            parsed_result = self._parse_json_result(result)
+            if is_structured_analysis(parsed_result):
+                await analysis_cache.store(image.sha256, self.model, prompt, parsed_result, image.detail,
+                                           replace=not use_cache)
+            elif parsed_result is None:
+                parsed_result = self._text_analysis(result)
+            
+            return {
+                "success": True,
+                "analysis": parsed_result,
+                "model": self.model,
+                "image_path": image_path,
+                "image_tokens": image.tokens,
+                "cached": False
+            }
+            
+        except Exception as e:
+            print(f"❌ GPT-4o分析失败: {e}")
+            return {
+                "success": False,
+                "error": str(e),
+                "fallback_analysis": await self._get_fallback_analysis(image_path)
+            }
+    
+    async def analyze_for_search(self, image_path: str, use_cache: bool = True) -> Dict[str, Any]:
+        """专门为搜索优化的图像分析"""
+        return await self.analyze_image_comprehensive(image_path, SEARCH_PROMPT, use_cache)
+    
+    async def analyze_with_custom_prompt(self, image_path: str, custom_prompt: str,
+                                         use_cache: bool = True) -> Dict[str, Any]:
+        """使用自定义提示词分析图片"""
+        return await self.analyze_image_comprehensive(image_path, custom_prompt, use_cache)
     
     async def search_similar_images(self, query: str, image_descriptions: List[str]) -> Dict[str, Any]:
         """使用GPT-4o进行语义相似度匹配"""
@@ -172,26 +215,19 @@ class GPT4oImageAnalyzer:
             print(f"❌ 查询增强失败: {e}")
             return {"enhanced_query": user_query}
     
-    async def _prepare_image_for_gpt4o(self, image_path: str) -> str:
-        """为GPT-4o准备图像数据"""
+    async def _prepare_image_for_gpt4o(self, image_path: str, policy: Optional[str] = None) -> PreparedImage:
+        """为GPT-4o准备图像数据（在预处理进程池中解码、缩放和编码）
+        
+        policy 默认取 VISION_SIZING_POLICY: fixed 为长边2048、detail=high；budget 按切片预算自适应；low 为512、detail=low
+        """
         try:
-            with Image.open(image_path) as img:
-                # 转换为RGB
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # 优化尺寸 - GPT-4o支持更大的图片
-                max_size = 2048  # GPT-4o支持更高分辨率
-                if img.width > max_size or img.height > max_size:
-                    img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-                
-                # 转换为base64
-                buffer = io.BytesIO()
-                img.save(buffer, format='JPEG', quality=90, optimize=True)
-                image_bytes = buffer.getvalue()
-                
-                return base64.b64encode(image_bytes).decode('utf-8')
-                
+            return await image_preprocessor.prepare(
+                image_path,
+                max_size=2048,
+                quality=90,
+                policy=policy or settings.vision_sizing_policy,
+                max_tiles=settings.vision_max_tiles
+            )
         except Exception as e:
             print(f"❌ 图片预处理失败: {e}")
             raise
@@ -212,14 +248,9 @@ class GPT4oImageAnalyzer:
 
 请提供详细、准确的描述，并生成便于搜索的标签。以JSON格式返回结果。"""
     
-    async def _call_gpt4o_vision_api(self, image_data: str, prompt: str) -> str:
-        """调用GPT-4o Vision API"""
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {settings.openai_api_key}"
-        }
-        
-        payload = {
+    def _build_vision_payload(self, image_data: str, prompt: str, detail: str = "high") -> Dict[str, Any]:
+        """构建视觉分析请求体（在线调用和离线批量文件共用）"""
+        return {
             "model": self.model,
             "messages": [
                 {
@@ -230,7 +261,7 @@ class GPT4oImageAnalyzer:
                             "type": "image_url",
                             "image_url": {
                                 "url": f"data:image/jpeg;base64,{image_data}",
-                                "detail": "high"  # 使用高质量分析
+                                "detail": detail
                             }
                         }
                     ]
@@ -239,11 +270,15 @@ class GPT4oImageAnalyzer:
             "max_tokens": settings.openai_max_tokens,
             "temperature": settings.openai_temperature
         }
+    
+    async def _call_gpt4o_vision_api(self, image: PreparedImage, prompt: str) -> str:
+        """调用GPT-4o Vision API"""
+        payload = self._build_vision_payload(image.data, prompt, image.detail)
         
-        response = await self.client.post(
-            f"{settings.openai_base_url}/chat/completions",
-            headers=headers,
-            json=payload
+        response = await ai_client.chat_completion(
+            payload,
+            settings.image_analysis_timeout,
+            estimate_tokens(prompt, image.tokens)
         )
         
         if response.status_code == 200:
@@ -254,11 +289,6 @@ class GPT4oImageAnalyzer:
     
     async def _call_gpt4o_text_api(self, prompt: str) -> str:
         """调用GPT-4o Text API"""
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {settings.openai_api_key}"
-        }
-        
         payload = {
             "model": self.model,
             "messages": [{"role": "user", "content": prompt}],
@@ -266,10 +296,10 @@ class GPT4oImageAnalyzer:
             "temperature": settings.openai_temperature
         }
         
-        response = await self.client.post(
-            f"{settings.openai_base_url}/chat/completions",
-            headers=headers,
-            json=payload
+        response = await ai_client.chat_completion(
+            payload,
+            settings.openai_text_timeout,
+            estimate_tokens(prompt)
         )
         
         if response.status_code == 200:
@@ -280,27 +310,36 @@ class GPT4oImageAnalyzer:
     
     async def _parse_and_validate_result(self, result: str) -> Dict[str, Any]:
         """解析和验证GPT-4o返回结果"""
+        parsed = self._parse_json_result(result)
+        if parsed is not None:
+            return parsed
+        
+        # 如果解析失败，返回文本分析结果
+        return self._text_analysis(result)
+    
+    def _parse_json_result(self, result: str) -> Optional[Dict[str, Any]]:
+        """解析GPT-4o返回的JSON，无法解析时返回 None"""
         try:
             # 尝试直接解析JSON
-            parsed = json.loads(result)
-            return parsed
+            return json.loads(result)
         except json.JSONDecodeError:
             # 如果不是JSON，尝试提取JSON部分
             import re
             json_match = re.search(r'\{.*\}', result, re.DOTALL)
             if json_match:
                 try:
-                    parsed = json.loads(json_match.group())
-                    return parsed
+                    return json.loads(json_match.group())
                 except:
                     pass
-            
-            # 如果解析失败，返回文本分析结果
-            return {
-                "description": result,
-                "tags": self._extract_tags_from_text(result),
-                "confidence": 0.7
-            }
+            return None
+    
+    def _text_analysis(self, result: str) -> Dict[str, Any]:
+        """非JSON输出的文本分析结果"""
+        return {
+            "description": result,
+            "tags": self._extract_tags_from_text(result),
+            "confidence": 0.7
+        }
     
     def _extract_tags_from_text(self, text: str) -> Dict[str, List[str]]:
         """从文本中提取标签"""
@@ -332,10 +371,6 @@ class GPT4oImageAnalyzer:
             },
             "confidence": 0.3
         }
-    
-    async def close(self):
-        """关闭HTTP客户端"""
-        await self.client.aclose()
 
 
 # 创建全局GPT-4o服务实例
@@ -0,0 +1,262 @@
+"""
+图片预处理服务 - 解码、缩放、JPEG重编码和base64在进程池中执行，不阻塞 uvicorn 事件循环
+
+JPEG 用 Image.draft() 在 DCT 域按 1/2、1/4、1/8 直接降采样解码，大照片无需解码全尺寸；
+解码后的像素数和原始字节数都有上限，同时处理的图片数量不超过进程数，内存占用有界。
+每个阶段（下载、读取、解码、缩放、编码）分别计时。
+
+视觉调用的输出尺寸和 detail 由尺寸策略决定（plan_vision_size），按 OpenAI 的切片规则预估图片token。
+"""
+import asyncio
+import base64
+import hashlib
+import io
+import math
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, NamedTuple, Optional, Tuple, Union
+
+import httpx
+from PIL import Image
+
+from app.config import get_settings
+
+settings = get_settings()
+
+STAGES = ("download", "read", "decode", "resize", "encode")
+
+# OpenAI 视觉输入的计费规则: detail=high 时图片先缩放到 2048 见方以内，再把短边缩放到 768 以内，
+# 按 512px 切片，每个切片 170 token，另加 85 基础token；detail=low 固定 85 token（512px）
+SIZING_POLICIES = ("fixed", "budget", "low")
+TILE_SIZE = 512
+TILE_TOKENS = 170
+BASE_TOKENS = 85
+HIGH_DETAIL_MAX_SIDE = 2048
+HIGH_DETAIL_SHORT_SIDE = 768
+LOW_DETAIL_SIZE = 512
+
+
+class SizePlan(NamedTuple):
+    """视觉调用的输出尺寸、detail 和预估图片token"""
+    width: int
+    height: int
+    detail: str
+    tokens: int
+
+
+class PreparedImage(NamedTuple):
+    """预处理结果"""
+    data: str  # JPEG base64
+    sha256: str  # 归一化内容的哈希
+    width: int
+    height: int
+    detail: str
+    tokens: int  # 预估图片token
+
+
+def _high_detail_size(width: int, height: int) -> Tuple[float, float]:
+    """服务端在 detail=high 时实际使用的尺寸（只缩小不放大）"""
+    scale = min(1.0, HIGH_DETAIL_MAX_SIDE / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, HIGH_DETAIL_SHORT_SIDE / min(width, height))
+    return width * scale, height * scale
+
+
+def high_detail_tokens(width: int, height: int) -> int:
+    """detail=high 时一张图片的token数"""
+    width, height = _high_detail_size(width, height)
+    tiles = math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+    return BASE_TOKENS + TILE_TOKENS * tiles
+
+
+def plan_vision_size(width: int, height: int, policy: str = "fixed", max_size: int = HIGH_DETAIL_MAX_SIDE,
+                     max_tiles: int = 0) -> SizePlan:
+    """按尺寸策略决定输出尺寸和 detail
+    
+    fixed: 长边缩放到 max_size 以内，detail=high（原有行为）
+    budget: 在 max_tiles 个切片以内按宽高比取最大尺寸，且不超过服务端会保留的尺寸；max_tiles 为 0 时使用 low
+    low: 长边缩放到 512 以内，detail=low
+    """
+    if policy not in SIZING_POLICIES:
+        raise ValueError(f"未知的尺寸策略: {policy}")
+    
+    if policy == "low" or (policy == "budget" and max_tiles <= 0):
+        scale = min(1.0, LOW_DETAIL_SIZE / max(width, height))
+        return SizePlan(max(1, round(width * scale)), max(1, round(height * scale)), "low", BASE_TOKENS)
+    
+    if policy == "fixed":
+        scale = min(1.0, max_size / max(width, height))
+        target_width, target_height = max(1, round(width * scale)), max(1, round(height * scale))
+        return SizePlan(target_width, target_height, "high", high_detail_tokens(target_width, target_height))
+    
+    # 发送超过服务端保留尺寸的像素只会增加传输和解码开销
+    effective_width, effective_height = _high_detail_size(width, height)
+    scale = 0.0
+    for columns in range(1, max_tiles + 1):
+        rows = max_tiles // columns
+        scale = max(scale, min(1.0, columns * TILE_SIZE / effective_width, rows * TILE_SIZE / effective_height))
+    target_width = max(1, math.floor(effective_width * scale))
+    target_height = max(1, math.floor(effective_height * scale))
+    return SizePlan(target_width, target_height, "high", high_detail_tokens(target_width, target_height))
+
+
+def preprocess_image(source: Union[str, bytes], max_size: int, quality: int = 90,
+                     max_pixels: Optional[int] = None, policy: str = "fixed",
+                     max_tiles: int = 0) -> Tuple[str, Dict[str, float], Dict[str, Any]]:
+    """读取本地路径或图片内容，按尺寸策略缩放并编码为 JPEG base64
+    
+    返回 (base64字符串, 各阶段耗时毫秒, 尺寸信息)；在进程池中执行，只依赖 PIL。
+    """
+    max_pixels = max_pixels or settings.preprocess_max_pixels
+    timings: Dict[str, float] = {}
+    
+    started = time.perf_counter()
+    if isinstance(source, bytes):
+        content = source
+    else:
+        with open(source, "rb") as f:
+            content = f.read()
+    timings["read"] = (time.perf_counter() - started) * 1000
+    
+    started = time.perf_counter()
+    with Image.open(io.BytesIO(content)) as img:
+        original_size = img.size
+        plan = plan_vision_size(img.width, img.height, policy, max_size, max_tiles)
+        # JPEG 在解码时按比例降采样（结果不小于目标尺寸），其他格式不受影响
+        img.draft("RGB", (plan.width, plan.height))
+        if img.width * img.height > max_pixels:
+            raise ValueError(f"图片过大: {original_size[0]}x{original_size[1]}，超过 {max_pixels} 像素上限")
+        img.load()
+        decoded_size = img.size
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        timings["decode"] = (time.perf_counter() - started) * 1000
+        
+        started = time.perf_counter()
+        if img.width > plan.width or img.height > plan.height:
+            img.thumbnail((plan.width, plan.height), Image.Resampling.LANCZOS)
+        timings["resize"] = (time.perf_counter() - started) * 1000
+        
+        started = time.perf_counter()
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=quality, optimize=True)
+        jpeg_bytes = buffer.getvalue()
+        encoded = base64.b64encode(jpeg_bytes).decode("utf-8")
+        timings["encode"] = (time.perf_counter() - started) * 1000
+        
+        info = {
+            "original_size": original_size,
+            "decoded_size": decoded_size,
+            "output_size": img.size,
+            "output_bytes": len(jpeg_bytes),
+            "detail": plan.detail,
+            "tokens": high_detail_tokens(*img.size) if plan.detail == "high" else BASE_TOKENS,
+            # 归一化后图片内容的哈希，用作分析结果缓存的键
+            "sha256": hashlib.sha256(jpeg_bytes).hexdigest()
+        }
+    return encoded, timings, info
+
+
+class ImagePreprocessor:
+    """图片预处理进程池 - 下载在事件循环中异步进行，CPU密集的部分交给子进程"""
+    
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._http: Optional[httpx.AsyncClient] = None
+        # 同时在内存中的图片数量上限
+        self._slots = asyncio.Semaphore(max(1, workers))
+        self.processed = 0
+        self.failed = 0
+        self.stage_totals: Dict[str, float] = {stage: 0.0 for stage in STAGES}
+        self.last_timings: Dict[str, float] = {}
+    
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        """按需创建进程池；workers 为 0 时返回 None，改在线程中执行"""
+        if self.workers <= 0:
+            return None
+        if self._executor is None:
+            # spawn 避免复制事件循环线程和数据库连接
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+    
+    async def _download(self, url: str) -> bytes:
+        """流式下载远程图片，超过字节上限时中止"""
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(timeout=settings.image_analysis_timeout, follow_redirects=True)
+        
+        chunks = []
+        size = 0
+        async with self._http.stream("GET", url) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > settings.preprocess_max_bytes:
+                    raise ValueError(f"图片超过 {settings.preprocess_max_bytes} 字节上限: {url}")
+                chunks.append(chunk)
+        return b"".join(chunks)
+    
+    async def prepare(self, image_path: str, max_size: int, quality: int = 90, policy: str = "fixed",
+                      max_tiles: int = 0) -> PreparedImage:
+        """预处理本地路径或 http(s) 地址的图片"""
+        async with self._slots:
+            timings: Dict[str, float] = {}
+            try:
+                source: Union[str, bytes] = image_path
+                if image_path.startswith(("http://", "https://")):
+                    started = time.perf_counter()
+                    source = await self._download(image_path)
+                    timings["download"] = (time.perf_counter() - started) * 1000
+                
+                executor = self._get_executor()
+                if executor is None:
+                    encoded, stage_timings, info = await asyncio.to_thread(
+                        preprocess_image, source, max_size, quality, settings.preprocess_max_pixels,
+                        policy, max_tiles
+                    )
+                else:
+                    encoded, stage_timings, info = await asyncio.get_running_loop().run_in_executor(
+                        executor, preprocess_image, source, max_size, quality, settings.preprocess_max_pixels,
+                        policy, max_tiles
+                    )
+            except Exception:
+                self.failed += 1
+                raise
+        
+        timings.update(stage_timings)
+        self.processed += 1
+        self.last_timings = {stage: round(value, 1) for stage, value in timings.items()}
+        for stage, value in timings.items():
+            self.stage_totals[stage] += value
+        print(f"🖼️ 图片预处理 {info['original_size']} -> {info['output_size']} "
+              f"(detail={info['detail']}, 约{info['tokens']} token): "
+              + ", ".join(f"{stage} {value:.0f}ms" for stage, value in self.last_timings.items()))
+        width, height = info["output_size"]
+        return PreparedImage(encoded, info["sha256"], width, height, info["detail"], info["tokens"])
+    
+    async def shutdown(self):
+        """关闭进程池和下载客户端（应用关闭时调用）"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._http is not None and not self._http.is_closed:
+            await self._http.aclose()
+        self._http = None
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "processed": self.processed,
+            "failed": self.failed,
+            "avg_ms": {stage: round(total / self.processed, 1) if self.processed else 0.0
+                       for stage, total in self.stage_totals.items()},
+            "last_ms": self.last_timings
+        }
+
+
+# 创建全局图片预处理实例
+image_preprocessor = ImagePreprocessor(settings.preprocess_workers)
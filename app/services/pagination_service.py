@@ -0,0 +1,134 @@
+"""
+分页服务 - 基于 (upload_time, id) 的游标分页，以及带后台刷新的总数缓存
+"""
+import asyncio
+import base64
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Query, Session
+
+from app.config import get_settings
+from app.models.image import Image
+
+settings = get_settings()
+
+
+def encode_cursor(image: Image) -> str:
+    """将分页位置编码为不透明游标"""
+    raw = f"{image.upload_time.isoformat()}|{image.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """解析游标，格式错误时抛出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        upload_time, image_id = base64.urlsafe_b64decode(padded).decode("utf-8").rsplit("|", 1)
+        return datetime.fromisoformat(upload_time), int(image_id)
+    except Exception:
+        raise ValueError("无效的分页游标")
+
+
+def order_by_upload_time(query: Query, descending: bool = True) -> Query:
+    """按上传时间排序，ID作为唯一的次序键"""
+    if descending:
+        return query.order_by(Image.upload_time.desc(), Image.id.desc())
+    return query.order_by(Image.upload_time.asc(), Image.id.asc())
+
+
+def paginate_by_cursor(query: Query, per_page: int, cursor: Optional[str] = None,
+                       descending: bool = True) -> Tuple[List[Image], Optional[str]]:
+    """游标分页: 从游标之后取 per_page 条，返回 (图片列表, 下一页游标)"""
+    if cursor:
+        upload_time, image_id = decode_cursor(cursor)
+        if descending:
+            query = query.filter(or_(
+                Image.upload_time < upload_time,
+                and_(Image.upload_time == upload_time, Image.id < image_id)
+            ))
+        else:
+            query = query.filter(or_(
+                Image.upload_time > upload_time,
+                and_(Image.upload_time == upload_time, Image.id > image_id)
+            ))
+    
+    # 多取一条判断是否还有下一页
+    images = order_by_upload_time(query, descending).limit(per_page + 1).all()
+    if len(images) > per_page:
+        images = images[:per_page]
+        return images, encode_cursor(images[-1])
+    return images, None
+
+
+class CountCache:
+    """列表总数缓存: 过期后先返回旧值，同时在后台线程重新统计"""
+    
+    max_entries = 1000
+    
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str, db: Session, build_query: Callable[[Session], Query]) -> int:
+        """获取总数，build_query 根据会话构建带筛选条件的查询"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        
+        if entry is None:
+            count = build_query(db).count()
+            self._store(key, count)
+            return count
+        
+        count, computed_at = entry
+        if time.monotonic() - computed_at > self.ttl:
+            self._schedule_refresh(key, build_query)
+        return count
+    
+    def _store(self, key: str, count: int):
+        with self._lock:
+            self._entries[key] = (count, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def _schedule_refresh(self, key: str, build_query: Callable[[Session], Query]):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        
+        try:
+            asyncio.get_running_loop().create_task(asyncio.to_thread(self._refresh, key, build_query))
+        except RuntimeError:
+            self._refresh(key, build_query)
+    
+    def _refresh(self, key: str, build_query: Callable[[Session], Query]):
+        """使用独立会话重新统计"""
+        from app.database import SessionLocal
+        
+        db = SessionLocal()
+        try:
+            self._store(key, build_query(db).count())
+        except Exception as e:
+            print(f"⚠️ 刷新列表总数失败 {key}: {e}")
+        finally:
+            db.close()
+            with self._lock:
+                self._refreshing.discard(key)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# 创建全局总数缓存实例
+count_cache = CountCache(settings.count_cache_ttl)
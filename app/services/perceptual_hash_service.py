@@ -0,0 +1,149 @@
+"""
+感知哈希服务 - 64位 pHash + BK树，按汉明距离查找近似重复图片
+
+pHash 对重新编码、缩放、轻微调色保持稳定，以16位十六进制字符串保存在 images.phash。
+BK树利用汉明距离的三角不等式剪枝，在小半径下单次查询只访问树中一小部分节点，
+全库聚类无需两两比较。
+"""
+import io
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image as PILImage
+from scipy.fft import dctn
+from sqlalchemy.orm import Session
+
+from app.models.image import Image
+
+def phash_image(img: PILImage.Image) -> int:
+    """计算 pHash: 32x32 灰度图做二维DCT，取左上8x8低频系数（去掉直流分量）与中位数比较"""
+    gray = img.convert("L").resize((32, 32), PILImage.LANCZOS)
+    coefficients = dctn(np.asarray(gray, dtype=np.float64), norm="ortho")[:8, :8].ravel()
+    bits = coefficients > np.median(coefficients[1:])
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def phash_bytes(content: bytes) -> Optional[str]:
+    """由图片内容计算 pHash 十六进制字符串，无法解码时返回 None"""
+    try:
+        with PILImage.open(io.BytesIO(content)) as img:
+            return format(phash_image(img), "016x")
+    except Exception as e:
+        print(f"⚠️ 计算感知哈希失败: {e}")
+        return None
+
+
+def phash_file(file_path: str) -> Optional[str]:
+    """由本地文件计算 pHash 十六进制字符串"""
+    try:
+        with PILImage.open(file_path) as img:
+            return format(phash_image(img), "016x")
+    except Exception as e:
+        print(f"⚠️ 计算感知哈希失败 {file_path}: {e}")
+        return None
+
+
+def hamming(a: int, b: int) -> int:
+    """两个哈希之间的汉明距离"""
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """BK树: 以汉明距离为度量，子节点按与父节点的距离分组"""
+    
+    def __init__(self):
+        # 节点: [哈希, 图片ID列表, {距离: 子节点}]
+        self._root: Optional[list] = None
+        self.size = 0
+    
+    def add(self, value: int, image_id: int):
+        """插入哈希，相同哈希的图片共用一个节点"""
+        self.size += 1
+        if self._root is None:
+            self._root = [value, [image_id], {}]
+            return
+        
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(image_id)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [image_id], {}]
+                return
+            node = child
+    
+    def search(self, value: int, radius: int) -> List[Tuple[int, int]]:
+        """返回距离不超过 radius 的 (图片ID, 距离)"""
+        result: List[Tuple[int, int]] = []
+        if self._root is None:
+            return result
+        
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                result.extend((image_id, distance) for image_id in node[1])
+            # 三角不等式: 只有与当前节点距离在 [d - r, d + r] 内的子树可能命中
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return result
+
+
+def find_duplicate_clusters(hashes: Iterable[Tuple[int, str]], radius: int) -> List[Dict]:
+    """按汉明距离半径对 (图片ID, pHash) 聚类，返回包含两张及以上图片的簇"""
+    tree = BKTree()
+    values: Dict[int, int] = {}
+    for image_id, hex_hash in hashes:
+        values[image_id] = int(hex_hash, 16)
+        tree.add(values[image_id], image_id)
+    
+    # 并查集合并半径内的图片
+    parent = {image_id: image_id for image_id in values}
+    
+    def find(image_id: int) -> int:
+        while parent[image_id] != image_id:
+            parent[image_id] = parent[parent[image_id]]
+            image_id = parent[image_id]
+        return image_id
+    
+    # 记录每条命中边的距离，用于报告簇内最大距离
+    edges: List[Tuple[int, int]] = []
+    for image_id, value in values.items():
+        for other_id, distance in tree.search(value, radius):
+            if other_id <= image_id:
+                continue
+            root_a, root_b = find(image_id), find(other_id)
+            if root_a != root_b:
+                parent[root_b] = root_a
+            edges.append((image_id, distance))
+    
+    clusters: Dict[int, List[int]] = {}
+    for image_id in values:
+        clusters.setdefault(find(image_id), []).append(image_id)
+    
+    widest: Dict[int, int] = {}
+    for image_id, distance in edges:
+        root = find(image_id)
+        widest[root] = max(widest.get(root, 0), distance)
+    
+    result = [
+        {"image_ids": sorted(ids), "count": len(ids), "max_distance": widest.get(root, 0)}
+        for root, ids in clusters.items() if len(ids) > 1
+    ]
+    result.sort(key=lambda cluster: (-cluster["count"], cluster["image_ids"][0]))
+    return result
+
+
+def load_active_hashes(db: Session) -> Tuple[List[Tuple[int, str]], int]:
+    """读取有效图片的 pHash，返回 (已计算的 (图片ID, 哈希), 尚未计算的数量)"""
+    rows = db.query(Image.id, Image.phash).filter(Image.is_active == True).all()
+    hashes = [(image_id, value) for image_id, value in rows if value]
+    return hashes, len(rows) - len(hashes)
@@ -0,0 +1,207 @@
+"""
+热门搜索统计服务 - Space-Saving算法 + 指数时间衰减，内存占用固定，定期持久化到磁盘
+"""
+import asyncio
+import heapq
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.config import get_settings
+from app.services.query_expansion_service import normalize_query
+
+settings = get_settings()
+
+# 冷启动时用于补足热门列表的默认搜索词
+DEFAULT_POPULAR_SEARCHES = [
+    "女性坐姿",
+    "男性站立",
+    "室内场景",
+    "户外自然光",
+    "思考表情",
+    "阅读动作",
+    "办公室环境",
+    "休闲服装",
+    "专业风格",
+    "轻松氛围"
+]
+
+
+class SpaceSaving:
+    """带时间衰减的Space-Saving热门项统计
+    
+    采用前向衰减: 时刻 t 的一次计数权重为 2^((t - t0) / half_life)，
+    比较大小时无需逐项衰减；权重过大时整体缩放并重置 t0。
+    """
+    
+    # 权重超过该值时整体缩放，避免浮点溢出
+    max_weight = 1e12
+    
+    def __init__(self, capacity: int, half_life: float):
+        self.capacity = capacity
+        self.half_life = half_life
+        self.t0 = time.time()
+        self.counts: Dict[str, float] = {}
+        self.errors: Dict[str, float] = {}
+        self._heap: List[Tuple[float, str]] = []
+    
+    def _weight(self, now: float) -> float:
+        return 2.0 ** ((now - self.t0) / self.half_life)
+    
+    def _rescale(self, now: float):
+        factor = 1.0 / self._weight(now)
+        self.counts = {key: count * factor for key, count in self.counts.items()}
+        self.errors = {key: error * factor for key, error in self.errors.items()}
+        self.t0 = now
+        self._rebuild_heap()
+    
+    def _rebuild_heap(self):
+        self._heap = [(count, key) for key, count in self.counts.items()]
+        heapq.heapify(self._heap)
+    
+    def _pop_min(self) -> Tuple[str, float]:
+        """弹出当前计数最小的项（跳过堆中过期的记录）"""
+        while True:
+            count, key = heapq.heappop(self._heap)
+            if self.counts.get(key) == count:
+                return key, count
+    
+    def add(self, key: str, now: Optional[float] = None):
+        now = now or time.time()
+        weight = self._weight(now)
+        if weight > self.max_weight:
+            self._rescale(now)
+            weight = 1.0
+        
+        if key in self.counts:
+            self.counts[key] += weight
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = weight
+            self.errors[key] = 0.0
+        else:
+            # 替换计数最小的项，新项继承其计数作为误差上界
+            evicted, min_count = self._pop_min()
+            del self.counts[evicted]
+            del self.errors[evicted]
+            self.counts[key] = min_count + weight
+            self.errors[key] = min_count
+        
+        heapq.heappush(self._heap, (self.counts[key], key))
+        if len(self._heap) > self.capacity * 4:
+            self._rebuild_heap()
+    
+    def top(self, k: int, now: Optional[float] = None) -> List[Tuple[str, float]]:
+        """返回计数最高的 k 项，计数已换算为当前时刻的衰减次数"""
+        scale = 1.0 / self._weight(now or time.time())
+        return [(key, count * scale) for key, count in heapq.nlargest(k, self.counts.items(), key=lambda item: item[1])]
+    
+    def to_dict(self) -> Dict:
+        return {"t0": self.t0, "half_life": self.half_life, "counts": dict(self.counts), "errors": dict(self.errors)}
+    
+    def load_dict(self, state: Dict):
+        self.t0 = float(state.get("t0", time.time()))
+        counts = state.get("counts", {})
+        errors = state.get("errors", {})
+        # 容量变小时只保留计数最高的项
+        kept = heapq.nlargest(self.capacity, counts.items(), key=lambda item: item[1])
+        self.counts = {key: float(count) for key, count in kept}
+        self.errors = {key: float(errors.get(key, 0.0)) for key in self.counts}
+        self._rebuild_heap()
+
+
+class PopularSearchTracker:
+    """热门搜索统计: 记录 /api/search 的规范化查询，提供衰减后的 top-k"""
+    
+    # top-k 快照的刷新间隔(秒)
+    snapshot_interval = 10
+    snapshot_size = 100
+    
+    def __init__(self, state_path: str, capacity: int, half_life: float):
+        self.state_path = state_path
+        self._sketch = SpaceSaving(capacity, half_life)
+        self._lock = threading.Lock()
+        self._snapshot: List[Tuple[str, float]] = []
+        self._snapshot_at = 0.0
+        self._dirty = False
+        # 每记录一次递增，供自动补全判断是否需要重建
+        self.version = 0
+    
+    def record(self, query: str):
+        key = normalize_query(query)
+        if not key:
+            return
+        with self._lock:
+            self._sketch.add(key)
+            self._dirty = True
+            self.version += 1
+    
+    def top(self, k: int = 10) -> List[Tuple[str, float]]:
+        """从快照返回 (查询, 衰减次数)，快照定期重算"""
+        now = time.monotonic()
+        if now - self._snapshot_at > self.snapshot_interval:
+            with self._lock:
+                self._snapshot = self._sketch.top(self.snapshot_size)
+            self._snapshot_at = now
+        return self._snapshot[:k]
+    
+    def popular_queries(self, k: int = 10, defaults: Optional[List[str]] = None) -> List[str]:
+        """热门搜索词，数据不足时用默认搜索词补足"""
+        queries = [query for query, _ in self.top(k)]
+        for query in defaults if defaults is not None else DEFAULT_POPULAR_SEARCHES:
+            if len(queries) >= k:
+                break
+            if query not in queries:
+                queries.append(query)
+        return queries
+    
+    def load(self) -> bool:
+        """从磁盘恢复统计状态"""
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            with self._lock:
+                self._sketch.load_dict(state)
+            self._snapshot_at = 0.0
+            print(f"✅ 热门搜索统计加载完成: {len(self._sketch.counts)} 个查询")
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"⚠️ 加载热门搜索统计失败: {e}")
+            return False
+    
+    def save(self) -> bool:
+        """写入磁盘（先写临时文件再替换，避免写到一半）"""
+        with self._lock:
+            if not self._dirty:
+                return False
+            state = self._sketch.to_dict()
+            self._dirty = False
+        
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            tmp_path = f"{self.state_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp_path, self.state_path)
+            return True
+        except Exception as e:
+            print(f"⚠️ 保存热门搜索统计失败: {e}")
+            self._dirty = True
+            return False
+    
+    async def run_persister(self):
+        """定期持久化任务，在应用生命周期内运行"""
+        while True:
+            await asyncio.sleep(settings.popular_search_persist_interval)
+            await asyncio.to_thread(self.save)
+
+
+# 创建全局热门搜索统计实例
+popular_searches = PopularSearchTracker(
+    settings.popular_search_state_path,
+    settings.popular_search_capacity,
+    settings.popular_search_half_life
+)
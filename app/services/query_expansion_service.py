@@ -0,0 +1,100 @@
+"""
+查询扩展缓存服务 - 缓存GPT-4o查询增强结果，并定时预热热门查询
+"""
+import asyncio
+import re
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, List
+
+from app.config import get_settings
+from app.services.cache_service import CacheService
+from app.services.gpt4o_service import gpt4o_analyzer
+
+settings = get_settings()
+
+
+def normalize_query(query: str) -> str:
+    """规范化查询: 全角转半角、小写、合并空白"""
+    query = unicodedata.normalize("NFKC", query or "")
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+class QueryExpansionCache:
+    """查询扩展缓存"""
+    
+    # 查询频次表的最大长度，超出后只保留高频部分
+    max_tracked_queries = 10000
+    
+    def __init__(self):
+        self.cache = CacheService("query_expansion", max_size=settings.query_cache_size)
+        self.frequencies: Counter = Counter()
+        self.llm_calls = 0
+    
+    def record(self, key: str):
+        """记录查询频次，供缓存预热使用"""
+        self.frequencies[key] += 1
+        if len(self.frequencies) > self.max_tracked_queries:
+            self.frequencies = Counter(dict(self.frequencies.most_common(self.max_tracked_queries // 2)))
+    
+    async def _expand(self, key: str) -> Dict[str, Any]:
+        """调用GPT-4o扩展查询，只缓存成功的结果"""
+        self.llm_calls += 1
+        result = await gpt4o_analyzer.enhance_search_query(key)
+        if result.get("keywords") or result.get("synonyms"):
+            await self.cache.set(key, result)
+        return result
+    
+    async def get_or_expand(self, query: str) -> Dict[str, Any]:
+        """优先返回缓存的扩展结果，未命中时调用GPT-4o"""
+        key = normalize_query(query)
+        if not key:
+            return {"enhanced_query": query}
+        
+        self.record(key)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            return cached
+        
+        return await self._expand(key)
+    
+    def top_queries(self, limit: int) -> List[str]:
+        """返回最常见的查询"""
+        return [key for key, _ in self.frequencies.most_common(limit)]
+    
+    async def warm(self, top_n: int, interval: int) -> int:
+        """预热热门查询: 缓存缺失或将在下个周期前过期的查询重新扩展"""
+        warmed = 0
+        for key in self.top_queries(top_n):
+            if self.cache.local.ttl_remaining(key) > interval:
+                continue
+            try:
+                await self._expand(key)
+                warmed += 1
+            except Exception as e:
+                print(f"⚠️ 预热查询失败 {key}: {e}")
+        return warmed
+    
+    async def run_warmer(self):
+        """定时预热任务，在应用生命周期内运行"""
+        interval = settings.query_cache_warm_interval
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                warmed = await self.warm(settings.query_cache_warm_top_n, interval)
+                if warmed:
+                    print(f"🔥 查询扩展缓存预热完成: {warmed} 个查询")
+            except Exception as e:
+                print(f"❌ 查询扩展缓存预热失败: {e}")
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.cache.stats(),
+            "llm_calls": self.llm_calls,
+            "tracked_queries": len(self.frequencies),
+            "top_queries": self.top_queries(10)
+        }
+
+
+# 创建全局查询扩展缓存实例
+query_expansion_cache = QueryExpansionCache()
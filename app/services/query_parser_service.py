@@ -0,0 +1,258 @@
+"""
+查询解析服务 - 将关键词映射、否定词和标签名编译为Aho-Corasick自动机，按最长匹配切分查询
+"""
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.models.image import Tag, PREDEFINED_TAGS
+
+
+# 关键词映射字典: 口语化说法 -> 标签
+KEYWORD_MAPPINGS: Dict[str, List[str]] = {
+    # 姿势相关
+    "站着": ["站姿", "站立"],
+    "坐着": ["坐姿"],
+    "躺着": ["躺姿"],
+    "蹲着": ["蹲姿"],
+    
+    # 性别相关
+    "女人": ["女性"],
+    "男人": ["男性"],
+    "女孩": ["女性"],
+    "男孩": ["男性"],
+    "女的": ["女性"],
+    "男的": ["男性"],
+    
+    # 年龄相关
+    "小孩": ["儿童"],
+    "孩子": ["儿童"],
+    "年轻": ["青年"],
+    "老人": ["老年"],
+    
+    # 服装相关
+    "西装": ["正装"],
+    "便装": ["休闲装"],
+    "裙子": ["裙子"],
+    "牛仔": ["牛仔裤"],
+    
+    # 场景相关
+    "室内": ["室内"],
+    "户外": ["户外"],
+    "外面": ["户外"],
+    "里面": ["室内"],
+    "办公": ["办公室"],
+    "家里": ["家居"],
+    "公园": ["公园"],
+    
+    # 角度相关
+    "正面": ["正面"],
+    "侧面": ["侧面"],
+    "背面": ["背面"],
+    "从上": ["俯视"],
+    "从下": ["仰视"],
+    "俯拍": ["俯视"],
+    "仰拍": ["仰视"],
+    
+    # 表情相关
+    "笑": ["微笑"],
+    "严肃": ["严肃"],
+    "想": ["思考表情"],
+    "放松": ["放松"],
+    
+    # 动作相关
+    "走": ["行走"],
+    "看书": ["阅读"],
+    "读书": ["阅读"],
+    "伸懒腰": ["伸展"],
+    
+    # 道具相关
+    "椅子": ["椅子"],
+    "桌子": ["桌子"],
+    "书": ["书本"],
+    "咖啡": ["咖啡杯"],
+    "没有道具": ["无道具"],
+    "无道具": ["无道具"],
+    
+    # 光线相关
+    "自然光": ["自然光"],
+    "阳光": ["自然光"],
+    "人造光": ["人工光"],
+    "灯光": ["人工光"],
+    "逆光": ["逆光"],
+    "柔光": ["柔和光"],
+    "强光": ["强光"],
+}
+
+# 否定词
+NEGATIVE_WORDS = ["不", "没有", "不是", "非", "除了", "不要"]
+
+# 以单字否定词开头但不表示否定的常用词，最长匹配时优先于否定词
+NEUTRAL_WORDS = ["非常", "非凡", "不错", "不同", "不过", "不少", "不仅", "不但", "不断", "不停", "不久", "不管"]
+
+# 自动机输出中表示否定词的标记
+NEGATION = None
+
+
+class AhoCorasick:
+    """Aho-Corasick多模式匹配自动机，构建后只读"""
+    
+    def __init__(self, patterns: Dict[str, Optional[List[str]]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # 每个节点: 以该节点结尾的模式长度（自身），及沿失败链的下一个输出节点
+        self._length: List[int] = [0]
+        self._output_link: List[int] = [-1]
+        self._values: Dict[int, Optional[List[str]]] = {}
+        
+        for pattern, value in patterns.items():
+            if pattern:
+                self._insert(pattern, value)
+        self._build_links()
+    
+    def __len__(self) -> int:
+        return len(self._values)
+    
+    def _insert(self, pattern: str, value: Optional[List[str]]):
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._length.append(0)
+                self._output_link.append(-1)
+            node = next_node
+        self._length[node] = len(pattern)
+        self._values[node] = value
+    
+    def _build_links(self):
+        """广度优先计算失败指针和输出链接"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[child] = target
+                self._output_link[child] = target if target in self._values else self._output_link[target]
+    
+    def segment(self, text: str) -> List[Tuple[int, int, Optional[List[str]]]]:
+        """最长匹配切分: 返回互不重叠的 (起点, 终点, 值)，优先取最左、最长的模式"""
+        longest_at: Dict[int, int] = {}
+        ends_at: Dict[int, int] = {}
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            
+            output = node if node in self._values else self._output_link[node]
+            while output > 0:
+                start = position - self._length[output] + 1
+                if self._length[output] > longest_at.get(start, 0):
+                    longest_at[start] = self._length[output]
+                    ends_at[start] = output
+                output = self._output_link[output]
+        
+        segments = []
+        position = 0
+        while position < len(text):
+            length = longest_at.get(position)
+            if length:
+                segments.append((position, position + length, self._values[ends_at[position]]))
+                position += length
+            else:
+                position += 1
+        return segments
+
+
+class QueryParser:
+    """查询解析器: 进程内只编译一次，标签变化时标记过期并在下次解析前重建"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tag_names: Set[str] = {tag["name"] for tag in PREDEFINED_TAGS}
+        self._automaton: Optional[AhoCorasick] = None
+    
+    def _compile(self) -> AhoCorasick:
+        patterns: Dict[str, Optional[List[str]]] = {}
+        for tag_name in self._tag_names:
+            patterns[tag_name.lower()] = [tag_name]
+        for keyword, tags in KEYWORD_MAPPINGS.items():
+            patterns[keyword.lower()] = tags
+        for word in NEGATIVE_WORDS:
+            patterns.setdefault(word, NEGATION)
+        for word in NEUTRAL_WORDS:
+            patterns.setdefault(word, [])
+        return AhoCorasick(patterns)
+    
+    @property
+    def automaton(self) -> AhoCorasick:
+        automaton = self._automaton
+        if automaton is None:
+            with self._lock:
+                if self._automaton is None:
+                    self._automaton = self._compile()
+                automaton = self._automaton
+        return automaton
+    
+    def load_tags(self, db: Session) -> int:
+        """从标签表加载全部标签名并重建自动机"""
+        try:
+            names = [name for (name,) in db.query(Tag.name).all()]
+        except SQLAlchemyError as e:
+            print(f"❌ 加载查询解析词典失败: {e}")
+            return 0
+        
+        with self._lock:
+            self._tag_names.update(names)
+            self._automaton = self._compile()
+        print(f"✅ 查询解析词典编译完成: {len(self._automaton)} 个词条")
+        return len(names)
+    
+    def add_tags(self, tag_names: Iterable[str]):
+        """新增标签后调用，下次解析时重新编译"""
+        with self._lock:
+            new_names = set(tag_names) - self._tag_names
+            if new_names:
+                self._tag_names.update(new_names)
+                self._automaton = None
+    
+    def parse(self, query: str) -> Tuple[List[str], List[str]]:
+        """解析查询，返回 (肯定标签, 否定标签)"""
+        positive_tags: List[str] = []
+        negative_tags: List[str] = []
+        is_negative = False
+        negation_end = 0
+        text = query.strip().lower()
+        
+        for start, end, tags in self.automaton.segment(text):
+            if tags is NEGATION:
+                is_negative = True
+                negation_end = end
+                continue
+            if not tags:
+                continue
+            # 否定词与标签之间隔着其他字（如"不好看的户外"）时不作用于该标签
+            if is_negative and text[negation_end:start].strip():
+                is_negative = False
+            if is_negative:
+                negative_tags.extend(tags)
+                is_negative = False  # 否定只作用于紧随其后的一个词
+            else:
+                positive_tags.extend(tags)
+        
+        return list(dict.fromkeys(positive_tags)), list(dict.fromkeys(negative_tags))
+
+
+# 创建全局查询解析器实例
+query_parser = QueryParser()
@@ -0,0 +1,202 @@
+"""
+相关性排序服务 - BM25文本相关性 + 标签置信度 + AI置信度 + 热度，NumPy一次算完全部候选
+"""
+import json
+from collections import Counter
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Query, Session
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.config import get_settings
+from app.models.image import Image, Tag, ImageTag
+from app.services.vector_index_service import HashingEncoder
+
+settings = get_settings()
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """返回得分最高的 k 个下标（降序），argpartition 只对前 k 个排序"""
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < n:
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(n)
+    # 得分相同时按原顺序，保证结果稳定
+    return part[np.lexsort((part, -scores[part]))]
+
+
+def _keywords_text(keywords: Any) -> str:
+    """ai_searchable_keywords 可能是列表或JSON字符串"""
+    if isinstance(keywords, str):
+        try:
+            keywords = json.loads(keywords)
+        except ValueError:
+            return keywords
+    if isinstance(keywords, list):
+        return " ".join(str(k) for k in keywords)
+    return ""
+
+
+class RelevanceRanker:
+    """候选图片打分: 各项归一化到 [0, 1] 后加权求和"""
+    
+    # 各项权重，与原先的逐张打分保持同样的比例
+    tag_weight = 0.4
+    text_weight = 0.3
+    confidence_weight = 0.2
+    popularity_weight = 0.1
+    # BM25 参数
+    k1 = 1.2
+    b = 0.75
+    # 单条 IN 查询包含的最大图片数量
+    batch_size = 1000
+    
+    def __init__(self, max_candidates: int):
+        self.max_candidates = max_candidates
+    
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return HashingEncoder.tokenize(text)
+    
+    def bm25(self, documents: Sequence[str], query_text: str) -> np.ndarray:
+        """对每个文档计算 BM25，仅统计查询中出现的词项"""
+        n = len(documents)
+        vocab = {token: col for col, token in enumerate(dict.fromkeys(self.tokenize(query_text)))}
+        if n == 0 or not vocab:
+            return np.zeros(n, dtype=np.float32)
+        
+        tf = np.zeros((n, len(vocab)), dtype=np.float32)
+        lengths = np.zeros(n, dtype=np.float32)
+        for row, document in enumerate(documents):
+            tokens = self.tokenize(document)
+            lengths[row] = len(tokens)
+            for token, count in Counter(t for t in tokens if t in vocab).items():
+                tf[row, vocab[token]] = count
+        
+        df = np.count_nonzero(tf, axis=0)
+        idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avg_length = max(float(lengths.mean()), 1.0)
+        norm = self.k1 * (1.0 - self.b + self.b * lengths / avg_length)
+        return (tf * (self.k1 + 1.0) / (tf + norm[:, None])) @ idf
+    
+    def tag_scores(self, db: Session, image_ids: Sequence[int], tag_names: Iterable[str]) -> np.ndarray:
+        """命中的查询标签按 ImageTag.confidence 累加，再除以查询标签数"""
+        tag_names = list(dict.fromkeys(tag_names))
+        scores = np.zeros(len(image_ids), dtype=np.float32)
+        if not tag_names or not image_ids:
+            return scores
+        
+        try:
+            rows = []
+            for start in range(0, len(image_ids), self.batch_size):
+                rows.extend(db.query(ImageTag.image_id, ImageTag.confidence).join(
+                    Tag, ImageTag.tag_id == Tag.id
+                ).filter(
+                    ImageTag.image_id.in_(list(image_ids[start:start + self.batch_size])),
+                    Tag.name.in_(tag_names)
+                ).all())
+        except SQLAlchemyError as e:
+            print(f"⚠️ 获取标签置信度失败: {e}")
+            return scores
+        if not rows:
+            return scores
+        
+        ids = np.asarray(image_ids, dtype=np.int64)
+        order = np.argsort(ids, kind="stable")
+        hit_ids = np.fromiter((image_id for image_id, _ in rows), dtype=np.int64, count=len(rows))
+        # 人工标签等未记录置信度的关联按 1.0 计
+        hit_weights = np.fromiter((1.0 if c is None else c for _, c in rows), dtype=np.float32, count=len(rows))
+        positions = order[np.searchsorted(ids, hit_ids, sorter=order)]
+        np.add.at(scores, positions, np.clip(hit_weights, 0.0, 1.0))
+        return np.minimum(scores / len(tag_names), 1.0)
+    
+    def score(self, documents: Sequence[str], tag_scores: np.ndarray, confidences: Sequence[Optional[float]],
+              view_counts: Sequence[Optional[int]], query_text: str) -> np.ndarray:
+        """组合各项得分，返回与候选顺序一致的得分数组"""
+        text = self.bm25(documents, query_text)
+        if text.size and text.max() > 0:
+            text = text / text.max()
+        
+        confidence = np.clip(np.array([c or 0.0 for c in confidences], dtype=np.float32), 0.0, 1.0)
+        popularity = np.log1p(np.array([v or 0 for v in view_counts], dtype=np.float32))
+        if popularity.size and popularity.max() > 0:
+            popularity = popularity / popularity.max()
+        
+        return (self.tag_weight * tag_scores + self.text_weight * text
+                + self.confidence_weight * confidence + self.popularity_weight * popularity)
+    
+    def rank_query(self, db: Session, query: Query, query_text: str, tag_names: Iterable[str],
+                   limit: int, relevance=None) -> List[Tuple[int, float]]:
+        """对查询命中的候选打分，返回前 limit 个 (图片ID, 得分)
+        
+        先取全部命中的ID；超过 max_candidates 时按标签命中得分加全文相关度（relevance 为
+        MATCH 表达式时）预筛，只对保留的候选读取文本列并完整打分。
+        """
+        tag_names = list(dict.fromkeys(tag_names))
+        columns = (Image.id,) if relevance is None else (Image.id, relevance)
+        # 按ID倒序，预筛得分相同时保留较新的图片
+        matches = query.with_entities(*columns).order_by(None).order_by(Image.id.desc()).all()
+        if not matches:
+            return []
+        
+        image_ids = [row[0] for row in matches]
+        tags = self.tag_scores(db, image_ids, tag_names)
+        if len(image_ids) > self.max_candidates:
+            prefilter = tags.copy()
+            if relevance is not None:
+                text = np.array([row[1] or 0.0 for row in matches], dtype=np.float32)
+                if text.max() > 0:
+                    prefilter += text / text.max()
+            keep = top_k_indices(prefilter, self.max_candidates)
+            image_ids = [image_ids[i] for i in keep]
+            tags = tags[keep]
+        
+        details = {}
+        for start in range(0, len(image_ids), self.batch_size):
+            for row in db.query(
+                Image.id, Image.ai_description, Image.ai_searchable_keywords, Image.ai_confidence, Image.view_count
+            ).filter(Image.id.in_(image_ids[start:start + self.batch_size])).all():
+                details[row[0]] = row
+        # 两次查询之间被删除的图片不参与打分
+        present = [i for i, image_id in enumerate(image_ids) if image_id in details]
+        image_ids = [image_ids[i] for i in present]
+        rows = [details[image_id] for image_id in image_ids]
+        if not rows:
+            return []
+        
+        documents = [f"{row[1] or ''} {_keywords_text(row[2])}" for row in rows]
+        scores = self.score(
+            documents,
+            tags[present],
+            [row[3] for row in rows],
+            [row[4] for row in rows],
+            query_text
+        )
+        return [(image_ids[i], float(scores[i])) for i in top_k_indices(scores, limit)]
+    
+    def rank_images(self, db: Session, images: Sequence[Image], query_text: str,
+                    tag_names: Iterable[str]) -> np.ndarray:
+        """对已加载的图片打分，顺序与 images 一致"""
+        return self.score(
+            [f"{image.ai_description or ''} {_keywords_text(image.ai_searchable_keywords)}" for image in images],
+            self.tag_scores(db, [image.id for image in images], tag_names),
+            [image.ai_confidence for image in images],
+            [image.view_count for image in images],
+            query_text
+        )
+
+
+def hydrate_ranked(db: Session, ranked: List[Tuple[int, float]]) -> List[Image]:
+    """按排序结果取回图片对象并保持顺序"""
+    if not ranked:
+        return []
+    images = {image.id: image for image in db.query(Image).filter(Image.id.in_([image_id for image_id, _ in ranked])).all()}
+    return [images[image_id] for image_id, _ in ranked if image_id in images]
+
+
+# 创建全局相关性排序实例
+relevance_ranker = RelevanceRanker(settings.ranking_max_candidates)
@@ -0,0 +1,181 @@
+"""
+API限流服务 - 请求数/token 双令牌桶、429/5xx 重试（遵守 Retry-After，指数退避加抖动）
+
+批量分析的吞吐由 API 配额决定，而不是固定的 sleep:
+每次调用先按预估 token 从两个令牌桶中预留额度，响应返回后按实际用量结算；
+收到带 Retry-After 的 429 时全部工作协程一起暂停。
+"""
+import asyncio
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+
+from app.config import get_settings
+
+settings = get_settings()
+
+# 需要重试的HTTP状态码
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """令牌桶 - 允许余额为负（预留制），调用方按返回的等待时间排队，先到先得"""
+    
+    def __init__(self, capacity: float, per_minute: float):
+        self.capacity = float(capacity)
+        self.rate = per_minute / 60.0
+        self._balance = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float):
+        self._balance = min(self.capacity, self._balance + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def reserve(self, amount: float, now: Optional[float] = None) -> float:
+        """预留额度，返回需要等待的秒数"""
+        with self._lock:
+            self._refill(time.monotonic() if now is None else now)
+            self._balance -= amount
+            if self._balance >= 0:
+                return 0.0
+            return -self._balance / self.rate
+    
+    def refund(self, amount: float):
+        """归还（或在 amount 为负时追加扣除）额度"""
+        with self._lock:
+            self._balance = min(self.capacity, self._balance + amount)
+    
+    @property
+    def available(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._balance
+
+
+def parse_retry_after(headers: httpx.Headers) -> Optional[float]:
+    """解析 retry-after-ms / Retry-After（秒数或HTTP日期），返回秒数"""
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000.0)
+        except ValueError:
+            pass
+    
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None, base: float = 1.0,
+                  cap: float = 60.0, rng: random.Random = random) -> float:
+    """第 attempt 次重试前的等待: 有 Retry-After 时以其为下限再加少量抖动，否则指数退避 + 全抖动"""
+    if retry_after is not None:
+        return retry_after + rng.uniform(0, base)
+    return rng.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class RateLimiter:
+    """API 调用限流器 - 请求数和 token 两个令牌桶，统一处理重试和全局暂停"""
+    
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, max_retries: int = 5,
+                 backoff_base: float = 1.0, backoff_max: float = 60.0):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._paused_until = 0.0
+        self.stats_counter = {"calls": 0, "retries": 0, "throttled": 0, "failed": 0}
+    
+    def pause(self, seconds: float):
+        """收到 Retry-After 后暂停所有调用"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+    
+    async def acquire(self, estimated_tokens: int):
+        """等待全局暂停结束，并从两个令牌桶预留额度"""
+        pause = self._paused_until - time.monotonic()
+        while pause > 0:
+            await asyncio.sleep(pause)
+            pause = self._paused_until - time.monotonic()
+        
+        wait = max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+        if wait > 0:
+            self.stats_counter["throttled"] += 1
+            await asyncio.sleep(wait)
+    
+    def _settle(self, response: httpx.Response, estimated_tokens: int):
+        """按响应中的实际 token 用量结算预留额度"""
+        try:
+            used = response.json().get("usage", {}).get("total_tokens")
+        except Exception:
+            used = None
+        if used is not None:
+            self.tokens.refund(estimated_tokens - used)
+    
+    async def call(self, send: Callable[[], Awaitable[httpx.Response]], estimated_tokens: int) -> httpx.Response:
+        """限流并重试地发送请求，429/5xx 重试耗尽后返回最后一次响应，网络错误耗尽后抛出"""
+        self.stats_counter["calls"] += 1
+        attempt = 0
+        while True:
+            await self.acquire(estimated_tokens)
+            retry_after = None
+            try:
+                response = await send()
+            except (httpx.TimeoutException, httpx.NetworkError) as e:
+                self.tokens.refund(estimated_tokens)
+                if attempt >= self.max_retries:
+                    self.stats_counter["failed"] += 1
+                    raise
+                reason = f"{type(e).__name__}"
+            else:
+                if response.status_code not in RETRYABLE_STATUS:
+                    self._settle(response, estimated_tokens)
+                    return response
+                # 被拒绝的请求不消耗 token 配额
+                self.tokens.refund(estimated_tokens)
+                if attempt >= self.max_retries:
+                    self.stats_counter["failed"] += 1
+                    return response
+                retry_after = parse_retry_after(response.headers)
+                reason = f"HTTP {response.status_code}"
+            
+            delay = backoff_delay(attempt, retry_after, self.backoff_base, self.backoff_max)
+            if retry_after is not None:
+                self.pause(delay)
+            attempt += 1
+            self.stats_counter["retries"] += 1
+            print(f"⏳ API调用{reason}，{delay:.1f}秒后第{attempt}次重试")
+            await asyncio.sleep(delay)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats_counter,
+            "available_requests": round(self.requests.available, 1),
+            "available_tokens": round(self.tokens.available, 1),
+            "paused_seconds": round(max(0.0, self._paused_until - time.monotonic()), 1)
+        }
+
+
+# 创建全局OpenAI限流器实例
+openai_limiter = RateLimiter(
+    settings.openai_requests_per_minute,
+    settings.openai_tokens_per_minute,
+    settings.openai_max_retries,
+    settings.openai_backoff_base,
+    settings.openai_backoff_max
+)
@@ -0,0 +1,133 @@
+"""
+响应缓存服务 - 按请求参数 + 图库版本号缓存完整的接口响应
+
+图库内容发生变化（新增图片、标签写入、分析完成、删除、批量更新）时递增版本号，
+旧版本的缓存键不再被访问，因此不会返回过期结果，旧条目随LRU淘汰或TTL过期。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import threading
+from typing import Any, Dict, Optional
+
+from app.config import get_settings
+from app.services.cache_service import CacheService, get_redis, get_sync_redis
+
+settings = get_settings()
+
+
+class CatalogVersion:
+    """
+    图库版本号: 进程内计数，启用Redis时改用共享计数，多进程之间同步失效
+    
+    未启用Redis时版本号只在本进程内有效: 写入方把变化的图片登记到图库变更日志，
+    其他进程由图库变更同步递增本地版本号。Redis计数递增失败时本进程改用自己的版本号，
+    直到补上这次递增；其他进程在此之前要等变更同步或缓存TTL过期。
+    """
+    
+    redis_key = "ai-pose-gallery:catalog_version"
+    
+    def __init__(self):
+        self._local = 0
+        self._lock = threading.Lock()
+        self.skipped_bumps = 0
+        # Redis计数递增失败，尚未补上
+        self.unsynced = False
+    
+    def bump_local(self):
+        """只递增本进程版本号"""
+        with self._lock:
+            self._local += 1
+    
+    def bump(self):
+        """递增版本号，必须在数据库事务提交之后调用；Redis计数同步递增，返回前即对其他进程生效"""
+        self.bump_local()
+        
+        if get_redis() is None:
+            return
+        redis_client = get_sync_redis()
+        if redis_client is None:
+            self._skip("同步Redis客户端不可用")
+            return
+        try:
+            redis_client.incr(self.redis_key)
+        except Exception as e:
+            self._skip(e)
+    
+    def _skip(self, reason):
+        self.skipped_bumps += 1
+        self.unsynced = True
+        print(f"⚠️ 更新Redis图库版本失败，本进程改用自己的版本号，其他进程要等变更同步或TTL过期: {reason}")
+    
+    @property
+    def local(self) -> int:
+        return self._local
+    
+    def _local_version(self) -> str:
+        """本进程的版本号；Redis二级缓存由各进程共用，带上进程标识避免与其他进程的版本号重叠"""
+        return f"l{socket.gethostname()}-{os.getpid()}-{self._local}"
+    
+    async def current(self) -> str:
+        """当前版本号，启用Redis时使用共享版本，使各进程共用同一批缓存键"""
+        redis_client = get_redis()
+        if redis_client is not None:
+            try:
+                if self.unsynced:
+                    # 补上失败的递增，之前的共享缓存键对所有进程失效
+                    version = await redis_client.incr(self.redis_key)
+                    self.unsynced = False
+                    print("✅ 已补上Redis图库版本递增")
+                    return f"r{int(version)}"
+                return f"r{int(await redis_client.get(self.redis_key) or 0)}"
+            except Exception as e:
+                print(f"⚠️ 读取Redis图库版本失败: {e}")
+        return self._local_version()
+
+
+class ResponseCache:
+    """接口响应缓存"""
+    
+    def __init__(self):
+        self.cache = CacheService("responses", max_size=settings.response_cache_size,
+                                  ttl=settings.response_cache_ttl)
+        self.version = CatalogVersion()
+    
+    async def key(self, endpoint: str, params: Dict[str, Any]) -> str:
+        """生成缓存键，需在查询数据库之前获取，保证写入期间计算的结果不会被新版本读到"""
+        version = await self.version.current()
+        raw = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+        digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+        return f"{endpoint}:{version}:{digest}"
+    
+    async def get(self, key: str) -> Optional[Any]:
+        if not settings.enable_response_cache:
+            return None
+        return await self.cache.get(key)
+    
+    async def set(self, key: str, value: Any):
+        if not settings.enable_response_cache:
+            return
+        await self.cache.set(key, value)
+    
+    def invalidate(self):
+        """图库内容变化后使全部响应缓存失效"""
+        self.version.bump()
+    
+    async def invalidate_async(self):
+        """在异步接口中使缓存失效，同步的Redis递增放到线程中执行，不阻塞事件循环"""
+        await asyncio.to_thread(self.version.bump)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.cache.stats(),
+            "enabled": settings.enable_response_cache,
+            "local_version": self.version.local,
+            "skipped_version_bumps": self.version.skipped_bumps,
+            "version_unsynced": self.version.unsynced
+        }
+
+
+# 创建全局响应缓存实例
+response_cache = ResponseCache()
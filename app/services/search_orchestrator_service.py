@@ -0,0 +1,183 @@
+"""
+AI搜索编排服务 - 按单次请求的延迟预算调度查询扩展、检索、向量排序和GPT二次排序
+"""
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+from app.config import get_settings
+from app.models.image import Image
+from app.services.search_service import SearchService
+from app.services.vector_index_service import vector_index
+from app.services.query_expansion_service import query_expansion_cache
+from app.services.gpt4o_service import gpt4o_analyzer
+
+settings = get_settings()
+
+
+class StageLog:
+    """记录各阶段的执行状态: completed, skipped, timeout, failed"""
+    
+    def __init__(self, budget_ms: int):
+        self.budget_ms = budget_ms
+        self.started = time.monotonic()
+        self.deadline = self.started + budget_ms / 1000
+        self.stages: List[Dict[str, Any]] = []
+    
+    def remaining(self) -> float:
+        """剩余预算(秒)"""
+        return self.deadline - time.monotonic()
+    
+    def elapsed_ms(self) -> int:
+        return int((time.monotonic() - self.started) * 1000)
+    
+    def record(self, name: str, status: str, started: Optional[float] = None, **extra):
+        entry = {"name": name, "status": status}
+        if started is not None:
+            entry["elapsed_ms"] = int((time.monotonic() - started) * 1000)
+        entry.update(extra)
+        self.stages.append(entry)
+    
+    @property
+    def degraded(self) -> bool:
+        """有阶段超时或失败，结果不完整"""
+        return any(stage["status"] in ("timeout", "failed") for stage in self.stages)
+
+
+class SearchOrchestrator:
+    """AI搜索编排器
+    
+    本地检索与GPT-4o查询扩展同时开始；扩展在预算内未返回时不再等待，
+    直接使用已有的检索结果。每个阶段的执行情况记录在响应的 stages 中。
+    """
+    
+    # 尚未完成的后台查询扩展，超时后继续运行以写入缓存
+    _background: set = set()
+    
+    def __init__(self, search_service, budget_ms: Optional[int] = None):
+        # search_service 为 SmartSearchService，复用其候选检索和结果格式化
+        self.search = search_service
+        self.db = search_service.db
+        self.log = StageLog(budget_ms or settings.search_latency_budget_ms)
+    
+    async def run(self, query: str, limit: int, rerank: bool) -> Dict[str, Any]:
+        expansion_task = asyncio.create_task(query_expansion_cache.get_or_expand(query))
+        
+        # 1. 本地检索（标签索引 + 相关性排序），与查询扩展并发执行
+        #    期间事件循环只等待扩展的网络请求，会话不会被并发使用
+        started = time.monotonic()
+        try:
+            local = await asyncio.to_thread(SearchService(self.db).search_images, query, limit * 2)
+            local_ids = [image["id"] for image in local["images"]]
+            self.log.record("retrieval", "completed", started, count=len(local_ids))
+        except Exception as e:
+            print(f"⚠️ 本地检索失败: {e}")
+            local_ids = []
+            self.log.record("retrieval", "failed", started)
+        
+        # 2. 在预算内等待查询扩展，为后续阶段预留时间
+        enhanced_query = await self._await_expansion(expansion_task)
+        
+        # 3. 扩展后的关键词检索，与本地检索结果合并
+        candidate_images = []
+        search_method = "tag_index"
+        if enhanced_query and self.log.remaining() > 0:
+            started = time.monotonic()
+            candidate_images = await self.search._get_candidate_images(enhanced_query, limit * 2)
+            self.log.record("expanded_retrieval", "completed", started, count=len(candidate_images))
+            search_method = "enhanced_keyword"
+        elif enhanced_query:
+            self.log.record("expanded_retrieval", "skipped")
+        
+        known_ids = {img["id"] for img in candidate_images}
+        extra_ids = [image_id for image_id in local_ids if image_id not in known_ids]
+        if extra_ids:
+            candidate_images = candidate_images + await self._hydrate(extra_ids)
+        
+        # 4. 本地向量排序（毫秒级），预算耗尽时跳过
+        if vector_index.size:
+            if self.log.remaining() > 0:
+                started = time.monotonic()
+                query_text = " ".join([query] + (enhanced_query or {}).get("keywords", []) + (enhanced_query or {}).get("synonyms", []))
+                candidate_images = await self.search._rank_by_vector(query_text, candidate_images, limit * 2)
+                self.log.record("vector_rank", "completed", started)
+                search_method = "vector_semantic"
+            else:
+                self.log.record("vector_rank", "skipped")
+        
+        result = {
+            "query": query,
+            "enhanced_query": enhanced_query or {"enhanced_query": query},
+            "search_method": search_method
+        }
+        
+        # 5. GPT-4o二次排序，剩余预算不足时跳过，超时则取消并保留当前顺序
+        if rerank and len(candidate_images) > limit:
+            candidate_images = await self._rerank(query, candidate_images, result)
+        
+        result.update({
+            "total": len(candidate_images[:limit]),
+            "images": candidate_images[:limit],
+            "stages": self.log.stages,
+            "budget_ms": self.log.budget_ms,
+            "elapsed_ms": self.log.elapsed_ms(),
+            "degraded": self.log.degraded
+        })
+        return result
+    
+    async def _await_expansion(self, task: asyncio.Task) -> Optional[Dict[str, Any]]:
+        """等待查询扩展，超出预算时放弃等待，让其在后台完成并写入缓存"""
+        started = self.log.started
+        timeout = self.log.remaining() - settings.search_stage_reserve_ms / 1000
+        try:
+            enhanced_query = await asyncio.wait_for(asyncio.shield(task), timeout=max(timeout, 0))
+        except asyncio.TimeoutError:
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+            self.log.record("expansion", "timeout", started)
+            return None
+        except Exception as e:
+            print(f"⚠️ 查询扩展失败: {e}")
+            self.log.record("expansion", "failed", started)
+            return None
+        
+        if not (enhanced_query.get("keywords") or enhanced_query.get("synonyms")):
+            # GPT调用失败时 enhance_search_query 返回不含关键词的结果
+            self.log.record("expansion", "failed", started)
+            return None
+        self.log.record("expansion", "completed", started)
+        return enhanced_query
+    
+    async def _hydrate(self, image_ids: List[int]) -> List[Dict[str, Any]]:
+        """按给定顺序取回并格式化图片"""
+        images = {image.id: image for image in self.db.query(Image).filter(Image.id.in_(image_ids)).all()}
+        return await self.search._format_image_results([images[i] for i in image_ids if i in images])
+    
+    async def _rerank(self, query: str, candidate_images: List[Dict[str, Any]], result: Dict[str, Any]) -> List[Dict[str, Any]]:
+        remaining = self.log.remaining()
+        if remaining < settings.search_rerank_min_ms / 1000:
+            self.log.record("rerank", "skipped")
+            return candidate_images
+        
+        started = time.monotonic()
+        descriptions = [img["description"] for img in candidate_images]
+        try:
+            similarity_result = await asyncio.wait_for(
+                gpt4o_analyzer.search_similar_images(query, descriptions), timeout=remaining
+            )
+        except asyncio.TimeoutError:
+            self.log.record("rerank", "timeout", started)
+            return candidate_images
+        except Exception as e:
+            print(f"⚠️ GPT-4o二次排序失败: {e}")
+            self.log.record("rerank", "failed", started)
+            return candidate_images
+        
+        if not similarity_result.get("matches"):
+            self.log.record("rerank", "failed", started)
+            return candidate_images
+        
+        self.log.record("rerank", "completed", started)
+        result["search_method"] = "gpt4o_semantic"
+        result["similarity_analysis"] = similarity_result.get("query_analysis", "")
+        return await self.search._sort_by_similarity(candidate_images, similarity_result)
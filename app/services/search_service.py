@@ -1,13 +1,18 @@
 """
 搜索服务 - 自然语言处理和图片检索
 """
-import re
 from typing import List, Dict, Any, Tuple, Optional
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, or_, func
 
 from app.models.image import Image, Tag, ImageTag, TagCategory
 from app.services.database_service import DatabaseService
+from app.services.tag_index_service import tag_index
+from app.services.fulltext_service import FullTextSearchService
+from app.services.query_parser_service import query_parser, KEYWORD_MAPPINGS, NEGATIVE_WORDS
+from app.services.popular_search_service import popular_searches
+from app.services.ranking_service import relevance_ranker, hydrate_ranked
+from app.services.color_palette_service import color_index
 
 
 class SearchService:
@@ -16,118 +21,18 @@ class SearchService:
     def __init__(self, db: Session):
         self.db = db
         self.db_service = DatabaseService(db)
+        self.fulltext = FullTextSearchService(db)
         
-        # 关键词映射字典
-        self.keyword_mappings = {
-            # 姿势相关
-            "站着": ["站姿", "站立"],
-            "坐着": ["坐姿"],
-            "躺着": ["躺姿"],
-            "蹲着": ["蹲姿"],
-            
-            # 性别相关
-            "女人": ["女性"],
-            "男人": ["男性"],
-            "女孩": ["女性"],
-            "男孩": ["男性"],
-            "女的": ["女性"],
-            "男的": ["男性"],
-            
-            # 年龄相关
-            "小孩": ["儿童"],
-            "孩子": ["儿童"],
-            "年轻": ["青年"],
-            "老人": ["老年"],
-            
-            # 服装相关
-            "西装": ["正装"],
-            "便装": ["休闲装"],
-            "裙子": ["裙子"],
-            "牛仔": ["牛仔裤"],
-            
-            # 场景相关
-            "室内": ["室内"],
-            "户外": ["户外"],
-            "外面": ["户外"],
-            "里面": ["室内"],
-            "办公": ["办公室"],
-            "家里": ["家居"],
-            "公园": ["公园"],
-            
-            # 角度相关
-            "正面": ["正面"],
-            "侧面": ["侧面"],
-            "背面": ["背面"],
-            "从上": ["俯视"],
-            "从下": ["仰视"],
-            "俯拍": ["俯视"],
-            "仰拍": ["仰视"],
-            
-            # 表情相关
-            "笑": ["微笑"],
-            "严肃": ["严肃"],
-            "想": ["思考表情"],
-            "放松": ["放松"],
-            
-            # 动作相关
-            "走": ["行走"],
-            "看书": ["阅读"],
-            "读书": ["阅读"],
-            "伸懒腰": ["伸展"],
-            
-            # 道具相关
-            "椅子": ["椅子"],
-            "桌子": ["桌子"],
-            "书": ["书本"],
-            "咖啡": ["咖啡杯"],
-            "没有道具": ["无道具"],
-            "无道具": ["无道具"],
-            
-            # 光线相关
-            "自然光": ["自然光"],
-            "阳光": ["自然光"],
-            "人造光": ["人工光"],
-            "灯光": ["人工光"],
-            "逆光": ["逆光"],
-            "柔光": ["柔和光"],
-            "强光": ["强光"],
-        }
-        
-        # 否定词
-        self.negative_words = ["不", "没有", "不是", "非", "除了", "不要"]
+        # 关键词映射与否定词在进程内编译为自动机，这里仅保留引用
+        self.keyword_mappings = KEYWORD_MAPPINGS
+        self.negative_words = NEGATIVE_WORDS
         
     def parse_natural_language(self, query: str) -> Dict[str, Any]:
         """解析自然语言查询"""
         query = query.strip().lower()
         
-        # 提取的标签和否定标签
-        positive_tags = []
-        negative_tags = []
-        
-        # 当前是否在否定上下文中
-        is_negative = False
-        
-        # 分词并处理
-        words = self._simple_tokenize(query)
-        
-        for i, word in enumerate(words):
-            # 检查否定词
-            if word in self.negative_words:
-                is_negative = True
-                continue
-            
-            # 检查是否匹配关键词
-            matched_tags = self._match_keywords(word)
-            if matched_tags:
-                if is_negative:
-                    negative_tags.extend(matched_tags)
-                    is_negative = False  # 重置否定状态
-                else:
-                    positive_tags.extend(matched_tags)
-        
-        # 去重
-        positive_tags = list(set(positive_tags))
-        negative_tags = list(set(negative_tags))
+        # 最长匹配切分，提取肯定标签和否定标签
+        positive_tags, negative_tags = query_parser.parse(query)
         
         # 分析查询意图
         intent = self._analyze_intent(query)
@@ -140,27 +45,6 @@ class SearchService:
             "parsed_successfully": len(positive_tags) > 0
         }
     
-    def _simple_tokenize(self, text: str) -> List[str]:
-        """简单分词"""
-        # 使用正则表达式分词
-        words = re.findall(r'[\u4e00-\u9fff]+|[a-zA-Z]+', text)
-        return words
-    
-    def _match_keywords(self, word: str) -> List[str]:
-        """匹配关键词到标签"""
-        matched_tags = []
-        
-        # 直接匹配
-        if word in self.keyword_mappings:
-            matched_tags.extend(self.keyword_mappings[word])
-        
-        # 模糊匹配
-        for keyword, tags in self.keyword_mappings.items():
-            if word in keyword or keyword in word:
-                matched_tags.extend(tags)
-        
-        return matched_tags
-    
     def _analyze_intent(self, query: str) -> str:
         """分析查询意图"""
         if any(word in query for word in ["坐", "站", "躺", "蹲"]):
@@ -194,8 +78,9 @@ class SearchService:
         }
         
         # 处理图片结果
+        tags_map = self.db_service.get_tags_for_images([image.id for image in images])
         for image in images:
-            image_tags = self.db_service.get_image_tags(image.id)
+            image_tags = tags_map.get(image.id, [])
             
             result["images"].append({
                 "id": image.id,
@@ -220,6 +105,14 @@ class SearchService:
         positive_tags = parsed["positive_tags"]
         negative_tags = parsed["negative_tags"]
         
+        # 优先使用内存标签索引计算候选集，数据库只负责取回最终结果
+        if tag_index.loaded and positive_tags:
+            candidate_ids = tag_index.match(positive_tags, negative_tags)
+            if not candidate_ids:
+                return []
+            if len(candidate_ids) <= tag_index.max_hydrate_ids:
+                return self._rank(base_query.filter(Image.id.in_(candidate_ids)), parsed, limit)
+        
         if positive_tags:
             # 包含指定标签的图片
             positive_subquery = self.db.query(ImageTag.image_id).join(Tag).filter(
@@ -236,24 +129,29 @@ class SearchService:
             
             base_query = base_query.filter(~Image.id.in_(negative_subquery))
         
-        # 按相关性排序（这里简化为按查看次数和上传时间）
-        base_query = base_query.order_by(
-            Image.view_count.desc(),
-            Image.upload_time.desc()
+        return self._rank(base_query, parsed, limit)
+    
+    def _rank(self, candidate_query, parsed: Dict[str, Any], limit: int) -> List[Image]:
+        """按相关性排序：BM25文本匹配、标签置信度、AI置信度和热度"""
+        ranked = relevance_ranker.rank_query(
+            self.db, candidate_query, parsed["original_query"], parsed["positive_tags"], limit
         )
-        
-        return base_query.limit(limit).all()
+        return hydrate_ranked(self.db, ranked)
     
     def _fallback_search(self, query: str, limit: int) -> Dict[str, Any]:
         """备用搜索 - 基于描述的模糊搜索"""
         
-        # 在AI描述中搜索关键词
-        images = self.db.query(Image).filter(
+        # 在AI描述和关键词中全文检索
+        condition, relevance = self.fulltext.search_condition("ft_images_description", [query])
+        images_query = self.db.query(Image).filter(
             and_(
                 Image.is_active == True,
-                Image.ai_description.contains(query)
+                condition
             )
-        ).order_by(Image.upload_time.desc()).limit(limit).all()
+        )
+        if relevance is not None:
+            images_query = images_query.order_by(relevance.desc())
+        images = images_query.order_by(Image.upload_time.desc()).limit(limit).all()
         
         result = {
             "query": query,
@@ -262,8 +160,9 @@ class SearchService:
             "images": []
         }
         
+        tags_map = self.db_service.get_tags_for_images([image.id for image in images])
         for image in images:
-            image_tags = self.db_service.get_image_tags(image.id)
+            image_tags = tags_map.get(image.id, [])
             
             result["images"].append({
                 "id": image.id,
@@ -281,6 +180,49 @@ class SearchService:
         
         return result
     
+    def search_by_color(self, colors: List[str], limit: int = 20) -> Dict[str, Any]:
+        """按主色调搜索 - 颜色索引一次计算全库距离，不调用AI"""
+        if not color_index.loaded:
+            color_index.load(self.db)
+        
+        # 索引不跟踪删除状态: 过滤已删除的图片，不足 limit 张时扩大候选数重新检索，直到索引取尽
+        k = limit * 2
+        while True:
+            ranked = color_index.search(colors, k)
+            images = [image for image in hydrate_ranked(self.db, ranked) if image.is_active]
+            if len(images) >= limit or len(ranked) < k:
+                break
+            k *= 2
+        images = images[:limit]
+        distances = dict(ranked)
+        
+        result = {
+            "colors": colors,
+            "total": len(images),
+            "images": []
+        }
+        
+        tags_map = self.db_service.get_tags_for_images([image.id for image in images])
+        for image in images:
+            image_tags = tags_map.get(image.id, [])
+            
+            result["images"].append({
+                "id": image.id,
+                "filename": image.filename,
+                "url": f"/uploads/{image.file_path.split('/')[-1]}",
+                "width": image.width,
+                "height": image.height,
+                "description": image.ai_description,
+                "confidence": image.ai_confidence,
+                "upload_time": image.upload_time.isoformat(),
+                "view_count": image.view_count,
+                "tags": [{"name": tag.name, "category": tag.category} for tag in image_tags],
+                "uploader": image.uploader,
+                "color_distance": round(distances[image.id], 2)
+            })
+        
+        return result
+    
     def get_search_suggestions(self, partial_query: str) -> List[str]:
         """获取搜索建议"""
         suggestions = []
@@ -299,8 +241,8 @@ class SearchService:
         return suggestions[:5]  # 返回前5个建议
     
     def get_popular_searches(self) -> List[str]:
-        """获取热门搜索词"""
-        return [
+        """获取热门搜索词，数据不足时用原有的默认搜索词补足"""
+        return popular_searches.popular_queries(8, [
             "女性坐姿",
             "男性站立",
             "室内正面",
@@ -309,4 +251,4 @@ class SearchService:
             "阅读动作",
             "办公室场景",
             "自然光照"
-        ]
\ No newline at end of file
+        ])
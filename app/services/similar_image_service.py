@@ -0,0 +1,334 @@
+"""
+相似图片预计算服务 - 稀疏 图片×标签 矩阵（IDF × 置信度加权）分块计算余弦 top-K，
+结果写入 image_neighbors 表，/api/similar 只需一次索引读取
+
+标签变化的图片先登记为待刷新，后台任务定时只重算受影响的行:
+变化的图片本身、当前列表中包含它的图片、以及与它的新相似度超过自身第K名的图片。
+IDF 在增量刷新时按当前标签分布重新计算，但未受影响的行不会重写，
+全量重建（build_similar_images.py）可消除这部分偏差。
+标签数组缓存在内存中，增量刷新只重新读取变化图片的标签。
+"""
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.models.image import Image, ImageTag, ImageNeighbor
+from app.services.response_cache_service import response_cache
+
+settings = get_settings()
+
+
+def weighted_tag_matrix(rows: Sequence[Tuple[int, int, Optional[float]]]) -> Tuple[np.ndarray, sparse.csr_matrix]:
+    """由 (图片ID, 标签ID, 置信度) 构建行L2归一化的 IDF × 置信度 稀疏矩阵，返回 (图片ID数组, 矩阵)"""
+    return weighted_tag_matrix_arrays(*tag_triples(rows))
+
+
+def tag_triples(rows: Sequence[Tuple[int, int, Optional[float]]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(图片ID, 标签ID, 置信度) 行转为三列数组"""
+    image_col = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    tag_col = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+    # 旧数据没有置信度，按 1.0 处理
+    confidences = np.fromiter((row[2] if row[2] and row[2] > 0 else 1.0 for row in rows),
+                              dtype=np.float64, count=len(rows))
+    return image_col, tag_col, confidences
+
+
+def weighted_tag_matrix_arrays(image_col: np.ndarray, tag_col: np.ndarray,
+                               confidences: np.ndarray) -> Tuple[np.ndarray, sparse.csr_matrix]:
+    """三列数组版本的 weighted_tag_matrix"""
+    if len(image_col) == 0:
+        return np.zeros(0, dtype=np.int64), sparse.csr_matrix((0, 0), dtype=np.float64)
+    
+    image_ids = np.unique(image_col)
+    tag_ids = np.unique(tag_col)
+    matrix = sparse.csr_matrix(
+        (np.minimum(confidences, 1.0), (np.searchsorted(image_ids, image_col), np.searchsorted(tag_ids, tag_col))),
+        shape=(len(image_ids), len(tag_ids))
+    )
+    matrix.sum_duplicates()
+    
+    # 平滑 IDF: 越少见的标签权重越高
+    doc_freq = np.bincount(matrix.indices, minlength=len(tag_ids))
+    idf = np.log((1.0 + len(image_ids)) / (1.0 + doc_freq)) + 1.0
+    matrix = sparse.csr_matrix(matrix.multiply(idf.reshape(1, -1)))
+    
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return image_ids, sparse.csr_matrix(sparse.diags(1.0 / norms) @ matrix)
+
+
+def top_k_neighbors(matrix: sparse.csr_matrix, image_ids: np.ndarray, rows: Sequence[int],
+                    k: int) -> Dict[int, List[Tuple[int, float]]]:
+    """计算一批行的余弦 top-K 相似图片（不含自身），按得分降序、ID升序排列"""
+    result: Dict[int, List[Tuple[int, float]]] = {}
+    if len(rows) == 0:
+        return result
+    
+    rows = np.asarray(rows, dtype=np.int64)
+    scores = sparse.csr_matrix(matrix[rows] @ matrix.T)
+    for offset, row in enumerate(rows):
+        start, end = scores.indptr[offset], scores.indptr[offset + 1]
+        cols = scores.indices[start:end]
+        values = scores.data[start:end]
+        keep = (cols != row) & (values > 1e-9)
+        # 舍入后再排序，标签组合相同的图片得分完全相等，按ID稳定排列
+        cols, values = cols[keep], np.round(values[keep], 6)
+        
+        if len(values) > k:
+            # 保留与第K名同分的全部候选，排序后再截断，结果不受 argpartition 选取顺序影响
+            kth = -np.partition(-values, k - 1)[k - 1]
+            keep = values >= kth
+            cols, values = cols[keep], values[keep]
+        order = np.lexsort((image_ids[cols], -values))[:k]
+        result[int(image_ids[row])] = [(int(image_ids[col]), float(value))
+                                       for col, value in zip(cols[order], values[order])]
+    return result
+
+
+class SimilarImageIndex:
+    """相似图片表维护: 全量重建 + 按标签变化增量刷新"""
+    
+    # 单条 DELETE / 阈值查询包含的最大图片数量
+    batch_size = 500
+    
+    def __init__(self, top_k: int, block_size: int):
+        self.top_k = top_k
+        self.block_size = block_size
+        self._dirty: Set[int] = set()
+        # 其他进程修改了标签的图片: 只需重读缓存的标签数组，相似图片行由写入方的刷新任务重写
+        self._stale: Set[int] = set()
+        self._lock = threading.Lock()
+        # 重建和增量刷新互斥，避免并发写同一批行
+        self._build_lock = threading.Lock()
+        self.built = False
+        self.built_at: Optional[datetime] = None
+        self.refreshed_rows = 0
+        # 增量刷新复用的 (图片ID, 标签ID, 置信度) 三列数组，只重新读取变化图片的标签
+        self._triples: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+        self._triples_loaded_at = 0.0
+    
+    def load(self, db: Session) -> bool:
+        """检查相似图片表是否已有数据，没有时需要全量重建"""
+        self.built = db.query(ImageNeighbor.image_id).first() is not None
+        return self.built
+    
+    def mark_dirty(self, image_id: int):
+        """登记标签发生变化的图片，由后台任务增量刷新"""
+        with self._lock:
+            self._dirty.add(image_id)
+    
+    def mark_stale(self, image_ids: Iterable[int]):
+        """登记其他进程修改了标签的图片，下次增量刷新时重新读取其标签"""
+        with self._lock:
+            self._stale.update(image_ids)
+    
+    def _take_stale(self) -> Set[int]:
+        with self._lock:
+            stale = self._stale
+            self._stale = set()
+        return stale
+    
+    def _take_dirty(self) -> Set[int]:
+        with self._lock:
+            dirty = self._dirty
+            self._dirty = set()
+        return dirty
+    
+    def _restore(self, image_ids: Iterable[int]):
+        """刷新失败时放回待刷新集合，下次重试"""
+        with self._lock:
+            self._dirty.update(image_ids)
+    
+    @staticmethod
+    def load_triples(db: Session, image_ids: Optional[List[int]] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """读取有效图片的标签（指定 image_ids 时只读取这些图片）"""
+        query = db.query(ImageTag.image_id, ImageTag.tag_id, ImageTag.confidence).join(
+            Image, Image.id == ImageTag.image_id
+        ).filter(Image.is_active == True)
+        if image_ids is None:
+            return tag_triples(query.all())
+        
+        rows = []
+        for start in range(0, len(image_ids), SimilarImageIndex.batch_size):
+            rows.extend(query.filter(ImageTag.image_id.in_(image_ids[start:start + SimilarImageIndex.batch_size])).all())
+        return tag_triples(rows)
+    
+    @staticmethod
+    def build_matrix(db: Session) -> Tuple[np.ndarray, sparse.csr_matrix]:
+        """读取全部有效图片的标签，构建加权矩阵"""
+        return weighted_tag_matrix_arrays(*SimilarImageIndex.load_triples(db))
+    
+    def _refresh_matrix(self, db: Session, changed_ids: Set[int]) -> Tuple[np.ndarray, sparse.csr_matrix]:
+        """
+        在内存中替换变化图片的标签后重新加权，不再每次扫描整个 image_tags；
+        首次刷新或超过 similar_matrix_reload_interval 时全量读取，纠正未登记的变化（如图片停用）
+        """
+        stale_ids = self._take_stale()
+        if self._triples is None or time.monotonic() - self._triples_loaded_at > settings.similar_matrix_reload_interval:
+            self._triples = self.load_triples(db)
+            self._triples_loaded_at = time.monotonic()
+        else:
+            changed_list = sorted(changed_ids | stale_ids)
+            image_col, tag_col, confidences = self._triples
+            keep = ~np.isin(image_col, np.asarray(changed_list, dtype=np.int64))
+            try:
+                new_image_col, new_tag_col, new_confidences = self.load_triples(db, changed_list)
+            except Exception:
+                self.mark_stale(stale_ids)
+                raise
+            self._triples = (
+                np.concatenate([image_col[keep], new_image_col]),
+                np.concatenate([tag_col[keep], new_tag_col]),
+                np.concatenate([confidences[keep], new_confidences])
+            )
+        return weighted_tag_matrix_arrays(*self._triples)
+    
+    def _write(self, db: Session, image_ids: List[int], neighbors: Dict[int, List[Tuple[int, float]]]):
+        """替换指定图片的相似图片行（由调用方提交事务）"""
+        for start in range(0, len(image_ids), self.batch_size):
+            chunk = image_ids[start:start + self.batch_size]
+            db.query(ImageNeighbor).filter(ImageNeighbor.image_id.in_(chunk)).delete(synchronize_session=False)
+        
+        values = [
+            {"image_id": image_id, "rank": rank, "neighbor_id": neighbor_id, "score": score}
+            for image_id, items in neighbors.items()
+            for rank, (neighbor_id, score) in enumerate(items)
+        ]
+        if values:
+            db.execute(insert(ImageNeighbor), values)
+    
+    def _compute_rows(self, matrix: sparse.csr_matrix, image_ids: np.ndarray,
+                      rows: Sequence[int]) -> Dict[int, List[Tuple[int, float]]]:
+        """分块计算，控制单次稀疏乘积的内存"""
+        neighbors: Dict[int, List[Tuple[int, float]]] = {}
+        for start in range(0, len(rows), self.block_size):
+            neighbors.update(top_k_neighbors(matrix, image_ids, rows[start:start + self.block_size], self.top_k))
+        return neighbors
+    
+    def rebuild(self, db: Session) -> int:
+        """全量重建相似图片表，返回写入的图片数量"""
+        with self._build_lock:
+            # 重建会覆盖全部行，之前登记的增量无需再处理
+            self._take_dirty()
+            self._take_stale()
+            self._triples = self.load_triples(db)
+            self._triples_loaded_at = time.monotonic()
+            image_ids, matrix = weighted_tag_matrix_arrays(*self._triples)
+            
+            try:
+                db.query(ImageNeighbor).delete(synchronize_session=False)
+                for start in range(0, len(image_ids), self.block_size):
+                    rows = list(range(start, min(start + self.block_size, len(image_ids))))
+                    self._write(db, [], top_k_neighbors(matrix, image_ids, rows, self.top_k))
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            
+            self.built = True
+            self.built_at = datetime.now()
+            print(f"✅ 相似图片表重建完成: {len(image_ids)} 张图片")
+            return len(image_ids)
+    
+    def _kth_scores(self, db: Session, image_ids: List[int]) -> Dict[int, Tuple[int, float]]:
+        """每张图片当前的相似图片数量和最低得分"""
+        thresholds: Dict[int, Tuple[int, float]] = {}
+        for start in range(0, len(image_ids), self.batch_size):
+            chunk = image_ids[start:start + self.batch_size]
+            rows = db.query(
+                ImageNeighbor.image_id, func.count(ImageNeighbor.rank), func.min(ImageNeighbor.score)
+            ).filter(ImageNeighbor.image_id.in_(chunk)).group_by(ImageNeighbor.image_id).all()
+            thresholds.update({image_id: (count, score) for image_id, count, score in rows})
+        return thresholds
+    
+    def refresh(self, db: Session, changed_ids: Set[int]) -> int:
+        """增量刷新标签变化的图片及受其影响的行，返回重写的图片数量"""
+        if not changed_ids:
+            return 0
+        
+        with self._build_lock:
+            image_ids, matrix = self._refresh_matrix(db, changed_ids)
+            row_of = {int(image_id): row for row, image_id in enumerate(image_ids)}
+            affected: Set[int] = set(changed_ids)
+            
+            # 1. 当前列表中包含变化图片的行（标签减少或图片失效后需要补位）
+            changed_list = sorted(changed_ids)
+            for start in range(0, len(changed_list), self.batch_size):
+                chunk = changed_list[start:start + self.batch_size]
+                affected.update(image_id for (image_id,) in db.query(ImageNeighbor.image_id).filter(
+                    ImageNeighbor.neighbor_id.in_(chunk)
+                ).distinct())
+            
+            # 2. 与变化图片的新相似度超过自身第K名的行
+            changed_rows = [row_of[image_id] for image_id in changed_ids if image_id in row_of]
+            if changed_rows:
+                best = np.asarray(sparse.csr_matrix(matrix @ matrix[changed_rows].T).max(axis=1).todense()).ravel()
+                candidates = [int(image_ids[row]) for row in np.flatnonzero(best > 0)
+                              if int(image_ids[row]) not in affected]
+                thresholds = self._kth_scores(db, candidates)
+                for image_id in candidates:
+                    count, min_score = thresholds.get(image_id, (0, 0.0))
+                    if count < self.top_k or best[row_of[image_id]] >= min_score:
+                        affected.add(image_id)
+            
+            rows = sorted(row_of[image_id] for image_id in affected if image_id in row_of)
+            neighbors = self._compute_rows(matrix, image_ids, rows)
+            try:
+                self._write(db, sorted(affected), neighbors)
+                db.commit()
+            except Exception:
+                db.rollback()
+                # 变化会放回待刷新集合，缓存的标签数组仍按新标签保留
+                raise
+            
+            self.refreshed_rows += len(affected)
+            return len(affected)
+    
+    def refresh_pending(self) -> int:
+        """刷新已登记的图片（在线程中执行）"""
+        from app.database import SessionLocal
+        
+        changed_ids = self._take_dirty()
+        if not changed_ids:
+            return 0
+        
+        db = SessionLocal()
+        try:
+            return self.refresh(db, changed_ids)
+        except Exception:
+            self._restore(changed_ids)
+            raise
+        finally:
+            db.close()
+    
+    async def run_refresher(self):
+        """定时增量刷新任务，在应用生命周期内运行"""
+        while True:
+            await asyncio.sleep(settings.similar_refresh_interval)
+            if not self.built or not self._dirty:
+                continue
+            try:
+                if await asyncio.to_thread(self.refresh_pending):
+                    await response_cache.invalidate_async()
+            except Exception as e:
+                print(f"❌ 增量刷新相似图片失败: {e}")
+    
+    def stats(self) -> Dict[str, object]:
+        return {
+            "built": self.built,
+            "built_at": self.built_at.isoformat() if self.built_at else None,
+            "pending_images": len(self._dirty),
+            "refreshed_rows": self.refreshed_rows
+        }
+
+
+# 创建全局相似图片索引实例
+similar_images = SimilarImageIndex(settings.similar_top_k, settings.similar_block_size)
@@ -1,14 +1,24 @@
 """
 智能搜索服务 - 添加相似图片推荐功能
 """
+import asyncio
 import json
 from typing import List, Dict, Any, Optional
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, or_, func, text
 
-from app.models.image import Image, Tag, ImageTag
+from app.models.image import Image, Tag, ImageTag, ImageNeighbor
 from app.services.database_service import DatabaseService
-from app.services.gpt4o_service import gpt4o_analyzer
+from app.services.tag_index_service import tag_index
+from app.services.fulltext_service import FullTextSearchService
+from app.services.vector_index_service import vector_index
+from app.services.query_expansion_service import query_expansion_cache
+from app.services.ranking_service import relevance_ranker, hydrate_ranked
+from app.services.search_orchestrator_service import SearchOrchestrator
+from app.services.similar_image_service import similar_images
+from app.config import get_settings
+
+settings = get_settings()
 
 
 class SmartSearchService:
@@ -17,6 +27,7 @@ class SmartSearchService:
     def __init__(self, db: Session):
         self.db = db
         self.db_service = DatabaseService(db)
+        self.fulltext = FullTextSearchService(db)
     
     async def find_similar_images(self, image_id: int, similarity_type: str = "tags", limit: int = 6) -> Dict[str, Any]:
         """查找相似图片"""
@@ -51,7 +62,18 @@ class SmartSearchService:
             return {"success": False, "error": str(e)}
     
     async def _find_similar_by_tags(self, target_image: Image, limit: int) -> List[Dict[str, Any]]:
-        """基于标签查找相似图片"""
+        """基于标签查找相似图片 - 读取预计算的相似图片表，未构建时实时聚合"""
+        if similar_images.built:
+            rows = self.db.query(Image, ImageNeighbor.score).join(
+                ImageNeighbor, ImageNeighbor.neighbor_id == Image.id
+            ).filter(
+                ImageNeighbor.image_id == target_image.id,
+                Image.is_active == True
+            ).order_by(ImageNeighbor.rank).limit(limit).all()
+            return await self._format_similar_images(
+                [image for image, _ in rows], [], scores=[score for _, score in rows]
+            )
+        
         # 获取目标图片的标签
         target_tags = self.db_service.get_image_tags(target_image.id)
         if not target_tags:
@@ -71,8 +93,8 @@ class SmartSearchService:
             Image.view_count.desc()
         ).limit(limit)
         
-        similar_images = similar_images_query.all()
-        return await self._format_similar_images(similar_images, target_tag_names)
+        images = similar_images_query.all()
+        return await self._format_similar_images(images, target_tag_names)
     
     async def _find_similar_by_style(self, target_image: Image, limit: int) -> List[Dict[str, Any]]:
         """基于风格查找相似图片"""
@@ -80,14 +102,18 @@ class SmartSearchService:
         if not target_style:
             return await self._find_similar_by_tags(target_image, limit)
         
-        # 查找相同风格的图片
-        similar_images = self.db.query(Image).filter(
+        # 查找相同风格的图片 - 全文索引按相关度排序
+        condition, relevance = self.fulltext.search_condition("ft_images_style", [target_style], natural=True)
+        similar_query = self.db.query(Image).filter(
             and_(
                 Image.is_active == True,
                 Image.id != target_image.id,
-                Image.ai_style.contains(target_style)
+                condition
             )
-        ).order_by(
+        )
+        if relevance is not None:
+            similar_query = similar_query.order_by(relevance.desc())
+        similar_images = similar_query.order_by(
             Image.ai_confidence.desc(),
             Image.view_count.desc()
         ).limit(limit).all()
@@ -100,14 +126,18 @@ class SmartSearchService:
         if not target_mood:
             return await self._find_similar_by_tags(target_image, limit)
         
-        # 查找相同氛围的图片
-        similar_images = self.db.query(Image).filter(
+        # 查找相同氛围的图片 - 全文索引按相关度排序
+        condition, relevance = self.fulltext.search_condition("ft_images_mood", [target_mood], natural=True)
+        similar_query = self.db.query(Image).filter(
             and_(
                 Image.is_active == True,
                 Image.id != target_image.id,
-                Image.ai_mood.contains(target_mood)
+                condition
             )
-        ).order_by(
+        )
+        if relevance is not None:
+            similar_query = similar_query.order_by(relevance.desc())
+        similar_images = similar_query.order_by(
             Image.ai_confidence.desc(),
             Image.view_count.desc()
         ).limit(limit).all()
@@ -151,13 +181,19 @@ class SmartSearchService:
         
         return await self._format_similar_images(similar_images, target_keywords)
     
-    async def _format_similar_images(self, images: List[Image], reference_terms: List[str]) -> List[Dict[str, Any]]:
-        """格式化相似图片结果"""
+    async def _format_similar_images(self, images: List[Image], reference_terms: List[str],
+                                     scores: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+        """格式化相似图片结果，未提供得分时按参考词计算"""
         result_images = []
+        tags_map = self.db_service.get_tags_for_images([image.id for image in images])
         
-        for image in images:
+        # 一次性计算全部图片的相似度得分
+        if scores is None:
+            scores = relevance_ranker.rank_images(self.db, images, " ".join(reference_terms), reference_terms)
+        
+        for image, score in zip(images, scores):
             # 获取标签
-            tags = self.db_service.get_image_tags(image.id)
+            tags = tags_map.get(image.id, [])
             
             # 解析搜索关键词
             searchable_keywords = []
@@ -170,11 +206,6 @@ class SmartSearchService:
                 except:
                     pass
             
-            # 计算相似度得分（简化计算）
-            similarity_score = self._calculate_similarity_score(
-                image, tags, searchable_keywords, reference_terms
-            )
-            
             result_images.append({
                 "id": image.id,
                 "filename": image.filename,
@@ -190,7 +221,7 @@ class SmartSearchService:
                 "uploader": image.uploader,
                 "tags": [{"name": tag.name, "category": tag.category} for tag in tags],
                 "searchable_keywords": searchable_keywords,
-                "similarity_score": similarity_score
+                "similarity_score": round(float(score), 4)
             })
         
         # 按相似度排序
@@ -198,71 +229,43 @@ class SmartSearchService:
         
         return result_images
     
-    def _calculate_similarity_score(self, image: Image, tags: List[Tag], 
-                                  searchable_keywords: List[str], reference_terms: List[str]) -> float:
-        """计算相似度得分"""
-        score = 0.0
-        
-        # 标签匹配度 (40%)
-        tag_names = [tag.name for tag in tags]
-        tag_matches = len(set(tag_names) & set(reference_terms))
-        tag_score = tag_matches / max(len(reference_terms), 1) * 0.4
-        
-        # 关键词匹配度 (30%)
-        keyword_matches = len(set(searchable_keywords) & set(reference_terms))
-        keyword_score = keyword_matches / max(len(reference_terms), 1) * 0.3
-        
-        # AI置信度 (20%)
-        confidence_score = (image.ai_confidence or 0.0) * 0.2
-        
-        # 流行度 (10%)
-        popularity_score = min(image.view_count / 100, 1.0) * 0.1
-        
-        score = tag_score + keyword_score + confidence_score + popularity_score
-        
-        return min(score, 1.0)
-    
     # 保持原有的搜索功能...
-    async def search_with_gpt4o(self, query: str, limit: int = 20) -> Dict[str, Any]:
-        """使用GPT-4o进行智能搜索"""
+    async def search_with_gpt4o(self, query: str, limit: int = 20, rerank: Optional[bool] = None,
+                                budget_ms: Optional[int] = None) -> Dict[str, Any]:
+        """使用GPT-4o进行智能搜索 - 在延迟预算内并发执行各阶段，超时的阶段跳过"""
+        if rerank is None:
+            rerank = settings.search_gpt_rerank
+        
         try:
-            # 1. 使用GPT-4o增强查询
-            enhanced_query = await gpt4o_analyzer.enhance_search_query(query)
-            
-            # 2. 获取所有可能相关的图片描述
-            candidate_images = await self._get_candidate_images(enhanced_query, limit * 2)
-            
-            # 3. 如果候选图片数量较少，直接返回
-            if len(candidate_images) <= limit:
-                return {
-                    "query": query,
-                    "enhanced_query": enhanced_query,
-                    "total": len(candidate_images),
-                    "images": candidate_images,
-                    "search_method": "enhanced_keyword"
-                }
-            
-            # 4. 使用GPT-4o进行语义相似度排序
-            descriptions = [img["description"] for img in candidate_images]
-            similarity_result = await gpt4o_analyzer.search_similar_images(query, descriptions)
-            
-            # 5. 根据相似度重新排序
-            sorted_images = await self._sort_by_similarity(candidate_images, similarity_result)
-            
-            return {
-                "query": query,
-                "enhanced_query": enhanced_query,
-                "total": len(sorted_images),
-                "images": sorted_images[:limit],
-                "search_method": "gpt4o_semantic",
-                "similarity_analysis": similarity_result.get("query_analysis", "")
-            }
+            return await SearchOrchestrator(self, budget_ms).run(query, limit, rerank)
             
         except Exception as e:
             print(f"❌ Smart search failed: {e}")
             # 降级到传统搜索
             return await self._fallback_search(query, limit)
     
+    async def _rank_by_vector(self, query_text: str, candidate_images: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+        """合并向量检索结果并按余弦相似度排序"""
+        known_ids = {img["id"] for img in candidate_images}
+        extra_ids = [image_id for image_id, _ in vector_index.search(query_text, limit) if image_id not in known_ids]
+        
+        if extra_ids:
+            extra_images = self.db.query(Image).filter(
+                and_(
+                    Image.is_active == True,
+                    Image.id.in_(extra_ids)
+                )
+            ).all()
+            candidate_images = candidate_images + await self._format_image_results(extra_images)
+        
+        scores = vector_index.score_ids(query_text, [img["id"] for img in candidate_images])
+        for img in candidate_images:
+            img["vector_score"] = round(scores.get(img["id"], 0.0), 4)
+        
+        # 稳定排序，得分相同时保持关键词检索的顺序
+        candidate_images.sort(key=lambda x: x["vector_score"], reverse=True)
+        return candidate_images
+    
     async def _get_candidate_images(self, enhanced_query: Dict[str, Any], limit: int) -> List[Dict[str, Any]]:
         """获取候选图片"""
         # 提取关键词
@@ -277,37 +280,49 @@ class SmartSearchService:
         # 构建数据库查询
         base_query = self.db.query(Image).filter(Image.is_active == True)
         
-        # 在描述中搜索关键词
-        description_conditions = []
-        for term in all_search_terms:
-            description_conditions.append(Image.ai_description.contains(term))
-        
-        # 在标签中搜索关键词
-        tag_subquery = self.db.query(ImageTag.image_id).join(Tag).filter(
-            Tag.name.in_(all_search_terms)
-        ).subquery()
+        # 在描述和搜索关键词中全文检索
+        text_condition, relevance = self.fulltext.search_condition("ft_images_description", all_search_terms)
         
-        # 在搜索关键词中搜索
-        keyword_conditions = []
-        for term in all_search_terms:
-            keyword_conditions.append(
-                Image.ai_searchable_keywords.contains(f'"{term}"')
-            )
+        # 在标签中搜索关键词 - 优先使用内存标签索引
+        tag_candidate_ids = tag_index.lookup(all_search_terms) if tag_index.loaded else None
+        if tag_candidate_ids is not None and len(tag_candidate_ids) <= tag_index.max_hydrate_ids:
+            tag_condition = Image.id.in_(tag_candidate_ids) if tag_candidate_ids else False
+        else:
+            tag_subquery = self.db.query(ImageTag.image_id).join(Tag).filter(
+                Tag.name.in_(all_search_terms)
+            ).subquery()
+            tag_condition = Image.id.in_(tag_subquery)
         
         # 组合查询条件
         final_query = base_query.filter(
             or_(
-                or_(*description_conditions) if description_conditions else False,
-                Image.id.in_(tag_subquery),
-                or_(*keyword_conditions) if keyword_conditions else False
+                text_condition,
+                tag_condition
             )
-        ).order_by(
-            Image.view_count.desc(),
-            Image.upload_time.desc()
-        ).limit(limit)
+        )
         
-        images = final_query.all()
-        return await self._format_image_results(images)
+        # 全文条件只负责召回，排序交给相关性打分（分词和打分在线程中执行，不阻塞事件循环）
+        ranked = await asyncio.to_thread(
+            self._rank_in_thread, final_query, " ".join(all_search_terms), all_search_terms, limit, relevance
+        )
+        images = hydrate_ranked(self.db, ranked)
+        results = await self._format_image_results(images)
+        # 打分后被删除或停用的图片不会取回，按ID对应得分
+        scores = dict(ranked)
+        for img in results:
+            img["relevance_score"] = round(scores[img["id"]], 4)
+        return results
+    
+    @staticmethod
+    def _rank_in_thread(query, query_text: str, tag_names: List[str], limit: int, relevance):
+        """在线程中打分，使用独立会话（请求的会话不能跨线程使用）"""
+        from app.database import SessionLocal
+        
+        db = SessionLocal()
+        try:
+            return relevance_ranker.rank_query(db, query.with_session(db), query_text, tag_names, limit, relevance)
+        finally:
+            db.close()
     
     async def _get_latest_images(self, limit: int) -> List[Dict[str, Any]]:
         """获取最新图片"""
@@ -322,10 +337,11 @@ class SmartSearchService:
     async def _format_image_results(self, images: List[Image]) -> List[Dict[str, Any]]:
         """格式化图片结果"""
         result_images = []
+        tags_map = self.db_service.get_tags_for_images([image.id for image in images])
         
         for image in images:
             # 获取标签
-            tags = self.db_service.get_image_tags(image.id)
+            tags = tags_map.get(image.id, [])
             
             # 解析搜索关键词
             searchable_keywords = []
@@ -383,16 +399,21 @@ class SmartSearchService:
     
     async def _fallback_search(self, query: str, limit: int) -> Dict[str, Any]:
         """降级搜索"""
-        # 简单的关键词搜索
-        images = self.db.query(Image).filter(
+        # 全文检索描述和关键词，同时模糊匹配文件名；未建全文索引时回退到描述的模糊搜索
+        condition, relevance = self.fulltext.search_condition("ft_images_description", [query])
+        if relevance is None:
+            condition = Image.ai_description.contains(query)
+        condition = or_(condition, Image.filename.contains(query))
+        
+        images_query = self.db.query(Image).filter(
             and_(
                 Image.is_active == True,
-                or_(
-                    Image.ai_description.contains(query),
-                    Image.filename.contains(query)
-                )
+                condition
             )
-        ).order_by(Image.upload_time.desc()).limit(limit).all()
+        )
+        if relevance is not None:
+            images_query = images_query.order_by(relevance.desc())
+        images = images_query.order_by(Image.upload_time.desc()).limit(limit).all()
         
         formatted_images = await self._format_image_results(images)
         
@@ -406,8 +427,8 @@ class SmartSearchService:
     async def get_search_suggestions(self, partial_query: str) -> List[str]:
         """获取搜索建议"""
         try:
-            # 使用GPT-4o生成搜索建议
-            enhance_result = await gpt4o_analyzer.enhance_search_query(partial_query)
+            # 使用GPT-4o生成搜索建议（优先读取缓存）
+            enhance_result = await query_expansion_cache.get_or_expand(partial_query)
             
             suggestions = []
             suggestions.extend(enhance_result.get("related_searches", []))
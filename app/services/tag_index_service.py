@@ -0,0 +1,159 @@
+"""
+标签倒排索引服务 - 进程内内存索引，加速标签布尔查询
+"""
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.models.image import Tag, ImageTag
+
+# 会话 info 中暂存待提交的索引变更
+PENDING_KEY = "tag_index_pending"
+
+
+class TagIndex:
+    """标签倒排索引: 标签名 -> 图片ID集合"""
+    
+    # 候选ID超过该数量时回退到数据库子查询，避免生成过长的 IN 列表
+    max_hydrate_ids = 5000
+    
+    def __init__(self):
+        self._postings: Dict[str, Set[int]] = {}
+        self._image_tags: Dict[int, Set[str]] = {}
+        self._categories: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.loaded_at: Optional[datetime] = None
+    
+    def build(self, db: Session) -> int:
+        """从 image_tags 全量构建索引，返回关联数量"""
+        try:
+            rows = db.query(ImageTag.image_id, Tag.name).join(
+                Tag, ImageTag.tag_id == Tag.id
+            ).all()
+            categories = dict(db.query(Tag.name, Tag.category).all())
+        except SQLAlchemyError as e:
+            print(f"❌ 构建标签索引失败: {e}")
+            return 0
+        
+        postings: Dict[str, Set[int]] = defaultdict(set)
+        image_tags: Dict[int, Set[str]] = defaultdict(set)
+        for image_id, tag_name in rows:
+            postings[tag_name].add(image_id)
+            image_tags[image_id].add(tag_name)
+        
+        with self._lock:
+            self._postings = dict(postings)
+            self._image_tags = dict(image_tags)
+            self._categories = categories
+            self.loaded = True
+            self.loaded_at = datetime.now()
+        
+        print(f"✅ 标签索引构建完成: {len(self._postings)} 个标签, {len(rows)} 个关联")
+        return len(rows)
+    
+    def add(self, image_id: int, tag_names: Iterable[str]):
+        """增量添加图片标签"""
+        with self._lock:
+            for tag_name in tag_names:
+                self._postings.setdefault(tag_name, set()).add(image_id)
+                self._image_tags.setdefault(image_id, set()).add(tag_name)
+    
+    def discard(self, image_id: int, tag_names: Iterable[str]):
+        """增量移除图片标签"""
+        with self._lock:
+            for tag_name in tag_names:
+                ids = self._postings.get(tag_name)
+                if ids is not None:
+                    ids.discard(image_id)
+                    if not ids:
+                        del self._postings[tag_name]
+                names = self._image_tags.get(image_id)
+                if names is not None:
+                    names.discard(tag_name)
+    
+    def remove_image(self, image_id: int):
+        """移除图片的全部标签"""
+        names = list(self._image_tags.get(image_id, ()))
+        self.discard(image_id, names)
+        with self._lock:
+            self._image_tags.pop(image_id, None)
+    
+    def replace(self, image_id: int, tag_names: Iterable[str]):
+        """用数据库中的当前标签替换图片的全部标签（同步其他进程的写入）"""
+        names = set(tag_names)
+        current = self.tags_of(image_id)
+        self.discard(image_id, current - names)
+        self.add(image_id, names - current)
+        if not names:
+            with self._lock:
+                self._image_tags.pop(image_id, None)
+    
+    def stage(self, db: Session, operation: str, *args):
+        """登记随事务生效的索引变更: 提交后按顺序应用，回滚则丢弃"""
+        db.info.setdefault(PENDING_KEY, []).append((operation, args))
+    
+    def apply_pending(self, db: Session):
+        """应用会话中已提交的索引变更"""
+        for operation, args in db.info.pop(PENDING_KEY, []):
+            getattr(self, operation)(*args)
+    
+    def lookup(self, tag_names: Iterable[str]) -> Set[int]:
+        """返回包含任一标签的图片ID"""
+        result: Set[int] = set()
+        with self._lock:
+            for tag_name in tag_names:
+                result |= self._postings.get(tag_name, set())
+        return result
+    
+    def match(self, positive_tags: List[str], negative_tags: List[str]) -> Set[int]:
+        """正向标签取并集，再减去否定标签命中的图片"""
+        candidates = self.lookup(positive_tags)
+        if candidates and negative_tags:
+            candidates -= self.lookup(negative_tags)
+        return candidates
+    
+    def tags_of(self, image_id: int) -> Set[str]:
+        """返回图片当前的标签名"""
+        with self._lock:
+            return set(self._image_tags.get(image_id, ()))
+    
+    def categories_of(self, tag_names: Iterable[str]) -> Dict[str, str]:
+        """返回已知的标签分类，未知标签不在结果中"""
+        with self._lock:
+            return {name: self._categories[name] for name in tag_names if name in self._categories}
+    
+    def set_categories(self, categories: Dict[str, str]):
+        """登记标签分类（新建标签或按需从数据库补齐）"""
+        with self._lock:
+            self._categories.update(categories)
+    
+    def stats(self) -> Dict[str, int]:
+        """索引统计信息"""
+        with self._lock:
+            return {
+                "tags": len(self._postings),
+                "images": len(self._image_tags),
+                "postings": sum(len(ids) for ids in self._postings.values())
+            }
+
+
+# 创建全局标签索引实例
+tag_index = TagIndex()
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_pending_changes(session: Session):
+    tag_index.apply_pending(session)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_pending_changes(session: Session, transaction):
+    # 提交时已先行应用；回滚或未提交就关闭的事务丢弃暂存变更
+    if transaction.parent is None:
+        session.info.pop(PENDING_KEY, None)
@@ -0,0 +1,378 @@
+"""
+本地向量索引服务 - CPU编码器 + 内存映射向量矩阵，替代GPT语义排序
+"""
+import asyncio
+import contextlib
+import json
+import math
+import os
+import re
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.models.image import Image
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，只保留进程内锁
+    fcntl = None
+
+settings = get_settings()
+
+
+class TextEncoder(ABC):
+    """文本编码器基类 - 可替换为其他本地模型"""
+    
+    name = "base"
+    dim = 0
+    
+    @abstractmethod
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """将文本编码为L2归一化的向量矩阵 (len(texts), dim)"""
+
+
+class HashingEncoder(TextEncoder):
+    """特征哈希编码器: 中文字/二元组 + 英文单词，无需训练和外部模型"""
+    
+    name = "hashing-v1"
+    
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+    
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        """中文按字和相邻二元组切分，英文按单词切分"""
+        tokens = []
+        for chunk in re.findall(r'[\u4e00-\u9fff]+|[a-zA-Z0-9]+', (text or "").lower()):
+            if '\u4e00' <= chunk[0] <= '\u9fff':
+                tokens.extend(chunk)
+                tokens.extend(chunk[i:i + 2] for i in range(len(chunk) - 1))
+            else:
+                tokens.append(chunk)
+        return tokens
+    
+    def encode(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts: Dict[str, int] = {}
+            for token in self.tokenize(text):
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                # crc32 在进程间稳定，内置 hash() 每次启动都会变化
+                h = zlib.crc32(token.encode("utf-8"))
+                sign = 1.0 if h & 0x80000000 else -1.0
+                vectors[row, h % self.dim] += sign * (1.0 + math.log(count))
+        
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+def build_image_text(image: Image) -> str:
+    """拼接用于编码的图片文本: 描述、关键词、氛围、风格"""
+    keywords = image.ai_searchable_keywords or []
+    if isinstance(keywords, str):
+        try:
+            keywords = json.loads(keywords)
+        except ValueError:
+            keywords = [keywords]
+    if not isinstance(keywords, list):
+        keywords = []
+    
+    parts = [image.ai_description or "", " ".join(str(k) for k in keywords),
+             image.ai_mood or "", image.ai_style or ""]
+    return " ".join(part for part in parts if part)
+
+
+class VectorIndex:
+    """
+    图片向量索引 - 向量保存在内存映射文件中，一次矩阵乘法完成检索
+    
+    Web进程和独立分析worker会同时写入: 写操作持有目录下的文件锁，先按 meta.json 的
+    generation 同步其他进程的写入再追加行，ids.npy/meta.json 先写临时文件再原子替换；
+    检索前发现 meta.json 变化时重新加载。
+    """
+    
+    def __init__(self, index_dir: str, encoder: TextEncoder):
+        self.index_dir = index_dir
+        self.encoder = encoder
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.memmap] = None
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._rows: Dict[int, int] = {}
+        self._count = 0
+        self._generation = 0
+        self._meta_signature: Optional[Tuple[int, int]] = None
+    
+    @property
+    def size(self) -> int:
+        """已索引的图片数量"""
+        return len(self._rows)
+    
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.index_dir, "vectors.f32")
+    
+    @property
+    def _ids_path(self) -> str:
+        return os.path.join(self.index_dir, "ids.npy")
+    
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.index_dir, "meta.json")
+    
+    @property
+    def _lock_path(self) -> str:
+        return os.path.join(self.index_dir, ".lock")
+    
+    @contextlib.contextmanager
+    def _write_lock(self):
+        """跨进程文件锁 + 进程内锁"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(self._lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with self._lock:
+                    yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _stat_meta(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self._meta_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+    
+    def _read_meta(self) -> Optional[dict]:
+        try:
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+    
+    def _load_locked(self, meta: dict) -> bool:
+        """按元数据映射向量文件（调用方持有锁）"""
+        if meta.get("encoder") != self.encoder.name or meta.get("dim") != self.encoder.dim:
+            print("⚠️ 向量索引编码器已变化，需要重建")
+            return False
+        
+        self._count = int(meta.get("count", 0))
+        self._generation = int(meta.get("generation", 0))
+        self._ids = np.load(self._ids_path) if self._count else np.zeros(0, dtype=np.int64)
+        capacity = len(self._ids)
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r+",
+                                 shape=(capacity, self.encoder.dim)) if capacity else None
+        self._rows = {int(image_id): row for row, image_id in enumerate(self._ids[:self._count])
+                      if image_id >= 0}
+        return True
+    
+    def load(self) -> bool:
+        """从磁盘加载索引，编码器不一致时丢弃旧索引"""
+        with self._lock:
+            try:
+                self._meta_signature = self._stat_meta()
+                meta = self._read_meta()
+                if meta is None or not self._load_locked(meta):
+                    return False
+                print(f"✅ 向量索引加载完成: {len(self._rows)} 张图片")
+                return True
+            except Exception as e:
+                print(f"❌ 加载向量索引失败: {e}")
+                return False
+    
+    def refresh(self):
+        """其他进程写入后重新加载（meta.json 被替换时才读取）"""
+        signature = self._stat_meta()
+        if signature is None or signature == self._meta_signature:
+            return
+        try:
+            with self._lock:
+                self._meta_signature = signature
+                meta = self._read_meta()
+                if meta is not None and int(meta.get("generation", 0)) != self._generation:
+                    self._load_locked(meta)
+        except Exception as e:
+            print(f"⚠️ 重新加载向量索引失败: {e}")
+    
+    def _sync_locked(self):
+        """写入前同步其他进程的写入（调用方持有写锁）"""
+        meta = self._read_meta()
+        if meta is not None and int(meta.get("generation", 0)) != self._generation:
+            self._load_locked(meta)
+    
+    def _ensure_capacity(self, needed: int):
+        """按需扩容内存映射文件（容量翻倍）"""
+        capacity = 0 if self._matrix is None else self._matrix.shape[0]
+        if needed <= capacity:
+            return
+        
+        new_capacity = max(1024, capacity * 2, needed)
+        if self._matrix is not None:
+            self._matrix.flush()
+            del self._matrix
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(new_capacity * self.encoder.dim * 4)
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r+",
+                                 shape=(new_capacity, self.encoder.dim))
+        
+        ids = np.full(new_capacity, -1, dtype=np.int64)
+        ids[:len(self._ids)] = self._ids
+        self._ids = ids
+    
+    def _save_meta(self):
+        """持久化ID映射和元数据（先写临时文件再原子替换）"""
+        if self._matrix is not None:
+            self._matrix.flush()
+        self._generation += 1
+        
+        tmp_path = f"{self._ids_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, self._ids)
+        os.replace(tmp_path, self._ids_path)
+        
+        tmp_path = f"{self._meta_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"encoder": self.encoder.name, "dim": self.encoder.dim,
+                       "count": self._count, "generation": self._generation}, f)
+        os.replace(tmp_path, self._meta_path)
+        self._meta_signature = self._stat_meta()
+    
+    def upsert_many(self, items: List[Tuple[int, str]]):
+        """批量写入或更新图片向量"""
+        if not items:
+            return
+        vectors = self.encoder.encode([text for _, text in items])
+        
+        with self._write_lock():
+            self._sync_locked()
+            new_ids = {image_id for image_id, _ in items if image_id not in self._rows}
+            self._ensure_capacity(self._count + len(new_ids))
+            for (image_id, _), vector in zip(items, vectors):
+                row = self._rows.get(image_id)
+                if row is None:
+                    row = self._count
+                    self._count += 1
+                    self._rows[image_id] = row
+                    self._ids[row] = image_id
+                self._matrix[row] = vector
+            self._save_meta()
+    
+    def index_image(self, image: Image):
+        """分析完成后编码单张图片"""
+        self.index_text(image.id, build_image_text(image))
+    
+    def index_text(self, image_id: int, text: str):
+        """编码并写入单张图片的文本，文本为空时跳过"""
+        try:
+            if text:
+                self.upsert_many([(image_id, text)])
+        except Exception as e:
+            print(f"⚠️ 写入向量索引失败 ID {image_id}: {e}")
+    
+    async def index_image_async(self, image: Image):
+        """异步接口中编码单张图片: 图片文本在事件循环中读取（会话不跨线程），加锁、编码和文件读写在线程中执行"""
+        await asyncio.to_thread(self.index_text, image.id, build_image_text(image))
+    
+    def remove(self, image_id: int):
+        """移除图片向量（行置零，不参与检索）"""
+        self.remove_many([image_id])
+    
+    def remove_many(self, image_ids: List[int]):
+        """删除或停用图片后移除向量，失败时只记录日志"""
+        try:
+            with self._write_lock():
+                self._sync_locked()
+                changed = False
+                for image_id in image_ids:
+                    row = self._rows.pop(image_id, None)
+                    if row is not None and self._matrix is not None:
+                        self._matrix[row] = 0
+                        self._ids[row] = -1
+                        changed = True
+                if changed:
+                    self._save_meta()
+        except Exception as e:
+            print(f"⚠️ 移除向量失败 ID {image_ids}: {e}")
+    
+    async def remove_async(self, image_ids: List[int]):
+        """在线程中移除向量，不阻塞事件循环"""
+        if image_ids:
+            await asyncio.to_thread(self.remove_many, list(image_ids))
+    
+    def rebuild(self, db: Session, batch_size: int = 1000) -> int:
+        """从数据库全量重建索引"""
+        with self._write_lock():
+            self._sync_locked()
+            self._matrix = None
+            self._ids = np.zeros(0, dtype=np.int64)
+            self._rows = {}
+            self._count = 0
+            if os.path.exists(self._vectors_path):
+                os.remove(self._vectors_path)
+            self._save_meta()
+        
+        last_id = 0
+        total = 0
+        while True:
+            images = db.query(Image).filter(
+                Image.is_active == True,
+                Image.ai_analysis_status == 'completed',
+                Image.id > last_id
+            ).order_by(Image.id).limit(batch_size).all()
+            if not images:
+                break
+            
+            items = [(image.id, build_image_text(image)) for image in images]
+            self.upsert_many([item for item in items if item[1]])
+            total += len(items)
+            last_id = images[-1].id
+        
+        print(f"✅ 向量索引重建完成: {self.size} 张图片")
+        return total
+    
+    def search(self, query: str, k: int, exclude_id: Optional[int] = None) -> List[Tuple[int, float]]:
+        """余弦相似度 top-k: 一次矩阵乘法 + argpartition"""
+        self.refresh()
+        if not self._rows or k <= 0:
+            return []
+        query_vector = self.encoder.encode([query])[0]
+        
+        with self._lock:
+            scores = self._matrix[:self._count] @ query_vector
+            ids = self._ids[:self._count]
+            scores = np.where(ids >= 0, scores, -np.inf)
+            if exclude_id is not None:
+                scores = np.where(ids == exclude_id, -np.inf, scores)
+            
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(int(ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i]) and scores[i] > 0]
+    
+    def score_ids(self, query: str, image_ids: List[int]) -> Dict[int, float]:
+        """计算指定图片与查询的余弦相似度"""
+        self.refresh()
+        if not self._rows:
+            return {}
+        query_vector = self.encoder.encode([query])[0]
+        
+        with self._lock:
+            pairs = [(image_id, self._rows[image_id]) for image_id in image_ids if image_id in self._rows]
+            if not pairs:
+                return {}
+            rows = np.array([row for _, row in pairs])
+            scores = self._matrix[rows] @ query_vector
+            return {image_id: float(score) for (image_id, _), score in zip(pairs, scores)}
+
+
+# 创建全局向量索引实例
+vector_index = VectorIndex(settings.vector_index_dir, HashingEncoder(settings.vector_dim))
@@ -0,0 +1,169 @@
+"""
+查看次数计数服务 - 在内存中累计增量，定时以一条 UPDATE ... CASE 批量写回数据库
+"""
+import asyncio
+import threading
+import uuid
+from collections import Counter
+from typing import Dict, Iterable
+
+from sqlalchemy import case, func, update
+
+from app.config import get_settings
+from app.models.image import Image
+from app.services.cache_service import get_redis
+
+settings = get_settings()
+
+
+class ViewCounter:
+    """查看次数聚合器: 本进程累计，启用Redis时汇总到共享哈希，由一个进程统一写库"""
+    
+    redis_key = "ai-pose-gallery:view_counts"
+    redis_lock_key = "ai-pose-gallery:view_counts:lock"
+    # 单条 UPDATE 包含的最大图片数量
+    batch_size = 500
+    # 比较持有者后删除锁
+    _release_script = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+    
+    def __init__(self):
+        self._pending: Counter = Counter()
+        self._lock = threading.Lock()
+        self.flushed_total = 0
+        self.flush_count = 0
+    
+    def increment(self, image_id: int, count: int = 1):
+        with self._lock:
+            self._pending[image_id] += count
+    
+    def increment_many(self, image_ids: Iterable[int]):
+        with self._lock:
+            self._pending.update(image_ids)
+    
+    def pending(self, image_id: int) -> int:
+        """尚未写入数据库的增量，用于详情页显示"""
+        return self._pending.get(image_id, 0)
+    
+    def _take_pending(self) -> Dict[int, int]:
+        with self._lock:
+            counts = dict(self._pending)
+            self._pending.clear()
+        return counts
+    
+    def _restore(self, counts: Dict[int, int]):
+        """写入失败时放回缓冲区，下次重试"""
+        with self._lock:
+            self._pending.update(counts)
+    
+    def _write_to_db(self, counts: Dict[int, int]):
+        """批量写库: UPDATE images SET view_count = view_count + CASE id WHEN ... END"""
+        from app.database import SessionLocal
+        
+        db = SessionLocal()
+        try:
+            items = list(counts.items())
+            for start in range(0, len(items), self.batch_size):
+                chunk = dict(items[start:start + self.batch_size])
+                db.execute(
+                    update(Image)
+                    .where(Image.id.in_(list(chunk)))
+                    .values(view_count=func.coalesce(Image.view_count, 0) + case(chunk, value=Image.id, else_=0))
+                    .execution_options(synchronize_session=False)
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    
+    async def _flush_via_redis(self, redis_client, counts: Dict[int, int]):
+        """将本进程增量汇总到Redis，抢到锁的进程负责写库"""
+        if counts:
+            try:
+                pipe = redis_client.pipeline()
+                for image_id, count in counts.items():
+                    pipe.hincrby(self.redis_key, image_id, count)
+                await pipe.execute()
+            except Exception:
+                self._restore(counts)
+                raise
+        
+        token = uuid.uuid4().hex
+        if not await redis_client.set(self.redis_lock_key, token, nx=True, ex=settings.view_count_flush_lock_ttl):
+            return 0
+        
+        try:
+            if not await redis_client.exists(self.redis_key):
+                return 0
+            
+            # 改名、读取、删除在同一个事务中完成: 取出的增量不再留在Redis中，即使锁过期也不会被重复写库；
+            # 期间其他进程写入的增量进入新的哈希
+            processing_key = f"{self.redis_key}:processing"
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.rename(self.redis_key, processing_key)
+            pipe.hgetall(processing_key)
+            pipe.delete(processing_key)
+            _, raw, _ = await pipe.execute()
+            shared = {int(image_id): int(count) for image_id, count in raw.items()}
+            
+            try:
+                await asyncio.to_thread(self._write_to_db, shared)
+            except Exception:
+                # 写库失败时放回共享哈希，下次重试
+                pipe = redis_client.pipeline()
+                for image_id, count in shared.items():
+                    pipe.hincrby(self.redis_key, image_id, count)
+                await pipe.execute()
+                raise
+            return sum(shared.values())
+        finally:
+            await self._release_lock(redis_client, token)
+    
+    async def _release_lock(self, redis_client, token: str):
+        """只释放自己持有的写库锁（锁已过期并被其他进程取得时不删除）"""
+        try:
+            await redis_client.eval(self._release_script, 1, self.redis_lock_key, token)
+        except Exception as e:
+            print(f"⚠️ 释放查看次数写库锁失败: {e}")
+    
+    async def flush(self) -> int:
+        """写回累计的查看次数，返回写入的增量总数"""
+        counts = self._take_pending()
+        redis_client = get_redis()
+        
+        try:
+            if redis_client is not None:
+                flushed = await self._flush_via_redis(redis_client, counts)
+            elif counts:
+                await asyncio.to_thread(self._write_to_db, counts)
+                flushed = sum(counts.values())
+            else:
+                return 0
+        except Exception as e:
+            print(f"❌ 写入查看次数失败: {e}")
+            if redis_client is None:
+                self._restore(counts)
+            return 0
+        
+        self.flushed_total += flushed
+        self.flush_count += 1
+        return flushed
+    
+    async def run_flusher(self):
+        """定时写回任务，在应用生命周期内运行"""
+        while True:
+            await asyncio.sleep(settings.view_count_flush_interval)
+            await self.flush()
+    
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending_images": len(self._pending),
+            "pending_views": sum(self._pending.values()),
+            "flushed_total": self.flushed_total,
+            "flush_count": self.flush_count
+        }
+
+
+# 创建全局查看次数计数器实例
+view_counter = ViewCounter()
@@ -0,0 +1,106 @@
+"""
+图片特征回填脚本 - 为已有图片补齐感知哈希 (images.phash) 和主色调调色板 (images.color_palette)
+"""
+import sys
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+from sqlalchemy import or_
+
+from app.database import SessionLocal
+from app.models.image import Image
+from app.services.database_service import DatabaseService
+from app.services.perceptual_hash_service import phash_bytes
+from app.services.color_palette_service import palette_bytes
+from app.services.storage_service import storage_manager
+
+BATCH_SIZE = 200
+WORKERS = 8
+
+
+def load_image_bytes(file_path: str) -> Optional[bytes]:
+    """优先读取本地文件，不存在时从存储地址下载"""
+    if os.path.exists(file_path):
+        with open(file_path, 'rb') as f:
+            return f.read()
+    
+    try:
+        response = requests.get(storage_manager.get_image_url(file_path), timeout=15)
+        response.raise_for_status()
+        return response.content
+    except Exception as e:
+        print(f"⚠️ 下载图片失败 {file_path}: {e}")
+        return None
+
+
+def compute_features(image: Image) -> Tuple[Optional[str], Optional[bytes]]:
+    """只计算缺失的特征，返回 (pHash, 调色板)"""
+    content = load_image_bytes(image.file_path)
+    if content is None:
+        return None, None
+    phash = image.phash or phash_bytes(content)
+    palette = image.color_palette or palette_bytes(content)
+    return phash, palette
+
+
+def backfill(include_inactive: bool = False):
+    """按ID分批回填，单批内并发下载和计算"""
+    db = SessionLocal()
+    db_service = DatabaseService(db)
+    last_id = 0
+    updated = 0
+    failed = 0
+    
+    try:
+        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            while True:
+                query = db.query(Image).filter(
+                    or_(Image.phash == None, Image.color_palette == None),
+                    Image.id > last_id
+                )
+                if not include_inactive:
+                    query = query.filter(Image.is_active == True)
+                images = query.order_by(Image.id).limit(BATCH_SIZE).all()
+                if not images:
+                    break
+                
+                features = list(executor.map(compute_features, images))
+                new_palettes = []
+                for image, (phash, palette) in zip(images, features):
+                    if not phash and not palette:
+                        failed += 1
+                        continue
+                    if palette and not image.color_palette:
+                        new_palettes.append((image.id, palette))
+                    image.phash = phash
+                    image.color_palette = palette
+                    updated += 1
+                db.commit()
+                
+                # 颜色索引和颜色标签
+                for image_id, palette in new_palettes:
+                    db_service.apply_color_palette(image_id, palette)
+                
+                last_id = images[-1].id
+                print(f"📊 已处理到 ID {last_id}: 成功 {updated}, 失败 {failed}")
+        
+        print(f"🎉 图片特征回填完成: 成功 {updated}, 失败 {failed}")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ 图片特征回填失败: {e}")
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='图片特征回填工具（感知哈希、主色调）')
+    parser.add_argument('--include-inactive', action='store_true', help='同时处理已删除的图片')
+    args = parser.parse_args()
+    
+    backfill(args.include_inactive)
@@ -0,0 +1,181 @@
+"""
+视觉调用尺寸策略基准测试 - 比较各策略的图片token、调用延迟和标签一致性
+
+对同一组图片分别按每个策略预处理并直接调用视觉API（不经过分析缓存），
+以第一个策略的标签为基准计算其余策略的标签 Jaccard 一致性。
+--dry-run 只统计输出尺寸和预估token，不调用API。
+
+示例:
+    python benchmark_vision_sizing.py --limit 20 --policies fixed budget:4 budget:2 low
+    python benchmark_vision_sizing.py --dir ./uploads --dry-run
+"""
+import sys
+import os
+import asyncio
+import statistics
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.config import get_settings
+from app.services.ai_client_service import ai_client
+from app.services.gpt4o_service import gpt4o_analyzer, estimate_tokens, SEARCH_PROMPT
+from app.services.image_preprocess_service import image_preprocessor, SIZING_POLICIES
+
+settings = get_settings()
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def parse_policy(spec: str):
+    """budget:4 -> ("budget", 4)；未指定切片数时使用 VISION_MAX_TILES"""
+    policy, _, tiles = spec.partition(":")
+    if policy not in SIZING_POLICIES:
+        raise ValueError(f"未知的尺寸策略: {spec}")
+    return policy, int(tiles) if tiles else settings.vision_max_tiles
+
+
+def load_sources(directory: str = None, limit: int = 20):
+    """本地目录中的图片，或数据库中已完成分析的图片地址"""
+    if directory:
+        names = sorted(name for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS))
+        return [os.path.join(directory, name) for name in names[:limit]]
+    
+    from app.database import SessionLocal
+    from app.models.image import Image
+    from app.services.storage_service import storage_manager
+    
+    db = SessionLocal()
+    try:
+        rows = db.query(Image.file_path).filter(
+            Image.is_active == True,
+            Image.ai_analysis_status == 'completed'
+        ).order_by(Image.id.desc()).limit(limit).all()
+        return [storage_manager.get_image_url(file_path) for (file_path,) in rows]
+    finally:
+        db.close()
+
+
+def tag_set(analysis: dict) -> set:
+    tags = set()
+    for values in (analysis.get("tags") or {}).values():
+        if isinstance(values, list):
+            tags.update(str(value).strip() for value in values if value)
+    return tags
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def run_policy(source: str, policy: str, max_tiles: int, dry_run: bool) -> dict:
+    """预处理并调用一次视觉API"""
+    started = time.perf_counter()
+    image = await image_preprocessor.prepare(source, max_size=2048, quality=90, policy=policy, max_tiles=max_tiles)
+    result = {
+        "size": (image.width, image.height),
+        "detail": image.detail,
+        "estimated_tokens": image.tokens,
+        "bytes": len(image.data) * 3 // 4,
+        "preprocess_ms": (time.perf_counter() - started) * 1000
+    }
+    if dry_run:
+        return result
+    
+    payload = gpt4o_analyzer._build_vision_payload(image.data, SEARCH_PROMPT, image.detail)
+    started = time.perf_counter()
+    response = await ai_client.chat_completion(payload, settings.image_analysis_timeout,
+                                               estimate_tokens(SEARCH_PROMPT, image.tokens))
+    result["latency_ms"] = (time.perf_counter() - started) * 1000
+    if response.status_code != 200:
+        raise Exception(f"OpenAI API错误: {response.status_code} - {response.text}")
+    
+    body = response.json()
+    analysis = await gpt4o_analyzer._parse_and_validate_result(body["choices"][0]["message"]["content"])
+    result["prompt_tokens"] = (body.get("usage") or {}).get("prompt_tokens")
+    result["tags"] = tag_set(analysis)
+    return result
+
+
+async def benchmark(sources, policies, dry_run: bool):
+    results = {spec: [] for spec in policies}
+    await ai_client.open()
+    try:
+        for index, source in enumerate(sources, 1):
+            print(f"🖼️ [{index}/{len(sources)}] {source}")
+            for spec in policies:
+                policy, max_tiles = parse_policy(spec)
+                try:
+                    results[spec].append(await run_policy(source, policy, max_tiles, dry_run))
+                except Exception as e:
+                    print(f"  ❌ {spec}: {e}")
+                    results[spec].append(None)
+    finally:
+        await ai_client.close()
+        await image_preprocessor.shutdown()
+    return results
+
+
+def report(results, policies, dry_run: bool):
+    reference = results[policies[0]]
+    print(f"\n📊 尺寸策略对比（标签一致性以 {policies[0]} 为基准）")
+    header = f"{'策略':<12}{'平均尺寸':>14}{'预估token':>10}{'图片KB':>9}{'预处理ms':>10}"
+    if not dry_run:
+        header += f"{'实际prompt':>11}{'延迟p50':>9}{'延迟p95':>9}{'标签一致':>9}"
+    print(header)
+    
+    for spec in policies:
+        rows = [row for row in results[spec] if row]
+        if not rows:
+            print(f"{spec:<12}  全部失败")
+            continue
+        width = statistics.mean(row["size"][0] for row in rows)
+        height = statistics.mean(row["size"][1] for row in rows)
+        line = (f"{spec:<12}{f'{width:.0f}x{height:.0f}':>14}"
+                f"{statistics.mean(row['estimated_tokens'] for row in rows):>10.0f}"
+                f"{statistics.mean(row['bytes'] for row in rows) / 1024:>9.0f}"
+                f"{statistics.mean(row['preprocess_ms'] for row in rows):>10.0f}")
+        if not dry_run:
+            prompt_tokens = [row["prompt_tokens"] for row in rows if row.get("prompt_tokens")]
+            latencies = [row["latency_ms"] for row in rows]
+            agreement = [jaccard(row["tags"], ref["tags"])
+                         for row, ref in zip(results[spec], reference) if row and ref]
+            line += (f"{statistics.mean(prompt_tokens) if prompt_tokens else 0:>11.0f}"
+                     f"{percentile(latencies, 0.5):>9.0f}{percentile(latencies, 0.95):>9.0f}"
+                     f"{statistics.mean(agreement) if agreement else 0:>9.2f}")
+        print(line)
+
+
+def main(directory: str = None, limit: int = 20, policies=None, dry_run: bool = False):
+    policies = policies or ["fixed", f"budget:{settings.vision_max_tiles}", "low"]
+    for spec in policies:
+        parse_policy(spec)
+    
+    sources = load_sources(directory, limit)
+    if not sources:
+        print("⚠️ 没有找到图片")
+        return
+    
+    print(f"🚀 基准测试: {len(sources)} 张图片, 策略 {', '.join(policies)}{' (dry-run)' if dry_run else ''}")
+    results = asyncio.run(benchmark(sources, policies, dry_run))
+    report(results, policies, dry_run)
+
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='视觉调用尺寸策略基准测试')
+    parser.add_argument('--dir', default=None, help='本地图片目录（默认取数据库中已完成分析的图片）')
+    parser.add_argument('--limit', type=int, default=20, help='图片数量')
+    parser.add_argument('--policies', nargs='+', default=None,
+                        help='策略列表: fixed, budget[:切片数], low；第一个作为标签一致性基准')
+    parser.add_argument('--dry-run', action='store_true', help='只统计尺寸和预估token，不调用API')
+    args = parser.parse_args()
+    
+    main(args.dir, args.limit, args.policies, args.dry_run)
@@ -0,0 +1,32 @@
+"""
+相似图片离线计算脚本 - 全量重建 image_neighbors 表
+"""
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.database import SessionLocal, create_tables
+from app.services.similar_image_service import similar_images
+
+
+def main():
+    """全量重建相似图片表"""
+    print("🚀 开始计算相似图片...")
+    create_tables()
+    
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        count = similar_images.rebuild(db)
+        print(f"🎉 完成: {count} 张图片, 每张保留 {similar_images.top_k} 个相似图片, "
+              f"耗时 {time.perf_counter() - started:.1f}s")
+    except Exception as e:
+        print(f"❌ 计算相似图片失败: {e}")
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,11 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from migrations.add_oss_fields import upgrade as add_oss_fields_upgrade, downgrade as add_oss_fields_downgrade
+from migrations.add_fulltext_indexes import upgrade as add_fulltext_indexes_upgrade, downgrade as add_fulltext_indexes_downgrade
+from migrations.add_pagination_index import upgrade as add_pagination_index_upgrade, downgrade as add_pagination_index_downgrade
+from migrations.add_phash_column import upgrade as add_phash_column_upgrade, downgrade as add_phash_column_downgrade
+from migrations.add_color_palette_column import upgrade as add_color_palette_column_upgrade, downgrade as add_color_palette_column_downgrade
+from migrations.add_image_tokens_column import upgrade as add_image_tokens_column_upgrade, downgrade as add_image_tokens_column_downgrade
 
 def run_migrations():
     """运行所有迁移"""
@@ -14,6 +19,21 @@ def run_migrations():
     try:
         # 运行添加OSS字段的迁移
         add_oss_fields_upgrade()
+        
+        # 添加全文索引（ngram分词）
+        add_fulltext_indexes_upgrade()
+        
+        # 添加游标分页索引
+        add_pagination_index_upgrade()
+        
+        # 添加感知哈希字段（近似重复检测）
+        add_phash_column_upgrade()
+        
+        # 添加主色调字段（颜色搜索）
+        add_color_palette_column_upgrade()
+        
+        # 添加图片token预估字段（视觉调用尺寸策略）
+        add_image_tokens_column_upgrade()
         print("✅ 所有迁移执行完成!")
         
     except Exception as e:
@@ -27,6 +47,11 @@ def rollback_migrations():
     print("🔄 开始回滚迁移...")
     
     try:
+        add_image_tokens_column_downgrade()
+        add_color_palette_column_downgrade()
+        add_phash_column_downgrade()
+        add_pagination_index_downgrade()
+        add_fulltext_indexes_downgrade()
         add_oss_fields_downgrade()
         print("✅ 回滚完成!")
         
@@ -0,0 +1,64 @@
+"""
+添加主色调字段的迁移脚本 - MySQL版本
+"""
+from sqlalchemy import text
+from app.database import get_db
+
+
+def upgrade():
+    """升级数据库 - 添加 color_palette 字段"""
+    db = next(get_db())
+    
+    try:
+        print("🔧 开始添加主色调字段...")
+        
+        result = db.execute(text("""
+            SELECT COLUMN_NAME
+            FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE()
+            AND TABLE_NAME = 'images'
+        """)).fetchall()
+        existing_columns = [row[0] for row in result]
+        
+        if 'color_palette' not in existing_columns:
+            db.execute(text("""
+                ALTER TABLE images
+                ADD COLUMN color_palette VARBINARY(32) NULL COMMENT '主色调调色板，每色4字节打包的Lab值和占比'
+            """))
+            print("✅ 添加 color_palette 字段")
+        else:
+            print("⏭️ color_palette 字段已存在")
+        
+        db.commit()
+        print("🎉 主色调字段添加完成!")
+    
+    except Exception as e:
+        db.rollback()
+        print(f"❌ 添加主色调字段失败: {e}")
+        raise
+    finally:
+        db.close()
+
+
+def downgrade():
+    """降级数据库 - 移除 color_palette 字段"""
+    db = next(get_db())
+    
+    try:
+        print("🔧 开始移除主色调字段...")
+        
+        try:
+            db.execute(text("ALTER TABLE images DROP COLUMN color_palette"))
+            print("✅ 删除 color_palette 字段")
+        except Exception as e:
+            print(f"⚠️ 删除 color_palette 字段失败: {e}")
+        
+        db.commit()
+        print("🎉 主色调字段移除完成!")
+    
+    except Exception as e:
+        db.rollback()
+        print(f"❌ 移除主色调字段失败: {e}")
+        raise
+    finally:
+        db.close()
@@ -0,0 +1,99 @@
+"""
+添加全文索引的迁移脚本 - MySQL版本（ngram 分词，支持中文）
+"""
+from sqlalchemy import text
+from app.database import get_db
+
+# 索引名 -> 列
+FULLTEXT_INDEXES = {
+    "ft_images_description": "ai_description, ai_keywords_text",
+    "ft_images_style": "ai_style",
+    "ft_images_mood": "ai_mood",
+}
+
+
+def upgrade():
+    """升级数据库 - 添加关键词文本列和全文索引"""
+    db = next(get_db())
+    
+    try:
+        print("🔧 开始添加全文索引...")
+        
+        result = db.execute(text("""
+            SELECT COLUMN_NAME
+            FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE()
+            AND TABLE_NAME = 'images'
+        """)).fetchall()
+        existing_columns = [row[0] for row in result]
+        
+        # JSON列不能建立全文索引，添加存储型生成列保存关键词文本
+        if 'ai_keywords_text' not in existing_columns:
+            db.execute(text("""
+                ALTER TABLE images
+                ADD COLUMN ai_keywords_text TEXT
+                GENERATED ALWAYS AS (JSON_UNQUOTE(ai_searchable_keywords)) STORED
+            """))
+            print("✅ 添加 ai_keywords_text 生成列")
+        else:
+            print("⏭️ ai_keywords_text 字段已存在")
+        
+        index_result = db.execute(text("""
+            SELECT DISTINCT INDEX_NAME
+            FROM INFORMATION_SCHEMA.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE()
+            AND TABLE_NAME = 'images'
+        """)).fetchall()
+        existing_indexes = [row[0] for row in index_result]
+        
+        for index_name, columns in FULLTEXT_INDEXES.items():
+            if index_name in existing_indexes:
+                print(f"⏭️ {index_name} 索引已存在")
+                continue
+            
+            db.execute(text(f"""
+                ALTER TABLE images
+                ADD FULLTEXT INDEX {index_name} ({columns}) WITH PARSER ngram
+            """))
+            print(f"✅ 创建 {index_name} 全文索引")
+        
+        db.commit()
+        print("🎉 全文索引添加完成!")
+    
+    except Exception as e:
+        db.rollback()
+        print(f"❌ 添加全文索引失败: {e}")
+        raise
+    finally:
+        db.close()
+
+
+def downgrade():
+    """降级数据库 - 移除全文索引和关键词文本列"""
+    db = next(get_db())
+    
+    try:
+        print("🔧 开始移除全文索引...")
+        
+        for index_name in FULLTEXT_INDEXES:
+            try:
+                db.execute(text(f"DROP INDEX {index_name} ON images"))
+                print(f"✅ 删除 {index_name} 索引")
+            except Exception as e:
+                print(f"⚠️ 删除 {index_name} 索引失败: {e}")
+        
+        try:
+            db.execute(text("ALTER TABLE images DROP COLUMN ai_keywords_text"))
+            print("✅ 删除 ai_keywords_text 字段")
+        except Exception as e:
+            print(f"⚠️ 删除 ai_keywords_text 字段失败: {e}")
+        
+        db.commit()
+        print("🎉 全文索引移除完成!")
+    
+    except Exception as e:
+        db.rollback()
+        print(f"❌ 移除全文索引失败: {e}")
+        raise
+    finally:
+        db.close()
@@ -0,0 +1,64 @@
+"""
+添加图片token预估字段的迁移脚本 - MySQL版本
+"""
+from sqlalchemy import text
+from app.database import get_db
+
+
+def upgrade():
+    """升级数据库 - 添加 ai_image_tokens 字段"""
+    db = next(get_db())
+    
+    try:
+        print("🔧 开始添加图片token预估字段...")
+        
+        result = db.execute(text("""
+            SELECT COLUMN_NAME
+            FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE()
+            AND TABLE_NAME = 'images'
+        """)).fetchall()
+        existing_columns = [row[0] for row in result]
+        
+        if 'ai_image_tokens' not in existing_columns:
+            db.execute(text("""
+                ALTER TABLE images
+                ADD COLUMN ai_image_tokens INT NULL COMMENT '最近一次视觉分析的图片token预估（按尺寸策略和切片规则计算）'
+            """))
+            print("✅ 添加 ai_image_tokens 字段")
+        else:
+            print("⏭️ ai_image_tokens 字段已存在")
+        
+        db.commit()
+        print("🎉 图片token预估字段添加完成!")
+    
+    except Exception as e:
+        db.rollback()
+        print(f"❌ 添加图片token预估字段失败: {e}")
+        raise
+    finally:
+        db.close()
+
+
+def downgrade():
+    """降级数据库 - 移除 ai_image_tokens 字段"""
+    db = next(get_db())
+    
+    try:
+        print("🔧 开始移除图片token预估字段...")
+        
+        try:
+            db.execute(text("ALTER TABLE images DROP COLUMN ai_image_tokens"))
+            print("✅ 删除 ai_image_tokens 字段")
+        except Exception as e:
+            print(f"⚠️ 删除 ai_image_tokens 字段失败: {e}")
+        
+        db.commit()
+        print("🎉 图片token预估字段移除完成!")
+    
+    except Exception as e:
+        db.rollback()
+        print(f"❌ 移除图片token预估字段失败: {e}")
+        raise
+    finally:
+        db.close()
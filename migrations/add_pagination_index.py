@@ -0,0 +1,66 @@
+"""
+添加游标分页索引的迁移脚本 - MySQL版本
+"""
+from sqlalchemy import text
+from app.database import get_db
+
+INDEX_NAME = "idx_images_active_upload"
+
+
+def upgrade():
+    """升级数据库 - 添加 (is_active, upload_time, id) 复合索引"""
+    db = next(get_db())
+    
+    try:
+        print("🔧 开始添加分页索引...")
+        
+        index_result = db.execute(text("""
+            SELECT DISTINCT INDEX_NAME
+            FROM INFORMATION_SCHEMA.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE()
+            AND TABLE_NAME = 'images'
+        """)).fetchall()
+        existing_indexes = [row[0] for row in index_result]
+        
+        if INDEX_NAME in existing_indexes:
+            print(f"⏭️ {INDEX_NAME} 索引已存在")
+        else:
+            db.execute(text(f"""
+                ALTER TABLE images
+                ADD INDEX {INDEX_NAME} (is_active, upload_time, id)
+            """))
+            print(f"✅ 创建 {INDEX_NAME} 索引")
+        
+        db.commit()
+        print("🎉 分页索引添加完成!")
+    
+    except Exception as e:
+        db.rollback()
+        print(f"❌ 添加分页索引失败: {e}")
+        raise
+    finally:
+        db.close()
+
+
+def downgrade():
+    """降级数据库 - 移除分页索引"""
+    db = next(get_db())
+    
+    try:
+        print("🔧 开始移除分页索引...")
+        
+        try:
+            db.execute(text(f"DROP INDEX {INDEX_NAME} ON images"))
+            print(f"✅ 删除 {INDEX_NAME} 索引")
+        except Exception as e:
+            print(f"⚠️ 删除 {INDEX_NAME} 索引失败: {e}")
+        
+        db.commit()
+        print("🎉 分页索引移除完成!")
+    
+    except Exception as e:
+        db.rollback()
+        print(f"❌ 移除分页索引失败: {e}")
+        raise
+    finally:
+        db.close()
@@ -0,0 +1,86 @@
+"""
+添加感知哈希字段的迁移脚本 - MySQL版本
+"""
+from sqlalchemy import text
+from app.database import get_db
+
+INDEX_NAME = "ix_images_phash"
+
+
+def upgrade():
+    """升级数据库 - 添加 phash 字段和索引"""
+    db = next(get_db())
+    
+    try:
+        print("🔧 开始添加感知哈希字段...")
+        
+        result = db.execute(text("""
+            SELECT COLUMN_NAME
+            FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE()
+            AND TABLE_NAME = 'images'
+        """)).fetchall()
+        existing_columns = [row[0] for row in result]
+        
+        if 'phash' not in existing_columns:
+            db.execute(text("""
+                ALTER TABLE images
+                ADD COLUMN phash VARCHAR(16) NULL COMMENT '感知哈希(pHash)，用于近似重复检测'
+            """))
+            print("✅ 添加 phash 字段")
+        else:
+            print("⏭️ phash 字段已存在")
+        
+        index_result = db.execute(text("""
+            SELECT DISTINCT INDEX_NAME
+            FROM INFORMATION_SCHEMA.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE()
+            AND TABLE_NAME = 'images'
+        """)).fetchall()
+        existing_indexes = [row[0] for row in index_result]
+        
+        if INDEX_NAME in existing_indexes:
+            print(f"⏭️ {INDEX_NAME} 索引已存在")
+        else:
+            db.execute(text(f"ALTER TABLE images ADD INDEX {INDEX_NAME} (phash)"))
+            print(f"✅ 创建 {INDEX_NAME} 索引")
+        
+        db.commit()
+        print("🎉 感知哈希字段添加完成!")
+    
+    except Exception as e:
+        db.rollback()
+        print(f"❌ 添加感知哈希字段失败: {e}")
+        raise
+    finally:
+        db.close()
+
+
+def downgrade():
+    """降级数据库 - 移除 phash 字段和索引"""
+    db = next(get_db())
+    
+    try:
+        print("🔧 开始移除感知哈希字段...")
+        
+        try:
+            db.execute(text(f"DROP INDEX {INDEX_NAME} ON images"))
+            print(f"✅ 删除 {INDEX_NAME} 索引")
+        except Exception as e:
+            print(f"⚠️ 删除 {INDEX_NAME} 索引失败: {e}")
+        
+        try:
+            db.execute(text("ALTER TABLE images DROP COLUMN phash"))
+            print("✅ 删除 phash 字段")
+        except Exception as e:
+            print(f"⚠️ 删除 phash 字段失败: {e}")
+        
+        db.commit()
+        print("🎉 感知哈希字段移除完成!")
+    
+    except Exception as e:
+        db.rollback()
+        print(f"❌ 移除感知哈希字段失败: {e}")
+        raise
+    finally:
+        db.close()
@@ -0,0 +1,66 @@
+"""
+测试共享AI客户端 - 单个连接池复用、每次调用独立超时、调用统计、生命周期关闭
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import asyncio
+import json
+
+import httpx
+
+from app.services.ai_client_service import AIClientManager, ai_client
+from app.services.gpt4o_service import gpt4o_analyzer
+
+
+def _mock_client(handler) -> httpx.AsyncClient:
+    return httpx.AsyncClient(base_url="http://api.test/v1", transport=httpx.MockTransport(handler))
+
+
+def test_calls_share_one_client_with_per_call_timeout():
+    seen = []
+
+    def handler(request):
+        seen.append((request.url.path, request.extensions["timeout"]["read"]))
+        return httpx.Response(200, json={"choices": [{"message": {"content": "{}"}}],
+                                         "usage": {"total_tokens": 10}})
+
+    async def run():
+        manager = AIClientManager()
+        manager._client = _mock_client(handler)
+        client = manager.client
+        await manager.chat_completion({"model": "gpt-4o"}, 5, 100)
+        await manager.chat_completion({"model": "gpt-4o"}, 60, 100)
+        assert manager.client is client
+        stats = manager.stats()
+        await manager.close()
+        return manager, stats
+
+    manager, stats = asyncio.run(run())
+    assert seen == [("/v1/chat/completions", 5), ("/v1/chat/completions", 60)]
+    assert stats["requests"] == 2 and stats["errors"] == 0 and stats["in_flight"] == 0
+    assert stats["peak_in_flight"] == 1 and stats["open"]
+    assert not manager.stats()["open"]
+
+
+def test_analyzer_text_call_uses_shared_client():
+    def handler(request):
+        payload = json.loads(request.content)
+        assert payload["messages"][0]["role"] == "user"
+        return httpx.Response(200, json={"choices": [{"message": {"content": '{"enhanced_query": "坐姿 女性"}'}}]})
+
+    async def run():
+        ai_client._client = _mock_client(handler)
+        try:
+            return await gpt4o_analyzer.enhance_search_query("坐着的女生")
+        finally:
+            await ai_client.close()
+
+    assert asyncio.run(run()) == {"enhanced_query": "坐姿 女性"}
+
+
+if __name__ == "__main__":
+    test_calls_share_one_client_with_per_call_timeout()
+    test_analyzer_text_call_uses_shared_client()
+    print("✅ 共享AI客户端测试通过")
@@ -0,0 +1,141 @@
+"""
+测试分析结果缓存 - 按图片内容和提示词哈希命中、重复上传不再调用视觉API
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import asyncio
+import json
+import tempfile
+
+import httpx
+from PIL import Image
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.models.image import AnalysisCache
+from app.services.analysis_cache_service import AnalysisResultCache, analysis_cache, prompt_hash
+from app.services.ai_client_service import ai_client
+from app.services.gpt4o_service import gpt4o_analyzer
+from app.services.image_preprocess_service import image_preprocessor
+
+
+def _session_factory():
+    """内存SQLite，线程间共享同一连接"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine, tables=[AnalysisCache.__table__])
+    return sessionmaker(bind=engine)
+
+
+def test_get_set_and_hit_count():
+    cache = AnalysisResultCache(_session_factory())
+    key = prompt_hash("gpt-4o", "分析姿势")
+    assert key != prompt_hash("gpt-4o-mini", "分析姿势")
+    assert cache.get("a" * 64, key) is None
+
+    cache.set("a" * 64, key, "gpt-4o", {"tags": {"pose": ["站立"]}})
+    # 同一键重复写入时保留已有记录
+    cache.set("a" * 64, key, "gpt-4o", {"tags": {"pose": ["坐姿"]}})
+    assert cache.get("a" * 64, key) == {"tags": {"pose": ["站立"]}}
+    assert cache.get("a" * 64, prompt_hash("gpt-4o", "其他提示词")) is None
+
+    db = cache._session()
+    assert db.query(AnalysisCache).one().hit_count == 1
+    db.close()
+    assert cache.stats()["hits"] == 1 and cache.stats()["stores"] == 1
+
+
+def test_duplicate_upload_reuses_analysis():
+    calls = []
+
+    def handler(request):
+        calls.append(json.loads(request.content)["model"])
+        content = json.dumps({"description": "站立的女性", "tags": {"pose": ["站立"]}}, ensure_ascii=False)
+        return httpx.Response(200, json={"choices": [{"message": {"content": content}}]})
+
+    paths = []
+    for _ in range(2):
+        with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as f:
+            Image.new("RGB", (800, 600), (90, 160, 30)).save(f, format="JPEG")
+            paths.append(f.name)
+
+    async def run():
+        ai_client._client = httpx.AsyncClient(base_url="http://api.test/v1", transport=httpx.MockTransport(handler))
+        try:
+            first = await gpt4o_analyzer.analyze_for_search(paths[0])
+            # 内容相同的另一个文件
+            second = await gpt4o_analyzer.analyze_for_search(paths[1])
+            custom = await gpt4o_analyzer.analyze_with_custom_prompt(paths[1], "只看服装")
+            return first, second, custom
+        finally:
+            await ai_client.close()
+
+    original_factory, original_workers = analysis_cache._session_factory, image_preprocessor.workers
+    analysis_cache._session_factory = _session_factory()
+    image_preprocessor.workers = 0
+    try:
+        first, second, custom = asyncio.run(run())
+    finally:
+        analysis_cache._session_factory = original_factory
+        image_preprocessor.workers = original_workers
+        for path in paths:
+            os.unlink(path)
+
+    assert first["success"] and not first["cached"]
+    assert second["cached"] and second["analysis"] == first["analysis"]
+    # 提示词不同时重新调用
+    assert not custom["cached"]
+    assert len(calls) == 2
+
+
+def test_unstructured_reply_not_cached_and_reanalysis_replaces():
+    replies = ["看起来是一位站立的女性", json.dumps({"description": "站立", "tags": {"pose": ["站立"]}}, ensure_ascii=False),
+               json.dumps({"description": "坐着", "tags": {"pose": ["坐姿"]}}, ensure_ascii=False)]
+
+    def handler(request):
+        return httpx.Response(200, json={"choices": [{"message": {"content": replies.pop(0)}}]})
+
+    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as f:
+        Image.new("RGB", (800, 600), (30, 60, 200)).save(f, format="JPEG")
+        path = f.name
+
+    async def run():
+        ai_client._client = httpx.AsyncClient(base_url="http://api.test/v1", transport=httpx.MockTransport(handler))
+        try:
+            # 非JSON回复走文本兜底，不写入缓存，下次仍调用模型
+            text = await gpt4o_analyzer.analyze_for_search(path)
+            parsed = await gpt4o_analyzer.analyze_for_search(path)
+            cached = await gpt4o_analyzer.analyze_for_search(path)
+            # 重新分析跳过缓存，并覆盖已有记录
+            fresh = await gpt4o_analyzer.analyze_for_search(path, use_cache=False)
+            after = await gpt4o_analyzer.analyze_for_search(path)
+            return text, parsed, cached, fresh, after
+        finally:
+            await ai_client.close()
+
+    original_factory, original_workers = analysis_cache._session_factory, image_preprocessor.workers
+    analysis_cache._session_factory = _session_factory()
+    image_preprocessor.workers = 0
+    try:
+        text, parsed, cached, fresh, after = asyncio.run(run())
+    finally:
+        analysis_cache._session_factory = original_factory
+        image_preprocessor.workers = original_workers
+        os.unlink(path)
+
+    assert text["analysis"]["description"] == "看起来是一位站立的女性" and not text["cached"]
+    assert not parsed["cached"]
+    assert cached["cached"] and cached["analysis"]["description"] == "站立"
+    assert not fresh["cached"] and fresh["analysis"]["description"] == "坐着"
+    assert after["cached"] and after["analysis"]["description"] == "坐着"
+    assert replies == []
+
+
+if __name__ == "__main__":
+    test_get_set_and_hit_count()
+    test_duplicate_upload_reuses_analysis()
+    test_unstructured_reply_not_cached_and_reanalysis_replaces()
+    print("✅ 分析结果缓存测试通过")
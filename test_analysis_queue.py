@@ -0,0 +1,191 @@
+"""
+测试分析任务队列 - 登记去重、领取与租约、失败重试、租约过期回收、补登遗留的 pending 图片、分析失败不算完成
+"""
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.models.image import Image, AnalysisJob
+import app.database
+from app.services.analysis_queue_service import AnalysisQueue, run_analysis_job
+from app.services.gpt4o_service import gpt4o_analyzer
+
+
+def _build_session(image_count: int = 5):
+    """创建内存SQLite会话并写入测试图片"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine, tables=[Image.__table__, AnalysisJob.__table__])
+    db = sessionmaker(bind=engine)()
+    for i in range(image_count):
+        db.add(Image(filename=f"{i}.jpg", file_path=f"uploads/{i}.jpg", file_size=1024,
+                     ai_analysis_status="completed"))
+    db.commit()
+    return db
+
+
+def _build_factory():
+    """创建内存SQLite会话工厂（各会话共享同一连接）并写入一张 pending 图片"""
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    db.add(Image(filename="1.jpg", file_path="https://example.com/1.jpg", file_size=1024, ai_analysis_status="pending"))
+    db.commit()
+    db.close()
+    return factory
+
+
+def _queue(worker_id: str = "node-a") -> AnalysisQueue:
+    queue = AnalysisQueue(lease_seconds=60, max_attempts=2, poll_interval=0.1)
+    queue.worker_id = worker_id
+    return queue
+
+
+def test_enqueue_dedupes_queued_jobs():
+    db = _build_session()
+    try:
+        queue = _queue()
+        assert queue.enqueue(db, [1, 2, 2], "analyze") == 2
+        # 已排队的图片只更新类型和提示词
+        assert queue.enqueue(db, [2, 3], "reanalyze", "只看姿势") == 1
+        jobs = {job.image_id: job for job in db.query(AnalysisJob)}
+        assert len(jobs) == 3
+        assert jobs[2].kind == "reanalyze" and jobs[2].custom_prompt == "只看姿势"
+        assert {image.ai_analysis_status for image in db.query(Image).filter(Image.id.in_([1, 2, 3]))} == {"pending"}
+    finally:
+        db.close()
+
+
+def test_enqueue_skips_running_and_batched_jobs():
+    db = _build_session()
+    try:
+        queue = _queue()
+        queue.enqueue(db, [1, 2], "analyze")
+        queue.claim(db)
+        db.query(AnalysisJob).filter(AnalysisJob.image_id == 2).update({"state": "batched"},
+                                                                       synchronize_session=False)
+        db.commit()
+
+        # 执行中和已提交离线批次的图片不再另行排队
+        assert queue.enqueue(db, [1, 2, 3], "reanalyze") == 1
+        assert queue.counts(db) == {"running": 1, "batched": 1, "queued": 1}
+        assert db.query(AnalysisJob).filter(AnalysisJob.image_id == 1).one().kind == "analyze"
+    finally:
+        db.close()
+
+
+def test_claim_finish_and_retry():
+    db = _build_session()
+    try:
+        queue = _queue()
+        queue.enqueue(db, [1, 2], "batch")
+        claimed = queue.claim(db, limit=1)
+        assert [job["image_id"] for job in claimed] == [1] and claimed[0]["attempts"] == 1
+
+        assert queue.finish(db, claimed[0]["id"], True)
+        assert db.get(AnalysisJob, claimed[0]["id"]).state == "completed"
+
+        # 第一次失败: 退避后重新排队，暂时不可领取
+        job = queue.claim(db)[0]
+        assert queue.finish(db, job["id"], False, "OpenAI API错误: 500")
+        row = db.get(AnalysisJob, job["id"])
+        assert row.state == "queued" and row.available_at > datetime.utcnow() - timedelta(seconds=1)
+        assert row.last_error == "OpenAI API错误: 500"
+
+        # 达到最大次数后任务和图片都标记为失败
+        row.available_at = datetime.utcnow() - timedelta(seconds=1)
+        db.commit()
+        job = queue.claim(db)[0]
+        assert job["attempts"] == 2
+        queue.finish(db, job["id"], False, "再次失败")
+        db.expire_all()
+        assert db.get(AnalysisJob, job["id"]).state == "failed"
+        assert db.get(Image, 2).ai_analysis_status == "failed"
+        assert queue.claim(db) == []
+    finally:
+        db.close()
+
+
+def test_expired_lease_is_requeued_and_stale_finish_ignored():
+    db = _build_session()
+    try:
+        crashed, survivor = _queue("node-a"), _queue("node-b")
+        crashed.enqueue(db, [4], "analyze")
+        job = crashed.claim(db)[0]
+
+        # 续租只作用于自己领取的任务
+        assert survivor.renew(db, [job["id"]]) == 0
+        db.query(AnalysisJob).update({"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)})
+        db.commit()
+
+        assert survivor.requeue_expired(db) == 1
+        retried = survivor.claim(db)[0]
+        assert retried["id"] == job["id"] and retried["attempts"] == 2
+        # 原进程恢复后写回的结果被忽略
+        assert not crashed.finish(db, job["id"], True)
+        assert survivor.finish(db, job["id"], True)
+    finally:
+        db.close()
+
+
+def test_release_and_recover_pending():
+    db = _build_session()
+    try:
+        queue = _queue()
+        queue.enqueue(db, [1], "analyze")
+        job = queue.claim(db)[0]
+        assert queue.release(db, [job["id"]]) == 1
+        row = db.get(AnalysisJob, job["id"])
+        db.refresh(row)
+        assert row.state == "queued" and row.attempts == 0
+
+        # 没有任务的 pending 图片补登任务，已有任务的不重复登记
+        db.query(Image).filter(Image.id.in_([1, 3, 5])).update({"ai_analysis_status": "pending"},
+                                                                synchronize_session=False)
+        db.commit()
+        assert queue.recover_pending(db) == 2
+        assert queue.counts(db) == {"queued": 3}
+    finally:
+        db.close()
+
+
+def test_failed_analysis_does_not_complete_job():
+    factory = _build_factory()
+    original_factory = app.database.SessionLocal
+    original_analyze = gpt4o_analyzer.analyze_for_search
+
+    async def failing_analyze(image_url):
+        return {"success": False, "error": "接口超时",
+                "fallback_analysis": {"description": "兜底", "tags": {"general": ["图片"]}}}
+
+    app.database.SessionLocal = factory
+    gpt4o_analyzer.analyze_for_search = failing_analyze
+    try:
+        # GPT 调用失败时任务不算完成，也不保存 fallback 分析
+        assert asyncio.run(run_analysis_job("analyze", 1)) is False
+        db = factory()
+        image = db.get(Image, 1)
+        assert image.ai_analysis_status == "failed"
+        assert image.ai_description is None
+        db.close()
+    finally:
+        app.database.SessionLocal = original_factory
+        gpt4o_analyzer.analyze_for_search = original_analyze
+
+
+if __name__ == "__main__":
+    test_enqueue_dedupes_queued_jobs()
+    test_enqueue_skips_running_and_batched_jobs()
+    test_claim_finish_and_retry()
+    test_expired_lease_is_requeued_and_stale_finish_ignored()
+    test_release_and_recover_pending()
+    test_failed_analysis_does_not_complete_job()
+    print("✅ 分析任务队列测试通过")
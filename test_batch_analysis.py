@@ -0,0 +1,229 @@
+"""
+测试离线批量分析 - 对本地批量API替身服务完成 构建请求文件 -> 上传 -> 轮询 -> 导入结果，缓存命中和失败回退
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import asyncio
+import email.parser
+import email.policy
+import io
+import json
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image as PILImage
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import app.database
+from app.config import get_settings
+from app.database import Base
+from app.models.image import Image, AnalysisJob, AnalysisBatch
+from app.services.ai_client_service import ai_client
+from app.services.analysis_cache_service import analysis_cache, prompt_hash
+from app.services.batch_analysis_service import BatchAnalysisService, parse_output_line
+from app.services.gpt4o_service import SEARCH_PROMPT, gpt4o_analyzer
+from app.services.image_preprocess_service import image_preprocessor, preprocess_image
+
+COLORS = {1: (200, 40, 40), 2: (40, 200, 40), 3: (40, 40, 200), 4: (200, 200, 40)}
+
+
+def _jpeg(image_id: int) -> bytes:
+    buffer = io.BytesIO()
+    PILImage.new("RGB", (640, 480), COLORS[image_id]).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class StandInBatchAPI(BaseHTTPRequestHandler):
+    """本地批量API替身: 提供图片、文件上传、批次创建/查询和结果下载；图片4的请求返回错误"""
+    files = {}
+    batches = {}
+    uploaded = []
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body, content_type: str = "application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.startswith("/img/"):
+            return self._send(200, _jpeg(int(self.path[5:-4])), "image/jpeg")
+        if self.path.startswith("/v1/batches/"):
+            batch = self.batches[self.path.rsplit("/", 1)[1]]
+            # 第一次查询时仍在处理
+            batch["polls"] += 1
+            status = "in_progress" if batch["polls"] == 1 else "completed"
+            return self._send(200, {"id": batch["id"], "status": status,
+                                    "output_file_id": batch["output_file_id"] if status == "completed" else None,
+                                    "error_file_id": batch["error_file_id"] if status == "completed" else None})
+        if self.path.startswith("/v1/files/") and self.path.endswith("/content"):
+            return self._send(200, self.files[self.path.split("/")[3]], "application/jsonl")
+        self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/v1/files":
+            message = email.parser.BytesParser(policy=email.policy.default).parsebytes(
+                b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + body
+            )
+            fields = {part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+                      for part in message.iter_parts()}
+            assert fields["purpose"] == b"batch"
+            file_id = f"file-{len(self.files) + 1}"
+            self.files[file_id] = fields["file"]
+            self.uploaded.append(file_id)
+            return self._send(200, {"id": file_id, "purpose": "batch"})
+        if self.path == "/v1/batches":
+            request = json.loads(body)
+            output, errors = [], []
+            for line in self.files[request["input_file_id"]].decode("utf-8").splitlines():
+                item = json.loads(line)
+                if item["custom_id"] == "image-4":
+                    errors.append({"custom_id": item["custom_id"], "response": {
+                        "status_code": 400, "body": {"error": {"message": "invalid image"}}}})
+                    continue
+                content = json.dumps({"description": "站立的女性", "tags": {"pose": ["站立"]},
+                                      "confidence": 0.9}, ensure_ascii=False)
+                output.append({"custom_id": item["custom_id"], "response": {
+                    "status_code": 200, "body": {"choices": [{"message": {"content": content}}]}}})
+            batch_id = f"batch_{len(self.batches) + 1}"
+            self.files[f"{batch_id}-out"] = "\n".join(json.dumps(line) for line in output).encode("utf-8")
+            self.files[f"{batch_id}-err"] = "\n".join(json.dumps(line) for line in errors).encode("utf-8")
+            self.batches[batch_id] = {"id": batch_id, "polls": 0, "endpoint": request["endpoint"],
+                                      "output_file_id": f"{batch_id}-out", "error_file_id": f"{batch_id}-err"}
+            return self._send(200, {"id": batch_id, "status": "validating"})
+        self._send(404, {"error": "not found"})
+
+
+def test_parse_output_line():
+    ok = json.dumps({"custom_id": "image-7", "response": {"status_code": 200, "body": {
+        "choices": [{"message": {"content": "{}"}}]}}})
+    assert parse_output_line(ok) == ("image-7", "{}", None)
+    failed = json.dumps({"custom_id": "image-8", "response": None,
+                         "error": {"code": "batch_expired", "message": "expired"}})
+    custom_id, content, error = parse_output_line(failed)
+    assert custom_id == "image-8" and content is None and "batch_expired" in error
+
+
+def test_renew_extends_batch_lease():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine, tables=[AnalysisBatch.__table__])
+    db = sessionmaker(bind=engine)()
+    try:
+        db.add(AnalysisBatch(state="building", image_ids=[1], request_count=0, cached_count=0,
+                             succeeded_count=0, failed_count=0))
+        db.commit()
+        service = BatchAnalysisService(max_requests=10, poll_interval=0.1, lease_seconds=60)
+        batch = service.claim_building(db)
+        row = db.get(AnalysisBatch, batch["id"])
+        row.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+        db.commit()
+
+        # 续租后不会被当作过期批次回收
+        assert service.renew(db, batch["id"], "uploading")
+        assert service.recover_expired(db) == 0
+        db.refresh(row)
+        assert row.state == "uploading" and row.lease_expires_at > datetime.utcnow()
+        # 已被回收或已完成的批次不再续租
+        assert not service.renew(db, batch["id"], "ingesting")
+    finally:
+        db.close()
+
+
+def test_batch_round_trip_against_stand_in_server():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInBatchAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    db = factory()
+    for image_id in COLORS:
+        db.add(Image(id=image_id, filename=f"{image_id}.jpg", file_path=f"{base}/img/{image_id}.jpg",
+                     file_size=1024, ai_analysis_status="failed"))
+    # 图片3正在在线分析中，不进入批次
+    db.add(AnalysisJob(image_id=3, kind="analyze", state="running", attempts=1,
+                       available_at=datetime.utcnow()))
+    db.commit()
+
+    settings = get_settings()
+    original = (app.database.SessionLocal, analysis_cache._session_factory, image_preprocessor.workers,
+                settings.openai_batch_base_url, settings.openai_api_key)
+    app.database.SessionLocal = factory
+    analysis_cache._session_factory = factory
+    image_preprocessor.workers = 0
+    settings.openai_batch_base_url = f"{base}/v1"
+    settings.openai_api_key = "sk-stand-in"
+    try:
+        # 图片2的分析结果已在缓存中
+        _, _, info = preprocess_image(_jpeg(2), 2048, 90, policy=settings.vision_sizing_policy,
+                                      max_tiles=settings.vision_max_tiles)
+        analysis_cache.set(info["sha256"], prompt_hash(gpt4o_analyzer.model, SEARCH_PROMPT, info["detail"]), gpt4o_analyzer.model,
+                           {"description": "缓存的结果", "tags": {"pose": ["坐姿"]}, "confidence": 0.8})
+
+        service = BatchAnalysisService(max_requests=10, poll_interval=0.1, lease_seconds=60, session_factory=factory)
+        batch_ids = service.create(db, [1, 2, 3, 4])
+        assert len(batch_ids) == 1
+        states = {job.image_id: job.state for job in db.query(AnalysisJob)}
+        assert states == {1: "batched", 2: "batched", 3: "running", 4: "batched"}
+
+        async def run():
+            try:
+                await service.run_once()  # 构建、上传并提交；第一次查询仍在处理
+                await service.run_once()  # 完成后导入结果
+            finally:
+                await ai_client.close()
+
+        asyncio.run(run())
+
+        # 请求文件只包含未命中缓存的图片
+        uploaded = StandInBatchAPI.files[StandInBatchAPI.uploaded[0]].decode("utf-8").splitlines()
+        requests = [json.loads(line) for line in uploaded]
+        assert [request["custom_id"] for request in requests] == ["image-1", "image-4"]
+        assert requests[0]["url"] == "/v1/chat/completions" and requests[0]["body"]["model"] == gpt4o_analyzer.model
+
+        db.expire_all()
+        batch = db.get(AnalysisBatch, batch_ids[0])
+        assert batch.state == "completed" and batch.remote_status == "completed"
+        assert (batch.request_count, batch.cached_count, batch.succeeded_count, batch.failed_count) == (2, 1, 1, 1)
+
+        images = {image.id: image for image in db.query(Image)}
+        assert images[1].ai_analysis_status == "completed" and images[1].ai_description == "站立的女性"
+        assert images[2].ai_analysis_status == "completed" and images[2].ai_description == "缓存的结果"
+        assert [item.tag.name for item in images[1].image_tags] == ["站立"]
+        # 记录按尺寸策略预估的图片token
+        assert images[1].ai_image_tokens == images[2].ai_image_tokens == 425
+
+        jobs = {job.image_id: job for job in db.query(AnalysisJob)}
+        assert jobs[1].state == "completed" and jobs[2].state == "completed"
+        # 批量请求失败的图片退回在线队列
+        assert jobs[4].state == "queued" and "invalid image" in jobs[4].last_error
+
+        # 导入的结果写入分析缓存
+        _, _, info = preprocess_image(_jpeg(1), 2048, 90, policy=settings.vision_sizing_policy,
+                                      max_tiles=settings.vision_max_tiles)
+        assert analysis_cache.get(info["sha256"], prompt_hash(gpt4o_analyzer.model, SEARCH_PROMPT, info["detail"])) is not None
+    finally:
+        (app.database.SessionLocal, analysis_cache._session_factory, image_preprocessor.workers,
+         settings.openai_batch_base_url, settings.openai_api_key) = original
+        db.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    test_parse_output_line()
+    test_renew_extends_batch_lease()
+    test_batch_round_trip_against_stand_in_server()
+    print("✅ 离线批量分析测试通过")
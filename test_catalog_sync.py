@@ -0,0 +1,125 @@
+"""
+测试图库变更同步 - 变更日志随事务写入、其他进程的写入同步到内存索引、自增ID空洞等待未提交的事务
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models.image import Image, Tag, ImageTag, CatalogChange
+from app.services.catalog_sync_service import CatalogSync, catalog_sync
+from app.services.color_palette_service import color_index, pack_palette
+from app.services.database_service import DatabaseService
+from app.services.query_parser_service import query_parser
+from app.services.response_cache_service import response_cache
+from app.services.tag_index_service import tag_index
+
+OTHER_ORIGIN = "worker-host-1"
+
+
+def _build_session():
+    """创建内存SQLite会话并写入两张图片"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine, tables=[
+        Image.__table__,
+        Tag.__table__,
+        ImageTag.__table__,
+        CatalogChange.__table__
+    ])
+    db = sessionmaker(bind=engine)()
+    db.add_all([
+        Image(filename="1.jpg", file_path="uploads/1.jpg", file_size=1024),
+        Image(filename="2.jpg", file_path="uploads/2.jpg", file_size=1024)
+    ])
+    db.commit()
+    return db
+
+
+def _write_as_other_process(db, image_id: int, tag_name: str):
+    """模拟分析工作进程: 直接写入标签和变更日志，不经过本进程的索引"""
+    tag = Tag(name=tag_name, category="pose")
+    db.add(tag)
+    db.flush()
+    db.add(ImageTag(image_id=image_id, tag_id=tag.id, source="gpt4o"))
+    db.add(CatalogChange(image_id=image_id, origin=OTHER_ORIGIN))
+    db.commit()
+
+
+def test_changes_are_logged_with_commit():
+    db = _build_session()
+    service = DatabaseService(db)
+    try:
+        service.add_tags_to_image(1, ["同步测试甲"])
+        changes = db.query(CatalogChange).all()
+        assert [(change.image_id, change.origin) for change in changes] == [(1, catalog_sync.origin)]
+
+        # 回滚的改动不写变更日志
+        service.clear_image_tags(1)
+        db.rollback()
+        service.remove_tag_name_from_image(2, "同步测试甲")
+        db.rollback()
+        assert db.query(CatalogChange).count() == 1
+    finally:
+        tag_index.remove_image(1)
+        db.close()
+
+
+def test_sync_applies_other_process_changes():
+    db = _build_session()
+    sync = CatalogSync(poll_interval=1.0, gap_seconds=60, retention=86400)
+    try:
+        assert sync.start(db) == 0
+        version = response_cache.version.local
+
+        _write_as_other_process(db, 2, "同步测试乙")
+        db.query(Image).filter(Image.id == 2).update(
+            {"color_palette": pack_palette([((200.0, 30.0, 30.0), 1.0)])}, synchronize_session=False
+        )
+        db.commit()
+        assert tag_index.lookup(["同步测试乙"]) == set()
+
+        assert sync.sync(db) == 1
+        assert tag_index.lookup(["同步测试乙"]) == {2}
+        assert tag_index.categories_of(["同步测试乙"]) == {"同步测试乙": "pose"}
+        assert query_parser.parse("同步测试乙")[0] == ["同步测试乙"]
+        assert any(image_id == 2 for image_id, _ in color_index.search(["#c81e1e"], 5))
+        assert response_cache.version.local == version + 1
+
+        # 已应用的变更不再重复读取
+        assert sync.sync(db) == 0
+    finally:
+        tag_index.remove_image(2)
+        db.close()
+
+
+def test_sync_waits_for_gaps():
+    db = _build_session()
+    sync = CatalogSync(poll_interval=1.0, gap_seconds=60, retention=86400)
+    try:
+        sync.start(db)
+        # ID 1 属于尚未提交的事务，先看到 ID 2
+        db.add(CatalogChange(id=2, image_id=1, origin=OTHER_ORIGIN))
+        db.commit()
+        assert sync.sync(db) == 1
+        assert sync.stats()["pending_gaps"] == 1
+
+        _write_as_other_process(db, 2, "同步测试丙")
+        db.query(CatalogChange).filter(CatalogChange.id == 3).update({"id": 1}, synchronize_session=False)
+        db.commit()
+        assert sync.sync(db) == 1
+        assert tag_index.lookup(["同步测试丙"]) == {2}
+        assert sync.stats()["pending_gaps"] == 0
+    finally:
+        tag_index.remove_image(1)
+        tag_index.remove_image(2)
+        db.close()
+
+
+if __name__ == "__main__":
+    test_changes_are_logged_with_commit()
+    test_sync_applies_other_process_changes()
+    test_sync_waits_for_gaps()
+    print("✅ 图库变更同步测试通过")
@@ -0,0 +1,87 @@
+"""
+测试主色调提取和颜色检索 - 调色板打包往返、按颜色检索排序
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from PIL import Image as PILImage
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models.image import Image, Tag, ImageTag
+from app.services.color_palette_service import (
+    ColorIndex, color_index, color_tag_names, extract_palette, pack_palette, parse_color, unpack_palette
+)
+from app.services.search_service import SearchService
+
+
+def _two_tone(main_rgb, accent_rgb, main_ratio: float = 0.75) -> PILImage.Image:
+    pixels = np.zeros((100, 100, 3), dtype=np.uint8)
+    split = int(100 * main_ratio)
+    pixels[:split] = main_rgb
+    pixels[split:] = accent_rgb
+    return PILImage.fromarray(pixels)
+
+
+def test_palette_finds_dominant_colours():
+    palette = extract_palette(_two_tone((200, 30, 30), (20, 60, 200)))
+    (main_lab, main_weight), (accent_lab, accent_weight) = palette[:2]
+
+    assert abs(main_weight - 0.75) < 0.05 and abs(accent_weight - 0.25) < 0.05
+    assert np.linalg.norm(np.array(main_lab) - parse_color("#c81e1e")) < 3
+
+
+def test_pack_round_trip_is_compact():
+    palette = extract_palette(_two_tone((240, 200, 40), (30, 30, 30)))
+    packed = pack_palette(palette)
+    labs, weights = unpack_palette(packed)
+
+    assert len(packed) == 4 * len(palette) <= 20
+    np.testing.assert_allclose(labs, [lab for lab, _ in palette], atol=1.0)
+    np.testing.assert_allclose(weights, [weight for _, weight in palette], atol=0.01)
+    assert [name for name, _ in color_tag_names(packed)] == ["黄色", "黑色"]
+
+
+def test_search_ranks_dominant_colour_first():
+    index = ColorIndex()
+    index.add(1, pack_palette(extract_palette(_two_tone((20, 60, 200), (200, 30, 30), 0.9))))
+    index.add(2, pack_palette(extract_palette(_two_tone((200, 30, 30), (20, 60, 200), 0.9))))
+    index.add(3, pack_palette(extract_palette(_two_tone((40, 160, 60), (240, 240, 240), 0.6))))
+
+    assert [image_id for image_id, _ in index.search(["红色"], 3)][:2] == [2, 1]
+    assert index.search(["#1976d2"], 1)[0][0] == 1
+
+
+def test_color_search_skips_deleted_images():
+    """最接近的图片大多已删除时继续扩大候选，仍返回 limit 张有效图片"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine, tables=[Image.__table__, Tag.__table__, ImageTag.__table__])
+    db = sessionmaker(bind=engine)()
+    try:
+        red = pack_palette(extract_palette(_two_tone((200, 30, 30), (20, 20, 20), 0.9)))
+        blue = pack_palette(extract_palette(_two_tone((20, 60, 200), (20, 20, 20), 0.9)))
+        for i in range(12):
+            db.add(Image(filename=f"{i}.jpg", file_path=f"uploads/{i}.jpg", file_size=1024,
+                         is_active=i >= 8, color_palette=red if i < 10 else blue))
+        db.commit()
+        color_index.load(db)
+        # 颜色索引不跟踪删除: 重新登记前8张已删除的红色图片
+        for image in db.query(Image).filter(Image.is_active == False):
+            color_index.add(image.id, image.color_palette)
+
+        result = SearchService(db).search_by_color(["红色"], 3)
+        assert result["total"] == 3
+        assert [image["id"] for image in result["images"]][:2] == [9, 10]
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    test_palette_finds_dominant_colours()
+    test_pack_round_trip_is_compact()
+    test_search_ranks_dominant_colour_first()
+    test_color_search_skips_deleted_images()
+    print("✅ 主色调测试通过")
@@ -0,0 +1,106 @@
+"""
+测试图片预处理 - JPEG草稿解码降采样、像素上限、尺寸策略和token预估、进程池执行和阶段计时
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import asyncio
+import base64
+import io
+import tempfile
+
+from PIL import Image
+
+from app.services.image_preprocess_service import (
+    ImagePreprocessor, preprocess_image, plan_vision_size, high_detail_tokens
+)
+
+
+def _image_bytes(size, fmt="JPEG") -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 120, 40)).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def test_jpeg_draft_downscales_during_decode():
+    encoded, timings, info = preprocess_image(_image_bytes((4000, 3000)), max_size=1024, quality=85)
+    # DCT 降采样后的尺寸不小于目标，随后再精确缩放
+    assert info["original_size"] == (4000, 3000)
+    assert info["decoded_size"] == (2000, 1500)
+    assert info["output_size"] == (1024, 768)
+    assert set(timings) == {"read", "decode", "resize", "encode"}
+    with Image.open(io.BytesIO(base64.b64decode(encoded))) as img:
+        assert img.format == "JPEG" and img.size == (1024, 768)
+
+
+def test_pixel_limit_rejects_oversized_non_jpeg():
+    try:
+        preprocess_image(_image_bytes((1000, 1000), "PNG"), max_size=512, max_pixels=500_000)
+    except ValueError as e:
+        assert "像素上限" in str(e)
+    else:
+        raise AssertionError("超过像素上限的图片应被拒绝")
+
+    # 同尺寸的 JPEG 经草稿解码后在上限之内
+    _, _, info = preprocess_image(_image_bytes((1000, 1000)), max_size=400, max_pixels=500_000)
+    assert info["decoded_size"] == (500, 500) and info["output_size"] == (400, 400)
+
+
+def test_high_detail_tokens_follow_tiling_rules():
+    # 2048x1536 -> 1024x768: 2x2 切片
+    assert high_detail_tokens(2048, 1536) == 85 + 170 * 4
+    # 16:9 缩放到 1365x768: 3x2 切片
+    assert high_detail_tokens(4000, 2250) == 85 + 170 * 6
+    assert high_detail_tokens(300, 200) == 85 + 170
+
+
+def test_sizing_policies():
+    assert plan_vision_size(4000, 2250, "fixed", 2048) == (2048, 1152, "high", 1105)
+    # 预算内取最大尺寸，不超过服务端保留的尺寸
+    assert plan_vision_size(4000, 2250, "budget", 2048, 4) == (1024, 576, "high", 765)
+    assert plan_vision_size(3000, 4000, "budget", 2048, 4) == (768, 1024, "high", 765)
+    assert plan_vision_size(4000, 3000, "budget", 2048, 2) == (682, 512, "high", 425)
+    # 长条图按宽高比选择 4x1 切片
+    assert plan_vision_size(10000, 1000, "budget", 2048, 4)[:2] == (2048, 204)
+    assert plan_vision_size(300, 200, "budget", 2048, 4) == (300, 200, "high", 255)
+    assert plan_vision_size(4000, 3000, "budget", 2048, 0) == (512, 384, "low", 85)
+    assert plan_vision_size(4000, 3000, "low") == (512, 384, "low", 85)
+
+    _, _, info = preprocess_image(_image_bytes((4000, 2250)), 2048, 90, policy="budget", max_tiles=4)
+    assert info["output_size"] == (1024, 576) and info["tokens"] == 765 and info["detail"] == "high"
+
+
+def test_prepare_runs_in_process_pool():
+    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as f:
+        f.write(_image_bytes((3000, 1000)))
+        path = f.name
+
+    async def run():
+        preprocessor = ImagePreprocessor(workers=1)
+        try:
+            image = await preprocessor.prepare(path, max_size=2048, quality=90)
+            # 相同内容归一化后得到相同的哈希
+            assert (await preprocessor.prepare(path, max_size=2048, quality=90)).sha256 == image.sha256
+            assert (image.width, image.height, image.detail, image.tokens) == (2048, 683, "high", 85 + 170 * 8)
+            return image.data, preprocessor.stats()
+        finally:
+            await preprocessor.shutdown()
+
+    try:
+        encoded, stats = asyncio.run(run())
+    finally:
+        os.unlink(path)
+    with Image.open(io.BytesIO(base64.b64decode(encoded))) as img:
+        assert img.size == (2048, 683)
+    assert stats["processed"] == 2 and stats["failed"] == 0
+    assert set(stats["last_ms"]) == {"read", "decode", "resize", "encode"}
+
+
+if __name__ == "__main__":
+    test_jpeg_draft_downscales_during_decode()
+    test_pixel_limit_rejects_oversized_non_jpeg()
+    test_high_detail_tokens_follow_tiling_rules()
+    test_sizing_policies()
+    test_prepare_runs_in_process_pool()
+    print("✅ 图片预处理测试通过")
@@ -0,0 +1,89 @@
+"""
+测试游标分页 - 游标编解码、按 (上传时间, ID) 续接不重复不遗漏、非上传时间排序拒绝游标
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import asyncio
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models.image import Image
+from app.services.pagination_service import encode_cursor, decode_cursor, paginate_by_cursor
+
+
+def _build_session():
+    """创建内存SQLite会话，部分图片上传时间相同"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine, tables=[Image.__table__])
+    db = sessionmaker(bind=engine)()
+    start = datetime(2024, 5, 1, 8, 0, 0)
+    for i in range(7):
+        db.add(Image(filename=f"{i}.jpg", file_path=f"uploads/{i}.jpg", file_size=1024,
+                     upload_time=start + timedelta(minutes=i // 2)))
+    db.commit()
+    return db
+
+
+def test_cursor_round_trip():
+    image = Image(id=42, upload_time=datetime(2024, 5, 1, 8, 30, 15, 123456))
+    cursor = encode_cursor(image)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (image.upload_time, 42)
+
+    for bad in ("", "不是游标", "bm90LWEtY3Vyc29y"):
+        try:
+            decode_cursor(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"游标应被拒绝: {bad}")
+
+
+def test_pages_do_not_overlap():
+    db = _build_session()
+    try:
+        for descending in (True, False):
+            seen, cursor = [], None
+            while True:
+                query = db.query(Image).filter(Image.is_active == True)
+                images, cursor = paginate_by_cursor(query, 3, cursor, descending)
+                seen.extend(image.id for image in images)
+                if cursor is None:
+                    break
+            expected = sorted(db.query(Image).all(), key=lambda image: (image.upload_time, image.id),
+                              reverse=descending)
+            assert seen == [image.id for image in expected]
+
+        # 恰好取完时不返回下一页游标
+        images, cursor = paginate_by_cursor(db.query(Image), 7)
+        assert len(images) == 7 and cursor is None
+    finally:
+        db.close()
+
+
+def test_cursor_rejected_for_other_sorts():
+    from app.api.admin_images import get_images_list
+
+    async def run():
+        return await get_images_list(page=1, per_page=15, cursor="abc", status="active", ai_status=None,
+                                     uploader=None, search=None, sort_by="view_count", sort_order="desc",
+                                     current_user=None, db=None)
+
+    try:
+        asyncio.run(run())
+    except HTTPException as e:
+        assert e.status_code == 400
+    else:
+        raise AssertionError("非上传时间排序时应拒绝游标")
+
+
+if __name__ == "__main__":
+    test_cursor_round_trip()
+    test_pages_do_not_overlap()
+    test_cursor_rejected_for_other_sorts()
+    print("✅ 游标分页测试通过")
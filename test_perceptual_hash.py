@@ -0,0 +1,66 @@
+"""
+测试感知哈希 - 重新编码/缩放的副本距离很小，BK树检索与暴力比较一致
+"""
+import sys
+import os
+import io
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from PIL import Image as PILImage
+
+from app.services.perceptual_hash_service import BKTree, find_duplicate_clusters, hamming, phash_bytes
+
+
+def _image_bytes(pixels: np.ndarray, size=None, quality: int = 95) -> bytes:
+    img = PILImage.fromarray(pixels.astype(np.uint8))
+    if size:
+        img = img.resize(size)
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def _random_picture(seed: int) -> np.ndarray:
+    """平滑的随机图案，接近真实照片的低频结构"""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, size=(8, 8, 3))
+    return np.asarray(PILImage.fromarray(small.astype(np.uint8)).resize((256, 256), PILImage.BICUBIC))
+
+
+def test_reencoded_copy_is_near_duplicate():
+    original = _random_picture(1)
+    base = int(phash_bytes(_image_bytes(original)), 16)
+    copy = int(phash_bytes(_image_bytes(original, size=(180, 180), quality=40)), 16)
+    other = int(phash_bytes(_image_bytes(_random_picture(2))), 16)
+
+    assert hamming(base, copy) <= 6
+    assert hamming(base, other) > 12
+
+
+def test_bk_tree_matches_brute_force():
+    rng = np.random.default_rng(5)
+    values = [int(v) for v in rng.integers(0, 2 ** 63, size=500, dtype=np.int64)]
+    # 加入若干只差几位的近似值
+    values += [values[i] ^ (1 << int(rng.integers(0, 64))) for i in range(50)]
+
+    tree = BKTree()
+    for image_id, value in enumerate(values):
+        tree.add(value, image_id)
+
+    for query in values[:60]:
+        expected = sorted(i for i, value in enumerate(values) if hamming(query, value) <= 4)
+        assert sorted(image_id for image_id, _ in tree.search(query, 4)) == expected
+
+
+def test_clusters_group_transitive_matches():
+    hashes = [(1, "0000000000000000"), (2, "0000000000000003"), (3, "000000000000000f"), (4, "ffffffffffffffff")]
+    clusters = find_duplicate_clusters(hashes, radius=2)
+    assert clusters == [{"image_ids": [1, 2, 3], "count": 3, "max_distance": 2}]
+
+
+if __name__ == "__main__":
+    test_reencoded_copy_is_near_duplicate()
+    test_bk_tree_matches_brute_force()
+    test_clusters_group_transitive_matches()
+    print("✅ 感知哈希测试通过")
@@ -0,0 +1,105 @@
+"""
+测试热门搜索统计 - Space-Saving 时间衰减、权重缩放、容量满时替换最小项、持久化恢复
+"""
+import sys
+import os
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.popular_search_service import SpaceSaving, PopularSearchTracker
+
+T0 = 1_000_000.0
+HALF_LIFE = 100.0
+
+
+def _sketch(capacity: int = 10) -> SpaceSaving:
+    sketch = SpaceSaving(capacity, HALF_LIFE)
+    sketch.t0 = T0
+    return sketch
+
+
+def _top(sketch: SpaceSaving, k: int, now: float):
+    return [(key, round(count, 6)) for key, count in sketch.top(k, now)]
+
+
+def test_counts_decay_with_half_life():
+    sketch = _sketch()
+    for _ in range(3):
+        sketch.add("女性坐姿", T0)
+    sketch.add("户外", T0 + HALF_LIFE)
+
+    assert _top(sketch, 2, T0 + HALF_LIFE) == [("女性坐姿", 1.5), ("户外", 1.0)]
+    assert _top(sketch, 2, T0 + 2 * HALF_LIFE) == [("女性坐姿", 0.75), ("户外", 0.5)]
+
+    # 较新的计数权重更高，超过较早的多次计数
+    sketch.add("户外", T0 + HALF_LIFE)
+    assert _top(sketch, 1, T0 + HALF_LIFE) == [("户外", 2.0)]
+
+
+def test_rescale_keeps_relative_counts():
+    sketch = _sketch()
+    sketch.max_weight = 4.0
+    sketch.add("站立", T0)
+    sketch.add("站立", T0 + HALF_LIFE)
+    sketch.add("坐姿", T0 + 2 * HALF_LIFE)
+    assert sketch.t0 == T0
+
+    # 权重 2^3 超过上限，整体缩放后 t0 移到当前时刻
+    now = T0 + 3 * HALF_LIFE
+    sketch.add("坐姿", now)
+    assert sketch.t0 == now
+    assert max(sketch.counts.values()) <= sketch.max_weight
+    assert _top(sketch, 2, now) == [("坐姿", 1.5), ("站立", 0.375)]
+
+
+def test_eviction_replaces_minimum():
+    sketch = _sketch(capacity=2)
+    sketch.add("a", T0)
+    sketch.add("a", T0)
+    sketch.add("b", T0)
+    sketch.add("b", T0)
+    sketch.add("b", T0)
+
+    # 新项替换计数最小的 a，继承其计数作为误差上界
+    sketch.add("c", T0)
+    assert set(sketch.counts) == {"b", "c"}
+    assert sketch.counts["c"] == 3.0 and sketch.errors["c"] == 2.0
+
+    # 已更新过的项在堆中有过期记录，替换时跳过
+    sketch.add("c", T0)
+    sketch.add("d", T0)
+    assert set(sketch.counts) == {"c", "d"}
+    assert sketch.counts["d"] == 4.0 and sketch.errors["d"] == 3.0
+
+
+def test_state_round_trip():
+    sketch = _sketch()
+    for key, times in (("a", 3), ("b", 2), ("c", 1)):
+        for _ in range(times):
+            sketch.add(key, T0)
+
+    # 容量变小时只保留计数最高的项
+    smaller = SpaceSaving(2, HALF_LIFE)
+    smaller.load_dict(sketch.to_dict())
+    assert smaller.t0 == T0
+    assert _top(smaller, 5, T0) == [("a", 3.0), ("b", 2.0)]
+
+    state_path = os.path.join(tempfile.mkdtemp(), "popular.json")
+    tracker = PopularSearchTracker(state_path, 10, HALF_LIFE)
+    assert not tracker.save()
+    tracker.record("  女性坐姿 ")
+    tracker.record("")
+    assert tracker.version == 1
+    assert tracker.save() and not tracker.save()
+
+    restored = PopularSearchTracker(state_path, 10, HALF_LIFE)
+    assert restored.load()
+    assert restored.popular_queries(3, defaults=["户外", "女性坐姿"])[:2] == [tracker.top(1)[0][0], "户外"]
+
+
+if __name__ == "__main__":
+    test_counts_decay_with_half_life()
+    test_rescale_keeps_relative_counts()
+    test_eviction_replaces_minimum()
+    test_state_round_trip()
+    print("✅ 热门搜索统计测试通过")
@@ -0,0 +1,57 @@
+"""
+测试查询解析器 - Aho-Corasick最长匹配切分与否定词处理
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.query_parser_service import AhoCorasick, QueryParser
+
+
+def test_longest_match_segmentation():
+    """重叠模式取最左、最长的匹配"""
+    automaton = AhoCorasick({"没有": None, "没有道具": ["无道具"], "道具": ["道具"]})
+    assert automaton.segment("没有道具") == [(0, 4, ["无道具"])]
+    assert automaton.segment("道具没有") == [(0, 2, ["道具"]), (2, 4, None)]
+
+
+def test_parse_compound_query():
+    """连写的中文查询可以直接切分出标签"""
+    parser = QueryParser()
+    assert parser.parse("女性坐姿") == (["女性", "坐姿"], [])
+    assert parser.parse("男人站着 室内") == (["男性", "站姿", "站立", "室内"], [])
+
+
+def test_parse_negation():
+    """否定词只作用于紧随其后的一个词"""
+    parser = QueryParser()
+    assert parser.parse("不要正面 户外") == (["户外"], ["正面"])
+    assert parser.parse("没有道具") == (["无道具"], [])
+    assert parser.parse("除了室内") == ([], ["室内"])
+    assert parser.parse("非室内") == ([], ["室内"])
+
+
+def test_negator_inside_ordinary_words():
+    """以"不""非"开头的常用词和隔着其他字的否定词不否定标签"""
+    parser = QueryParser()
+    assert parser.parse("非常放松的女性") == (["放松", "女性"], [])
+    assert parser.parse("不错的户外照片") == (["户外"], [])
+    assert parser.parse("不同角度的正面") == (["正面"], [])
+    assert parser.parse("不好看的户外") == (["户外"], [])
+
+
+def test_hot_reload_new_tags():
+    """新增标签后自动重新编译"""
+    parser = QueryParser()
+    assert parser.parse("瑜伽") == ([], [])
+    parser.add_tags(["瑜伽"])
+    assert parser.parse("瑜伽女性") == (["瑜伽", "女性"], [])
+
+
+if __name__ == "__main__":
+    test_longest_match_segmentation()
+    test_parse_compound_query()
+    test_parse_negation()
+    test_negator_inside_ordinary_words()
+    test_hot_reload_new_tags()
+    print("✅ 查询解析测试通过")
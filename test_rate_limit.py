@@ -0,0 +1,80 @@
+"""
+测试API限流 - 令牌桶预留、Retry-After 解析、429/5xx 重试
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import asyncio
+import random
+
+import httpx
+
+from app.services.rate_limit_service import (
+    TokenBucket, RateLimiter, parse_retry_after, backoff_delay
+)
+
+
+def test_token_bucket_reserves_and_refills():
+    bucket = TokenBucket(capacity=60, per_minute=60)
+    now = bucket._updated
+    assert bucket.reserve(60, now) == 0.0
+    # 余额为负时返回按速率补足所需的等待时间
+    assert abs(bucket.reserve(3, now) - 3.0) < 1e-9
+    assert abs(bucket.reserve(1, now + 2.0) - 2.0) < 1e-9
+    bucket.refund(10)
+    assert bucket.reserve(5, now + 2.0) == 0.0
+
+
+def test_retry_after_parsing_and_backoff():
+    assert parse_retry_after(httpx.Headers({"retry-after": "7"})) == 7.0
+    assert parse_retry_after(httpx.Headers({"retry-after-ms": "250", "retry-after": "7"})) == 0.25
+    assert parse_retry_after(httpx.Headers({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0.0
+    assert parse_retry_after(httpx.Headers({})) is None
+
+    rng = random.Random(1)
+    assert 5.0 <= backoff_delay(3, retry_after=5.0, base=1.0, rng=rng) <= 6.0
+    for attempt in range(8):
+        assert 0.0 <= backoff_delay(attempt, base=1.0, cap=10.0, rng=rng) <= min(10.0, 2 ** attempt)
+
+
+def test_call_retries_on_429_and_5xx():
+    responses = [
+        httpx.Response(429, headers={"retry-after-ms": "10"}),
+        httpx.Response(503),
+        httpx.Response(200, json={"usage": {"total_tokens": 40}}),
+    ]
+    transport = httpx.MockTransport(lambda request: responses.pop(0))
+
+    async def run():
+        limiter = RateLimiter(6000, 60000, max_retries=3, backoff_base=0.01, backoff_max=0.05)
+        async with httpx.AsyncClient(transport=transport) as client:
+            response = await limiter.call(lambda: client.post("http://api.test/chat/completions"), 100)
+        return limiter, response
+
+    limiter, response = asyncio.run(run())
+    assert response.status_code == 200
+    assert limiter.stats_counter["retries"] == 2
+    # 只扣除实际用量
+    assert 60000 - limiter.tokens.available <= 40 + 1e-6
+
+
+def test_call_gives_up_after_max_retries():
+    transport = httpx.MockTransport(lambda request: httpx.Response(500))
+
+    async def run():
+        limiter = RateLimiter(6000, 60000, max_retries=2, backoff_base=0.01, backoff_max=0.01)
+        async with httpx.AsyncClient(transport=transport) as client:
+            return limiter, await limiter.call(lambda: client.get("http://api.test/"), 10)
+
+    limiter, response = asyncio.run(run())
+    assert response.status_code == 500
+    assert limiter.stats_counter["retries"] == 2 and limiter.stats_counter["failed"] == 1
+
+
+if __name__ == "__main__":
+    test_token_bucket_reserves_and_refills()
+    test_retry_after_parsing_and_backoff()
+    test_call_retries_on_429_and_5xx()
+    test_call_gives_up_after_max_retries()
+    print("✅ API限流测试通过")
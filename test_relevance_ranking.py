@@ -0,0 +1,118 @@
+"""
+测试相关性排序 - top-k 选取与完整排序一致，标签置信度和描述匹配优先于热度
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import app.database
+
+from app.database import Base
+from app.models.image import Image, Tag, ImageTag
+from app.services.ranking_service import RelevanceRanker, relevance_ranker, top_k_indices
+from app.services.search_service import SearchService
+from app.services.smart_search_service import SmartSearchService
+
+
+def _build_session():
+    """创建内存SQLite会话并写入测试数据"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine, tables=[
+        Image.__table__,
+        Tag.__table__,
+        ImageTag.__table__
+    ])
+    db = sessionmaker(bind=engine)()
+
+    sitting = Tag(name="坐姿", category="pose")
+    db.add(sitting)
+    db.flush()
+
+    rows = [
+        # (描述, 标签置信度, AI置信度, 查看次数)
+        ("女性坐在椅子上阅读", 0.95, 0.9, 3),
+        ("男性站在窗边", 0.3, 0.9, 500),
+        ("户外草地坐着休息", 0.6, 0.5, 10),
+    ]
+    for i, (description, tag_confidence, confidence, views) in enumerate(rows):
+        image = Image(filename=f"{i}.jpg", file_path=f"uploads/{i}.jpg", file_size=1024,
+                      ai_description=description, ai_confidence=confidence, view_count=views)
+        db.add(image)
+        db.flush()
+        db.add(ImageTag(image_id=image.id, tag_id=sitting.id, confidence=tag_confidence))
+
+    db.commit()
+    return db
+
+
+def test_top_k_matches_full_sort():
+    rng = np.random.default_rng(7)
+    scores = rng.random(10000).astype(np.float32)
+    for k in (1, 10, 500, 10000, 20000):
+        expected = np.argsort(-scores, kind="stable")[:k]
+        assert list(top_k_indices(scores, k)) == list(expected)
+
+
+def test_bm25_prefers_matching_documents():
+    ranker = RelevanceRanker(max_candidates=100)
+    scores = ranker.bm25(["女性坐在椅子上", "户外草地", "坐着的女性 女性"], "女性坐")
+    assert scores[1] == 0
+    assert scores[0] > 0 and scores[2] > 0
+
+
+def test_search_ranks_by_relevance_not_views():
+    db = _build_session()
+    try:
+        result = SearchService(db).search_images("坐姿 阅读", limit=2)
+        descriptions = [image["description"] for image in result["images"]]
+        assert descriptions[0] == "女性坐在椅子上阅读"
+        assert len(descriptions) == 2
+    finally:
+        db.close()
+
+
+def test_prefilter_keeps_tag_matches_over_popular_images():
+    """候选超过上限时按标签命中预筛，不按热度截取；线程中使用独立会话"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine, tables=[Image.__table__, Tag.__table__, ImageTag.__table__])
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    sitting = Tag(name="坐姿", category="pose")
+    db.add(sitting)
+    db.flush()
+    tagged = Image(filename="0.jpg", file_path="uploads/0.jpg", file_size=1024,
+                   ai_description="安静的室内", ai_confidence=0.5, view_count=0)
+    db.add(tagged)
+    db.flush()
+    db.add(ImageTag(image_id=tagged.id, tag_id=sitting.id, confidence=0.9))
+    for i in range(1, 6):
+        db.add(Image(filename=f"{i}.jpg", file_path=f"uploads/{i}.jpg", file_size=1024,
+                     ai_description="热门的室内", ai_confidence=0.9, view_count=1000 * i))
+    db.commit()
+
+    original, original_max = app.database.SessionLocal, relevance_ranker.max_candidates
+    app.database.SessionLocal = factory
+    relevance_ranker.max_candidates = 3
+    try:
+        query = db.query(Image).filter(Image.is_active == True)
+        direct = RelevanceRanker(max_candidates=3).rank_query(db, query, "坐姿", ["坐姿"], 1)
+        assert direct[0][0] == tagged.id
+        threaded = SmartSearchService._rank_in_thread(query, "坐姿", ["坐姿"], 1, None)
+        assert threaded == direct
+    finally:
+        app.database.SessionLocal = original
+        relevance_ranker.max_candidates = original_max
+        db.close()
+
+
+if __name__ == "__main__":
+    test_top_k_matches_full_sort()
+    test_bm25_prefers_matching_documents()
+    test_search_ranks_by_relevance_not_views()
+    test_prefilter_keeps_tag_matches_over_popular_images()
+    print("✅ 相关性排序测试通过")
@@ -0,0 +1,75 @@
+"""
+测试响应缓存版本号 - Redis递增失败时写入方改用本进程版本号，Redis恢复后补上递增
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import asyncio
+
+from app.services import response_cache_service
+from app.services.response_cache_service import CatalogVersion
+
+
+class FakeRedis:
+    """只实现 get/incr 的Redis替身，可切换为写入失败"""
+
+    def __init__(self):
+        self.value = 0
+        self.fail_writes = False
+
+    def incr(self, key):
+        if self.fail_writes:
+            raise ConnectionError("READONLY")
+        self.value += 1
+        return self.value
+
+
+class FakeAsyncRedis:
+    def __init__(self, sync: FakeRedis):
+        self.sync = sync
+
+    async def get(self, key):
+        return str(self.sync.value)
+
+    async def incr(self, key):
+        return self.sync.incr(key)
+
+
+def test_failed_incr_falls_back_to_local_version():
+    redis_client = FakeRedis()
+    original = response_cache_service.get_redis, response_cache_service.get_sync_redis
+    response_cache_service.get_redis = lambda: FakeAsyncRedis(redis_client)
+    response_cache_service.get_sync_redis = lambda: redis_client
+    try:
+        version = CatalogVersion()
+        version.bump()
+        assert asyncio.run(version.current()) == "r1"
+
+        # 递增失败: 写入方不再读取旧的共享版本
+        redis_client.fail_writes = True
+        version.bump()
+        assert version.unsynced and version.skipped_bumps == 1
+        current = asyncio.run(version.current())
+        assert current.startswith("l") and current.endswith(f"-{os.getpid()}-2")
+
+        # Redis恢复后补上递增，所有进程的旧缓存键失效
+        redis_client.fail_writes = False
+        assert asyncio.run(version.current()) == "r2"
+        assert not version.unsynced
+        assert asyncio.run(version.current()) == "r2"
+    finally:
+        response_cache_service.get_redis, response_cache_service.get_sync_redis = original
+
+
+def test_invalidate_async_bumps_version():
+    cache = response_cache_service.ResponseCache()
+    before = cache.version.local
+    asyncio.run(cache.invalidate_async())
+    assert cache.version.local == before + 1
+
+
+if __name__ == "__main__":
+    test_failed_incr_falls_back_to_local_version()
+    test_invalidate_async_bumps_version()
+    print("✅ 响应缓存版本测试通过")
@@ -0,0 +1,164 @@
+"""
+测试AI搜索编排 - 预算内完成全部阶段、查询扩展超时后台继续、二次排序超时或预算不足时跳过
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import asyncio
+
+from app.models.image import Image
+from app.services import search_orchestrator_service
+from app.services.search_orchestrator_service import SearchOrchestrator, settings
+
+IMAGES = [{"id": i, "description": f"图片{i}"} for i in range(1, 7)]
+
+
+class FakeSession:
+    """会话替身: 按ID取回图片时返回全部图片"""
+
+    def query(self, model):
+        return self
+
+    def filter(self, *conditions):
+        return self
+
+    def all(self):
+        return [Image(id=image["id"], ai_description=image["description"]) for image in IMAGES]
+
+
+class FakeSearchService:
+    """SmartSearchService 替身: 扩展检索返回 1-4"""
+
+    db = FakeSession()
+
+    async def _get_candidate_images(self, enhanced_query, limit):
+        return [dict(image) for image in IMAGES[:4]]
+
+    async def _format_image_results(self, images):
+        return [{"id": image.id, "description": image.ai_description} for image in images]
+
+    async def _rank_by_vector(self, query_text, candidate_images, limit):
+        return candidate_images
+
+    async def _sort_by_similarity(self, candidate_images, similarity_result):
+        order = similarity_result["matches"]
+        return sorted(candidate_images, key=lambda image: order.index(image["id"]) if image["id"] in order else len(order))
+
+
+class FakeLocalSearch:
+    """本地检索替身: 返回 3-6"""
+
+    def __init__(self, db):
+        pass
+
+    def search_images(self, query, limit):
+        return {"images": [dict(image) for image in IMAGES[2:]]}
+
+
+class FakeExpansion:
+    def __init__(self, delay: float = 0.0, error: Exception = None):
+        self.delay = delay
+        self.error = error
+        self.finished = False
+
+    async def get_or_expand(self, query):
+        await asyncio.sleep(self.delay)
+        self.finished = True
+        if self.error:
+            raise self.error
+        return {"enhanced_query": query, "keywords": ["坐姿"], "synonyms": []}
+
+
+class FakeAnalyzer:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+
+    async def search_similar_images(self, query, descriptions):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return {"matches": [6, 5], "query_analysis": "坐姿优先"}
+
+
+class FakeVectorIndex:
+    size = 0
+
+
+def _run(budget_ms, expansion, analyzer, rerank=True, limit=3, rerank_min_ms=1500, reserve_ms=300):
+    patched = {
+        "SearchService": FakeLocalSearch,
+        "query_expansion_cache": expansion,
+        "gpt4o_analyzer": analyzer,
+        "vector_index": FakeVectorIndex()
+    }
+    original = {name: getattr(search_orchestrator_service, name) for name in patched}
+    original_settings = settings.search_rerank_min_ms, settings.search_stage_reserve_ms
+    for name, value in patched.items():
+        setattr(search_orchestrator_service, name, value)
+    settings.search_rerank_min_ms, settings.search_stage_reserve_ms = rerank_min_ms, reserve_ms
+
+    async def run():
+        result = await SearchOrchestrator(FakeSearchService(), budget_ms).run("坐姿", limit, rerank)
+        # 等待被放弃的查询扩展在后台完成
+        while SearchOrchestrator._background:
+            await asyncio.sleep(0.01)
+        return result
+
+    try:
+        return asyncio.run(run())
+    finally:
+        for name, value in original.items():
+            setattr(search_orchestrator_service, name, value)
+        settings.search_rerank_min_ms, settings.search_stage_reserve_ms = original_settings
+
+
+def _statuses(result):
+    return {stage["name"]: stage["status"] for stage in result["stages"]}
+
+
+def test_all_stages_within_budget():
+    analyzer = FakeAnalyzer()
+    result = _run(3000, FakeExpansion(), analyzer)
+    assert _statuses(result) == {"retrieval": "completed", "expansion": "completed",
+                                 "expanded_retrieval": "completed", "rerank": "completed"}
+    assert not result["degraded"] and result["search_method"] == "gpt4o_semantic"
+    # 扩展检索结果在前，本地检索补充 5、6，二次排序后 6、5 靠前
+    assert [image["id"] for image in result["images"]] == [6, 5, 1]
+    assert analyzer.calls == 1
+
+
+def test_expansion_timeout_keeps_running_in_background():
+    expansion = FakeExpansion(delay=0.3)
+    analyzer = FakeAnalyzer()
+    result = _run(350, expansion, analyzer)
+    assert _statuses(result) == {"retrieval": "completed", "expansion": "timeout", "rerank": "skipped"}
+    assert result["degraded"] and result["search_method"] == "tag_index"
+    assert [image["id"] for image in result["images"]] == [3, 4, 5]
+    assert result["elapsed_ms"] < 300
+    # 超时后查询扩展仍在后台完成（写入扩展缓存）
+    assert expansion.finished and analyzer.calls == 0
+
+
+def test_expansion_failure_and_rerank_timeout():
+    analyzer = FakeAnalyzer(delay=5.0)
+    result = _run(400, FakeExpansion(error=RuntimeError("quota")), analyzer, rerank_min_ms=100, reserve_ms=50)
+    assert _statuses(result) == {"retrieval": "completed", "expansion": "failed", "rerank": "timeout"}
+    assert result["degraded"]
+    assert [image["id"] for image in result["images"]] == [3, 4, 5]
+    assert result["elapsed_ms"] < 1000
+
+
+def test_rerank_not_needed():
+    analyzer = FakeAnalyzer()
+    result = _run(3000, FakeExpansion(), analyzer, rerank=False)
+    assert "rerank" not in _statuses(result) and analyzer.calls == 0
+    assert result["total"] == 3
+
+
+if __name__ == "__main__":
+    test_all_stages_within_budget()
+    test_expansion_timeout_keeps_running_in_background()
+    test_expansion_failure_and_rerank_timeout()
+    test_rerank_not_needed()
+    print("✅ AI搜索编排测试通过")
@@ -0,0 +1,163 @@
+"""
+测试相似图片预计算 - 分块 top-K 与稠密计算一致，增量刷新与全量重建结果相同
+"""
+import sys
+import os
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models.image import Image, Tag, ImageTag, ImageNeighbor
+from app.services.similar_image_service import SimilarImageIndex, similar_images, weighted_tag_matrix, top_k_neighbors
+from app.services.smart_search_service import SmartSearchService
+
+
+def _build_session(image_count: int = 40):
+    """创建内存SQLite会话并写入测试数据"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine, tables=[
+        Image.__table__,
+        Tag.__table__,
+        ImageTag.__table__,
+        ImageNeighbor.__table__
+    ])
+    db = sessionmaker(bind=engine)()
+
+    tags = [Tag(name=f"标签{i}", category="pose") for i in range(8)]
+    db.add_all(tags)
+    db.flush()
+
+    rng = np.random.default_rng(3)
+    for i in range(image_count):
+        image = Image(filename=f"{i}.jpg", file_path=f"uploads/{i}.jpg", file_size=1024)
+        db.add(image)
+        db.flush()
+        for tag_index in rng.choice(len(tags), size=int(rng.integers(1, 4)), replace=False):
+            db.add(ImageTag(image_id=image.id, tag_id=tags[tag_index].id, confidence=float(rng.uniform(0.5, 1.0))))
+
+    db.commit()
+    return db, tags
+
+
+def _neighbor_rows(db):
+    """image_id -> [(neighbor_id, score)]"""
+    table = {}
+    for row in db.query(ImageNeighbor).order_by(ImageNeighbor.image_id, ImageNeighbor.rank):
+        table.setdefault(row.image_id, []).append((row.neighbor_id, round(row.score, 6)))
+    return table
+
+
+def test_top_k_matches_dense_cosine():
+    db, _ = _build_session()
+    try:
+        image_ids, matrix = SimilarImageIndex.build_matrix(db)
+        dense = matrix.toarray()
+        np.testing.assert_allclose(np.linalg.norm(dense, axis=1), 1.0)
+
+        neighbors = top_k_neighbors(matrix, image_ids, range(len(image_ids)), k=5)
+        scores = dense @ dense.T
+        for row, image_id in enumerate(image_ids):
+            expected = sorted(((-round(scores[row, col], 6), image_ids[col]) for col in range(len(image_ids))
+                               if col != row and scores[row, col] > 1e-9))[:5]
+            got = neighbors[int(image_id)]
+            assert [neighbor_id for neighbor_id, _ in got] == [int(i) for _, i in expected]
+    finally:
+        db.close()
+
+
+def test_rare_tags_weigh_more():
+    image_ids, matrix = weighted_tag_matrix([(1, 1, 1.0), (1, 2, 1.0), (2, 1, 1.0), (3, 2, 1.0), (4, 1, 1.0)])
+    neighbors = top_k_neighbors(matrix, image_ids, [0], k=3)
+    # 图片3与图片1共享较少见的标签2，排在共享常见标签1的图片之前
+    assert neighbors[1][0][0] == 3
+
+
+def test_incremental_refresh_matches_rebuild():
+    db, tags = _build_session()
+    try:
+        index = SimilarImageIndex(top_k=5, block_size=7)
+        index.rebuild(db)
+        before = _neighbor_rows(db)
+
+        # 修改两张图片的标签并停用一张图片
+        db.query(ImageTag).filter(ImageTag.image_id == 3).delete()
+        db.add(ImageTag(image_id=3, tag_id=tags[7].id, confidence=0.8))
+        db.add(ImageTag(image_id=10, tag_id=tags[0].id, confidence=0.6))
+        db.query(Image).filter(Image.id == 20).update({"is_active": False})
+        db.commit()
+
+        rewritten = index.refresh(db, {3, 10, 20})
+        assert 3 <= rewritten < 40
+        incremental = _neighbor_rows(db)
+
+        index.rebuild(db)
+        rebuilt = _neighbor_rows(db)
+
+        # 重写的行与全量重建一致，其余行保持原样（IDF 的微小变化留给全量重建）
+        assert incremental[3] == rebuilt[3] and incremental[10] == rebuilt[10]
+        assert 20 not in incremental
+        for image_id, rows in incremental.items():
+            assert 20 not in [neighbor_id for neighbor_id, _ in rows]
+            assert rows == rebuilt.get(image_id) or rows == before.get(image_id)
+    finally:
+        db.close()
+
+
+def test_refresh_reads_only_changed_images():
+    """增量刷新在内存中替换变化图片的标签，结果与全量读取一致"""
+    db, tags = _build_session()
+    try:
+        index = SimilarImageIndex(top_k=5, block_size=7)
+        index.rebuild(db)
+
+        db.query(ImageTag).filter(ImageTag.image_id == 5).delete()
+        db.add(ImageTag(image_id=5, tag_id=tags[6].id, confidence=0.7))
+        db.commit()
+
+        statements = []
+        event.listen(db.get_bind(), "before_cursor_execute",
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        image_ids, matrix = index._refresh_matrix(db, {5})
+        assert len(statements) == 1 and " IN " in statements[0]
+
+        expected_ids, expected = SimilarImageIndex.build_matrix(db)
+        np.testing.assert_array_equal(image_ids, expected_ids)
+        np.testing.assert_allclose(matrix.toarray(), expected.toarray())
+    finally:
+        db.close()
+
+
+def test_find_similar_by_tags_reads_table_or_aggregates():
+    db, _ = _build_session()
+    built = similar_images.built
+    try:
+        target = db.get(Image, 1)
+        service = SmartSearchService(db)
+
+        # 相似图片表未构建时按共同标签实时聚合
+        similar_images.built = False
+        results = asyncio.run(service._find_similar_by_tags(target, 5))
+        assert results and all(item["id"] != 1 for item in results)
+
+        # 已构建时按预计算的排名返回
+        SimilarImageIndex(top_k=5, block_size=7).rebuild(db)
+        similar_images.built = True
+        results = asyncio.run(service._find_similar_by_tags(target, 5))
+        expected = [neighbor_id for neighbor_id, _ in _neighbor_rows(db)[1]]
+        assert [item["id"] for item in results] == expected
+    finally:
+        similar_images.built = built
+        db.close()
+
+
+if __name__ == "__main__":
+    test_top_k_matches_dense_cosine()
+    test_rare_tags_weigh_more()
+    test_incremental_refresh_matches_rebuild()
+    test_refresh_reads_only_changed_images()
+    test_find_similar_by_tags_reads_table_or_aggregates()
+    print("✅ 相似图片测试通过")
@@ -0,0 +1,83 @@
+"""
+测试批量标签加载 - 列表页标签查询次数不随分页大小增长
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models.image import Image, Tag, ImageTag
+from app.services.database_service import DatabaseService
+
+
+def _build_session(image_count: int):
+    """创建内存SQLite会话并写入测试数据"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine, tables=[
+        Image.__table__,
+        Tag.__table__,
+        ImageTag.__table__
+    ])
+    db = sessionmaker(bind=engine)()
+
+    tags = [Tag(name=f"标签{i}", category="pose") for i in range(5)]
+    db.add_all(tags)
+    db.flush()
+
+    for i in range(image_count):
+        image = Image(filename=f"{i}.jpg", file_path=f"uploads/{i}.jpg", file_size=1024)
+        db.add(image)
+        db.flush()
+        for tag in tags[: (i % len(tags)) + 1]:
+            db.add(ImageTag(image_id=image.id, tag_id=tag.id, confidence=0.9))
+
+    db.commit()
+    return engine, db
+
+
+def _count_tag_queries(page_size: int) -> int:
+    """统计加载一页标签所执行的SQL次数"""
+    engine, db = _build_session(page_size)
+    try:
+        image_ids = [image.id for image in db.query(Image).limit(page_size).all()]
+        db.expire_all()
+
+        statements = []
+        event.listen(engine, "before_cursor_execute",
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+
+        tags_map = DatabaseService(db).get_tags_for_images(image_ids)
+
+        # 结果与逐行查询保持一致
+        for index, image_id in enumerate(image_ids):
+            assert len(tags_map[image_id]) == (index % 5) + 1
+
+        return len(statements)
+    finally:
+        db.close()
+
+
+def test_tag_query_count_is_constant():
+    """不同分页大小的标签查询次数应相同"""
+    counts = {page_size: _count_tag_queries(page_size) for page_size in (1, 20, 100)}
+    print(f"📊 标签查询次数: {counts}")
+    assert len(set(counts.values())) == 1
+    assert counts[100] <= 2
+
+
+def test_empty_ids_skip_query():
+    """空列表不访问数据库"""
+    engine, db = _build_session(0)
+    try:
+        assert DatabaseService(db).get_tags_for_images([]) == {}
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    test_tag_query_count_is_constant()
+    test_empty_ids_skip_query()
+    print("✅ 批量标签加载测试通过")
@@ -0,0 +1,137 @@
+"""
+测试标签倒排索引 - 查询语义与随事务提交/回滚的增量更新
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models.image import Image, Tag, ImageTag, CatalogChange
+from app.services.tag_index_service import TagIndex, tag_index
+from app.services.database_service import DatabaseService
+
+
+def _build_session():
+    """创建内存SQLite会话并写入两张图片"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine, tables=[
+        Image.__table__,
+        Tag.__table__,
+        ImageTag.__table__,
+        CatalogChange.__table__
+    ])
+    db = sessionmaker(bind=engine)()
+    db.add_all([
+        Image(filename="1.jpg", file_path="uploads/1.jpg", file_size=1024),
+        Image(filename="2.jpg", file_path="uploads/2.jpg", file_size=1024)
+    ])
+    db.commit()
+    return db
+
+
+def test_lookup_and_match():
+    """正向标签取并集，否定标签做差集"""
+    index = TagIndex()
+    index.add(1, ["站姿", "户外"])
+    index.add(2, ["坐姿", "户外"])
+    index.add(3, ["站姿"])
+
+    assert index.lookup(["站姿"]) == {1, 3}
+    assert index.lookup(["站姿", "坐姿"]) == {1, 2, 3}
+    assert index.match(["户外"], ["坐姿"]) == {1}
+    assert index.match(["不存在"], ["户外"]) == set()
+    assert index.tags_of(2) == {"坐姿", "户外"}
+
+
+def test_discard_and_remove_image():
+    """移除标签后倒排表不残留空集合"""
+    index = TagIndex()
+    index.add(1, ["站姿", "户外"])
+    index.add(2, ["户外"])
+
+    index.discard(1, ["站姿"])
+    assert index.lookup(["站姿"]) == set()
+    assert index.stats()["tags"] == 1
+
+    index.remove_image(2)
+    assert index.lookup(["户外"]) == {1}
+    assert index.tags_of(2) == set()
+    assert index.stats() == {"tags": 1, "images": 1, "postings": 1}
+
+
+def test_build_from_database():
+    """全量构建与数据库中的关联一致"""
+    db = _build_session()
+    try:
+        DatabaseService(db).add_tags_to_image(1, ["站姿", "户外"])
+        DatabaseService(db).add_tags_to_image(2, ["户外"])
+
+        index = TagIndex()
+        assert index.build(db) == 3
+        assert index.lookup(["户外"]) == {1, 2}
+        assert index.categories_of(["站姿", "未知"]) == {"站姿": "auto"}
+    finally:
+        db.close()
+
+
+def test_changes_follow_transaction():
+    """未提交的增删不进入全局索引，回滚后丢弃，提交后生效"""
+    db = _build_session()
+    service = DatabaseService(db)
+    try:
+        service.add_tags_to_image(1, ["索引测试甲"])
+        assert tag_index.lookup(["索引测试甲"]) == {1}
+
+        # 清空后回滚: 数据库与索引都保留原标签
+        service.clear_image_tags(1)
+        assert tag_index.lookup(["索引测试甲"]) == {1}
+        db.rollback()
+        assert tag_index.lookup(["索引测试甲"]) == {1}
+        assert db.query(ImageTag).filter(ImageTag.image_id == 1).count() == 1
+
+        # 清空并重新打标签后提交: 按顺序应用
+        service.clear_image_tags(1)
+        service.add_tags_to_image(1, ["索引测试乙"])
+        assert tag_index.lookup(["索引测试甲"]) == set()
+        assert tag_index.lookup(["索引测试乙"]) == {1}
+
+        # 未提交就关闭会话的变更同样丢弃
+        service.remove_tag_name_from_image(1, "索引测试乙")
+        db.close()
+        assert tag_index.lookup(["索引测试乙"]) == {1}
+    finally:
+        tag_index.remove_image(1)
+        db.close()
+
+
+def test_clear_keeps_palette_tags():
+    """重新分析前清空标签时保留调色板生成的颜色标签，永久删除时全部清除"""
+    db = _build_session()
+    service = DatabaseService(db)
+    try:
+        service.add_tags_to_image(1, ["索引测试丙"])
+        service.add_tags_to_image(1, ["索引测试红"], "palette", category="color")
+
+        assert service.clear_image_tags(1) == 1
+        db.commit()
+        assert tag_index.tags_of(1) == {"索引测试红"}
+        assert [tag.name for tag in service.get_image_tags(1)] == ["索引测试红"]
+
+        assert service.clear_image_tags(1, keep_palette=False) == 1
+        db.commit()
+        assert tag_index.tags_of(1) == set()
+    finally:
+        tag_index.remove_image(1)
+        db.close()
+
+
+if __name__ == "__main__":
+    test_lookup_and_match()
+    test_discard_and_remove_image()
+    test_build_from_database()
+    test_changes_follow_transaction()
+    test_clear_keeps_palette_tags()
+    print("✅ 标签索引测试通过")
@@ -0,0 +1,66 @@
+"""
+测试本地向量索引 - 检索排序与多进程共享索引目录时的写入
+"""
+import sys
+import os
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import asyncio
+
+from app.models.image import Image
+from app.services.vector_index_service import VectorIndex, HashingEncoder
+
+
+def test_search_orders_by_similarity():
+    """查询词重合越多排名越靠前，已移除的图片不返回"""
+    index = VectorIndex(tempfile.mkdtemp(), HashingEncoder(128))
+    index.upsert_many([(1, "户外 站姿 阳光"), (2, "室内 坐姿"), (3, "户外 坐姿")])
+
+    assert [image_id for image_id, _ in index.search("户外 坐姿", 3)][0] == 3
+    index.remove(3)
+    assert 3 not in [image_id for image_id, _ in index.search("户外 坐姿", 3)]
+
+
+def test_writers_sharing_directory():
+    """两个实例（模拟Web进程和分析worker）交替写入不互相覆盖"""
+    index_dir = tempfile.mkdtemp()
+    web = VectorIndex(index_dir, HashingEncoder(128))
+    worker = VectorIndex(index_dir, HashingEncoder(128))
+
+    web.upsert_many([(1, "户外 站姿")])
+    worker.upsert_many([(2, "室内 坐姿")])
+    web.upsert_many([(3, "躺姿")])
+    worker.remove(1)
+
+    # 检索前自动加载其他实例的写入
+    web_ids = [image_id for image_id, _ in web.search("室内 坐姿", 5)]
+    assert web_ids[0] == 2 and 1 not in web_ids
+    assert [image_id for image_id, _ in worker.search("躺姿", 5)][0] == 3
+
+    reloaded = VectorIndex(index_dir, HashingEncoder(128))
+    assert reloaded.load()
+    assert reloaded.size == 2
+
+
+def test_async_index_and_remove():
+    """异步接口中的编码和批量移除（删除、停用图片时调用）"""
+    index = VectorIndex(tempfile.mkdtemp(), HashingEncoder(128))
+    images = [Image(id=1, ai_description="户外 站姿"), Image(id=2, ai_description="室内 坐姿"),
+              Image(id=3, ai_description="户外 坐姿")]
+
+    async def run():
+        for image in images:
+            await index.index_image_async(image)
+        await index.remove_async([1, 3, 99])
+        await index.remove_async([])
+
+    asyncio.run(run())
+    assert [image_id for image_id, _ in index.search("户外 坐姿", 3)] == [2]
+
+
+if __name__ == "__main__":
+    test_search_orders_by_similarity()
+    test_writers_sharing_directory()
+    test_async_index_and_remove()
+    print("✅ 向量索引测试通过")
@@ -0,0 +1,153 @@
+"""
+测试查看次数计数 - 内存缓冲批量写库、写库失败重试、经Redis汇总后由持锁进程写库
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import asyncio
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import app.database
+from app.database import Base
+from app.models.image import Image
+from app.services import view_counter_service
+from app.services.view_counter_service import ViewCounter
+
+
+class FakePipeline:
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.calls = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+        return queue
+
+    async def execute(self):
+        results = [await getattr(self.redis_client, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+        self.calls = []
+        return results
+
+
+class FakeRedis:
+    """内存中的异步Redis替身，只实现计数器用到的命令"""
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=False):
+        return FakePipeline(self)
+
+    async def hincrby(self, key, field, amount):
+        fields = self.data.setdefault(key, {})
+        fields[str(field)] = str(int(fields.get(str(field), 0)) + amount)
+
+    async def rename(self, key, new_key):
+        self.data[new_key] = self.data.pop(key)
+
+    async def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+    async def exists(self, key):
+        return key in self.data
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return False
+        self.data[key] = value
+        return True
+
+    async def eval(self, script, numkeys, key, token):
+        if self.data.get(key) == token:
+            del self.data[key]
+
+
+def _session_factory(with_tables: bool = True):
+    """内存SQLite，线程间共享同一连接"""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    if with_tables:
+        Base.metadata.create_all(bind=engine, tables=[Image.__table__])
+    factory = sessionmaker(bind=engine)
+    if with_tables:
+        db = factory()
+        db.add_all([Image(filename=f"{i}.jpg", file_path=f"uploads/{i}.jpg", file_size=1024, view_count=0)
+                    for i in range(1, 4)])
+        db.commit()
+        db.close()
+    return factory
+
+
+def _view_counts(factory):
+    db = factory()
+    try:
+        return dict(db.query(Image.id, Image.view_count).all())
+    finally:
+        db.close()
+
+
+def _run_with(factory, redis_client, operation):
+    original = app.database.SessionLocal, view_counter_service.get_redis
+    app.database.SessionLocal = factory
+    view_counter_service.get_redis = lambda: redis_client
+    try:
+        return asyncio.run(operation())
+    finally:
+        app.database.SessionLocal, view_counter_service.get_redis = original
+
+
+def test_buffered_flush_and_retry():
+    counter = ViewCounter()
+    counter.increment(1)
+    counter.increment_many([1, 2, 2, 2])
+    assert counter.pending(1) == 2 and counter.pending(3) == 0
+
+    # 写库失败时增量放回缓冲区
+    assert _run_with(_session_factory(with_tables=False), None, counter.flush) == 0
+    assert counter.stats()["pending_views"] == 5
+
+    factory = _session_factory()
+    assert _run_with(factory, None, counter.flush) == 5
+    assert _view_counts(factory) == {1: 2, 2: 3, 3: 0}
+    assert counter.stats()["pending_views"] == 0 and counter.flush_count == 1
+    assert _run_with(factory, None, counter.flush) == 0
+
+
+def test_redis_drain_by_lock_holder():
+    redis_client = FakeRedis()
+    factory = _session_factory()
+    web, worker = ViewCounter(), ViewCounter()
+
+    # 其他进程持有写库锁: 增量汇总到共享哈希，不写库
+    redis_client.data[ViewCounter.redis_lock_key] = "other"
+    web.increment_many([1, 1, 3])
+    assert _run_with(factory, redis_client, web.flush) == 0
+    assert redis_client.data[ViewCounter.redis_key] == {"1": "2", "3": "1"}
+    assert web.stats()["pending_views"] == 0
+
+    # 锁释放后，下一个进程把共享哈希和自己的增量一起写库
+    del redis_client.data[ViewCounter.redis_lock_key]
+    worker.increment(2)
+    assert _run_with(factory, redis_client, worker.flush) == 4
+    assert _view_counts(factory) == {1: 2, 2: 1, 3: 1}
+    assert ViewCounter.redis_key not in redis_client.data
+    assert ViewCounter.redis_lock_key not in redis_client.data
+
+    # 写库失败时增量放回共享哈希
+    worker.increment(3, 5)
+    assert _run_with(_session_factory(with_tables=False), redis_client, worker.flush) == 0
+    assert redis_client.data[ViewCounter.redis_key] == {"3": "5"}
+    assert ViewCounter.redis_lock_key not in redis_client.data
+
+
+if __name__ == "__main__":
+    test_buffered_flush_and_retry()
+    test_redis_drain_by_lock_holder()
+    print("✅ 查看次数计数测试通过")